@@ -9,6 +9,7 @@ environment, such as a laptop or desktop, not on Flocker nodes themselves (it
 may accidentally work on the Flocker nodes but this is not the expected use).
 """
 
+import json
 from os import devnull
 from os.path import expanduser
 from subprocess import check_call
@@ -19,6 +20,8 @@ from ipaddr import IPv4Address
 
 from twisted.python.filepath import FilePath
 
+from ..common import ssh_key_fingerprint
+
 
 def ssh(argv):
     with open(devnull, "w") as discard:
@@ -29,6 +32,21 @@ def ssh(argv):
 DEFAULT_SSH_DIRECTORY = FilePath(expanduser(b"~/.ssh/"))
 
 
+def _host_key(host):
+    """
+    Normalize a host identifier for use as a key in the record of configured
+    nodes.
+
+    :param host: The hostname or IP address of a node, as ``bytes``,
+        ``unicode`` or ``IPv4Address``.
+
+    :return: The host as ``unicode``.
+    """
+    if isinstance(host, bytes):
+        return host.decode("ascii")
+    return unicode(host)
+
+
 @attributes(["flocker_path", "ssh_config_path"])
 class OpenSSHConfiguration(object):
     """
@@ -41,7 +59,9 @@ class OpenSSHConfiguration(object):
 
     :ivar ssh_config_path: The path to the directory which holds SSH-related
         configuration.  For example, ``~/.ssh/``.  This is a path used on the
-        client node.
+        client node.  Besides the Flocker key pair it also holds a record of
+        the nodes the public key has been installed on, so that they need not
+        be configured again on every deploy.
     """
     @classmethod
     def defaults(cls):
@@ -53,6 +73,92 @@ class OpenSSHConfiguration(object):
             flocker_path=FilePath(b"/etc/flocker"),
             ssh_config_path=DEFAULT_SSH_DIRECTORY)
 
+    @property
+    def _configured_nodes_path(self):
+        """
+        The path of the file recording which nodes have been configured with
+        which key, as a JSON object mapping hosts to key fingerprints.
+        """
+        return self.ssh_config_path.child(b"flocker_configured_nodes.json")
+
+    def _load_configured_nodes(self):
+        """
+        Read the record of configured nodes.
+
+        A missing or unreadable record is treated as empty; the worst outcome
+        of that is an unnecessary ``configure_ssh`` call.
+
+        :return: A ``dict`` mapping ``unicode`` hosts to ``unicode`` key
+            fingerprints.
+        """
+        try:
+            configured = json.loads(self._configured_nodes_path.getContent())
+        except (IOError, ValueError):
+            return {}
+        if not isinstance(configured, dict):
+            return {}
+        return configured
+
+    def key_fingerprint(self):
+        """
+        :return: The fingerprint of the local Flocker public key as
+            ``unicode``, or ``None`` if no key pair has been generated yet.
+        """
+        local_public_path = self.ssh_config_path.child(b"id_rsa_flocker.pub")
+        try:
+            public_key = local_public_path.getContent()
+        except IOError:
+            return None
+        return ssh_key_fingerprint(public_key).decode("ascii")
+
+    def is_configured(self, host):
+        """
+        Determine whether the current Flocker key is recorded as installed on
+        the given node.
+
+        :param host: The hostname or IP address of the node.
+
+        :return: ``True`` if ``configure_ssh`` has been recorded as having
+            succeeded against ``host`` with the current key pair, otherwise
+            ``False``.
+        """
+        fingerprint = self.key_fingerprint()
+        if fingerprint is None:
+            return False
+        configured = self._load_configured_nodes()
+        return configured.get(_host_key(host)) == fingerprint
+
+    def record_configured(self, host):
+        """
+        Record that the current Flocker key has been installed on a node.
+
+        This is not thread-safe; callers running ``configure_ssh`` in threads
+        should record from a single thread.
+
+        :param host: The hostname or IP address of the node.
+        """
+        fingerprint = self.key_fingerprint()
+        if fingerprint is None:
+            return
+        configured = self._load_configured_nodes()
+        configured[_host_key(host)] = fingerprint
+        if not self.ssh_config_path.isdir():
+            self.ssh_config_path.makedirs()
+        self._configured_nodes_path.setContent(
+            json.dumps(configured, sort_keys=True))
+
+    def forget_configured(self, host):
+        """
+        Remove any record of a node having been configured, for example
+        because it turned out not to have the key installed after all.
+
+        :param host: The hostname or IP address of the node.
+        """
+        configured = self._load_configured_nodes()
+        if configured.pop(_host_key(host), None) is not None:
+            self._configured_nodes_path.setContent(
+                json.dumps(configured, sort_keys=True))
+
     def configure_ssh(self, host, port):
         """
         Configure a node to be able to connect to other similarly configured
@@ -0,0 +1,95 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+# -*- test-case-name: flocker.cli.test.test_statecache -*-
+
+"""
+A client-side cache of the state reported by ``flocker-reportstate``.
+
+Nodes number the states they report with a generation which increases
+whenever their state changes.  By telling a node which generation it already
+knows about, ``flocker-deploy`` only has to transfer and parse the state of
+nodes which have changed.
+"""
+
+import json
+from copy import deepcopy
+from os.path import expanduser
+
+from twisted.python.filepath import FilePath
+
+from ._sshconfig import _host_key
+
+
+DEFAULT_STATE_CACHE_PATH = FilePath(
+    expanduser(b"~/.flocker/cluster_state.json"))
+
+
+class ClusterStateCache(object):
+    """
+    The last state reported by each node, along with its generation.
+
+    Changes are kept in memory until ``save`` is called.
+    """
+    def __init__(self, path=DEFAULT_STATE_CACHE_PATH):
+        """
+        :param FilePath path: The file in which the cache is kept, as a JSON
+            object mapping hostnames to objects with ``generation`` and
+            ``state`` keys.
+        """
+        self._path = path
+        self._entries = None
+        self._changed = False
+
+    def _load(self):
+        """
+        :return: The cache entries, read from disk the first time this is
+            called.  A missing or corrupt cache is treated as empty.
+        """
+        if self._entries is None:
+            try:
+                entries = json.loads(self._path.getContent())
+            except (IOError, ValueError):
+                entries = {}
+            if not isinstance(entries, dict):
+                entries = {}
+            self._entries = entries
+        return self._entries
+
+    def get(self, host):
+        """
+        Look up the cached state of a node.
+
+        :param host: The hostname or IP address of the node.
+
+        :return: ``None`` if nothing is cached for the node, otherwise a
+            ``tuple`` of the ``int`` generation and a copy of the reported
+            state.
+        """
+        entry = self._load().get(_host_key(host))
+        try:
+            return entry[u"generation"], deepcopy(entry[u"state"])
+        except (KeyError, TypeError):
+            return None
+
+    def set(self, host, generation, state):
+        """
+        Cache the state reported by a node.
+
+        :param host: The hostname or IP address of the node.
+        :param int generation: The generation of the state.
+        :param state: The reported state, a JSON serializable ``dict``.
+        """
+        self._load()[_host_key(host)] = {
+            u"generation": generation, u"state": deepcopy(state)}
+        self._changed = True
+
+    def save(self):
+        """
+        Write the cache to disk if it has been changed.
+        """
+        if not self._changed:
+            return
+        directory = self._path.parent()
+        if not directory.exists():
+            directory.makedirs()
+        self._path.setContent(json.dumps(self._entries))
+        self._changed = False
@@ -11,17 +11,28 @@ from twisted.python.usage import Options, UsageError
 
 from zope.interface import implementer
 
-from yaml import safe_load, safe_dump
+from yaml import safe_load
 from yaml.error import YAMLError
 
 from characteristic import attributes
 
 from ..common.script import (flocker_standard_options, ICommandLineScript,
                              FlockerScriptRunner)
-from ..node import ConfigurationError, model_from_configuration
+from ..node import (
+    ConfigurationError, model_from_configuration, Deployment,
+    current_from_configuration, deployment_slices, node_slice_to_yaml,
+    configuration_hash)
 
-from ..common import ProcessNode
+from ..common import ProcessNode, encode_documents
 from ._sshconfig import DEFAULT_SSH_DIRECTORY, OpenSSHConfiguration
+from ._statecache import ClusterStateCache
+
+
+class KeyNotInstalled(Exception):
+    """
+    A node recorded as configured does not have the current Flocker ssh key
+    installed.
+    """
 
 
 @attributes(['node', 'hostname'])
@@ -31,6 +42,18 @@ class NodeTarget(object):
     """
 
 
+def _run_with_input(node, remote_command, data):
+    """
+    Run a command on a node, writing some data to its standard input.
+
+    :param INode node: The node to run the command on.
+    :param remote_command: ``list`` of ``bytes``, the command to run.
+    :param bytes data: The data to write to the command's standard input.
+    """
+    with node.run(remote_command) as stdin:
+        stdin.write(data)
+
+
 @flocker_standard_options
 class DeployOptions(Options):
     """
@@ -94,11 +117,30 @@ class DeployScript(object):
     """
     A script to start configured deployments on a Flocker cluster.
     """
-    def __init__(self, ssh_configuration=None, ssh_port=22):
+    def __init__(self, ssh_configuration=None, ssh_port=22,
+                 state_cache=None):
         if ssh_configuration is None:
             ssh_configuration = OpenSSHConfiguration.defaults()
         self.ssh_configuration = ssh_configuration
         self.ssh_port = ssh_port
+        if state_cache is None:
+            state_cache = ClusterStateCache()
+        self.state_cache = state_cache
+
+    def _configure_node_ssh(self, hostname):
+        """
+        Configure a single node with ssh keys and record that it has been
+        configured.
+
+        :param unicode hostname: The hostname of the node to configure.
+
+        :return: A ``Deferred`` which fires when the node has been configured.
+        """
+        d = deferToThread(
+            self.ssh_configuration.configure_ssh, hostname, self.ssh_port)
+        d.addCallback(
+            lambda _: self.ssh_configuration.record_configured(hostname))
+        return d
 
     def _configure_ssh(self, deployment):
         """
@@ -107,33 +149,36 @@ class DeployScript(object):
         """
         results = []
         for node in deployment.nodes:
-            results.append(
-                deferToThread(
-                    self.ssh_configuration.configure_ssh,
-                    node.hostname, self.ssh_port
-                )
-            )
+            results.append(self._configure_node_ssh(node.hostname))
         return DeferredList(results)
 
     def main(self, reactor, options):
         """
         See :py:meth:`ICommandLineScript.main` for parameter documentation.
 
+        Nodes which are recorded as already having the current ssh key
+        installed are not configured up front.  Instead the
+        ``flocker-reportstate`` call reports which key the node has and such
+        nodes are only configured (and asked for their state again) if that
+        turns out to be wrong.
+
         :return: A ``Deferred`` which fires when the deployment is complete or
                  has encountered an error.
         """
         deployment = options['deployment']
-        configuring = self._configure_ssh(deployment)
-        configuring.addCallback(
-            lambda _: self._reportstate_on_nodes(deployment))
-
-        def configured(current_config):
+        already_configured = frozenset(
+            node.hostname for node in deployment.nodes
+            if self.ssh_configuration.is_configured(node.hostname))
+        configuring = self._configure_ssh(Deployment(nodes=frozenset(
+            node for node in deployment.nodes
+            if node.hostname not in already_configured)))
+        configuring.addCallback(lambda _: self._reportstate_on_nodes(
+            deployment, already_configured))
+
+        def reported((current_config, applied)):
             return self._changestate_on_nodes(
-                deployment,
-                options["deployment_config"],
-                options["application_config"],
-                current_config)
-        configuring.addCallback(configured)
+                deployment, current_config, applied)
+        configuring.addCallback(reported)
         configuring.addCallback(lambda _: None)
         return configuring
 
@@ -157,21 +202,84 @@ class DeployScript(object):
                 hostname=node.hostname
             )
 
-    def _reportstate_on_nodes(self, deployment):
+    def _reportstate_on_node(self, target, probe):
+        """
+        Run ``flocker-reportstate`` on a single node.
+
+        :param NodeTarget target: The node to run the command on.
+        :param bool probe: If ``True`` the node has not had its ssh keys
+            configured during this run.  If the node cannot be reached or
+            reports that it does not have the current key installed it is
+            configured and the command is run again.
+
+        :return: ``Deferred`` that fires with the parsed state of the node, a
+            ``dict`` in the application configuration format.
+        """
+        command = [b"flocker-reportstate"]
+        cached = self.state_cache.get(target.hostname)
+        if cached is not None:
+            command += [b"--known-generation", b"%d" % (cached[0],)]
+        d = deferToThread(target.node.get_output, command)
+        d.addCallback(safe_load)
+
+        def use_cache(state):
+            if not isinstance(state, dict) or u"generation" not in state:
+                return state
+            generation = state[u"generation"]
+            if state.get(u"unchanged"):
+                if cached is None or cached[0] != generation:
+                    raise ValueError(
+                        "Node reported unknown generation as unchanged",
+                        target.hostname, generation)
+                return cached[1]
+            del state[u"generation"]
+            self.state_cache.set(target.hostname, generation, state)
+            return state
+        d.addCallback(use_cache)
+
+        if probe:
+            def check_key(state):
+                fingerprint = self.ssh_configuration.key_fingerprint()
+                if state.get(u"ssh_key") != fingerprint:
+                    raise KeyNotInstalled(target.hostname)
+                return state
+
+            def reconfigure(failure):
+                self.ssh_configuration.forget_configured(target.hostname)
+                configuring = self._configure_node_ssh(target.hostname)
+                configuring.addCallback(lambda _: self._reportstate_on_node(
+                    target, probe=False))
+                return configuring
+            d.addCallback(check_key)
+            d.addErrback(reconfigure)
+
+        def strip_key(state):
+            if isinstance(state, dict):
+                state.pop(u"ssh_key", None)
+            return state
+        d.addCallback(strip_key)
+        return d
+
+    def _reportstate_on_nodes(self, deployment, configured=frozenset()):
         """
         Connect to all nodes and run ``flocker-reportstate``.
 
         :param Deployment deployment: The requested already parsed
             configuration.
-
-        :return: ``Deferred`` that fires with a ``bytes`` in YAML format
-            describing the current configuration.
+        :param frozenset configured: The hostnames of nodes which were not
+            explicitly configured with ssh keys during this run because they
+            were recorded as already configured.
+
+        :return: ``Deferred`` that fires with a ``tuple`` of two ``dict``\ s
+            mapping hostnames to the current configuration of each node, in
+            the application configuration format, and to the hash of the node
+            slice each node reports it is still in the state of (or
+            ``None``).
         """
-        command = [b"flocker-reportstate"]
         results = []
         for target in self._get_destinations(deployment):
-            d = deferToThread(target.node.get_output, command)
-            d.addCallback(safe_load)
+            d = self._reportstate_on_node(
+                target, probe=target.hostname in configured)
             d.addCallback(lambda val, key=target.hostname: (key, val))
             results.append(d)
         d = DeferredList(results, fireOnOneErrback=False, consumeErrors=True)
@@ -181,37 +289,55 @@ class DeployScript(object):
             for succeeded, value in node_states:
                 if not succeeded:
                     return value
-            return safe_dump(dict(pair for (_, pair) in node_states))
+            self.state_cache.save()
+            states = dict(pair for (_, pair) in node_states)
+            applied = {}
+            for hostname, state in states.items():
+                if isinstance(state, dict):
+                    applied[hostname] = state.pop(u"applied", None)
+            return states, applied
         d.addCallback(got_results)
         return d
 
-    def _changestate_on_nodes(self, deployment, deployment_config,
-                              application_config, cluster_config):
+    def _changestate_on_nodes(self, deployment, cluster_config,
+                              applied=None):
         """
         Connect to all nodes and run ``flocker-changestate``.
 
+        Each node is only sent the slice of the deployment and of the current
+        cluster configuration which is relevant to it.  Nodes which report
+        that they are still in the state of exactly that slice are skipped.
+
         :param Deployment deployment: The requested already parsed
             configuration.
-        :param bytes deployment_config: YAML-encoded deployment configuration.
-        :param bytes application_config: YAML-encoded application
-            configuration.
-        :param bytes current_config: YAML-encoded current cluster
-            configuration.
+        :param dict cluster_config: The current cluster configuration, as
+            returned by ``_reportstate_on_nodes``.
+        :param dict applied: Map of hostnames to the hash of the slice each
+            node was last changed to, as returned by
+            ``_reportstate_on_nodes``.
 
         :return: ``Deferred`` that fires when all remote calls are finished.
         """
-        command = [b"flocker-changestate",
-                   deployment_config,
-                   application_config,
-                   cluster_config]
+        if applied is None:
+            applied = {}
+        slices = deployment_slices(
+            deployment, current_from_configuration(cluster_config))
         results = []
         for target in self._get_destinations(deployment):
+            # The configuration is sent over standard input rather than as
+            # arguments: it can easily exceed the remote command line length
+            # limit and compresses well.
+            document = node_slice_to_yaml(slices[target.hostname])
+            if applied.get(target.hostname) == configuration_hash(document):
+                continue
+            configuration = encode_documents([document])
             # XXX if number of nodes is bigger than number of available
             # threads we won't get the required parallelism...
             # https://github.com/ClusterHQ/flocker/issues/347
             results.append(
                 deferToThread(
-                    target.node.get_output, command + [target.hostname]))
+                    _run_with_input, target.node,
+                    [b"flocker-changestate"], configuration))
         return DeferredList(results)
 
 
@@ -17,8 +17,16 @@ from ...testtools import (
     FlockerScriptTestsMixin, StandardOptionsTestsMixin, make_with_init_tests)
 from ..script import DeployScript, DeployOptions, NodeTarget
 from .._sshconfig import DEFAULT_SSH_DIRECTORY
-from ...node import Application, Deployment, DockerImage, Node
-from ...common import ProcessNode, FakeNode
+from .._statecache import ClusterStateCache
+from ...node import (
+    Application, Deployment, DockerImage, Node, Port, NodeSlice, VolumeMove,
+    node_slice_from_configuration, node_slice_to_yaml, configuration_hash,
+    deployment_slices)
+from ...node._model import AttachedVolume
+from ...route import Proxy
+
+EMPTY_DEPLOYMENT = Deployment(nodes=frozenset())
+from ...common import ProcessNode, FakeNode, decode_documents
 
 
 class NodeTargetInitTests(
@@ -274,9 +282,12 @@ class FlockerDeployMainTests(TestCase):
             u"applications": {
                 site: {
                     u"image": u"clusterhq/example-site",
+                    u"ports": [{u"internal": 80, u"external": 8080}],
                 },
                 db: {
                     u"image": u"clusterhq/example-db",
+                    u"ports": [{u"internal": 5432, u"external": 5432}],
+                    u"volume": {u"mountpoint": b"/var/lib/db"},
                 },
             },
         })
@@ -386,8 +397,9 @@ class FlockerDeployMainTests(TestCase):
     def test_calls_changestate(self):
         """
         ``DeployScript.main`` calls ``flocker-changestate`` using the
-        destinations and hostnames from ``_get_destinations`` and the
-        aggreggated result for ``flocker-reportstate``.
+        destinations from ``_get_destinations``, writing the slice of the
+        configuration and of the aggreggated result for
+        ``flocker-reportstate`` relevant to each node to its standard input.
         """
         expected_hostname1 = b'node101.example.com'
         expected_hostname2 = b'node102.example.com'
@@ -397,6 +409,7 @@ class FlockerDeployMainTests(TestCase):
             u"applications": {
                 u"db-example.com": {
                     u"image": u"clusterhq/example-db",
+                    u"volume": {u"mountpoint": None},
                 },
             },
         }
@@ -418,22 +431,45 @@ class FlockerDeployMainTests(TestCase):
         running = self.run_script(destinations)
 
         def ran(ignored):
-            expected_common = [
-                b"flocker-changestate",
-                safe_load(self.deployment_config),
-                safe_load(self.application_config),
-                {expected_hostname1: actual_config_host1,
-                 expected_hostname2: actual_config_host2}]
-
-            actual = []
+            site = Application(
+                name=u"site-example.com",
+                image=DockerImage.from_string(u"clusterhq/example-site"),
+                ports=frozenset([Port(internal_port=80, external_port=8080)]))
+            db_volume = AttachedVolume(name=u"db-example.com",
+                                       mountpoint=FilePath(b"/var/lib/db"))
+            db = Application(
+                name=u"db-example.com",
+                image=DockerImage.from_string(u"clusterhq/example-db"),
+                ports=frozenset([Port(internal_port=5432,
+                                      external_port=5432)]),
+                volume=db_volume)
+            move = VolumeMove(volume=db_volume, source=expected_hostname1,
+                              destination=expected_hostname2)
+            expected = {
+                expected_hostname1: NodeSlice(
+                    hostname=expected_hostname1,
+                    applications=frozenset([site]),
+                    proxies=frozenset([
+                        Proxy(ip=expected_hostname2, port=5432)]),
+                    volume_moves=frozenset([move])),
+                expected_hostname2: NodeSlice(
+                    hostname=expected_hostname2,
+                    applications=frozenset([db]),
+                    proxies=frozenset([
+                        Proxy(ip=expected_hostname1, port=8080)]),
+                    volume_moves=frozenset([move])),
+            }
+
+            actual = {}
             for target in destinations:
-                command = target.node.remote_command
-                actual.append(map(safe_load, command[:-1]) + [command[-1]])
+                [configuration] = decode_documents(target.node.stdin.read())
+                actual[target.hostname] = (
+                    target.node.remote_command,
+                    node_slice_from_configuration(safe_load(configuration)))
             self.assertEqual(
-                sorted(actual),
-                sorted([expected_common + [expected_hostname1],
-                        expected_common + [expected_hostname2]])
-            )
+                {hostname: ([b"flocker-changestate"], node_slice)
+                 for hostname, node_slice in expected.items()},
+                actual)
         running.addCallback(ran)
         return running
 
@@ -444,10 +480,11 @@ class FlockerDeployMainTests(TestCase):
 
         (Proving actual parallelism is much more difficult...)
         """
+        report = safe_dump({u"version": 1, u"applications": {}})
         destinations = [
-            NodeTarget(node=FakeNode([b"{}", b""]),
+            NodeTarget(node=FakeNode([report]),
                        hostname=b'node101.example.com'),
-            NodeTarget(node=FakeNode([b"{}", b""]),
+            NodeTarget(node=FakeNode([report]),
                        hostname=b'node102.example.com'),
         ]
 
@@ -459,3 +496,324 @@ class FlockerDeployMainTests(TestCase):
                 set([current_thread().ident]))
         running.addCallback(ran)
         return running
+
+
+class FakeSSHConfiguration(object):
+    """
+    A stand-in for ``OpenSSHConfiguration`` which records configuration
+    instead of connecting to nodes.
+
+    :ivar list configured_hosts: The hosts ``configure_ssh`` was called with.
+    :ivar set recorded: The hosts currently recorded as configured.
+    """
+    def __init__(self, recorded=(), fingerprint=u"aa:bb"):
+        self.configured_hosts = []
+        self.recorded = set(recorded)
+        self.fingerprint = fingerprint
+
+    def key_fingerprint(self):
+        return self.fingerprint
+
+    def is_configured(self, host):
+        return host in self.recorded
+
+    def record_configured(self, host):
+        self.recorded.add(host)
+
+    def forget_configured(self, host):
+        self.recorded.discard(host)
+
+    def configure_ssh(self, host, port):
+        self.configured_hosts.append(host)
+
+
+class DeployScriptConfigureSSHTests(TestCase):
+    """
+    Tests for the way ``DeployScript.main`` avoids configuring ssh keys on
+    nodes which are already configured.
+    """
+    def run_script(self, ssh_configuration, destinations):
+        """
+        Run ``DeployScript.main`` with ``flocker-changestate`` disabled.
+
+        :param ssh_configuration: The ``FakeSSHConfiguration`` to use.
+        :param list destinations: ``NodeTarget`` instances to run
+            ``flocker-reportstate`` against.
+
+        :return: ``Deferred`` that fires with the reported cluster state.
+        """
+        self.patch(DeployScript, "_changestate_on_nodes",
+                   lambda self, deployment, cluster_config, applied:
+                   cluster_config)
+        deployment = Deployment(nodes=frozenset(
+            Node(hostname=target.hostname, applications=frozenset())
+            for target in destinations))
+        script = DeployScript(ssh_configuration=ssh_configuration)
+        script._get_destinations = lambda deployment: destinations
+        running = script.main(reactor, dict(
+            deployment=deployment, deployment_config=b"{}",
+            application_config=b"{}"))
+        running.addCallback(lambda _: script)
+        return running
+
+    def test_new_nodes_configured(self):
+        """
+        Nodes which are not recorded as configured are configured before
+        ``flocker-reportstate`` is run and then recorded.
+        """
+        ssh_configuration = FakeSSHConfiguration()
+        destinations = [
+            NodeTarget(node=FakeNode([b"{}"]), hostname=u"node1"),
+            NodeTarget(node=FakeNode([b"{}"]), hostname=u"node2"),
+        ]
+        running = self.run_script(ssh_configuration, destinations)
+
+        def ran(ignored):
+            self.assertEqual(
+                ({u"node1", u"node2"}, {u"node1", u"node2"}),
+                (set(ssh_configuration.configured_hosts),
+                 ssh_configuration.recorded))
+        running.addCallback(ran)
+        return running
+
+    def test_configured_nodes_skipped(self):
+        """
+        Nodes which are recorded as configured are not configured again if
+        ``flocker-reportstate`` reports the expected key.
+        """
+        ssh_configuration = FakeSSHConfiguration(recorded={u"node1"})
+        report = safe_dump({u"version": 1, u"applications": {},
+                            u"ssh_key": ssh_configuration.fingerprint})
+        destinations = [
+            NodeTarget(node=FakeNode([report]), hostname=u"node1"),
+            NodeTarget(node=FakeNode([b"{}"]), hostname=u"node2"),
+        ]
+        running = self.run_script(ssh_configuration, destinations)
+
+        def ran(ignored):
+            self.assertEqual([u"node2"], ssh_configuration.configured_hosts)
+        running.addCallback(ran)
+        return running
+
+    def test_key_not_reported(self):
+        """
+        If a node recorded as configured reports a different key it is
+        configured and ``flocker-reportstate`` is run again.
+        """
+        ssh_configuration = FakeSSHConfiguration(recorded={u"node1"})
+        report = safe_dump({u"version": 1, u"applications": {},
+                            u"ssh_key": None})
+        node = FakeNode([report, b"{}"])
+        destinations = [NodeTarget(node=node, hostname=u"node1")]
+        running = self.run_script(ssh_configuration, destinations)
+
+        def ran(ignored):
+            self.assertEqual(
+                ([u"node1"], [], {u"node1"}),
+                (ssh_configuration.configured_hosts, node._outputs,
+                 ssh_configuration.recorded))
+        running.addCallback(ran)
+        return running
+
+    def test_unreachable_configured_node(self):
+        """
+        If ``flocker-reportstate`` fails on a node recorded as configured, the
+        node is configured and ``flocker-reportstate`` is run again.
+        """
+        ssh_configuration = FakeSSHConfiguration(recorded={u"node1"})
+        node = FakeNode([IOError("Bad exit"), b"{}"])
+        destinations = [NodeTarget(node=node, hostname=u"node1")]
+        running = self.run_script(ssh_configuration, destinations)
+
+        def ran(ignored):
+            self.assertEqual([u"node1"], ssh_configuration.configured_hosts)
+        running.addCallback(ran)
+        return running
+
+    def test_key_not_passed_on(self):
+        """
+        The ``ssh_key`` probe result is not included in the cluster state
+        passed on to ``flocker-changestate``.
+        """
+        ssh_configuration = FakeSSHConfiguration(recorded={u"node1"})
+        report = safe_dump({u"version": 1, u"applications": {},
+                            u"ssh_key": ssh_configuration.fingerprint})
+        destinations = [NodeTarget(node=FakeNode([report]), hostname=u"node1")]
+        script = DeployScript(ssh_configuration=ssh_configuration)
+        script._get_destinations = lambda deployment: destinations
+        deployment = Deployment(nodes=frozenset(
+            [Node(hostname=u"node1", applications=frozenset())]))
+        reporting = script._reportstate_on_nodes(deployment, {u"node1"})
+        reporting.addCallback(lambda result: self.assertEqual(
+            {u"node1": {u"version": 1, u"applications": {}}},
+            result[0]))
+        return reporting
+
+
+class DeployScriptAppliedTests(TestCase):
+    """
+    Tests for the skipping of nodes which are already in the desired state
+    by ``DeployScript``.
+    """
+    def setUp(self):
+        self.application = Application(
+            name=u"site-example.com",
+            image=DockerImage.from_string(u"clusterhq/example-site"))
+        self.deployment = Deployment(nodes=frozenset([
+            Node(hostname=u"node1",
+                 applications=frozenset([self.application])),
+            Node(hostname=u"node2", applications=frozenset())]))
+        self.slices = deployment_slices(self.deployment, EMPTY_DEPLOYMENT)
+
+    def changestate(self, applied):
+        """
+        Run ``DeployScript._changestate_on_nodes`` against fake nodes.
+
+        :param dict applied: The hashes reported by the nodes.
+
+        :return: ``Deferred`` firing with a ``dict`` mapping hostnames to the
+            ``FakeNode`` for that node.
+        """
+        nodes = {u"node1": FakeNode(), u"node2": FakeNode()}
+        script = DeployScript(ssh_configuration=FakeSSHConfiguration())
+        script._get_destinations = lambda deployment: [
+            NodeTarget(node=node, hostname=hostname)
+            for hostname, node in nodes.items()]
+        d = script._changestate_on_nodes(self.deployment, {}, applied)
+        d.addCallback(lambda _: nodes)
+        return d
+
+    def test_unchanged_skipped(self):
+        """
+        ``flocker-changestate`` is not run on a node which reports the hash
+        of the slice it would be sent.
+        """
+        applied = {u"node1": configuration_hash(
+            node_slice_to_yaml(self.slices[u"node1"]))}
+        d = self.changestate(applied)
+
+        def ran(nodes):
+            self.assertEqual(
+                (False, True),
+                (hasattr(nodes[u"node1"], "remote_command"),
+                 hasattr(nodes[u"node2"], "remote_command")))
+        d.addCallback(ran)
+        return d
+
+    def test_changed_not_skipped(self):
+        """
+        ``flocker-changestate`` is run on a node which reports the hash of a
+        different slice.
+        """
+        applied = {u"node1": configuration_hash(
+            node_slice_to_yaml(self.slices[u"node2"]))}
+        d = self.changestate(applied)
+
+        def ran(nodes):
+            self.assertEqual(
+                [b"flocker-changestate"], nodes[u"node1"].remote_command)
+        d.addCallback(ran)
+        return d
+
+    def test_applied_reported(self):
+        """
+        ``DeployScript._reportstate_on_nodes`` strips the ``applied`` entry
+        from each node's state and returns it separately.
+        """
+        report = safe_dump({u"version": 1, u"applications": {},
+                            u"applied": u"abc"})
+        destinations = [NodeTarget(node=FakeNode([report]), hostname=u"node1")]
+        script = DeployScript(ssh_configuration=FakeSSHConfiguration())
+        script._get_destinations = lambda deployment: destinations
+        reporting = script._reportstate_on_nodes(self.deployment)
+        reporting.addCallback(lambda result: self.assertEqual(
+            ({u"node1": {u"version": 1, u"applications": {}}},
+             {u"node1": u"abc"}),
+            result))
+        return reporting
+
+
+class DeployScriptStateCacheTests(TestCase):
+    """
+    Tests for the use of the cluster state cache by
+    ``DeployScript._reportstate_on_nodes``.
+    """
+    def setUp(self):
+        self.cache = ClusterStateCache(FilePath(self.mktemp()))
+        self.deployment = Deployment(nodes=frozenset([
+            Node(hostname=u"node1", applications=frozenset())]))
+        self.state = {u"version": 1, u"applications": {}, u"applied": None}
+
+    def report(self, output):
+        """
+        Run ``DeployScript._reportstate_on_nodes`` against a fake node.
+
+        :param bytes output: The output of ``flocker-reportstate``.
+
+        :return: ``Deferred`` firing with a ``tuple`` of the ``FakeNode`` and
+            the result of ``_reportstate_on_nodes``.
+        """
+        node = FakeNode([output])
+        script = DeployScript(ssh_configuration=FakeSSHConfiguration(),
+                              state_cache=self.cache)
+        script._get_destinations = lambda deployment: [
+            NodeTarget(node=node, hostname=u"node1")]
+        d = script._reportstate_on_nodes(self.deployment)
+        d.addCallback(lambda result: (node, result))
+        return d
+
+    def test_state_cached(self):
+        """
+        A reported state is cached with its generation.
+        """
+        report = dict(self.state, generation=7)
+        d = self.report(safe_dump(report))
+
+        def reported((node, result)):
+            self.assertEqual(
+                ([b"flocker-reportstate"],
+                 ({u"node1": {u"version": 1, u"applications": {}}},
+                  {u"node1": None}),
+                 (7, self.state)),
+                (node.remote_command, result, self.cache.get(u"node1")))
+        d.addCallback(reported)
+        return d
+
+    def test_known_generation_sent(self):
+        """
+        The generation of a cached state is passed to
+        ``flocker-reportstate``.
+        """
+        self.cache.set(u"node1", 7, self.state)
+        d = self.report(safe_dump(dict(self.state, generation=8)))
+
+        def reported((node, result)):
+            self.assertEqual(
+                [b"flocker-reportstate", b"--known-generation", b"7"],
+                node.remote_command)
+        d.addCallback(reported)
+        return d
+
+    def test_unchanged(self):
+        """
+        If the node reports its state is unchanged, the cached state is used.
+        """
+        self.cache.set(u"node1", 7, dict(self.state, applied=u"abc"))
+        d = self.report(safe_dump({u"generation": 7, u"unchanged": True}))
+
+        def reported((node, result)):
+            self.assertEqual(
+                ({u"node1": {u"version": 1, u"applications": {}}},
+                 {u"node1": u"abc"}),
+                result)
+        d.addCallback(reported)
+        return d
+
+    def test_unchanged_unknown_generation(self):
+        """
+        If the node reports a generation other than the cached one as
+        unchanged, reporting fails.
+        """
+        self.cache.set(u"node1", 7, self.state)
+        d = self.report(safe_dump({u"generation": 6, u"unchanged": True}))
+        return self.assertFailure(d, ValueError)
@@ -0,0 +1,128 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Unit tests for ``flocker.cli._sshconfig``.
+"""
+
+from ipaddr import IPAddress
+
+from twisted.trial.unittest import SynchronousTestCase
+from twisted.python.filepath import FilePath
+
+from .._sshconfig import OpenSSHConfiguration
+from ...common import ssh_key_fingerprint
+from ...common.test.test_ssh import PUBLIC_KEY
+
+OTHER_PUBLIC_KEY = (
+    b"ssh-ed25519 "
+    b"AAAAC3NzaC1lZDI1NTE5AAAAIICRbUL47uHNlh6Y22JPnG5u7fZ8PSBCfZFOU4LfdrBl")
+
+
+class ConfiguredNodesTests(SynchronousTestCase):
+    """
+    Tests for the record of configured nodes kept by
+    ``OpenSSHConfiguration``.
+    """
+    def setUp(self):
+        self.ssh_config = FilePath(self.mktemp())
+        self.config = OpenSSHConfiguration(
+            ssh_config_path=self.ssh_config,
+            flocker_path=FilePath(self.mktemp()))
+
+    def set_public_key(self, public_key):
+        """
+        Write a local Flocker public key.
+        """
+        if not self.ssh_config.isdir():
+            self.ssh_config.makedirs()
+        self.ssh_config.child(b"id_rsa_flocker.pub").setContent(public_key)
+
+    def test_no_key_fingerprint(self):
+        """
+        ``OpenSSHConfiguration.key_fingerprint`` returns ``None`` if no key
+        pair has been generated.
+        """
+        self.assertIs(None, self.config.key_fingerprint())
+
+    def test_key_fingerprint(self):
+        """
+        ``OpenSSHConfiguration.key_fingerprint`` returns the fingerprint of the
+        local public key.
+        """
+        self.set_public_key(PUBLIC_KEY)
+        self.assertEqual(ssh_key_fingerprint(PUBLIC_KEY).decode("ascii"),
+                         self.config.key_fingerprint())
+
+    def test_not_configured(self):
+        """
+        A node which has not been recorded is not configured.
+        """
+        self.set_public_key(PUBLIC_KEY)
+        self.assertFalse(self.config.is_configured(u"node1.example.com"))
+
+    def test_recorded(self):
+        """
+        A node recorded with ``record_configured`` is configured.
+        """
+        self.set_public_key(PUBLIC_KEY)
+        self.config.record_configured(u"node1.example.com")
+        self.assertEqual(
+            (True, False),
+            (self.config.is_configured(u"node1.example.com"),
+             self.config.is_configured(u"node2.example.com")))
+
+    def test_recorded_persistent(self):
+        """
+        The record is kept on disk so that other ``OpenSSHConfiguration``
+        instances using the same path see it.
+        """
+        self.set_public_key(PUBLIC_KEY)
+        self.config.record_configured(u"node1.example.com")
+        config = OpenSSHConfiguration(
+            ssh_config_path=self.ssh_config,
+            flocker_path=FilePath(self.mktemp()))
+        self.assertTrue(config.is_configured(u"node1.example.com"))
+
+    def test_host_types(self):
+        """
+        ``bytes``, ``unicode`` and ``IPv4Address`` hosts are treated as the
+        same node.
+        """
+        self.set_public_key(PUBLIC_KEY)
+        self.config.record_configured(IPAddress("192.0.2.1"))
+        self.assertEqual(
+            (True, True),
+            (self.config.is_configured(b"192.0.2.1"),
+             self.config.is_configured(u"192.0.2.1")))
+
+    def test_key_changed(self):
+        """
+        A node recorded as configured with a different key pair is not
+        configured.
+        """
+        self.set_public_key(PUBLIC_KEY)
+        self.config.record_configured(u"node1.example.com")
+        self.set_public_key(OTHER_PUBLIC_KEY)
+        self.assertFalse(self.config.is_configured(u"node1.example.com"))
+
+    def test_forget(self):
+        """
+        A node is no longer configured after ``forget_configured``.
+        """
+        self.set_public_key(PUBLIC_KEY)
+        self.config.record_configured(u"node1.example.com")
+        self.config.record_configured(u"node2.example.com")
+        self.config.forget_configured(u"node1.example.com")
+        self.assertEqual(
+            (False, True),
+            (self.config.is_configured(u"node1.example.com"),
+             self.config.is_configured(u"node2.example.com")))
+
+    def test_corrupt_record(self):
+        """
+        A corrupt record is treated as if no nodes were configured.
+        """
+        self.set_public_key(PUBLIC_KEY)
+        self.ssh_config.child(b"flocker_configured_nodes.json").setContent(
+            b"{not json")
+        self.assertFalse(self.config.is_configured(u"node1.example.com"))
@@ -0,0 +1,87 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Unit tests for ``flocker.cli._statecache``.
+"""
+
+from ipaddr import IPAddress
+
+from twisted.trial.unittest import SynchronousTestCase
+from twisted.python.filepath import FilePath
+
+from .._statecache import ClusterStateCache
+
+
+class ClusterStateCacheTests(SynchronousTestCase):
+    """
+    Tests for ``ClusterStateCache``.
+    """
+    def setUp(self):
+        self.path = FilePath(self.mktemp()).child(b"cluster_state.json")
+        self.cache = ClusterStateCache(self.path)
+        self.state = {u"version": 1, u"applications": {}}
+
+    def test_missing(self):
+        """
+        ``ClusterStateCache.get`` returns ``None`` for a node nothing has been
+        cached for.
+        """
+        self.assertIs(None, self.cache.get(u"node1.example.com"))
+
+    def test_set(self):
+        """
+        ``ClusterStateCache.get`` returns the generation and state passed to
+        ``ClusterStateCache.set``.
+        """
+        self.cache.set(u"node1.example.com", 5, self.state)
+        self.assertEqual((5, self.state), self.cache.get(u"node1.example.com"))
+
+    def test_copies(self):
+        """
+        Changes to the state passed to ``ClusterStateCache.set`` or returned
+        by ``ClusterStateCache.get`` do not affect the cache.
+        """
+        self.cache.set(u"node1.example.com", 5, self.state)
+        self.state[u"version"] = 2
+        self.cache.get(u"node1.example.com")[1][u"applications"][u"x"] = {}
+        self.assertEqual(
+            (5, {u"version": 1, u"applications": {}}),
+            self.cache.get(u"node1.example.com"))
+
+    def test_host_types(self):
+        """
+        ``bytes``, ``unicode`` and ``IPv4Address`` hosts are treated as the
+        same node.
+        """
+        self.cache.set(IPAddress("192.0.2.1"), 5, self.state)
+        self.assertEqual(
+            ((5, self.state), (5, self.state)),
+            (self.cache.get(b"192.0.2.1"), self.cache.get(u"192.0.2.1")))
+
+    def test_save(self):
+        """
+        ``ClusterStateCache.save`` writes the cache to disk, where other
+        ``ClusterStateCache`` instances using the same path find it.
+        """
+        self.cache.set(u"node1.example.com", 5, self.state)
+        self.cache.save()
+        self.assertEqual(
+            (5, self.state),
+            ClusterStateCache(self.path).get(u"node1.example.com"))
+
+    def test_save_unchanged(self):
+        """
+        ``ClusterStateCache.save`` does not write anything if nothing has been
+        cached.
+        """
+        self.cache.get(u"node1.example.com")
+        self.cache.save()
+        self.assertFalse(self.path.exists())
+
+    def test_corrupt(self):
+        """
+        A corrupt cache file is treated as empty.
+        """
+        self.path.parent().makedirs()
+        self.path.setContent(b"[1, 2")
+        self.assertIs(None, self.cache.get(u"node1.example.com"))
@@ -4,6 +4,9 @@
 Shared flocker components.
 """
 
-__all__ = ['INode', 'FakeNode', 'ProcessNode']
+__all__ = ['INode', 'FakeNode', 'ProcessNode', 'ssh_key_fingerprint',
+           'encode_documents', 'decode_documents']
 
 from ._ipc import INode, FakeNode, ProcessNode
+from ._framing import encode_documents, decode_documents
+from ._ssh import ssh_key_fingerprint
@@ -0,0 +1,64 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+# -*- test-case-name: flocker.common.test.test_framing -*-
+
+"""
+A compact framing for passing several documents to a remote command over its
+standard input.
+
+The documents are encoded as a sequence of netstrings
+(http://cr.yp.to/proto/netstrings.txt) which is then compressed with zlib and
+prefixed with a version byte.
+"""
+
+import zlib
+
+_VERSION = b"\x01"
+
+
+def encode_documents(documents):
+    """
+    Frame and compress some documents.
+
+    :param documents: A sequence of ``bytes``.
+
+    :return: ``bytes`` which can be decoded with ``decode_documents``.
+    """
+    framed = b"".join(
+        b"%d:%s," % (len(document), document) for document in documents)
+    return _VERSION + zlib.compress(framed)
+
+
+def decode_documents(data):
+    """
+    Decode documents encoded by ``encode_documents``.
+
+    :param bytes data: The encoded documents.
+
+    :raises ValueError: If ``data`` was not produced by ``encode_documents``.
+
+    :return: A ``list`` of ``bytes``, the original documents.
+    """
+    if not data.startswith(_VERSION):
+        raise ValueError("Unknown framing version.")
+    try:
+        framed = zlib.decompress(data[len(_VERSION):])
+    except zlib.error as e:
+        raise ValueError("Could not decompress documents: %s" % (e,))
+
+    documents = []
+    position = 0
+    while position < len(framed):
+        separator = framed.find(b":", position)
+        if separator == -1:
+            raise ValueError("Truncated document length.")
+        try:
+            length = int(framed[position:separator])
+        except ValueError:
+            raise ValueError("Invalid document length.")
+        start = separator + 1
+        end = start + length
+        if length < 0 or framed[end:end + 1] != b",":
+            raise ValueError("Truncated document.")
+        documents.append(framed[start:end])
+        position = end + 1
+    return documents
@@ -0,0 +1,36 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+# -*- test-case-name: flocker.common.test.test_ssh -*-
+
+"""
+Helpers for dealing with the SSH keys Flocker installs on nodes.
+"""
+
+from base64 import b64decode
+from binascii import Error as BinasciiError
+from hashlib import md5
+
+
+def ssh_key_fingerprint(public_key):
+    """
+    Compute the fingerprint of an OpenSSH public key.
+
+    The result is the same colon-separated MD5 fingerprint displayed by
+    ``ssh-keygen -l``.
+
+    :param bytes public_key: A public key in the OpenSSH ``authorized_keys``
+        format, e.g. ``b"ssh-rsa AAAA... comment"``.
+
+    :raises ValueError: If ``public_key`` cannot be parsed.
+
+    :return: The fingerprint as ``bytes``.
+    """
+    parts = public_key.split()
+    if len(parts) < 2:
+        raise ValueError("Not an OpenSSH public key: %r" % (public_key,))
+    try:
+        blob = b64decode(parts[1])
+    except (TypeError, BinasciiError):
+        raise ValueError("Not an OpenSSH public key: %r" % (public_key,))
+    digest = md5(blob).hexdigest()
+    return b":".join(
+        digest[i:i + 2] for i in range(0, len(digest), 2))
@@ -0,0 +1,73 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.common._framing``.
+"""
+
+import zlib
+
+from twisted.trial.unittest import SynchronousTestCase
+
+from .. import encode_documents, decode_documents
+
+
+class FramingTests(SynchronousTestCase):
+    """
+    Tests for ``encode_documents`` and ``decode_documents``.
+    """
+    def test_roundtrip(self):
+        """
+        Documents encoded with ``encode_documents`` are decoded unchanged by
+        ``decode_documents``.
+        """
+        documents = [b"version: 1\n", b"", b"x" * 10000, b"1:2,3:\x00"]
+        self.assertEqual(
+            documents, decode_documents(encode_documents(documents)))
+
+    def test_no_documents(self):
+        """
+        An empty sequence of documents can be encoded and decoded.
+        """
+        self.assertEqual([], decode_documents(encode_documents([])))
+
+    def test_compressed(self):
+        """
+        Repetitive documents are encoded into fewer bytes than they contain.
+        """
+        documents = [b"applications: {}\n" * 1000] * 3
+        self.assertTrue(
+            len(encode_documents(documents)) <
+            sum(len(document) for document in documents) / 10)
+
+    def test_unknown_version(self):
+        """
+        ``decode_documents`` raises ``ValueError`` for data without the
+        expected version prefix.
+        """
+        self.assertRaises(ValueError, decode_documents, b"version: 1\n")
+
+    def test_not_compressed(self):
+        """
+        ``decode_documents`` raises ``ValueError`` if the data cannot be
+        decompressed.
+        """
+        encoded = encode_documents([b"abc"])
+        self.assertRaises(ValueError, decode_documents, encoded[:1] + b"abc")
+
+    def test_truncated(self):
+        """
+        ``decode_documents`` raises ``ValueError`` if the last document is
+        truncated.
+        """
+        encoded = encode_documents([b"abc"])
+        truncated = encoded[:1] + zlib.compress(
+            zlib.decompress(encoded[1:])[:-2])
+        self.assertRaises(ValueError, decode_documents, truncated)
+
+    def test_bad_length(self):
+        """
+        ``decode_documents`` raises ``ValueError`` if a document length is not
+        a number.
+        """
+        encoded = encode_documents([])[:1] + zlib.compress(b"x:abc,")
+        self.assertRaises(ValueError, decode_documents, encoded)
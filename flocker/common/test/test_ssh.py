@@ -0,0 +1,50 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.common._ssh``.
+"""
+
+from twisted.trial.unittest import SynchronousTestCase
+
+from .. import ssh_key_fingerprint
+
+PUBLIC_KEY = (
+    b"ssh-ed25519 "
+    b"AAAAC3NzaC1lZDI1NTE5AAAAICrSt43QLo5eAl9SXtnYhHrpcjvs0GHEDD4XInQRoaVG "
+    b"alice@example.com")
+
+
+class SSHKeyFingerprintTests(SynchronousTestCase):
+    """
+    Tests for ``ssh_key_fingerprint``.
+    """
+    def test_fingerprint(self):
+        """
+        ``ssh_key_fingerprint`` returns the same MD5 fingerprint as
+        ``ssh-keygen -l -E md5``.
+        """
+        self.assertEqual(
+            b"8d:04:40:3c:a0:e7:f6:67:3b:94:a5:da:ed:c4:12:90",
+            ssh_key_fingerprint(PUBLIC_KEY))
+
+    def test_comment_ignored(self):
+        """
+        The comment part of the key does not contribute to the fingerprint.
+        """
+        without_comment = PUBLIC_KEY.rsplit(b" ", 1)[0]
+        self.assertEqual(ssh_key_fingerprint(PUBLIC_KEY),
+                         ssh_key_fingerprint(without_comment + b"\n"))
+
+    def test_not_a_key(self):
+        """
+        ``ssh_key_fingerprint`` raises ``ValueError`` if given something which
+        is not an OpenSSH public key.
+        """
+        self.assertRaises(ValueError, ssh_key_fingerprint, b"garbage")
+
+    def test_bad_base64(self):
+        """
+        ``ssh_key_fingerprint`` raises ``ValueError`` if the key data is not
+        valid base64.
+        """
+        self.assertRaises(ValueError, ssh_key_fingerprint, b"ssh-rsa A")
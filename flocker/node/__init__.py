@@ -6,10 +6,14 @@ Local node manager for Flocker.
 
 from ._config import (
     ConfigurationError, model_from_configuration, current_from_configuration,
+    node_slice_from_configuration, node_slice_to_configuration,
+    node_slice_to_yaml, configuration_hash,
     )
 from ._model import (
-    Application, Deployment, DockerImage, Node, StateChanges, Port)
-from ._deploy import Deployer, NodeState
+    Application, Deployment, DockerImage, Node, StateChanges, Port,
+    NodeSlice, VolumeMove, ResourceLimits)
+from ._deploy import (
+    Deployer, NodeState, deployment_slices, deployment_slice)
 
 __all__ = [
     'ConfigurationError',
@@ -22,5 +26,14 @@ __all__ = [
     'Node',
     'StateChanges',
     'Port',
+    'ResourceLimits',
     'NodeState',
+    'NodeSlice',
+    'VolumeMove',
+    'deployment_slices',
+    'deployment_slice',
+    'node_slice_from_configuration',
+    'node_slice_to_configuration',
+    'node_slice_to_yaml',
+    'configuration_hash',
 ]
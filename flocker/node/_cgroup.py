@@ -0,0 +1,123 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+# -*- test-case-name: flocker.node.test.test_cgroup -*-
+
+"""
+Apply and read the resource limits of Docker containers through their
+control groups.
+
+Gear has no way to be told about resource limits, so they are written
+directly to the control groups Docker puts each container in.  Those are
+recreated whenever the container is, so the limits are applied again on
+every deployment.
+"""
+
+from twisted.python.filepath import FilePath
+
+from ._model import ResourceLimits
+
+
+# Where the control group hierarchies are mounted.
+CGROUP_ROOT = FilePath(b"/sys/fs/cgroup")
+
+# The ``ResourceLimits`` attributes, and the controller and file enforcing
+# each of them.
+_LIMITS = [
+    ("cpu_shares", b"cpu", b"cpu.shares"),
+    ("memory_limit", b"memory", b"memory.limit_in_bytes"),
+    ("cpuset", b"cpuset", b"cpuset.cpus"),
+    ("blkio_weight", b"blkio", b"blkio.weight"),
+]
+
+
+class CgroupNotFound(Exception):
+    """
+    A container has no control group for one of the controllers.
+    """
+
+
+def container_cgroup(root, controller, container_id):
+    """
+    Find the control group of a container.
+
+    Docker puts containers in ``docker/<id>`` when it manages control groups
+    itself, and in ``system.slice/docker-<id>.scope`` when systemd does.
+
+    :param FilePath root: Where the control group hierarchies are mounted.
+    :param bytes controller: The name of the controller, e.g. ``b"cpu"``.
+    :param bytes container_id: The full ID of the container.
+
+    :return: The ``FilePath`` of the control group, or ``None`` if the
+        container doesn't have one, e.g. because it isn't running.
+    """
+    hierarchy = root.child(controller)
+    for cgroup in [
+            hierarchy.child(b"docker").child(container_id),
+            hierarchy.child(b"system.slice").child(
+                b"docker-%s.scope" % (container_id,))]:
+        if cgroup.isdir():
+            return cgroup
+    return None
+
+
+def apply_limits(root, container_id, resources):
+    """
+    Limit the resources of a running container.
+
+    The limits are written from scratch, so that applying the same limits
+    again restores any which were lost or changed.  Limits which are ``None``
+    are reset to the value of the control group the container's group is in,
+    which ``read_limits`` reports as unlimited.
+
+    :param FilePath root: Where the control group hierarchies are mounted.
+    :param bytes container_id: The full ID of the container.
+    :param ResourceLimits resources: The limits to apply.
+
+    :raise CgroupNotFound: If the container has no control group for one of
+        the limits which is set.
+    """
+    for attribute, controller, name in _LIMITS:
+        value = getattr(resources, attribute)
+        cgroup = container_cgroup(root, controller, container_id)
+        if cgroup is None:
+            if value is None:
+                continue
+            raise CgroupNotFound(container_id, controller)
+        if value is None:
+            value = cgroup.parent().child(name).getContent().strip()
+        elif isinstance(value, unicode):
+            value = value.encode("ascii")
+        # FilePath.setContent replaces the file, which a control group's
+        # files can't be:
+        with cgroup.child(name).open("w") as control:
+            control.write(bytes(value))
+
+
+def read_limits(root, container_id):
+    """
+    Read the limits on the resources of a container.
+
+    A value which is the same as that of the control group the container's
+    group is in, e.g. the default CPU shares or the parent's CPUs, is not a
+    limit on the container.
+
+    :param FilePath root: Where the control group hierarchies are mounted.
+    :param bytes container_id: The full ID of the container.
+
+    :return: ``None`` if the container has no control groups or isn't
+        limited, otherwise the ``ResourceLimits`` of the container.
+    """
+    limits = {}
+    for attribute, controller, name in _LIMITS:
+        cgroup = container_cgroup(root, controller, container_id)
+        if cgroup is None:
+            continue
+        value = cgroup.child(name).getContent().strip()
+        if value == cgroup.parent().child(name).getContent().strip():
+            continue
+        if attribute == "cpuset":
+            limits[attribute] = value.decode("ascii")
+        else:
+            limits[attribute] = int(value)
+    if not limits:
+        return None
+    return ResourceLimits(**limits)
@@ -8,14 +8,164 @@ APIs for parsing and validating configuration.
 from __future__ import unicode_literals, absolute_import
 
 import os
+import re
+from hashlib import sha256
+
 import yaml
 
 from twisted.python.filepath import FilePath
 
 from ._model import (
     Application, AttachedVolume, Deployment,
-    DockerImage, Node, Port
+    DockerImage, Node, Port, NodeSlice, VolumeMove, ResourceLimits
 )
+from ..route import Proxy
+from ..volume._profiles import PROFILES, TUNABLE_PROPERTIES
+
+
+# The suffixes ``memory_limit`` can be given with, and the number of bytes
+# each stands for.
+_MEMORY_UNITS = {"b": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+
+# A list of CPUs and ranges of CPUs, as ``cpuset`` is given.
+_CPUSET = re.compile(r"^\d+(-\d+)?(,\d+(-\d+)?)*$")
+
+# The range of block IO weights the kernel accepts.
+_BLKIO_WEIGHTS = (10, 1000)
+
+
+def _integer(key, value, minimum=1, maximum=None):
+    """
+    Validate a limit which is a number.
+
+    :param unicode key: The name of the limit.
+    :param value: The configured value.
+    :param int minimum: The smallest allowed value.
+    :param maximum: ``None``, or the largest allowed value.
+
+    :raises ValueError: If the value isn't a number in range.
+
+    :return: The value.
+    """
+    if (isinstance(value, bool) or not isinstance(value, (int, long)) or
+            value < minimum or (maximum is not None and value > maximum)):
+        if maximum is None:
+            expected = "an integer of at least {minimum}"
+        else:
+            expected = "an integer from {minimum} to {maximum}"
+        raise ValueError(
+            ("'{key}' must be " + expected + ", not {value}.").format(
+                key=key, minimum=minimum, maximum=maximum, value=value))
+    return value
+
+
+def _memory(value):
+    """
+    Validate a ``memory_limit``.
+
+    :param value: The configured value: a number of bytes, or a ``unicode``
+        number of bytes, kilobytes, megabytes or gigabytes such as
+        ``"512m"``.
+
+    :raises ValueError: If the value isn't a positive amount of memory.
+
+    :return: The ``int`` number of bytes.
+    """
+    if isinstance(value, basestring):
+        text = value.strip().lower()
+        multiplier = 1
+        if text[-1:] in _MEMORY_UNITS:
+            multiplier = _MEMORY_UNITS[text[-1]]
+            text = text[:-1]
+        if not text.isdigit():
+            raise ValueError(
+                "'memory_limit' must be a number of bytes, optionally with a "
+                "suffix of b, k, m or g, not {value}.".format(value=value))
+        value = int(text) * multiplier
+    return _integer("memory_limit", value)
+
+
+def _cpuset(value):
+    """
+    Validate a ``cpuset``.
+
+    :param value: The configured value, a list of CPUs and ranges of CPUs
+        such as ``"0-3,6"``.
+
+    :raises ValueError: If the value isn't a list of CPUs.
+
+    :return: The ``unicode`` list of CPUs.
+    """
+    if isinstance(value, (int, long)) and not isinstance(value, bool):
+        value = unicode(value)
+    if not isinstance(value, basestring) or not _CPUSET.match(value):
+        raise ValueError(
+            "'cpuset' must be a list of CPUs such as '0-3,6', not "
+            "{value}.".format(value=value))
+    return unicode(value)
+
+
+def _tuning(configured_volume):
+    """
+    Validate and remove the ``profile`` and ``properties`` of a volume's
+    configuration.
+
+    :param dict configured_volume: The configuration of the volume.
+
+    :raises ValueError: If the profile is unknown or a property can't be
+        tuned.
+
+    :return: A ``tuple`` of the ``unicode`` name of the profile or ``None``,
+        and a ``frozenset`` of ``tuple``\ s of the name and value of each
+        property.
+    """
+    profile = configured_volume.pop('profile', None)
+    if profile is not None and (not isinstance(profile, (str, unicode)) or
+                                profile not in PROFILES):
+        raise ValueError(
+            "Unknown profile {profile}. Known profiles: {profiles}.".format(
+                profile=profile, profiles=', '.join(sorted(PROFILES))))
+
+    configured_properties = configured_volume.pop('properties', {})
+    if not isinstance(configured_properties, dict):
+        raise ValueError(
+            "Properties must be a mapping, not {value}.".format(
+                value=configured_properties))
+    properties = []
+    for name, value in configured_properties.items():
+        if name not in TUNABLE_PROPERTIES:
+            raise ValueError(
+                "Unsupported property {name}. Supported properties: "
+                "{properties}.".format(
+                    name=name,
+                    properties=', '.join(sorted(TUNABLE_PROPERTIES))))
+        # YAML reads unquoted on and off as booleans:
+        if isinstance(value, bool):
+            value = "on" if value else "off"
+        properties.append((unicode(name), unicode(value)))
+    if profile is not None:
+        profile = unicode(profile)
+    return profile, frozenset(properties)
+
+
+def _storage_class(configured_volume):
+    """
+    Validate and remove the ``storage_class`` of a volume's configuration.
+
+    :param dict configured_volume: The configuration of the volume.
+
+    :raises ValueError: If the storage class isn't a string.
+
+    :return: The ``unicode`` storage class, or ``None`` if there is none.
+    """
+    storage_class = configured_volume.pop('storage_class', None)
+    if storage_class is None:
+        return None
+    if not isinstance(storage_class, (str, unicode)):
+        raise ValueError(
+            "Storage class must be a string, not {value}.".format(
+                value=storage_class))
+    return unicode(storage_class)
 
 
 class ConfigurationError(Exception):
@@ -122,6 +272,9 @@ class Configuration(object):
                     except KeyError:
                         raise ValueError("Missing mountpoint.")
 
+                    profile, properties = _tuning(configured_volume)
+                    storage_class = _storage_class(configured_volume)
+
                     if not (self._lenient and mountpoint is None):
                         if not isinstance(mountpoint, str):
                             raise ValueError(
@@ -148,7 +301,10 @@ class Configuration(object):
 
                     volume = AttachedVolume(
                         name=application_name,
-                        mountpoint=mountpoint
+                        mountpoint=mountpoint,
+                        profile=profile,
+                        properties=properties,
+                        storage_class=storage_class,
                         )
                 except ValueError as e:
                     raise ConfigurationError(
@@ -160,11 +316,36 @@ class Configuration(object):
                         )
                     )
 
+            resources = None
+            limits = {}
+            try:
+                if "cpu_shares" in config:
+                    limits["cpu_shares"] = _integer(
+                        "cpu_shares", config.pop("cpu_shares"))
+                if "memory_limit" in config:
+                    limits["memory_limit"] = _memory(
+                        config.pop("memory_limit"))
+                if "cpuset" in config:
+                    limits["cpuset"] = _cpuset(config.pop("cpuset"))
+                if "blkio_weight" in config:
+                    minimum, maximum = _BLKIO_WEIGHTS
+                    limits["blkio_weight"] = _integer(
+                        "blkio_weight", config.pop("blkio_weight"),
+                        minimum, maximum)
+            except ValueError as e:
+                raise ConfigurationError(
+                    ("Application '{application_name}' has a config error. "
+                     "Invalid resource limits. {message}").format(
+                         application_name=application_name, message=e.message))
+            if limits:
+                resources = ResourceLimits(**limits)
+
             applications[application_name] = Application(
                 name=application_name,
                 image=image,
                 volume=volume,
-                ports=frozenset(ports))
+                ports=frozenset(ports),
+                resources=resources)
 
             if config:
                 raise ConfigurationError(
@@ -252,8 +433,72 @@ class Configuration(object):
             deployment_configuration, applications)
         return Deployment(nodes=frozenset(nodes))
 
+    def node_slice_from_configuration(self, slice_configuration):
+        """
+        Validate and coerce the supplied node slice configuration into a
+        ``NodeSlice`` instance.
+
+        :param dict slice_configuration: The intermediate representation of a
+            node slice as generated by ``node_slice_to_configuration``.
+
+        :raises ConfigurationError: if there are validation errors.
+
+        :returns: A ``NodeSlice`` object.
+        """
+        if not isinstance(slice_configuration, dict):
+            raise ConfigurationError(
+                "Node configuration has an error. "
+                "Unexpected value: {value}".format(value=slice_configuration))
+
+        for key in ("version", "hostname", "applications", "proxies",
+                    "volume_moves"):
+            if key not in slice_configuration:
+                raise ConfigurationError(
+                    "Node configuration has an error. "
+                    "Missing '{key}' key.".format(key=key))
+
+        if slice_configuration["version"] != 1:
+            raise ConfigurationError("Node configuration has an error. "
+                                     "Incorrect version specified.")
+
+        applications = self._applications_from_configuration(
+            {"version": 1,
+             "applications": slice_configuration["applications"]})
+
+        try:
+            proxies = frozenset(
+                Proxy(ip=proxy["ip"], port=proxy["port"])
+                for proxy in slice_configuration["proxies"])
+        except (KeyError, TypeError) as e:
+            raise ConfigurationError(
+                "Node configuration has an error. "
+                "Invalid proxy specification: {error}".format(error=e))
+
+        try:
+            volume_moves = []
+            for move in slice_configuration["volume_moves"]:
+                mountpoint = move["mountpoint"]
+                if mountpoint is not None:
+                    mountpoint = FilePath(mountpoint)
+                volume_moves.append(VolumeMove(
+                    volume=AttachedVolume(name=move["name"],
+                                          mountpoint=mountpoint),
+                    source=move["source"],
+                    destination=move["destination"]))
+        except (KeyError, TypeError) as e:
+            raise ConfigurationError(
+                "Node configuration has an error. "
+                "Invalid volume move specification: {error}".format(error=e))
+
+        return NodeSlice(hostname=slice_configuration["hostname"],
+                         applications=frozenset(applications.values()),
+                         proxies=proxies,
+                         volume_moves=frozenset(volume_moves))
+
 
 model_from_configuration = Configuration().model_from_configuration
+node_slice_from_configuration = (
+    Configuration().node_slice_from_configuration)
 
 
 def current_from_configuration(current_configuration):
@@ -281,9 +526,26 @@ def current_from_configuration(current_configuration):
     return Deployment(nodes=frozenset(nodes))
 
 
-def configuration_to_yaml(applications):
+def _resources_to_configuration(resources, config):
     """
-    Generate YAML representation of a node's applications.
+    Add the resource limits of an application to its configuration.
+
+    :param resources: ``None`` or the ``ResourceLimits`` of the application.
+    :param dict config: The application's configuration, to which a key is
+        added for each limit which is set.
+    """
+    if resources is None:
+        return
+    for key in ("cpu_shares", "memory_limit", "cpuset", "blkio_weight"):
+        value = getattr(resources, key)
+        if value is not None:
+            config[key] = value
+
+
+def applications_to_configuration(applications):
+    """
+    Generate the intermediate configuration representation of a node's
+    applications.
 
     A bunch of information is missing, but this is sufficient for the
     initial requirement of determining what to do about volumes when
@@ -294,8 +556,7 @@ def configuration_to_yaml(applications):
         current configuration on a node as determined by
         ``Deployer.discover_node_configuration()``.
 
-    :return: YAML serialized configuration in the application
-        configuration format.
+    :return: A ``dict`` in the application configuration format.
     """
     result = {}
     for application in applications:
@@ -316,4 +577,110 @@ def configuration_to_yaml(applications):
             result[application.name]["volume"] = {
                 "mountpoint": None,
             }
-    return yaml.safe_dump({"version": 1, "applications": result})
+        _resources_to_configuration(
+            application.resources, result[application.name])
+    return {"version": 1, "applications": result}
+
+
+def configuration_to_yaml(applications):
+    """
+    Generate YAML representation of a node's applications.
+
+    :see: ``applications_to_configuration``
+
+    :return: YAML serialized configuration in the application
+        configuration format.
+    """
+    return yaml.safe_dump(applications_to_configuration(applications))
+
+
+def node_slice_to_configuration(node_slice):
+    """
+    Generate the intermediate configuration representation of a node slice.
+
+    Unlike ``applications_to_configuration`` the complete application
+    configuration is included, since the slice is the desired configuration
+    of the node.  Lists are sorted so that equal slices have equal
+    representations.
+
+    :param NodeSlice node_slice: The slice to represent.
+
+    :return: A ``dict`` which can be loaded with
+        ``node_slice_from_configuration``.
+    """
+    applications = {}
+    for application in node_slice.applications:
+        config = {
+            "image": application.image.full_name,
+            "ports": sorted(
+                ({'internal': port.internal_port,
+                  'external': port.external_port}
+                 for port in application.ports),
+                key=lambda port: (port['internal'], port['external'])),
+        }
+        if application.volume:
+            config["volume"] = {
+                "mountpoint": application.volume.mountpoint.path,
+            }
+            if application.volume.profile is not None:
+                config["volume"]["profile"] = application.volume.profile
+            if application.volume.properties:
+                config["volume"]["properties"] = dict(
+                    application.volume.properties)
+            if application.volume.storage_class is not None:
+                config["volume"]["storage_class"] = (
+                    application.volume.storage_class)
+        _resources_to_configuration(application.resources, config)
+        applications[application.name] = config
+
+    proxies = [{"ip": proxy.ip, "port": proxy.port}
+               for proxy in sorted(node_slice.proxies,
+                                   key=lambda proxy: (proxy.ip, proxy.port))]
+
+    volume_moves = []
+    for move in sorted(node_slice.volume_moves,
+                       key=lambda move: move.volume.name):
+        mountpoint = move.volume.mountpoint
+        if mountpoint is not None:
+            mountpoint = mountpoint.path
+        volume_moves.append({
+            "name": move.volume.name,
+            "mountpoint": mountpoint,
+            "source": move.source,
+            "destination": move.destination,
+        })
+
+    return {
+        "version": 1,
+        "hostname": node_slice.hostname,
+        "applications": applications,
+        "proxies": proxies,
+        "volume_moves": volume_moves,
+    }
+
+
+def node_slice_to_yaml(node_slice):
+    """
+    Generate YAML representation of a node slice.
+
+    :see: ``node_slice_to_configuration``
+
+    :return: YAML serialized node slice configuration.
+    """
+    return yaml.safe_dump(node_slice_to_configuration(node_slice))
+
+
+def configuration_hash(configuration):
+    """
+    Identify serialized configuration by its content.
+
+    ``flocker-changestate`` records the hash of the last node slice it
+    applied and ``flocker-deploy`` compares it with the hash of the slice it
+    is about to send.
+
+    :param bytes configuration: Serialized configuration, for example the
+        output of ``node_slice_to_yaml``.
+
+    :return: ``unicode`` hexadecimal digest of ``configuration``.
+    """
+    return sha256(configuration).hexdigest().decode("ascii")
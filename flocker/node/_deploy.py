@@ -5,16 +5,39 @@
 Deploy applications on nodes.
 """
 
+from operator import itemgetter
+
 from characteristic import attributes
 
-from twisted.internet.defer import gatherResults, fail
+from eliot import Logger
+from eliot.twisted import DeferredContext
+
+from twisted.internet.defer import (
+    CancelledError, Deferred, DeferredSemaphore, gatherResults, fail,
+    maybeDeferred, succeed)
 
 from .gear import GearClient, PortMap
-from ._model import Application, StateChanges, AttachedVolume
+from ._logging import (
+    LIMIT_APPLICATION, PULL_IMAGE, START_APPLICATION, STOP_APPLICATION)
+from ._model import (
+    Application, StateChanges, AttachedVolume, NodeSlice, VolumeMove)
 from ..route import make_host_network, Proxy
 
 from twisted.internet.defer import DeferredList
 
+# The most application starts and stops a ``Deployer`` runs at once.
+DEFAULT_MAX_CONCURRENT_OPERATIONS = 4
+
+# The most seconds a ``Deployer`` waits for a started application's unit to
+# become active.
+DEFAULT_START_TIMEOUT = 120
+
+
+class StartTimeout(Exception):
+    """
+    The unit of a started application didn't become active in time.
+    """
+
 
 @attributes(["running", "not_running"])
 class NodeState(object):
@@ -28,32 +51,348 @@ class NodeState(object):
     """
 
 
+def _proxy_key(proxy):
+    """
+    :param Proxy proxy: A proxy, either desired or reported by an
+        ``INetwork``.
+
+    :return: A value which is equal for proxies to the same address and port
+        however the address is represented.
+    """
+    return unicode(proxy.ip), proxy.port
+
+
+def deployment_slices(desired_state, current_cluster_state, hostnames=()):
+    """
+    Split the desired and current cluster configuration into the parts
+    relevant to each node.
+
+    A node needs its own applications, a proxy for each port exposed by an
+    application on another node and the volume moves it takes part in.
+
+    Traffic to a port exposed by one of the node's own applications always
+    takes the direct path to that application, so the node has no proxy on
+    that port even if an application on another node exposes it too.
+
+    :param Deployment desired_state: The intended configuration of all
+        nodes.
+    :param Deployment current_cluster_state: The current configuration of all
+        nodes.
+    :param hostnames: An iterable of ``unicode`` hostnames of further nodes
+        to create slices for.
+
+    :return: A ``dict`` mapping the hostname of every node in either
+        configuration, and of every node in ``hostnames``, to a
+        ``NodeSlice``.
+    """
+    hostnames = set(hostnames)
+    hostnames.update(node.hostname for node in desired_state.nodes)
+    hostnames.update(node.hostname for node in current_cluster_state.nodes)
+
+    # Each node's proxies are all the proxies in the cluster except those on
+    # ports exposed locally, which includes those pointing at itself:
+    local_ports = {}
+    all_proxies = set()
+    for node in desired_state.nodes:
+        for application in node.applications:
+            for port in application.ports:
+                local_ports.setdefault(node.hostname, set()).add(
+                    port.external_port)
+                # XXX: also need to do DNS resolution. See
+                # https://github.com/ClusterHQ/flocker/issues/322
+                all_proxies.add(
+                    Proxy(ip=node.hostname, port=port.external_port))
+
+    current_hosts = {}
+    for node in current_cluster_state.nodes:
+        for application in node.applications:
+            current_hosts[application.name] = node.hostname
+
+    applications = {}
+    volume_moves = {}
+    for node in desired_state.nodes:
+        applications[node.hostname] = node.applications
+        for application in node.applications:
+            source = current_hosts.get(application.name)
+            if (application.volume is None or source is None or
+                    source == node.hostname):
+                continue
+            move = VolumeMove(volume=application.volume, source=source,
+                              destination=node.hostname)
+            for hostname in (source, node.hostname):
+                volume_moves.setdefault(hostname, set()).add(move)
+
+    return {
+        hostname: NodeSlice(
+            hostname=hostname,
+            applications=frozenset(applications.get(hostname, ())),
+            proxies=frozenset(
+                proxy for proxy in all_proxies
+                if proxy.port not in local_ports.get(hostname, ())),
+            volume_moves=frozenset(volume_moves.get(hostname, ())))
+        for hostname in hostnames
+    }
+
+
+def deployment_slice(desired_state, current_cluster_state, hostname):
+    """
+    Work out the part of the desired and current cluster configuration
+    relevant to a single node.
+
+    This gives the same slice as ``deployment_slices`` does for the node, but
+    only builds that one slice.
+
+    :param Deployment desired_state: The intended configuration of all
+        nodes.
+    :param Deployment current_cluster_state: The current configuration of all
+        nodes.
+    :param unicode hostname: The hostname of the node.
+
+    :return: The ``NodeSlice`` of the node.
+    """
+    applications = frozenset()
+    desired_hosts = {}
+    for node in desired_state.nodes:
+        if node.hostname == hostname:
+            applications = node.applications
+        for application in node.applications:
+            desired_hosts[application.name] = (node.hostname, application)
+
+    local_ports = {port.external_port
+                   for application in applications
+                   for port in application.ports}
+    # XXX: also need to do DNS resolution. See
+    # https://github.com/ClusterHQ/flocker/issues/322
+    proxies = frozenset(
+        Proxy(ip=node.hostname, port=port.external_port)
+        for node in desired_state.nodes if node.hostname != hostname
+        for application in node.applications
+        for port in application.ports
+        if port.external_port not in local_ports)
+
+    volume_moves = set()
+    for node in current_cluster_state.nodes:
+        for application in node.applications:
+            if application.name not in desired_hosts:
+                continue
+            destination, desired = desired_hosts[application.name]
+            if (desired.volume is None or node.hostname == destination or
+                    hostname not in (node.hostname, destination)):
+                continue
+            volume_moves.add(VolumeMove(volume=desired.volume,
+                                        source=node.hostname,
+                                        destination=destination))
+
+    return NodeSlice(hostname=hostname,
+                     applications=frozenset(applications),
+                     proxies=proxies,
+                     volume_moves=frozenset(volume_moves))
+
+
 class Deployer(object):
     """
     Start and stop applications.
+
+    :ivar INetwork network: The network routing API the proxies of the node
+        are configured through.
+    :ivar DeferredSemaphore _operations: Limits the number of application
+        starts and stops running at once.
+    :ivar _units: ``None``, or while the units are being watched a ``dict``
+        mapping the name of each unit to its ``Unit``.
+    :ivar list _waiting: ``tuple``\ s of the name, the wanted activation
+        states and the ``Deferred`` of each ``wait_for_unit`` call which is
+        still waiting.
+    :ivar dict _pulls: Map the ``unicode`` name of each image which has been
+        or is being pulled to a ``Deferred`` which fires once it is
+        available.
     """
-    def __init__(self, volume_service, gear_client=None, network=None):
+    logger = Logger()
+
+    def __init__(self, volume_service, gear_client=None, network=None,
+                 max_concurrent_operations=DEFAULT_MAX_CONCURRENT_OPERATIONS,
+                 reactor=None, start_timeout=DEFAULT_START_TIMEOUT):
         """
         :param VolumeService volume_service: The volume manager for this node.
         :param IGearClient gear_client: The gear client API to use in
             deployment operations. Default ``GearClient``.
         :param INetwork network: The network routing API to use in
             deployment operations. Default is iptables-based implementation.
+        :param int max_concurrent_operations: The most application starts
+            and stops to run at once.
+        :param reactor: The reactor to time the waits for started
+            applications with.  By default the global reactor.
+        :param start_timeout: The most seconds to wait for the unit of a
+            started application to become active.
         """
+        if reactor is None:
+            from twisted.internet import reactor
+        self._reactor = reactor
+        self._start_timeout = start_timeout
         if gear_client is None:
             gear_client = GearClient(hostname=u'127.0.0.1')
         self._gear_client = gear_client
         if network is None:
             network = make_host_network()
-        self._network = network
+        self.network = network
         self._volume_service = volume_service
+        self._operations = DeferredSemaphore(max_concurrent_operations)
+        self._units = None
+        self._watch = None
+        self._waiting = []
+        self._pulls = {}
+
+    def watch(self):
+        """
+        Keep track of the units as they change, so that
+        ``discover_node_configuration`` doesn't need to list them and
+        ``wait_for_unit`` can follow their state.
+
+        :return: A ``Deferred`` which fires once the existing units are
+            known.
+        """
+        if self._units is not None:
+            return succeed(None)
+        self._units = {}
+        d = self._gear_client.watch(self._unit_changed)
+
+        def watching(watch):
+            self._watch = watch
+
+        def failed(reason):
+            self._units = None
+            return reason
+        d.addCallbacks(watching, failed)
+        return d
+
+    def stop_watching(self):
+        """
+        Stop keeping track of the units.
+        """
+        if self._watch is not None:
+            self._watch.stop()
+            self._watch = None
+        self._units = None
+
+    def _unit_changed(self, name, unit):
+        """
+        Record a change to a unit and fire the ``wait_for_unit`` calls it
+        satisfies.
+
+        :param unicode name: The name of the unit.
+        :param unit: The ``Unit``, or ``None`` if it no longer exists.
+        """
+        if self._units is None:
+            return
+        if unit is None:
+            self._units.pop(name, None)
+            return
+        self._units[name] = unit
+        for waiting in list(self._waiting):
+            waiting_name, states, d = waiting
+            if waiting_name == name and unit.activation_state in states:
+                self._waiting.remove(waiting)
+                d.callback(unit)
+
+    def wait_for_unit(self, name, states=(u"active",)):
+        """
+        Wait for a unit to reach one of some activation states.
+
+        The units must be watched; see ``watch``.  Cancel the result to stop
+        waiting.
+
+        :param unicode name: The name of the unit.
+        :param states: The ``unicode`` activation states to wait for.
+
+        :return: A ``Deferred`` which fires with the ``Unit`` once it is in
+            one of the states.
+        """
+        if self._units is None:
+            return fail(RuntimeError("The units are not being watched."))
+        unit = self._units.get(name)
+        if unit is not None and unit.activation_state in states:
+            return succeed(unit)
+
+        def cancel(d):
+            self._waiting.remove(waiting)
+        d = Deferred(cancel)
+        waiting = (name, tuple(states), d)
+        self._waiting.append(waiting)
+        return d
+
+    def _wait_until_started(self, application):
+        """
+        Wait for the unit of a started application to become active.
+
+        The units must be watched; see ``watch``.
+
+        :param Application application: The started application.
+
+        :return: A ``Deferred`` which fires with ``None`` once the unit is
+            active, or errbacks with ``StartTimeout`` if it isn't within the
+            start timeout.
+        """
+        d = self.wait_for_unit(application.name)
+        timeout = self._reactor.callLater(self._start_timeout, d.cancel)
+
+        def waited(result):
+            if timeout.active():
+                timeout.cancel()
+            return result
+        d.addBoth(waited)
+
+        def timed_out(reason):
+            reason.trap(CancelledError)
+            raise StartTimeout(application.name)
+        d.addCallbacks(lambda _: None, timed_out)
+        return d
 
-    def start_application(self, application):
+    def pull_image(self, application):
+        """
+        Pull the image of an application, so that starting it doesn't have to.
+
+        Each image is only pulled once; later calls for it share the result of
+        the first.  A failure to pull is logged but not reported, since
+        starting the application will try again.
+
+        :param Application application: The application to pull the image
+            of.
+
+        :return: A ``Deferred`` which fires with ``None`` once the image has
+            been pulled or failed to be pulled.
+        """
+        image = application.image.full_name
+        pulling = self._pulls.get(image)
+        if pulling is None:
+            action = PULL_IMAGE(self.logger, image=unicode(image))
+            with action.context():
+                d = DeferredContext(
+                    maybeDeferred(self._gear_client.pull, image))
+                d.addActionFinish()
+            pulling = self._pulls[image] = d.result
+
+            def failed(reason):
+                # Try again next time:
+                if self._pulls.get(image) is pulling:
+                    del self._pulls[image]
+            pulling.addErrback(failed)
+        result = Deferred()
+        pulling.addCallback(lambda _: result.callback(None))
+        return result
+
+    def start_application(self, application, existing_units=None):
         """
         Launch the supplied application as a `gear` unit.
 
+        While the units are watched the start only finishes once the unit is
+        active.  The application's resource limits are then applied to it;
+        see ``limit_application``.  Outside a watched deployment run they are
+        applied as soon as gear has added the unit.
+
         :param Application application: The ``Application`` to create and
             start.
+        :param existing_units: ``None``, or the ``set`` of ``unicode`` names
+            of the units known to exist in the current deployment run, which
+            saves asking gear whether the unit already exists.
         :returns: A ``Deferred`` which fires with ``None`` when the application
            has started.
         """
@@ -63,10 +402,31 @@ class Deployer(object):
                             application.ports)
         else:
             port_maps = []
-        return self._gear_client.add(application.name,
-                                     application.image.full_name,
-                                     ports=port_maps,
-                                     )
+        d = self._gear_client.add(application.name,
+                                  application.image.full_name,
+                                  ports=port_maps,
+                                  existing=existing_units,
+                                  )
+        if self._units is not None:
+            d.addCallback(lambda _: self._wait_until_started(application))
+        if application.resources is not None:
+            d.addCallback(lambda _: self.limit_application(application))
+        return d
+
+    def limit_application(self, application):
+        """
+        Apply the resource limits of a running application.
+
+        The limits are lost whenever the application's container is
+        recreated, so they are applied again by every deployment run which
+        finds them differing from the configured ones.
+
+        :param Application application: The ``Application`` to limit.
+        :returns: A ``Deferred`` which fires with ``None`` when the limits are
+            applied.
+        """
+        return self._gear_client.set_resources(
+            application.name, application.resources)
 
     def stop_application(self, application):
         """
@@ -86,11 +446,28 @@ class Deployer(object):
         :returns: A ``Deferred`` which fires with a ``NodeState``
             instance.
         """
+        d = self._discover()
+        d.addCallback(itemgetter(0))
+        return d
+
+    def _discover(self):
+        """
+        List all the ``Application``\ s running on this node, and the units
+        they were found from.
+
+        :returns: A ``Deferred`` which fires with a ``tuple`` of a
+            ``NodeState`` instance and a ``set`` of the ``unicode`` names of
+            all the units.
+        """
         volumes = self._volume_service.enumerate()
         volumes.addCallback(lambda volumes: set(
             volume.name for volume in volumes
             if volume.uuid == self._volume_service.uuid))
-        d = gatherResults([self._gear_client.list(), volumes])
+        if self._units is not None:
+            units = succeed(set(self._units.values()))
+        else:
+            units = self._gear_client.list()
+        d = gatherResults([units, volumes])
 
         def applications_from_units(result):
             units, available_volumes = result
@@ -109,12 +486,14 @@ class Deployer(object):
                 else:
                     volume = None
                 application = Application(name=unit.name,
-                                          volume=volume)
+                                          volume=volume,
+                                          resources=unit.resources)
                 if unit.activation_state in (u"active", u"activating"):
                     running.append(application)
                 else:
                     not_running.append(application)
-            return NodeState(running=running, not_running=not_running)
+            return (NodeState(running=running, not_running=not_running),
+                    set(unit.name for unit in units))
         d.addCallback(applications_from_units)
         return d
 
@@ -137,62 +516,85 @@ class Deployer(object):
             specifying which applications must be started and which must be
             stopped.
         """
-        desired_proxies = set()
-        desired_node_applications = []
-        for node in desired_state.nodes:
-            if node.hostname == hostname:
-                desired_node_applications = node.applications
-            else:
-                for application in node.applications:
-                    for port in application.ports:
-                        # XXX: also need to do DNS resolution. See
-                        # https://github.com/ClusterHQ/flocker/issues/322
-                        desired_proxies.add(Proxy(ip=node.hostname,
-                                                  port=port.external_port))
+        return self.calculate_slice_changes(deployment_slice(
+            desired_state, current_cluster_state, hostname))
 
+    def calculate_slice_changes(self, node_slice):
+        """
+        Work out which changes need to happen to the local state to match
+        the given slice of the desired state.
+
+        :param NodeSlice node_slice: The part of the desired and current
+            cluster configuration relevant to this node.
+
+        :return: A ``Deferred`` which fires with a ``StateChanges`` instance
+            specifying which applications must be started and which must be
+            stopped.
+        """
         # XXX: This includes stopped units. See
         # https://github.com/ClusterHQ/flocker/issues/326
         d = self.discover_node_configuration()
-
-        def find_differences(current_node_state):
-            current_node_applications = current_node_state.running
-            all_applications = (current_node_state.running +
-                                current_node_state.not_running)
-
-            # Compare the applications being changed by name only.  Other
-            # configuration changes aren't important at this point.
-            current_state = {app.name for app in current_node_applications}
-            desired_state = {app.name for app in desired_node_applications}
-            not_running = {app.name for app in current_node_state.not_running}
-
-            # Don't start applications that exist on this node but aren't
-            # running; instead they should be restarted:
-            start_names = desired_state.difference(current_state | not_running)
-            stop_names = {app.name for app in all_applications}.difference(
-                desired_state)
-
-            start_containers = {
-                app for app in desired_node_applications
-                if app.name in start_names
-            }
-            stop_containers = {
-                app for app in all_applications
-                if app.name in stop_names
-            }
-            restart_containers = {
-                app for app in desired_node_applications
-                if app.name in not_running
-            }
-
-            return StateChanges(
-                applications_to_start=start_containers,
-                applications_to_stop=stop_containers,
-                applications_to_restart=restart_containers,
-                proxies=desired_proxies
-            )
-        d.addCallback(find_differences)
+        d.addCallback(lambda current_node_state: self._find_differences(
+            node_slice, current_node_state))
         return d
 
+    def _find_differences(self, node_slice, current_node_state):
+        """
+        Work out which changes need to happen to the local state to match
+        the given slice of the desired state.
+
+        :param NodeSlice node_slice: The part of the desired and current
+            cluster configuration relevant to this node.
+        :param NodeState current_node_state: The applications on this node.
+
+        :return: A ``StateChanges`` instance.
+        """
+        desired_node_applications = node_slice.applications
+        current_node_applications = current_node_state.running
+        all_applications = (current_node_state.running +
+                            current_node_state.not_running)
+
+        # Compare the applications being started and stopped by name only.
+        # Of the other configuration only the resource limits are compared,
+        # since those can be applied to running applications.
+        current_state = {app.name for app in current_node_applications}
+        desired_state = {app.name for app in desired_node_applications}
+        not_running = {app.name for app in current_node_state.not_running}
+
+        # Don't start applications that exist on this node but aren't
+        # running; instead they should be restarted:
+        start_names = desired_state.difference(current_state | not_running)
+        stop_names = {app.name for app in all_applications}.difference(
+            desired_state)
+
+        start_containers = {
+            app for app in desired_node_applications
+            if app.name in start_names
+        }
+        stop_containers = {
+            app for app in all_applications
+            if app.name in stop_names
+        }
+        restart_containers = {
+            app for app in desired_node_applications
+            if app.name in not_running
+        }
+        current_resources = {
+            app.name: app.resources for app in current_node_applications}
+        limit_containers = {
+            app for app in desired_node_applications
+            if app.name in current_state and
+            app.resources != current_resources[app.name]
+        }
+
+        return StateChanges(
+            applications_to_start=start_containers,
+            applications_to_stop=stop_containers,
+            applications_to_restart=restart_containers,
+            applications_to_limit=limit_containers,
+            proxies=set(node_slice.proxies)
+        )
+
     def change_node_state(self, desired_state,
                           current_cluster_state,
                           hostname):
@@ -206,19 +608,70 @@ class Deployer(object):
         :param unicode hostname: The hostname of the node that this is running
             on.
         """
-        d = self.calculate_necessary_state_changes(
-            desired_state=desired_state,
-            current_cluster_state=current_cluster_state,
-            hostname=hostname)
-        d.addCallback(self._apply_changes)
+        return self._change_slice(deployment_slice(
+            desired_state, current_cluster_state, hostname))
+
+    def change_slice_state(self, node_slice):
+        """
+        Change the local state to match the given slice of the desired state.
+
+        :param NodeSlice node_slice: The part of the desired and current
+            cluster configuration relevant to this node.
+        """
+        # Applications moving here from another node are pulled straight
+        # away, so that the pull overlaps with the volume being moved rather
+        # than adding to the application's downtime:
+        arriving = {move.volume.name for move in node_slice.volume_moves
+                    if move.destination == node_slice.hostname}
+        for application in node_slice.applications:
+            if (application.volume is not None and
+                    application.volume.name in arriving):
+                self.pull_image(application)
+        return self._change_slice(node_slice)
+
+    def _change_slice(self, node_slice):
+        """
+        Change the local state to match the given slice of the desired state,
+        in one deployment run.
+
+        The units are watched for the duration of the run, unless they
+        already were, so that the started applications can be waited for
+        until they are active.  Whether a unit exists is checked against the
+        units known at the start of the run rather than by asking gear again.
+        When the run ends the watching stops, so a later run never acts on
+        what this one knew.
+
+        :param NodeSlice node_slice: The part of the desired and current
+            cluster configuration relevant to this node.
+        """
+        watching = self._units is None
+        d = self.watch()
+        d.addCallback(lambda _: self._discover())
+
+        def discovered(result):
+            current_node_state, units = result
+            return self._apply_changes(
+                self._find_differences(node_slice, current_node_state),
+                units)
+        d.addCallback(discovered)
+
+        def finished(result):
+            if watching:
+                self.stop_watching()
+            return result
+        d.addBoth(finished)
         return d
 
-    def _apply_changes(self, necessary_state_changes):
+    def _apply_changes(self, necessary_state_changes, units=None):
         """
         Apply desired changes.
 
         :param StateChanges necessary_state_changes: A record of the
             applications which need to be started and stopped on this node.
+        :param units: ``None``, or the ``set`` of ``unicode`` names of the
+            units listed at the start of this deployment run.  It is kept up
+            to date with the applications stopped, and is used to check
+            whether the applications being started already exist.
 
         :return: A ``Deferred`` that fires when all application start/stop
             operations have finished.
@@ -227,28 +680,121 @@ class Deployer(object):
         # https://github.com/ClusterHQ/flocker/issues/296
         results = []
 
+        # The images of all the applications being started are pulled
+        # straight away, so that the pulls overlap with the proxy changes and
+        # the stops and each start only waits for its own image:
+        pulls = {
+            application.name: self.pull_image(application)
+            for application in (
+                list(necessary_state_changes.applications_to_start) +
+                list(necessary_state_changes.applications_to_restart))}
+
+        # Only touch the proxies which actually change, so that traffic
+        # through the others is not interrupted.  The network may report
+        # addresses as ``IPAddress`` instances where the desired proxies use
+        # text, so proxies are compared by the text of their address.  All of
+        # the changes are applied together, so either the node ends up with
+        # the desired proxies or its proxies are left as they were.
+        #
         # XXX: The proxy manipulation operations are blocking. Convert to a
         # non-blocking API. See https://github.com/ClusterHQ/flocker/issues/320
-        for proxy in self._network.enumerate_proxies():
-            try:
-                self._network.delete_proxy(proxy)
-            except:
-                results.append(fail())
-        for proxy in necessary_state_changes.proxies:
-            try:
-                self._network.create_proxy_to(proxy.ip, proxy.port)
-            except:
-                results.append(fail())
-
-        for application in necessary_state_changes.applications_to_stop:
-            results.append(self.stop_application(application))
+        existing_proxies = {
+            _proxy_key(proxy): proxy
+            for proxy in self.network.enumerate_proxies()}
+        desired_proxies = {
+            _proxy_key(proxy): proxy
+            for proxy in necessary_state_changes.proxies}
+        transaction = self.network.begin()
+        for key in set(existing_proxies) - set(desired_proxies):
+            transaction.delete_proxy(existing_proxies[key])
+        for key in set(desired_proxies) - set(existing_proxies):
+            proxy = desired_proxies[key]
+            transaction.create_proxy_to(proxy.ip, proxy.port)
+        try:
+            transaction.commit()
+        except Exception:
+            results.append(fail())
+
+        def stop(application):
+            d = self._schedule(
+                STOP_APPLICATION, self.stop_application, application)
+            if units is not None:
+                def stopped(result):
+                    units.discard(application.name)
+                    return result
+                d.addCallback(stopped)
+            return d
+
+        stops = [
+            stop(application)
+            for application in necessary_state_changes.applications_to_stop]
+        results.extend(stops)
 
         for application in necessary_state_changes.applications_to_start:
-            results.append(self.start_application(application))
+            results.append(self._start_after_stops(
+                stops, application, pulls[application.name], units))
 
         for application in necessary_state_changes.applications_to_restart:
-            d = self.stop_application(application)
-            d.addCallback(lambda _: self.start_application(application))
+            d = stop(application)
+            d.addCallback(
+                lambda _, application=application:
+                self._start_after_stops(
+                    stops, application, pulls[application.name], units))
             results.append(d)
+
+        for application in necessary_state_changes.applications_to_limit:
+            results.append(self._schedule(
+                LIMIT_APPLICATION, self.limit_application, application))
         return DeferredList(
             results, fireOnOneErrback=True, consumeErrors=True)
+
+    def _schedule(self, action_type, operation, application):
+        """
+        Run an operation on an application once fewer than the maximum number
+        of operations are running, logging it as an action.
+
+        :param ActionType action_type: The type of action to log the operation
+            as.
+        :param operation: ``start_application``, ``stop_application`` or
+            ``limit_application``.
+        :param Application application: The application to operate on.
+
+        :return: A ``Deferred`` which fires with the operation's result.
+        """
+        def run():
+            action = action_type(self.logger, application=application.name)
+            with action.context():
+                d = DeferredContext(maybeDeferred(operation, application))
+                d.addActionFinish()
+                return d.result
+        return self._operations.run(run)
+
+    def _start_after_stops(self, stops, application, pulled, units=None):
+        """
+        Start an application once its image is pulled and the applications
+        being stopped which might use the same ports are stopped.
+
+        Gear doesn't report the ports of existing units, so an application
+        exposing any ports waits for all of the stops.  The start happens
+        whether or not the stops and the pull succeed.  It counts towards
+        the running operations until ``start_application`` finishes, i.e.
+        while the units are watched until the application's unit is active.
+
+        :param list stops: ``Deferred``\ s which fire when the applications
+            being stopped are stopped.
+        :param Application application: The application to start.
+        :param Deferred pulled: Fires once the application's image has been
+            pulled; see ``pull_image``.
+        :param units: ``None``, or the ``set`` of ``unicode`` names of the
+            units known to exist in this deployment run.
+
+        :return: A ``Deferred`` which fires when the application has started.
+        """
+        if not application.ports:
+            stops = []
+        d = DeferredList(stops + [pulled])
+        d.addCallback(lambda _: self._schedule(
+            START_APPLICATION,
+            lambda application: self.start_application(application, units),
+            application))
+        return d
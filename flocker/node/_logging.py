@@ -0,0 +1,50 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Eliot log types for the node manager.
+"""
+
+from eliot import Field, ActionType
+
+
+def _system(name):
+    return u"flocker:node:" + name
+
+
+APPLICATION = Field.forTypes(
+    u"application", [unicode],
+    u"The name of the application being changed.")
+
+IMAGE = Field.forTypes(
+    u"image", [unicode],
+    u"The name of the Docker image being pulled.")
+
+
+START_APPLICATION = ActionType(
+    _system(u"start_application"),
+    [APPLICATION],
+    [],
+    u"The deployer is starting an application.")
+
+
+STOP_APPLICATION = ActionType(
+    _system(u"stop_application"),
+    [APPLICATION],
+    [],
+    u"The deployer is stopping an application.")
+
+
+LIMIT_APPLICATION = ActionType(
+    _system(u"limit_application"),
+    [APPLICATION],
+    [],
+    u"The deployer is applying the resource limits of a running "
+    u"application.")
+
+
+PULL_IMAGE = ActionType(
+    _system(u"pull_image"),
+    [IMAGE],
+    [],
+    u"The deployer is pulling the image of an application before starting "
+    u"it.")
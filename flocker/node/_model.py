@@ -49,7 +49,9 @@ class DockerImage(object):
         return cls(**kwargs)
 
 
-@attributes(["name", "mountpoint"])
+@attributes(["name", "mountpoint", "profile", "properties", "storage_class"],
+            defaults=dict(profile=None, properties=frozenset(),
+                          storage_class=None))
 class AttachedVolume(object):
     """
     A volume attached to an application to be deployed.
@@ -62,11 +64,44 @@ class AttachedVolume(object):
     :ivar FilePath mountpoint: The path within the container where this
         volume should be mounted, or ``None`` if unknown
         (see https://github.com/ClusterHQ/flocker/issues/289).
+
+    :ivar profile: ``None``, or the ``unicode`` name of the profile of
+        dataset properties the volume's filesystem is tuned with.
+
+    :ivar frozenset properties: ``tuple``\ s of the ``unicode`` name and
+        value of further dataset properties the volume's filesystem is tuned
+        with, overriding those of the profile.
+
+    :ivar storage_class: ``None``, or the ``unicode`` class of the storage
+        pools the volume's filesystem is to be placed on, e.g. ``u"ssd"``.
+    """
+
+
+@attributes(["cpu_shares", "memory_limit", "cpuset", "blkio_weight"],
+            defaults=dict(cpu_shares=None, memory_limit=None, cpuset=None,
+                          blkio_weight=None))
+class ResourceLimits(object):
     """
+    Limits on the resources of the node an application's container can use.
 
+    Each limit is ``None`` if the application is not limited in that way.
+
+    :ivar int cpu_shares: The weight of the container's share of CPU time,
+        relative to the other containers on the node.
+
+    :ivar int memory_limit: The most bytes of memory the container can use.
+
+    :ivar unicode cpuset: The CPUs the container can run on, for example
+        ``u"0-3,6"``.
+
+    :ivar int blkio_weight: The weight of the container's share of block IO,
+        from 10 to 1000, relative to the other containers on the node.
+    """
 
-@attributes(["name", "image", "ports", "volume"],
-            defaults=dict(image=None, ports=frozenset(), volume=None))
+
+@attributes(["name", "image", "ports", "volume", "resources"],
+            defaults=dict(image=None, ports=frozenset(), volume=None,
+                          resources=None))
 class Application(object):
     """
     A single `application <http://12factor.net/>`_ to be deployed.
@@ -90,6 +125,9 @@ class Application(object):
 
     :ivar volume: ``None`` if there is no volume, otherwise an
         ``AttachedVolume`` instance.
+
+    :ivar resources: ``None`` if the application's use of the node's
+        resources is not limited, otherwise a ``ResourceLimits`` instance.
     """
 
 
@@ -133,8 +171,9 @@ class Port(object):
 
 @attributes(
     ["applications_to_start", "applications_to_stop",
-     "applications_to_restart", "proxies"],
-    defaults=dict(proxies=frozenset(), applications_to_restart=frozenset())
+     "applications_to_restart", "applications_to_limit", "proxies"],
+    defaults=dict(proxies=frozenset(), applications_to_restart=frozenset(),
+                  applications_to_limit=frozenset())
 )
 class StateChanges(object):
     """
@@ -145,7 +184,43 @@ class StateChanges(object):
     :ivar set applications_to_restart: The applications which must be
         restarted.
     :ivar set applications_to_stop: The applications which must be stopped.
+    :ivar set applications_to_limit: The running applications whose resource
+        limits must be applied again because they differ from the desired
+        ones.  Defaults to an empty ``frozenset``.
     :ivar set proxies: The required full ``set`` of
         :class:`flocker.route.Proxy` routes to application on other
         nodes. Defaults to an empty ``frozenset``.
     """
+
+
+@attributes(["volume", "source", "destination"])
+class VolumeMove(object):
+    """
+    A volume which has to move from one node to another because the
+    application it is attached to is moving.
+
+    :ivar AttachedVolume volume: The volume as it is attached to the
+        application in the desired configuration.
+    :ivar unicode source: The hostname of the node the application is
+        currently running on.
+    :ivar unicode destination: The hostname of the node the application is
+        to run on.
+    """
+
+
+@attributes(["hostname", "applications", "proxies", "volume_moves"],
+            defaults=dict(applications=frozenset(), proxies=frozenset(),
+                          volume_moves=frozenset()))
+class NodeSlice(object):
+    """
+    The part of a desired ``Deployment``, and of the current cluster state,
+    which a single node needs in order to change its state.
+
+    :ivar unicode hostname: The hostname of the node.
+    :ivar frozenset applications: The ``Application`` instances which are to
+        run on the node.
+    :ivar frozenset proxies: The :class:`flocker.route.Proxy` routes the node
+        needs to applications on other nodes.
+    :ivar frozenset volume_moves: The ``VolumeMove`` instances moving a volume
+        to or from the node.
+    """
@@ -27,6 +27,7 @@ class DeployerTests(TestCase):
         """
         name = random_name()
         gear_client = GearClient("127.0.0.1")
+        self.addCleanup(gear_client.close)
         deployer = Deployer(create_volume_service(self), gear_client,
                             make_memory_network())
         self.addCleanup(gear_client.remove, name)
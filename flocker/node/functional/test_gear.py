@@ -22,13 +22,28 @@ from ...testtools import (
 
 from ..test.test_gear import make_igearclient_tests, random_name
 from ..gear import GearClient, GearError, PortMap
+from .._cgroup import CGROUP_ROOT, container_cgroup
+from .._model import ResourceLimits
 from ..testtools import if_gear_configured, wait_for_unit_state
 
 _if_root = skipIf(os.getuid() != 0, "Must run as root.")
 
 
-class IGearClientTests(make_igearclient_tests(
-        lambda test_case: GearClient("127.0.0.1"))):
+def make_gear_client(test_case):
+    """
+    Create a ``GearClient`` whose connections are closed when the test is
+    over.
+
+    :param TestCase test_case: The test which is using the client.
+
+    :return: A ``GearClient`` talking to the local gear daemon.
+    """
+    client = GearClient("127.0.0.1")
+    test_case.addCleanup(client.close)
+    return client
+
+
+class IGearClientTests(make_igearclient_tests(make_gear_client)):
     """``IGearClient`` tests for ``FakeGearClient``."""
 
     @if_gear_configured
@@ -59,7 +74,7 @@ class GearClientTests(TestCase):
         :return: ``Deferred`` that fires with the ``GearClient`` when the unit
             reaches the expected state.
         """
-        client = GearClient("127.0.0.1")
+        client = make_gear_client(self)
         d = client.add(
             unit_name=unit_name,
             image_name=image_name,
@@ -92,11 +107,41 @@ class GearClientTests(TestCase):
         d.addCallback(started)
         return d
 
+    @_if_root
+    def test_resource_limits(self):
+        """
+        ``GearClient.set_resources`` applies the resource limits to the
+        control groups of the unit's container, and ``GearClient.list``
+        reports them.
+        """
+        name = random_name()
+        resources = ResourceLimits(cpu_shares=512, memory_limit=104857600)
+        d = self.start_container(name)
+        d.addCallback(
+            lambda client: client.set_resources(name, resources).addCallback(
+                lambda _: client))
+
+        def limited(client):
+            data = subprocess.check_output(
+                [b"docker", b"inspect", name.encode("ascii")])
+            container_id = json.loads(data)[0][u"Id"].encode("ascii")
+            cgroup = container_cgroup(CGROUP_ROOT, b"cpu", container_id)
+            self.assertEqual(
+                b"512", cgroup.child(b"cpu.shares").getContent().strip())
+            return client.list()
+        d.addCallback(limited)
+
+        def listed(units):
+            [unit] = [unit for unit in units if unit.name == name]
+            self.assertEqual(resources, unit.resources)
+        d.addCallback(listed)
+        return d
+
     def test_add_error(self):
         """``GearClient.add`` returns ``Deferred`` that errbacks with
         ``GearError`` if response code is not a success response code.
         """
-        client = GearClient("127.0.0.1")
+        client = make_gear_client(self)
         # add() calls exists(), and we don't want exists() to be the one
         # failing since that's not the code path we're testing, so bypass
         # it:
@@ -110,7 +155,7 @@ class GearClientTests(TestCase):
         """``GearClient.remove`` returns ``Deferred`` that errbacks with
         ``GearError`` if response code is not a success response code.
         """
-        client = GearClient("127.0.0.1")
+        client = make_gear_client(self)
         # Illegal container name should make gear complain when we try to
         # remove it:
         d = client.remove(u"!!##!!")
@@ -8,12 +8,33 @@ from zope.interface import Interface, implementer
 
 from characteristic import attributes
 
-from twisted.internet.defer import succeed, fail
+from eliot import Logger, writeFailure
+
+from twisted.internet.defer import gatherResults, succeed, fail
+from twisted.internet.task import LoopingCall
+from twisted.web.client import HTTPConnectionPool
 
 from treq import request, content
 
+from ..volume import DockerClient
+from ._cgroup import CGROUP_ROOT, apply_limits, read_limits
+from ._model import ResourceLimits
+
 GEAR_PORT = 43273
 
+# The most idle connections to geard a ``GearClient`` keeps open.
+DEFAULT_MAX_CONNECTIONS = 4
+
+# The number of seconds an idle connection to geard is kept open for.
+DEFAULT_IDLE_TIMEOUT = 240
+
+# The number of seconds between listings when watching units by polling.
+DEFAULT_POLL_INTERVAL = 1
+
+# The hostnames of a gear daemon on this host, whose Docker daemon can be
+# talked to directly.
+_LOCAL_HOSTNAMES = frozenset([u"127.0.0.1", u"localhost"])
+
 
 class AlreadyExists(Exception):
     """A unit with the given name already exists."""
@@ -24,9 +45,9 @@ class GearError(Exception):
 
 
 @attributes(["name", "activation_state", "sub_state", "container_image",
-             "ports", "links"],
+             "ports", "links", "resources"],
             defaults=dict(sub_state=None, container_image=None,
-                          ports=(), links=()))
+                          ports=(), links=(), resources=None))
 class Unit(object):
     """
     Information about a unit managed by geard/systemd.
@@ -59,13 +80,16 @@ class Unit(object):
 
     :ivar list links: The ``PortMap`` instances which define how connections to
         ports inside the container are routed to ports on the host.
+
+    :ivar resources: ``None`` if unknown or unlimited, otherwise the
+        ``ResourceLimits`` of the unit's container.
     """
 
 
 class IGearClient(Interface):
     """A client for the geard HTTP API."""
 
-    def add(unit_name, image_name, ports=None, links=None):
+    def add(unit_name, image_name, ports=None, links=None, existing=None):
         """Install and start a new unit.
 
         :param unicode unit_name: The name of the unit to create.
@@ -79,6 +103,11 @@ class IGearClient(Interface):
         :param list links: A list of ``PortMap``\ s mapping ports forwarded
             from the container to ports on the host.
 
+        :param existing: ``None`` to ask whether the unit already exists, or
+            the ``set`` of ``unicode`` names of the units known to exist,
+            e.g. those listed at the start of the current deployment, to
+            check against instead.
+
         :return: ``Deferred`` that fires on success, or errbacks with
             :class:`AlreadyExists` if a unit by that name already exists.
         """
@@ -92,6 +121,23 @@ class IGearClient(Interface):
             otherwise ``False``.
         """
 
+    def set_resources(unit_name, resources):
+        """Limit the resources of a running unit.
+
+        The limits replace any the unit had, and are lost when its container
+        is recreated, e.g. when the unit is restarted, so they need applying
+        again whenever it may have been.
+
+        :param unicode unit_name: The name of the unit.
+
+        :param resources: ``None`` to remove all limits, or the
+            ``ResourceLimits`` to apply.  Limits which are ``None`` are
+            removed.
+
+        :return: ``Deferred`` that fires once the limits are applied, or
+            errbacks with :class:`GearError` if the unit isn't running.
+        """
+
     def remove(unit_name):
         """Stop and delete the given unit.
 
@@ -108,20 +154,178 @@ class IGearClient(Interface):
         :return: ``Deferred`` firing with ``set`` of :class:`Unit`.
         """
 
+    def pull(image_name):
+        """Make sure an image is available locally, pulling it if needed.
+
+        Adding a unit pulls its image if it is missing, so pulling the image
+        beforehand only makes the addition quicker.
+
+        :param unicode image_name: The Docker image to pull.
+
+        :return: ``Deferred`` that fires once the image is available.
+        """
+
+    def watch(receive):
+        """Follow the changes to the units.
+
+        :param receive: A callable which is called with the ``unicode`` name
+            of a unit and either its :class:`Unit`, as ``list`` would report
+            it, or ``None`` if the unit no longer exists.  It is called for
+            every unit which exists when watching starts, and then whenever a
+            unit is added, removed or changes state.
+
+        :return: ``Deferred`` that fires, once ``receive`` has been called for
+            all of the existing units, with an object whose ``stop`` method
+            stops the watching.
+        """
+
+
+class _PollingWatch(object):
+    """
+    Watch units by listing them periodically and reporting the differences.
+
+    :ivar dict _units: Map the name of each unit seen in the last listing to
+        its ``Unit``.
+    """
+    logger = Logger()
+
+    def __init__(self, client, receive, reactor, interval):
+        """
+        :param IGearClient client: The client to list the units with.
+        :param receive: See ``IGearClient.watch``.
+        :param reactor: The reactor to time the listings with.
+        :param interval: The number of seconds between listings.
+        """
+        self._client = client
+        self._receive = receive
+        self._interval = interval
+        self._units = {}
+        self._call = LoopingCall(self._poll)
+        self._call.clock = reactor
+
+    def start(self):
+        """
+        Report the existing units and start polling for changes.
+
+        :return: ``Deferred`` that fires with this watch once the existing
+            units have been reported.
+        """
+        d = self._list()
+
+        def listed(_):
+            # The result fires when polling stops, so don't wait for it:
+            self._call.start(self._interval, now=False)
+            return self
+        d.addCallback(listed)
+        return d
+
+    def stop(self):
+        """
+        Stop polling.
+        """
+        if self._call.running:
+            self._call.stop()
+
+    def _list(self):
+        d = self._client.list()
+        d.addCallback(self._update)
+        return d
+
+    def _poll(self):
+        d = self._list()
+        # Keep polling after errors:
+        d.addErrback(writeFailure, self.logger, u"flocker:node:gear")
+        return d
+
+    def _update(self, units):
+        """
+        Report the differences between the last listing and a new one.
+
+        :param set units: The ``Unit``\ s in the new listing.
+        """
+        current = {unit.name: unit for unit in units}
+        previous, self._units = self._units, current
+        for name in set(previous) - set(current):
+            self._receive(name, None)
+        for name, unit in current.items():
+            if previous.get(name) != unit:
+                self._receive(name, unit)
+
 
 @implementer(IGearClient)
 class GearClient(object):
     """Talk to the gear daemon over HTTP.
 
+    All requests share a pool of persistent connections, so a series of
+    operations doesn't have to connect to gear for each request.
+
+    ``exists`` asks gear about the one unit only, rather than listing all of
+    the units.
+
+    Gear can't be told about resource limits, so they are applied to the
+    control groups of a unit's running container, and read back from them
+    when listing the units.  This needs the Docker daemon and control groups
+    of the host gear is on, so it only works for units on this host.
+
     :ivar bytes _base_url: Base URL for gear.
+    :ivar HTTPConnectionPool _pool: The connections to gear.
+    :ivar _docker: ``None``, or the ``DockerClient`` used to pull images and
+        find the containers of units, which talks to Docker directly since
+        gear has no API for it.
+    :ivar FilePath _cgroup_root: Where the control group hierarchies are
+        mounted.
     """
+    logger = Logger()
 
-    def __init__(self, hostname):
+    def __init__(self, hostname, reactor=None,
+                 max_connections=DEFAULT_MAX_CONNECTIONS,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 poll_interval=DEFAULT_POLL_INTERVAL, docker_client=None,
+                 cgroup_root=CGROUP_ROOT):
         """
         :param unicode hostname: Gear host to connect to.
+        :param reactor: The reactor to connect and time polling with.  By
+            default the global reactor.
+        :param int max_connections: The most idle connections to keep open.
+        :param idle_timeout: The number of seconds to keep an idle connection
+            open for.
+        :param poll_interval: The number of seconds between listings of the
+            units while they are watched.
+        :param DockerClient docker_client: The client to pull images and find
+            containers with, talking to the Docker daemon gear uses.  By
+            default one talking to the Docker daemon of this host if gear is
+            on this host, and otherwise none, in which case images are left
+            for gear to pull when units are added and resource limits can't
+            be applied or reported.
+        :param FilePath cgroup_root: Where the control group hierarchies of
+            gear's host are mounted.
         """
+        if reactor is None:
+            from twisted.internet import reactor
+        if docker_client is None and hostname in _LOCAL_HOSTNAMES:
+            docker_client = DockerClient(reactor)
+        self._docker = docker_client
         self._base_url = b"http://%s:%d" % (hostname.encode("ascii"),
                                             GEAR_PORT)
+        self._reactor = reactor
+        self._pool = HTTPConnectionPool(reactor, persistent=True)
+        self._pool.maxPersistentPerHost = max_connections
+        self._pool.cachedConnectionTimeout = idle_timeout
+        self._poll_interval = poll_interval
+        self._cgroup_root = cgroup_root
+
+    def close(self):
+        """
+        Close the idle connections to gear and Docker.
+
+        :return: ``Deferred`` that fires when the connections are closed.
+        """
+        closing = [self._pool.closeCachedConnections()]
+        if self._docker is not None:
+            closing.append(self._docker.close())
+        d = gatherResults(closing)
+        d.addCallback(lambda _: None)
+        return d
 
     def _container_request(self, method, unit_name, operation=None, data=None):
         """Send HTTP request to gear.
@@ -159,12 +363,13 @@ class GearClient(object):
         if data is not None:
             data = json.dumps(data)
 
-        return request(method, url, data=data, persistent=False)
+        return request(method, url, data=data, pool=self._pool,
+                       reactor=self._reactor)
 
     def _ensure_ok(self, response):
         """Make sure response indicates success.
 
-        Also reads the body to ensure connection is closed.
+        Also reads the body so that the connection can be reused.
 
         :param response: Response from treq request,
             ``twisted.web.iweb.IResponse`` provider.
@@ -180,7 +385,8 @@ class GearClient(object):
             d.addCallback(lambda data: fail(GearError(response.code, data)))
         return d
 
-    def add(self, unit_name, image_name, ports=None, links=None):
+    def add(self, unit_name, image_name, ports=None, links=None,
+            existing=None):
         """
         See ``IGearClient.add`` for base documentation.
 
@@ -220,7 +426,10 @@ class GearClient(object):
                  u'ToPort': link.external_port}
             )
 
-        checked = self.exists(unit_name)
+        if existing is None:
+            checked = self.exists(unit_name)
+        else:
+            checked = succeed(unit_name in existing)
         checked.addCallback(
             lambda exists: fail(AlreadyExists(unit_name)) if exists else None)
         checked.addCallback(
@@ -228,12 +437,43 @@ class GearClient(object):
         checked.addCallback(self._ensure_ok)
         return checked
 
-    def exists(self, unit_name):
-        d = self.list()
+    def set_resources(self, unit_name, resources):
+        """
+        See ``IGearClient.set_resources`` for base documentation.
 
-        def got_units(units):
-            return unit_name in [unit.name for unit in units]
-        d.addCallback(got_units)
+        The limits are written to the control groups of the unit's container,
+        so this fails with ``ValueError`` for units on another host.
+        """
+        if self._docker is None:
+            return fail(ValueError(
+                "Resource limits can only be applied to units on this "
+                "host."))
+        if resources is None:
+            resources = ResourceLimits()
+        # Gear names the container of a unit after it:
+        d = self._docker.inspect_container(unit_name.encode("ascii"))
+
+        def inspected(info):
+            if info is None or not info[u"State"][u"Running"]:
+                raise GearError(
+                    "The container of %s isn't running." % (unit_name,))
+            apply_limits(self._cgroup_root, info[u"Id"].encode("ascii"),
+                         resources)
+        d.addCallback(inspected)
+        return d
+
+    def exists(self, unit_name):
+        d = self._container_request(b"GET", unit_name, operation=b"status")
+
+        def got_response(response):
+            if response.code == 404:
+                d = content(response)
+                d.addCallback(lambda _: False)
+                return d
+            d = self._ensure_ok(response)
+            d.addCallback(lambda _: True)
+            return d
+        d.addCallback(got_response)
         return d
 
     def remove(self, unit_name):
@@ -243,24 +483,72 @@ class GearClient(object):
         d.addCallback(self._ensure_ok)
         return d
 
+    def _units(self, values, containers):
+        """
+        :param list values: The ``dict``\ s gear describes the units with.
+        :param dict containers: Map the ``bytes`` names of the running
+            containers to their ``bytes`` IDs.
+
+        :return: A ``set`` of the ``Unit``\ s described.
+        """
+        # XXX: GearClient.list should also return container_image
+        # information.
+        # See https://github.com/ClusterHQ/flocker/issues/207
+        # container_image=image_name,
+        # Resource limits are read from the control groups of the running
+        # containers, so they are unknown for the others.
+        units = set()
+        for unit in values:
+            container_id = containers.get(unit[u"Id"].encode("ascii"))
+            resources = None
+            if container_id is not None:
+                try:
+                    resources = read_limits(self._cgroup_root, container_id)
+                except (IOError, ValueError):
+                    # The container stopped since it was listed:
+                    pass
+            units.add(Unit(name=unit[u"Id"],
+                           activation_state=unit[u"ActiveState"],
+                           sub_state=unit[u"SubState"],
+                           container_image=None,
+                           resources=resources))
+        return units
+
     def list(self):
         d = self._request(b"GET", b"/containers?all=1")
         d.addCallback(content)
 
         def got_body(data):
             values = json.loads(data)[u"Containers"]
-            # XXX: GearClient.list should also return container_image
-            # information.
-            # See https://github.com/ClusterHQ/flocker/issues/207
-            # container_image=image_name,
-            return set([Unit(name=unit[u"Id"],
-                             activation_state=unit[u"ActiveState"],
-                             sub_state=unit[u"SubState"],
-                             container_image=None)
-                        for unit in values])
+            if self._docker is None:
+                return self._units(values, {})
+            containers = self._docker.list_containers()
+            # The resource limits are only extra detail, so the units are
+            # still listed if Docker can't be asked about their containers:
+            containers.addErrback(
+                writeFailure, self.logger, u"flocker:node:gear")
+            containers.addCallback(
+                lambda containers: self._units(values, containers or {}))
+            return containers
         d.addCallback(got_body)
         return d
 
+    def pull(self, image_name):
+        if self._docker is None:
+            # Gear pulls the image itself when the unit is added:
+            return succeed(None)
+        return self._docker.ensure_image(image_name.encode("ascii"))
+
+    def watch(self, receive):
+        """
+        Watch the units by listing them periodically, since gear has no way
+        to report changes as they happen.
+
+        See ``IGearClient.watch`` for base documentation.
+        """
+        return _PollingWatch(
+            self, receive, self._reactor, self._poll_interval).start()
+
 
 @implementer(IGearClient)
 class FakeGearClient(object):
@@ -269,6 +557,7 @@ class FakeGearClient(object):
     The state the the simulated units is stored in memory.
 
     :ivar dict _units: See ``units`` of ``__init``\ .
+    :ivar list pulled: The names of the images pulled, in order.
     """
 
     def __init__(self, units=None):
@@ -280,9 +569,13 @@ class FakeGearClient(object):
         if units is None:
             units = {}
         self._units = units
+        self._watchers = []
+        self.pulled = []
 
-    def add(self, unit_name, image_name, ports=(), links=()):
-        if unit_name in self._units:
+    def add(self, unit_name, image_name, ports=(), links=(), existing=None):
+        if existing is None:
+            existing = self._units
+        if unit_name in existing:
             return fail(AlreadyExists(unit_name))
         self._units[unit_name] = Unit(
             name=unit_name,
@@ -291,6 +584,21 @@ class FakeGearClient(object):
             links=links,
             activation_state=u'active'
         )
+        self._changed(unit_name)
+        return succeed(None)
+
+    def set_resources(self, unit_name, resources):
+        unit = self._units.get(unit_name)
+        if unit is None or unit.activation_state != u'active':
+            return fail(GearError(
+                "The container of %s isn't running." % (unit_name,)))
+        if resources == ResourceLimits():
+            resources = None
+        self._units[unit_name] = Unit(
+            name=unit.name, activation_state=unit.activation_state,
+            sub_state=unit.sub_state, container_image=unit.container_image,
+            ports=unit.ports, links=unit.links, resources=resources)
+        self._changed(unit_name)
         return succeed(None)
 
     def exists(self, unit_name):
@@ -299,18 +607,62 @@ class FakeGearClient(object):
     def remove(self, unit_name):
         if unit_name in self._units:
             del self._units[unit_name]
+            self._changed(unit_name)
         return succeed(None)
 
-    def list(self):
+    def _listed(self, unit):
+        """
+        :param Unit unit: A unit.
+
+        :return: The ``Unit`` as ``list`` reports it.
+        """
         # XXX: This is a hack so that functional and unit tests that use
         # GearClient.list can pass until the real GearClient.list can also
         # return container_image information, ports and links.
         # See https://github.com/ClusterHQ/flocker/issues/207
-        incomplete_units = set()
-        for unit in self._units.values():
-            incomplete_units.add(
-                Unit(name=unit.name, activation_state=unit.activation_state))
-        return succeed(incomplete_units)
+        #
+        # Resource limits are kept, so that reporting them can be tested.
+        return Unit(name=unit.name, activation_state=unit.activation_state,
+                    resources=unit.resources)
+
+    def list(self):
+        return succeed(
+            set(self._listed(unit) for unit in self._units.values()))
+
+    def pull(self, image_name):
+        self.pulled.append(image_name)
+        return succeed(None)
+
+    def watch(self, receive):
+        for name, unit in self._units.items():
+            receive(name, self._listed(unit))
+        self._watchers.append(receive)
+        return succeed(_FakeWatch(self._watchers, receive))
+
+    def _changed(self, unit_name):
+        """
+        Report a change to a unit to the watchers.
+
+        :param unicode unit_name: The name of the changed unit.
+        """
+        unit = self._units.get(unit_name)
+        if unit is not None:
+            unit = self._listed(unit)
+        for receive in list(self._watchers):
+            receive(unit_name, unit)
+
+
+class _FakeWatch(object):
+    """
+    A watch of a ``FakeGearClient``'s units.
+    """
+    def __init__(self, watchers, receive):
+        self._watchers = watchers
+        self._receive = receive
+
+    def stop(self):
+        if self._receive in self._watchers:
+            self._watchers.remove(self._receive)
 
 
 @attributes(['internal_port', 'external_port'])
@@ -7,22 +7,28 @@ tools.
 """
 
 import sys
+import json
+from time import time
+from os.path import expanduser
 
+from twisted.python.filepath import FilePath
 from twisted.python.usage import Options, UsageError
 from twisted.internet import reactor
 
-from yaml import safe_load
+from yaml import safe_load, safe_dump
 from yaml.error import YAMLError
 
 from zope.interface import implementer
 
-from ._config import configuration_to_yaml
+from ._config import (
+    applications_to_configuration, _resources_to_configuration)
 
+from ..common import ssh_key_fingerprint, decode_documents
 from ..volume.script import VolumeOptions, VolumeScript
 from ..common.script import (
     flocker_standard_options, FlockerScriptRunner, ICommandLineScript)
-from . import (ConfigurationError, model_from_configuration, Deployer,
-               current_from_configuration)
+from . import (ConfigurationError, Deployer,
+               node_slice_from_configuration, configuration_hash)
 
 __all__ = [
     "ChangeStateOptions",
@@ -44,78 +50,54 @@ class ChangeStateOptions(Options):
     flocker-changestate is called by flocker-deploy to set the configuration of
     a node.
 
-    * deployment_configuration: The YAML string describing the desired
-        deployment configuration.
-
-    * application_configuration: The YAML string describing the desired
-        application configuration.
-
-    * current_configuration: The YAML string describing the current
-        cluster configuration.
-
-    * hostname: The hostname of this node. Used by the node to identify which
-        applications from deployment_configuration should be running.
+    The configuration is read from standard input, as framed and compressed
+    by flocker.common.encode_documents.  It consists of a single YAML
+    document describing the slice of the deployment relevant to this node:
+    its hostname, the applications it should run, the proxies it needs to
+    applications on other nodes and the volumes moving to or from it.
     """
-    synopsis = ("Usage: flocker-changestate [OPTIONS] "
-                "<deployment configuration> <application configuration> "
-                "<cluster configuration> <hostname>")
+    synopsis = "Usage: flocker-changestate [OPTIONS]"
 
-    def parseArgs(self, deployment_config, application_config, current_config,
-                  hostname):
+    def parseArgs(self):
         """
-        Parse `deployment_config`, `application_config` and `current_config`
-        strings as YAML, and into a :class:`Deployment` instance. Assign
-        the resulting instance to this `Options` dictionary. Decode a
-        supplied hostname as ASCII and assign to a `hostname` key.
-
-        :param bytes deployment_config: The YAML string describing the desired
-            deployment configuration.
-        :param bytes application_config: The YAML string describing the desired
-            application configuration.
-        :param bytes application_config: The YAML string describing the current
-            cluster configuration.
-        :param bytes hostname: The ascii encoded hostname of this node.
-
-        :raises UsageError: If the configuration files cannot be parsed as YAML
-            or if the hostname can not be decoded as ASCII.
+        Read the node slice configuration from standard input, parse it as
+        YAML and then into a :class:`NodeSlice` instance.  Assign the
+        resulting instance to a `slice` key, its hostname to a `hostname` key
+        and the hash of the configuration to a `slice_hash` key.
+
+        :raises UsageError: If the configuration cannot be read from standard
+            input, cannot be parsed as YAML or is not a valid node slice.
         """
         try:
-            deployment_config = safe_load(deployment_config)
-        except YAMLError as e:
+            documents = decode_documents(self._sys_module.stdin.read())
+        except ValueError as e:
             raise UsageError(
-                "Deployment config could not be parsed as YAML:\n\n" + str(e)
+                "Configuration could not be read from standard input: " +
+                str(e)
             )
-        try:
-            application_config = safe_load(application_config)
-        except YAMLError as e:
+        if len(documents) != 1:
             raise UsageError(
-                "Application config could not be parsed as YAML:\n\n" + str(e)
+                "Configuration could not be read from standard input: "
+                "expected 1 document, got {count}".format(
+                    count=len(documents))
             )
         try:
-            current_config = safe_load(current_config)
+            slice_config = safe_load(documents[0])
         except YAMLError as e:
             raise UsageError(
-                "Current config could not be parsed as YAML:\n\n" + str(e)
-            )
-        try:
-            self['hostname'] = hostname.decode('ascii')
-        except UnicodeDecodeError:
-            raise UsageError(
-                "Non-ASCII hostname: {hostname}".format(hostname=hostname)
+                "Node config could not be parsed as YAML:\n\n" + str(e)
             )
-
+        # The slice is not written by a human, so don't bother with nice
+        # errors beyond the configuration error message:
         try:
-            self['deployment'] = model_from_configuration(
-                application_configuration=application_config,
-                deployment_configuration=deployment_config)
+            self['slice'] = node_slice_from_configuration(slice_config)
         except ConfigurationError as e:
             raise UsageError(
                 'Configuration Error: {error}'
                 .format(error=str(e))
             )
-        # Current configuration is not written by a human, so don't bother
-        # with nice error for failure to parse:
-        self["current"] = current_from_configuration(current_config)
+        self['hostname'] = self['slice'].hostname
+        self['slice_hash'] = configuration_hash(documents[0])
 
 
 def _default_volume_service():
@@ -129,6 +111,114 @@ def _default_volume_service():
     return VolumeScript().create_volume_service(reactor, options)
 
 
+def _applied_path(flocker_path):
+    """
+    :param FilePath flocker_path: The directory holding Flocker's node state.
+
+    :return: The ``FilePath`` of the record of the last applied node slice.
+    """
+    return flocker_path.child(b"applied_slice.json")
+
+
+def _applications_record(applications):
+    """
+    :param applications: The ``Application``\ s which are, or are to be,
+        running on this node.
+
+    :return: A ``dict`` mapping the name of each application to a ``dict`` of
+        its resource limits, as they are recorded for an applied node slice.
+    """
+    record = {}
+    for application in applications:
+        limits = {}
+        _resources_to_configuration(application.resources, limits)
+        record[application.name] = limits
+    return record
+
+
+def _slice_record(slice_hash, node_slice):
+    """
+    :param unicode slice_hash: The ``configuration_hash`` of a node slice.
+    :param NodeSlice node_slice: The slice.
+
+    :return: The ``dict`` recorded once the slice has been applied.
+    """
+    return {
+        u"hash": slice_hash,
+        u"applications": _applications_record(node_slice.applications),
+        u"proxies": len(node_slice.proxies),
+    }
+
+
+def _in_recorded_state(record, state, network):
+    """
+    Determine whether this node is in the state of a node slice, as far as
+    cheaply observable: exactly the slice's applications are running with
+    its resource limits, nothing is stopped and the number of proxies is
+    the slice's (for example they are all lost if the node reboots).
+
+    :param dict record: The ``_slice_record`` of the slice.
+    :param NodeState state: The discovered state of this node.
+    :param INetwork network: The network routing API of this node.
+
+    :return: ``True`` if the node is in the slice's state, else ``False``.
+    """
+    if state.not_running:
+        return False
+    if _applications_record(state.running) != record[u"applications"]:
+        return False
+    return len(network.enumerate_proxies()) == record[u"proxies"]
+
+
+def _record_applied(flocker_path, slice_hash, node_slice):
+    """
+    Record that a node slice has been applied successfully.
+
+    :param FilePath flocker_path: The directory holding Flocker's node state.
+    :param unicode slice_hash: The ``configuration_hash`` of the slice.
+    :param NodeSlice node_slice: The slice which was applied.
+    """
+    if not flocker_path.exists():
+        flocker_path.makedirs()
+    _applied_path(flocker_path).setContent(
+        json.dumps(_slice_record(slice_hash, node_slice)))
+
+
+def _forget_applied(flocker_path):
+    """
+    Remove the record of the last applied node slice, if there is one.
+
+    :param FilePath flocker_path: The directory holding Flocker's node state.
+    """
+    path = _applied_path(flocker_path)
+    if path.exists():
+        path.remove()
+
+
+def _applied_hash(flocker_path, state, network):
+    """
+    Determine the hash of the node slice this node is still in the state of.
+
+    The recorded slice is only reported if the node's state still matches
+    it; see ``_in_recorded_state``.
+
+    :param FilePath flocker_path: The directory holding Flocker's node state.
+    :param NodeState state: The discovered state of this node.
+    :param INetwork network: The network routing API of this node.
+
+    :return: The ``unicode`` hash of the last applied slice or ``None``.
+    """
+    try:
+        record = json.loads(_applied_path(flocker_path).getContent())
+        slice_hash = record[u"hash"]
+        in_state = _in_recorded_state(record, state, network)
+    except (IOError, ValueError, KeyError, TypeError):
+        return None
+    if not in_state:
+        return None
+    return slice_hash
+
+
 @implementer(ICommandLineScript)
 class ChangeStateScript(object):
     """
@@ -139,23 +229,39 @@ class ChangeStateScript(object):
     :ivar Deployer _deployer: A :class:`Deployer` instance used to change the
         state of the current node.
     """
-    def __init__(self, create_volume_service=_default_volume_service):
+    def __init__(self, create_volume_service=_default_volume_service,
+                 flocker_path=FilePath(b"/etc/flocker")):
         """
         :param create_volume_service: Callable that returns a
             ``VolumeService``, defaulting to a standard production-configured
             service.
+        :param FilePath flocker_path: The directory in which the hash of the
+            last successfully applied node slice is recorded.
         """
         self._deployer = Deployer(create_volume_service())
+        self._flocker_path = flocker_path
 
     def main(self, reactor, options):
         """
         See :py:meth:`ICommandLineScript.main` for parameter documentation.
         """
-        return self._deployer.change_node_state(
-            desired_state=options['deployment'],
-            current_cluster_state=options['current'],
-            hostname=options['hostname']
-        )
+        # Until the new slice has been applied completely the node is in no
+        # known state:
+        _forget_applied(self._flocker_path)
+        d = self._deployer.change_slice_state(options['slice'])
+        # The slice is only recorded as applied once the node is found to be
+        # in its state, since changes which didn't take effect, such as
+        # resource limits which couldn't be applied, would otherwise never be
+        # made again:
+        d.addCallback(lambda _: self._deployer.discover_node_configuration())
+
+        def discovered(state):
+            record = _slice_record(options['slice_hash'], options['slice'])
+            if _in_recorded_state(record, state, self._deployer.network):
+                _record_applied(self._flocker_path, options['slice_hash'],
+                                options['slice'])
+        d.addCallback(discovered)
+        return d
 
 
 def flocker_changestate_main():
@@ -165,6 +271,70 @@ def flocker_changestate_main():
     ).main()
 
 
+def _installed_key_fingerprint(flocker_path, authorized_keys_path):
+    """
+    Determine which Flocker key pair, if any, is fully installed on this node.
+
+    A key pair is installed when its public part is in ``flocker_path`` and is
+    also authorized for SSH access.  ``flocker-deploy`` uses this as a probe to
+    decide whether a node it recorded as configured still is.
+
+    :param FilePath flocker_path: The directory holding Flocker's key pair.
+    :param FilePath authorized_keys_path: The ``authorized_keys`` file of the
+        user ``flocker-deploy`` connects as.
+
+    :return: The fingerprint of the installed public key as ``unicode``, or
+        ``None`` if no key pair is fully installed.
+    """
+    try:
+        public_key = flocker_path.child(b"id_rsa_flocker.pub").getContent()
+        authorized_keys = authorized_keys_path.getContent()
+        fingerprint = ssh_key_fingerprint(public_key)
+    except (IOError, ValueError):
+        return None
+    for line in authorized_keys.splitlines():
+        if not line.strip() or line.lstrip().startswith(b"#"):
+            continue
+        try:
+            if ssh_key_fingerprint(line) == fingerprint:
+                return fingerprint.decode("ascii")
+        except ValueError:
+            continue
+    return None
+
+
+def _state_generation(flocker_path, report, now=time):
+    """
+    Determine the generation of this node's reported state.
+
+    The generation is incremented whenever the report differs from the one
+    the previous generation was determined for.  A node without a recorded
+    generation starts counting at the current time in milliseconds, so that
+    generations keep increasing even if the record is lost.
+
+    :param FilePath flocker_path: The directory holding Flocker's node state.
+    :param dict report: The state about to be reported.
+    :param now: A callable returning the current time in seconds.
+
+    :return: The ``int`` generation of ``report``.
+    """
+    path = flocker_path.child(b"state_generation.json")
+    digest = configuration_hash(safe_dump(report))
+    try:
+        record = json.loads(path.getContent())
+        generation = record[u"generation"]
+        if record[u"digest"] == digest:
+            return generation
+        generation += 1
+    except (IOError, ValueError, KeyError, TypeError):
+        generation = int(now() * 1000)
+    if not flocker_path.exists():
+        flocker_path.makedirs()
+    path.setContent(json.dumps(
+        {u"generation": generation, u"digest": digest}))
+    return generation
+
+
 @flocker_standard_options
 class ReportStateOptions(Options):
     """
@@ -174,9 +344,19 @@ class ReportStateOptions(Options):
     longdesc = """\
     flocker-reportstate is called by flocker-deploy to get the configuration of
     a node.
+
+    The reported state is numbered with a generation which increases whenever
+    the state changes.  If the generation flocker-deploy already knows about
+    is given and the state has not changed since, only the generation is
+    reported.
     """
     synopsis = ("Usage: flocker-reportstate [OPTIONS]")
 
+    optParameters = [
+        ["known-generation", None, None,
+         "The generation of the state already known by the caller.", int],
+    ]
+
 
 @implementer(ICommandLineScript)
 class ReportStateScript(object):
@@ -188,25 +368,65 @@ class ReportStateScript(object):
     """
     def __init__(self,
                  create_volume_service=_default_volume_service,
-                 gear_client=None):
+                 gear_client=None,
+                 flocker_path=FilePath(b"/etc/flocker"),
+                 authorized_keys_path=FilePath(
+                     expanduser(b"~/.ssh/authorized_keys")),
+                 network=None):
         """
         :param create_volume_service: Callable that returns a
             ``VolumeService``, defaulting to a standard production-configured
             service.
         :param gear_client: A ``GearClient`` instance, optional.
+        :param FilePath flocker_path: The directory holding the Flocker key
+            pair installed by ``flocker-deploy`` and the record of the last
+            node slice applied by ``flocker-changestate``.
+        :param FilePath authorized_keys_path: The ``authorized_keys`` file
+            ``flocker-deploy`` installs the Flocker public key into.
+        :param INetwork network: The network routing API, optional.
         """
-        self._deployer = Deployer(create_volume_service(), gear_client)
+        self._deployer = Deployer(create_volume_service(), gear_client,
+                                  network)
+        self._flocker_path = flocker_path
+        self._authorized_keys_path = authorized_keys_path
 
     def _print_yaml(self, result):
         sys.stdout.write(result)
 
+    def _report(self, state, known_generation=None):
+        """
+        Serialize the state of this node for ``flocker-deploy``.
+
+        :param NodeState state: The discovered state of this node.
+        :param known_generation: The ``int`` generation of the state
+            ``flocker-deploy`` already knows about, or ``None``.
+
+        :return: ``bytes`` of YAML in the application configuration format,
+            with an additional ``ssh_key`` entry giving the fingerprint of the
+            installed Flocker key (or ``None``), an ``applied`` entry giving
+            the hash of the node slice the node is still in the state of (or
+            ``None``) and a ``generation`` entry.  If the generation is
+            ``known_generation`` only the ``generation`` and an ``unchanged``
+            entry are included.
+        """
+        report = applications_to_configuration(
+            list(state.running + state.not_running))
+        report[u"ssh_key"] = _installed_key_fingerprint(
+            self._flocker_path, self._authorized_keys_path)
+        report[u"applied"] = _applied_hash(
+            self._flocker_path, state, self._deployer.network)
+        generation = _state_generation(self._flocker_path, report)
+        if generation == known_generation:
+            return safe_dump({u"generation": generation, u"unchanged": True})
+        report[u"generation"] = generation
+        return safe_dump(report)
+
     def main(self, reactor, options):
         """
         See :py:meth:`ICommandLineScript.main` for parameter documentation.
         """
         d = self._deployer.discover_node_configuration()
-        d.addCallback(lambda state: configuration_to_yaml(
-            list(state.running + state.not_running)))
+        d.addCallback(self._report, options.get("known-generation"))
         d.addCallback(self._print_yaml)
         return d
 
@@ -0,0 +1,168 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.node._cgroup``.
+"""
+
+from twisted.python.filepath import FilePath
+from twisted.trial.unittest import SynchronousTestCase
+
+from .._cgroup import (
+    CgroupNotFound, apply_limits, container_cgroup, read_limits)
+from .._model import ResourceLimits
+
+
+# The contents of the files of an unlimited control group.
+DEFAULTS = {
+    b"cpu": (b"cpu.shares", b"1024\n"),
+    b"memory": (b"memory.limit_in_bytes", b"9223372036854771712\n"),
+    b"cpuset": (b"cpuset.cpus", b"0-7\n"),
+    b"blkio": (b"blkio.weight", b"500\n"),
+}
+
+
+def make_cgroups(root, container_id, parent=(b"docker",)):
+    """
+    Create the files of an unlimited container's control groups.
+
+    :param FilePath root: Where the control group hierarchies are mounted.
+    :param bytes container_id: The full ID of the container.
+    :param parent: The ``bytes`` path segments of the control group the
+        container's group is in.
+    """
+    for controller, (name, content) in DEFAULTS.items():
+        cgroup = root.child(controller)
+        for segment in parent:
+            cgroup = cgroup.child(segment)
+        cgroup.makedirs()
+        cgroup.child(name).setContent(content)
+        if parent == (b"docker",):
+            cgroup = cgroup.child(container_id)
+        else:
+            cgroup = cgroup.child(b"docker-%s.scope" % (container_id,))
+        cgroup.makedirs()
+        cgroup.child(name).setContent(content)
+
+
+class ContainerCgroupTests(SynchronousTestCase):
+    """
+    Tests for ``container_cgroup``.
+    """
+    def setUp(self):
+        self.root = FilePath(self.mktemp())
+
+    def test_docker(self):
+        """
+        ``container_cgroup`` finds the control group Docker creates itself.
+        """
+        make_cgroups(self.root, b"abc")
+        self.assertEqual(
+            self.root.descendant([b"cpu", b"docker", b"abc"]),
+            container_cgroup(self.root, b"cpu", b"abc"))
+
+    def test_systemd(self):
+        """
+        ``container_cgroup`` finds the control group systemd creates for
+        Docker.
+        """
+        make_cgroups(self.root, b"abc", parent=(b"system.slice",))
+        self.assertEqual(
+            self.root.descendant([b"cpu", b"system.slice",
+                                  b"docker-abc.scope"]),
+            container_cgroup(self.root, b"cpu", b"abc"))
+
+    def test_missing(self):
+        """
+        ``container_cgroup`` returns ``None`` if the container has no control
+        group.
+        """
+        make_cgroups(self.root, b"abc")
+        self.assertIs(None, container_cgroup(self.root, b"cpu", b"def"))
+
+
+class LimitsTests(SynchronousTestCase):
+    """
+    Tests for ``apply_limits`` and ``read_limits``.
+    """
+    def setUp(self):
+        self.root = FilePath(self.mktemp())
+        make_cgroups(self.root, b"abc")
+
+    def test_apply(self):
+        """
+        ``apply_limits`` writes each limit to the file of the container's
+        control group enforcing it.
+        """
+        apply_limits(self.root, b"abc", ResourceLimits(
+            cpu_shares=512, memory_limit=1048576, cpuset=u"0-3",
+            blkio_weight=100))
+        self.assertEqual(
+            [b"512", b"1048576", b"0-3", b"100"],
+            [self.root.descendant([controller, b"docker", b"abc", name]
+                                  ).getContent()
+             for controller, name in [(b"cpu", b"cpu.shares"),
+                                      (b"memory", b"memory.limit_in_bytes"),
+                                      (b"cpuset", b"cpuset.cpus"),
+                                      (b"blkio", b"blkio.weight")]])
+
+    def test_apply_unset(self):
+        """
+        ``apply_limits`` resets the limits which aren't set to the values of
+        the parent control group.
+        """
+        apply_limits(self.root, b"abc", ResourceLimits(
+            cpu_shares=512, memory_limit=1048576))
+        apply_limits(self.root, b"abc", ResourceLimits(cpu_shares=256))
+        self.assertEqual(
+            ResourceLimits(cpu_shares=256), read_limits(self.root, b"abc"))
+
+    def test_apply_unset_missing(self):
+        """
+        ``apply_limits`` ignores a missing control group for a limit which
+        isn't set.
+        """
+        self.root.descendant([b"blkio", b"docker", b"abc"]).remove()
+        apply_limits(self.root, b"abc", ResourceLimits(cpu_shares=512))
+        self.assertEqual(
+            ResourceLimits(cpu_shares=512), read_limits(self.root, b"abc"))
+
+    def test_apply_missing(self):
+        """
+        ``apply_limits`` raises ``CgroupNotFound`` if the container has no
+        control group.
+        """
+        self.assertRaises(
+            CgroupNotFound, apply_limits, self.root, b"def",
+            ResourceLimits(cpu_shares=512))
+
+    def test_read(self):
+        """
+        ``read_limits`` returns the limits applied to the container.
+        """
+        resources = ResourceLimits(
+            cpu_shares=512, memory_limit=1048576, cpuset=u"0-3",
+            blkio_weight=100)
+        apply_limits(self.root, b"abc", resources)
+        self.assertEqual(resources, read_limits(self.root, b"abc"))
+
+    def test_read_partial(self):
+        """
+        ``read_limits`` reports the values which are the same as those of the
+        parent control group as unlimited.
+        """
+        apply_limits(self.root, b"abc", ResourceLimits(memory_limit=1048576))
+        self.assertEqual(ResourceLimits(memory_limit=1048576),
+                         read_limits(self.root, b"abc"))
+
+    def test_read_unlimited(self):
+        """
+        ``read_limits`` returns ``None`` for an unlimited container.
+        """
+        self.assertIs(None, read_limits(self.root, b"abc"))
+
+    def test_read_missing(self):
+        """
+        ``read_limits`` returns ``None`` for a container without control
+        groups.
+        """
+        self.assertIs(None, read_limits(self.root, b"def"))
@@ -6,17 +6,21 @@ Tests for ``flocker.node._config``.
 
 from __future__ import unicode_literals, absolute_import
 
+import yaml
 from yaml import safe_load
 
 from twisted.python.filepath import FilePath
 from twisted.trial.unittest import SynchronousTestCase
 from .._config import (
     ConfigurationError, Configuration, configuration_to_yaml,
-    current_from_configuration,
+    current_from_configuration, node_slice_from_configuration,
+    node_slice_to_configuration,
     )
 from .._model import (
-    Application, AttachedVolume, DockerImage, Deployment, Node, Port
+    Application, AttachedVolume, DockerImage, Deployment, Node, Port,
+    NodeSlice, VolumeMove, ResourceLimits
 )
+from ...route import Proxy
 
 
 class ApplicationsFromConfigurationTests(SynchronousTestCase):
@@ -238,6 +242,109 @@ class ApplicationsFromConfigurationTests(SynchronousTestCase):
             exception.message
         )
 
+    def test_resource_limits(self):
+        """
+        ``Configuration._applications_from_configuration`` returns an
+        ``Application`` with ``ResourceLimits`` if the application
+        configuration has resource limits.
+        """
+        config = dict(
+            version=1,
+            applications={'mysql-hybridcluster': dict(
+                image='busybox',
+                cpu_shares=512, memory_limit='512m', cpuset='0-3,6',
+                blkio_weight=300,
+                )})
+        parser = Configuration()
+        applications = parser._applications_from_configuration(config)
+        self.assertEqual(
+            ResourceLimits(cpu_shares=512, memory_limit=512 * 1024 ** 2,
+                           cpuset='0-3,6', blkio_weight=300),
+            applications['mysql-hybridcluster'].resources)
+
+    def test_no_resource_limits(self):
+        """
+        ``Configuration._applications_from_configuration`` returns an
+        ``Application`` with no ``ResourceLimits`` if the application
+        configuration has no resource limits.
+        """
+        config = dict(
+            version=1,
+            applications={'mysql-hybridcluster': dict(image='busybox')})
+        parser = Configuration()
+        applications = parser._applications_from_configuration(config)
+        self.assertIs(None, applications['mysql-hybridcluster'].resources)
+
+    def test_memory_limit_bytes(self):
+        """
+        ``memory_limit`` can be given as a number of bytes.
+        """
+        config = dict(
+            version=1,
+            applications={'mysql-hybridcluster': dict(
+                image='busybox', memory_limit=1048576)})
+        parser = Configuration()
+        applications = parser._applications_from_configuration(config)
+        self.assertEqual(
+            ResourceLimits(memory_limit=1048576),
+            applications['mysql-hybridcluster'].resources)
+
+    def assert_invalid_resources(self, limits, message):
+        """
+        Assert that ``Configuration._applications_from_configuration`` raises
+        a ``ConfigurationError`` for an application with the given resource
+        limits.
+
+        :param dict limits: The resource limits of the application.
+        :param unicode message: The expected end of the error message.
+        """
+        config = dict(
+            version=1,
+            applications={'mysql-hybridcluster': dict(
+                image='busybox', **limits)})
+        parser = Configuration()
+        exception = self.assertRaises(ConfigurationError,
+                                      parser._applications_from_configuration,
+                                      config)
+        self.assertEqual(
+            "Application 'mysql-hybridcluster' has a config error. "
+            "Invalid resource limits. " + message,
+            exception.message
+        )
+
+    def test_invalid_cpu_shares(self):
+        """
+        ``cpu_shares`` must be a positive integer.
+        """
+        self.assert_invalid_resources(
+            dict(cpu_shares=0),
+            "'cpu_shares' must be an integer of at least 1, not 0.")
+
+    def test_invalid_memory_limit(self):
+        """
+        ``memory_limit`` must be a number of bytes with an optional suffix.
+        """
+        self.assert_invalid_resources(
+            dict(memory_limit='lots'),
+            "'memory_limit' must be a number of bytes, optionally with a "
+            "suffix of b, k, m or g, not lots.")
+
+    def test_invalid_cpuset(self):
+        """
+        ``cpuset`` must be a list of CPUs and ranges of CPUs.
+        """
+        self.assert_invalid_resources(
+            dict(cpuset='0-3;6'),
+            "'cpuset' must be a list of CPUs such as '0-3,6', not 0-3;6.")
+
+    def test_invalid_blkio_weight(self):
+        """
+        ``blkio_weight`` must be an integer from 10 to 1000.
+        """
+        self.assert_invalid_resources(
+            dict(blkio_weight=5000),
+            "'blkio_weight' must be an integer from 10 to 1000, not 5000.")
+
     def test_error_on_volume_extra_keys(self):
         """
         ``Configuration._applications_from_configuration`` raises a
@@ -286,6 +393,170 @@ class ApplicationsFromConfigurationTests(SynchronousTestCase):
             exception.message
         )
 
+    def test_volume_tuning(self):
+        """
+        ``Configuration._applications_from_configuration`` loads the profile
+        and properties of a volume into the ``AttachedVolume``, reading
+        YAML's booleans as ``on`` and ``off``.
+        """
+        config = safe_load("""
+        version: 1
+        applications:
+          mysql-hybridcluster:
+            image: clusterhq/mysql
+            volume:
+              mountpoint: /var/lib/mysql
+              profile: mysql
+              properties:
+                recordsize: 8K
+                copies: 2
+                atime: off
+        """)
+        parser = Configuration()
+        applications = parser._applications_from_configuration(config)
+        self.assertEqual(
+            AttachedVolume(
+                name='mysql-hybridcluster',
+                mountpoint=FilePath(b'/var/lib/mysql'),
+                profile='mysql',
+                properties=frozenset([('recordsize', '8K'), ('copies', '2'),
+                                      ('atime', 'off')])),
+            applications['mysql-hybridcluster'].volume)
+
+    def test_volume_storage_class(self):
+        """
+        ``Configuration._applications_from_configuration`` loads the storage
+        class of a volume into the ``AttachedVolume``.
+        """
+        config = safe_load("""
+        version: 1
+        applications:
+          mysql-hybridcluster:
+            image: clusterhq/mysql
+            volume:
+              mountpoint: /var/lib/mysql
+              storage_class: ssd
+        """)
+        parser = Configuration()
+        applications = parser._applications_from_configuration(config)
+        self.assertEqual(
+            AttachedVolume(
+                name='mysql-hybridcluster',
+                mountpoint=FilePath(b'/var/lib/mysql'),
+                storage_class='ssd'),
+            applications['mysql-hybridcluster'].volume)
+
+    def test_error_on_volume_storage_class_not_string(self):
+        """
+        ``Configuration._applications_from_configuration`` raises a
+        ``ConfigurationError`` if the volume's storage class isn't a string.
+        """
+        config = dict(
+            version=1,
+            applications={'mysql-hybridcluster': dict(
+                image='busybox',
+                volume={'mountpoint': b'/var/lib/mysql',
+                        'storage_class': 7},
+            )}
+        )
+        parser = Configuration()
+        exception = self.assertRaises(ConfigurationError,
+                                      parser._applications_from_configuration,
+                                      config)
+        self.assertEqual(
+            "Application 'mysql-hybridcluster' has a config error. "
+            "Invalid volume specification. Storage class must be a string, "
+            "not 7.",
+            exception.message
+        )
+
+    def test_error_on_volume_unknown_profile(self):
+        """
+        ``Configuration._applications_from_configuration`` raises a
+        ``ConfigurationError`` if the volume's profile is unknown.
+        """
+        config = dict(
+            version=1,
+            applications={'mysql-hybridcluster': dict(
+                image='busybox',
+                volume={'mountpoint': b'/var/lib/mysql', 'profile': 'oracle'},
+            )}
+        )
+        parser = Configuration()
+        exception = self.assertRaises(ConfigurationError,
+                                      parser._applications_from_configuration,
+                                      config)
+        self.assertEqual(
+            "Application 'mysql-hybridcluster' has a config error. "
+            "Invalid volume specification. Unknown profile oracle. "
+            "Known profiles: mysql, postgresql, sequential, small-files.",
+            exception.message
+        )
+
+    def test_error_on_volume_profile_not_string(self):
+        """
+        ``Configuration._applications_from_configuration`` raises a
+        ``ConfigurationError`` if the volume's profile isn't a string.
+        """
+        config = dict(
+            version=1,
+            applications={'mysql-hybridcluster': dict(
+                image='busybox',
+                volume={'mountpoint': b'/var/lib/mysql',
+                        'profile': ['mysql']},
+            )}
+        )
+        parser = Configuration()
+        self.assertRaises(ConfigurationError,
+                          parser._applications_from_configuration,
+                          config)
+
+    def test_error_on_volume_unsupported_property(self):
+        """
+        ``Configuration._applications_from_configuration`` raises a
+        ``ConfigurationError`` if a volume property can't be tuned.
+        """
+        config = dict(
+            version=1,
+            applications={'mysql-hybridcluster': dict(
+                image='busybox',
+                volume={'mountpoint': b'/var/lib/mysql',
+                        'properties': {'mountpoint': '/elsewhere'}},
+            )}
+        )
+        parser = Configuration()
+        exception = self.assertRaises(ConfigurationError,
+                                      parser._applications_from_configuration,
+                                      config)
+        self.assertIn(
+            "Invalid volume specification. Unsupported property mountpoint.",
+            exception.message
+        )
+
+    def test_error_on_volume_properties_not_mapping(self):
+        """
+        ``Configuration._applications_from_configuration`` raises a
+        ``ConfigurationError`` if a volume's properties aren't a mapping.
+        """
+        config = dict(
+            version=1,
+            applications={'mysql-hybridcluster': dict(
+                image='busybox',
+                volume={'mountpoint': b'/var/lib/mysql',
+                        'properties': 'recordsize=8K'},
+            )}
+        )
+        parser = Configuration()
+        exception = self.assertRaises(ConfigurationError,
+                                      parser._applications_from_configuration,
+                                      config)
+        self.assertEqual(
+            "Application 'mysql-hybridcluster' has a config error. "
+            "Invalid volume specification. Properties must be a mapping, "
+            "not recordsize=8K.",
+            exception.message
+        )
+
     def test_error_on_volume_invalid_mountpoint(self):
         """
         ``Configuration._applications_from_configuration`` raises a
@@ -684,6 +955,32 @@ class ConfigurationToYamlTests(SynchronousTestCase):
         }
         self.assertEqual(safe_load(result), expected)
 
+    def test_application_resources(self):
+        """
+        The dictionary includes the resource limits of each supplied
+        application which has them.
+        """
+        applications = {
+            Application(
+                name='site-hybridcluster',
+                image=DockerImage(repository='flocker/wordpress',
+                                  tag='v1.0.0'),
+                resources=ResourceLimits(cpu_shares=512, cpuset='1'))
+        }
+        result = configuration_to_yaml(applications)
+        expected = {
+            'applications': {
+                'site-hybridcluster': {
+                    'image': 'unknown',
+                    'ports': [],
+                    'cpu_shares': 512,
+                    'cpuset': '1',
+                },
+            },
+            'version': 1
+        }
+        self.assertEqual(safe_load(result), expected)
+
     def test_application_with_volume_includes_mountpoint(self):
         """
         If the supplied applications have a volume, the resulting yaml will
@@ -873,3 +1170,149 @@ class CurrentFromConfigurationTests(SynchronousTestCase):
             ]))]))
         self.assertEqual(expected,
                          current_from_configuration(config))
+
+
+class NodeSliceConfigurationTests(SynchronousTestCase):
+    """
+    Tests for ``node_slice_to_configuration`` and
+    ``node_slice_from_configuration``.
+    """
+    def setUp(self):
+        volume = AttachedVolume(name='mysql-hybridcluster',
+                                mountpoint=FilePath(b'/var/lib/mysql'))
+        self.node_slice = NodeSlice(
+            hostname='node1.example.com',
+            applications=frozenset([
+                Application(
+                    name='mysql-hybridcluster',
+                    image=DockerImage(repository='clusterhq/mysql',
+                                      tag='release-14.0'),
+                    ports=frozenset([
+                        Port(internal_port=3306, external_port=3306)]),
+                    volume=volume)]),
+            proxies=frozenset([
+                Proxy(ip='node3.example.com', port=80),
+                Proxy(ip='node2.example.com', port=8080)]),
+            volume_moves=frozenset([
+                VolumeMove(volume=volume, source='node2.example.com',
+                           destination='node1.example.com')]))
+
+    def test_to_configuration(self):
+        """
+        ``node_slice_to_configuration`` includes the complete configuration of
+        the applications, the proxies sorted by address and port and the
+        volume moves.
+        """
+        self.assertEqual(
+            {'version': 1,
+             'hostname': 'node1.example.com',
+             'applications': {
+                 'mysql-hybridcluster': {
+                     'image': 'clusterhq/mysql:release-14.0',
+                     'ports': [{'internal': 3306, 'external': 3306}],
+                     'volume': {'mountpoint': b'/var/lib/mysql'},
+                 }},
+             'proxies': [{'ip': 'node2.example.com', 'port': 8080},
+                         {'ip': 'node3.example.com', 'port': 80}],
+             'volume_moves': [{'name': 'mysql-hybridcluster',
+                               'mountpoint': b'/var/lib/mysql',
+                               'source': 'node2.example.com',
+                               'destination': 'node1.example.com'}]},
+            node_slice_to_configuration(self.node_slice))
+
+    def test_roundtrip(self):
+        """
+        ``node_slice_from_configuration`` loads the output of
+        ``node_slice_to_configuration`` as an equivalent ``NodeSlice``.
+        """
+        configuration = node_slice_to_configuration(self.node_slice)
+        loaded = node_slice_from_configuration(
+            safe_load(yaml.safe_dump(configuration)))
+        self.assertEqual(
+            (self.node_slice, configuration),
+            (loaded, node_slice_to_configuration(loaded)))
+
+    def test_roundtrip_resources(self):
+        """
+        The resource limits of the applications are kept when a slice is
+        converted to configuration and loaded again.
+        """
+        node_slice = NodeSlice(
+            hostname='node1.example.com',
+            applications=frozenset([
+                Application(
+                    name='mysql-hybridcluster',
+                    image=DockerImage(repository='clusterhq/mysql'),
+                    resources=ResourceLimits(
+                        cpu_shares=512, memory_limit=1024 ** 3,
+                        cpuset='0-3', blkio_weight=800))]))
+        loaded = node_slice_from_configuration(
+            safe_load(yaml.safe_dump(node_slice_to_configuration(node_slice))))
+        self.assertEqual(
+            [application.resources for application in node_slice.applications],
+            [application.resources for application in loaded.applications])
+
+    def test_roundtrip_volume_tuning(self):
+        """
+        The profile, properties and storage class of the applications'
+        volumes are kept when a slice is converted to configuration and
+        loaded again.
+        """
+        volume = AttachedVolume(
+            name='mysql-hybridcluster', mountpoint=FilePath(b'/var/lib/mysql'),
+            profile='mysql', properties=frozenset([('atime', 'off')]),
+            storage_class='ssd')
+        node_slice = NodeSlice(
+            hostname='node1.example.com',
+            applications=frozenset([
+                Application(
+                    name='mysql-hybridcluster',
+                    image=DockerImage(repository='clusterhq/mysql'),
+                    volume=volume)]))
+        loaded = node_slice_from_configuration(
+            safe_load(yaml.safe_dump(node_slice_to_configuration(node_slice))))
+        self.assertEqual(node_slice, loaded)
+
+    def test_missing_key(self):
+        """
+        ``node_slice_from_configuration`` raises a ``ConfigurationError`` if a
+        required key is missing.
+        """
+        configuration = node_slice_to_configuration(self.node_slice)
+        del configuration['proxies']
+        exception = self.assertRaises(
+            ConfigurationError, node_slice_from_configuration, configuration)
+        self.assertEqual(
+            "Node configuration has an error. Missing 'proxies' key.",
+            exception.message)
+
+    def test_not_a_dict(self):
+        """
+        ``node_slice_from_configuration`` raises a ``ConfigurationError`` if
+        the configuration is not a ``dict``.
+        """
+        self.assertRaises(
+            ConfigurationError, node_slice_from_configuration, None)
+
+    def test_incorrect_version(self):
+        """
+        ``node_slice_from_configuration`` raises a ``ConfigurationError`` if
+        the version is not 1.
+        """
+        configuration = node_slice_to_configuration(self.node_slice)
+        configuration['version'] = 2
+        exception = self.assertRaises(
+            ConfigurationError, node_slice_from_configuration, configuration)
+        self.assertEqual(
+            "Node configuration has an error. Incorrect version specified.",
+            exception.message)
+
+    def test_invalid_proxy(self):
+        """
+        ``node_slice_from_configuration`` raises a ``ConfigurationError`` if a
+        proxy is missing its port.
+        """
+        configuration = node_slice_to_configuration(self.node_slice)
+        configuration['proxies'] = [{'ip': 'node2.example.com'}]
+        self.assertRaises(
+            ConfigurationError, node_slice_from_configuration, configuration)
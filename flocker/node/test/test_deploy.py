@@ -6,12 +6,22 @@ Tests for ``flocker.node._deploy``.
 
 from uuid import uuid4
 
-from twisted.internet.defer import fail, FirstError, succeed
+from ipaddr import IPAddress
+from eliot.testing import validateLogging, assertHasAction
+
+from twisted.internet.defer import (
+    CancelledError, Deferred, fail, FirstError)
+from twisted.internet.task import Clock
 from twisted.trial.unittest import SynchronousTestCase
+from twisted.python.filepath import FilePath
 
 from .. import (Deployer, Application, DockerImage, Deployment, Node,
-                StateChanges, Port, NodeState)
-from .._model import AttachedVolume
+                StateChanges, Port, NodeState, NodeSlice, VolumeMove,
+                deployment_slices, deployment_slice)
+from .._logging import PULL_IMAGE, START_APPLICATION, STOP_APPLICATION
+from .._deploy import (
+    DEFAULT_MAX_CONCURRENT_OPERATIONS, DEFAULT_START_TIMEOUT, StartTimeout)
+from .._model import AttachedVolume, ResourceLimits
 from ..gear import GearClient, FakeGearClient, AlreadyExists, Unit, PortMap
 from ...route import Proxy, make_memory_network
 from ...route._iptables import HostNetwork
@@ -45,19 +55,19 @@ class DeployerAttributesTests(SynchronousTestCase):
 
     def test_network_default(self):
         """
-        ``Deployer._network`` is a ``HostNetwork`` by default.
+        ``Deployer.network`` is a ``HostNetwork`` by default.
         """
-        self.assertIsInstance(Deployer(None)._network, HostNetwork)
+        self.assertIsInstance(Deployer(None).network, HostNetwork)
 
     def test_network_override(self):
         """
-        ``Deployer._network`` can be overridden in the constructor.
+        ``Deployer.network`` can be overridden in the constructor.
         """
         dummy_network = object()
         self.assertIs(
             dummy_network,
             Deployer(create_volume_service(self),
-                     network=dummy_network)._network
+                     network=dummy_network).network
         )
 
 
@@ -93,6 +103,46 @@ class DeployerStartApplicationTests(SynchronousTestCase):
              fake_gear._units[application.name].ports)
         )
 
+    def test_resource_limits(self):
+        """
+        ``Deployer.start_application`` applies the application's resource
+        limits to the unit.
+        """
+        fake_gear = FakeGearClient()
+        api = Deployer(create_volume_service(self), gear_client=fake_gear)
+        resources = ResourceLimits(cpu_shares=512, memory_limit=1024 ** 3)
+        application = Application(
+            name=u'site-example.com',
+            image=DockerImage(repository=u'clusterhq/flocker'),
+            resources=resources,
+        )
+        api.start_application(application=application)
+        self.assertEqual(resources,
+                         fake_gear._units[application.name].resources)
+
+    def test_resource_limits_once_active(self):
+        """
+        While the units are watched, ``Deployer.start_application`` applies
+        the application's resource limits once the unit is active.
+        """
+        fake_gear = ActivatingGearClient()
+        api = Deployer(create_volume_service(self), gear_client=fake_gear,
+                       reactor=Clock())
+        resources = ResourceLimits(cpu_shares=512)
+        application = Application(
+            name=u'site-example.com',
+            image=DockerImage(repository=u'clusterhq/flocker'),
+            resources=resources,
+        )
+        api.watch()
+        d = api.start_application(application=application)
+        limited_before = fake_gear._units[application.name].resources
+        fake_gear.activate(application.name)
+        self.successResultOf(d)
+        self.assertEqual(
+            (None, resources),
+            (limited_before, fake_gear._units[application.name].resources))
+
     def test_already_exists(self):
         """
         ``Deployer.start_application`` returns a `Deferred` which errbacks with
@@ -193,6 +243,22 @@ class DeployerDiscoverNodeConfigurationTests(SynchronousTestCase):
         self.assertEqual(NodeState(running=[application], not_running=[]),
                          self.successResultOf(d))
 
+    def test_discover_resource_limits(self):
+        """
+        ``Deployer.discover_node_configuration`` reports the resource limits of
+        the units which have them.
+        """
+        resources = ResourceLimits(cpuset=u'1')
+        unit = Unit(name=u'site-example.com', activation_state=u'active',
+                    resources=resources)
+        fake_gear = FakeGearClient(units={unit.name: unit})
+        api = Deployer(create_volume_service(self), gear_client=fake_gear)
+        d = api.discover_node_configuration()
+        self.assertEqual(
+            [resources],
+            [application.resources
+             for application in self.successResultOf(d).running])
+
     def test_discover_multiple(self):
         """
         ``Deployer.discover_node_configuration`` returns a ``NodeState`` with
@@ -301,6 +367,93 @@ class DeployerDiscoverNodeConfigurationTests(SynchronousTestCase):
 EMPTY = Deployment(nodes=frozenset())
 
 
+class DeployerWatchTests(SynchronousTestCase):
+    """
+    Tests for ``Deployer.watch`` and the methods which use the watched units.
+    """
+    def setUp(self):
+        unit = Unit(name=u'site-example.com', activation_state=u'active')
+        self.gear = FakeGearClient(units={unit.name: unit})
+        self.deployer = Deployer(
+            create_volume_service(self), gear_client=self.gear,
+            network=make_memory_network())
+
+    def test_discover_without_listing(self):
+        """
+        While the units are watched, ``Deployer.discover_node_configuration``
+        reports them without listing them.
+        """
+        self.successResultOf(self.deployer.watch())
+        self.gear.add(u'new', u'busybox')
+        self.patch(self.gear, "list", lambda: 1/0)
+        self.assertEqual(
+            [u'new', u'site-example.com'],
+            sorted(application.name for application in self.successResultOf(
+                self.deployer.discover_node_configuration()).running))
+
+    def test_removed(self):
+        """
+        Units removed while they are watched are no longer discovered.
+        """
+        self.deployer.watch()
+        self.gear.remove(u'site-example.com')
+        self.assertEqual(
+            NodeState(running=[], not_running=[]),
+            self.successResultOf(self.deployer.discover_node_configuration()))
+
+    def test_stop_watching(self):
+        """
+        After ``Deployer.stop_watching`` the units are listed again.
+        """
+        self.deployer.watch()
+        self.deployer.stop_watching()
+        listed = []
+        original_list = self.gear.list
+        self.patch(self.gear, "list",
+                   lambda: listed.append(True) or original_list())
+        self.deployer.discover_node_configuration()
+        self.assertEqual(([True], []), (listed, self.gear._watchers))
+
+    def test_wait_for_existing(self):
+        """
+        ``Deployer.wait_for_unit`` fires immediately for a unit which is
+        already in the wanted state.
+        """
+        self.deployer.watch()
+        self.assertEqual(
+            u'site-example.com',
+            self.successResultOf(
+                self.deployer.wait_for_unit(u'site-example.com')).name)
+
+    def test_wait_for_new(self):
+        """
+        ``Deployer.wait_for_unit`` fires once the unit reaches the wanted
+        state.
+        """
+        self.deployer.watch()
+        d = self.deployer.wait_for_unit(u'new')
+        self.assertNoResult(d)
+        self.gear.add(u'new', u'busybox')
+        self.assertEqual(u'new', self.successResultOf(d).name)
+
+    def test_wait_cancelled(self):
+        """
+        Cancelling the result of ``Deployer.wait_for_unit`` stops the waiting.
+        """
+        self.deployer.watch()
+        d = self.deployer.wait_for_unit(u'new')
+        d.cancel()
+        self.failureResultOf(d, CancelledError)
+        self.assertEqual([], self.deployer._waiting)
+
+    def test_wait_without_watching(self):
+        """
+        ``Deployer.wait_for_unit`` fails if the units aren't watched.
+        """
+        self.failureResultOf(
+            self.deployer.wait_for_unit(u'site-example.com'), RuntimeError)
+
+
 class DeployerCalculateNecessaryStateChangesTests(SynchronousTestCase):
     """
     Tests for ``Deployer.calculate_necessary_state_changes``.
@@ -324,6 +477,54 @@ class DeployerCalculateNecessaryStateChangesTests(SynchronousTestCase):
                                 proxies=set())
         self.assertEqual(expected, self.successResultOf(d))
 
+    def test_resources_changed(self):
+        """
+        ``Deployer.calculate_necessary_state_changes`` specifies that a
+        running application whose resource limits differ from the desired
+        ones has its limits applied, rather than being started again.
+        """
+        unit = Unit(name=u'mysql-hybridcluster', activation_state=u'active',
+                    resources=ResourceLimits(cpu_shares=512))
+        fake_gear = FakeGearClient(units={unit.name: unit})
+        api = Deployer(create_volume_service(self), gear_client=fake_gear,
+                       network=make_memory_network())
+        application = Application(
+            name=u'mysql-hybridcluster',
+            image=DockerImage(repository=u'clusterhq/mysql'),
+            resources=ResourceLimits(cpu_shares=256))
+        desired = Deployment(nodes=frozenset([
+            Node(hostname=u'node.example.com',
+                 applications=frozenset([application]))]))
+        d = api.calculate_necessary_state_changes(
+            desired_state=desired, current_cluster_state=EMPTY,
+            hostname=u'node.example.com')
+        expected = StateChanges(applications_to_start=set(),
+                                applications_to_stop=set(),
+                                applications_to_limit={application})
+        self.assertEqual(expected, self.successResultOf(d))
+
+    def test_resources_unchanged(self):
+        """
+        ``Deployer.calculate_necessary_state_changes`` leaves a running
+        application with the desired resource limits alone.
+        """
+        unit = Unit(name=u'mysql-hybridcluster', activation_state=u'active',
+                    resources=ResourceLimits(cpu_shares=512))
+        fake_gear = FakeGearClient(units={unit.name: unit})
+        api = Deployer(create_volume_service(self), gear_client=fake_gear,
+                       network=make_memory_network())
+        application = Application(
+            name=u'mysql-hybridcluster',
+            image=DockerImage(repository=u'clusterhq/mysql'),
+            resources=ResourceLimits(cpu_shares=512))
+        desired = Deployment(nodes=frozenset([
+            Node(hostname=u'node.example.com',
+                 applications=frozenset([application]))]))
+        d = api.calculate_necessary_state_changes(
+            desired_state=desired, current_cluster_state=EMPTY,
+            hostname=u'node.example.com')
+        self.assertEqual(set(), self.successResultOf(d).applications_to_limit)
+
     def test_proxy_needs_creating(self):
         """
         ``Deployer.calculate_necessary_state_changes`` returns a
@@ -567,6 +768,248 @@ class DeployerCalculateNecessaryStateChangesTests(SynchronousTestCase):
         self.assertEqual(expected, self.successResultOf(d))
 
 
+class DeploymentSlicesTests(SynchronousTestCase):
+    """
+    Tests for ``deployment_slices``.
+    """
+    def setUp(self):
+        self.volume = AttachedVolume(name=u'mysql-hybridcluster',
+                                     mountpoint=FilePath(b"/var/lib/mysql"))
+        self.mysql = Application(
+            name=u'mysql-hybridcluster',
+            image=DockerImage(repository=u'clusterhq/mysql'),
+            ports=frozenset([Port(internal_port=3306, external_port=3306)]),
+            volume=self.volume)
+        self.site = Application(
+            name=u'site-hybridcluster.com',
+            image=DockerImage(repository=u'clusterhq/site'),
+            ports=frozenset([Port(internal_port=80, external_port=8080)]))
+
+    def test_empty(self):
+        """
+        There are no slices for an empty deployment.
+        """
+        self.assertEqual({}, deployment_slices(EMPTY, EMPTY))
+
+    def test_applications(self):
+        """
+        Each node's slice contains the applications desired on that node.
+        """
+        desired = Deployment(nodes=frozenset([
+            Node(hostname=u'node1.example.com',
+                 applications=frozenset([self.mysql])),
+            Node(hostname=u'node2.example.com',
+                 applications=frozenset([self.site]))]))
+        slices = deployment_slices(desired, EMPTY)
+        self.assertEqual(
+            (frozenset([self.mysql]), frozenset([self.site])),
+            (slices[u'node1.example.com'].applications,
+             slices[u'node2.example.com'].applications))
+
+    def test_proxies(self):
+        """
+        Each node's slice contains proxies to the ports exposed by
+        applications on all other nodes.
+        """
+        desired = Deployment(nodes=frozenset([
+            Node(hostname=u'node1.example.com',
+                 applications=frozenset([self.mysql])),
+            Node(hostname=u'node2.example.com',
+                 applications=frozenset([self.site])),
+            Node(hostname=u'node3.example.com',
+                 applications=frozenset())]))
+        slices = deployment_slices(desired, EMPTY)
+        self.assertEqual(
+            (frozenset([Proxy(ip=u'node2.example.com', port=8080)]),
+             frozenset([Proxy(ip=u'node1.example.com', port=3306)]),
+             frozenset([Proxy(ip=u'node1.example.com', port=3306),
+                        Proxy(ip=u'node2.example.com', port=8080)])),
+            (slices[u'node1.example.com'].proxies,
+             slices[u'node2.example.com'].proxies,
+             slices[u'node3.example.com'].proxies))
+
+    def test_no_proxy_on_local_port(self):
+        """
+        A node has no proxy on a port exposed by one of its own applications,
+        even if an application on another node exposes the same port.
+        """
+        other_site = Application(
+            name=u'site-example.com',
+            image=DockerImage(repository=u'clusterhq/site'),
+            ports=frozenset([Port(internal_port=80, external_port=8080)]))
+        desired = Deployment(nodes=frozenset([
+            Node(hostname=u'node1.example.com',
+                 applications=frozenset([self.mysql, other_site])),
+            Node(hostname=u'node2.example.com',
+                 applications=frozenset([self.site]))]))
+        slices = deployment_slices(desired, EMPTY)
+        self.assertEqual(
+            (frozenset(),
+             frozenset([Proxy(ip=u'node1.example.com', port=3306)])),
+            (slices[u'node1.example.com'].proxies,
+             slices[u'node2.example.com'].proxies))
+
+    def test_moved_application_proxy(self):
+        """
+        When an application moves, the node it moves from gets a proxy to its
+        new node and the node it moves to has no proxy for it.
+        """
+        current = Deployment(nodes=frozenset([
+            Node(hostname=u'node1.example.com',
+                 applications=frozenset([self.site])),
+            Node(hostname=u'node2.example.com',
+                 applications=frozenset())]))
+        desired = Deployment(nodes=frozenset([
+            Node(hostname=u'node1.example.com',
+                 applications=frozenset()),
+            Node(hostname=u'node2.example.com',
+                 applications=frozenset([self.site]))]))
+        slices = deployment_slices(desired, current)
+        self.assertEqual(
+            (frozenset([Proxy(ip=u'node2.example.com', port=8080)]),
+             frozenset()),
+            (slices[u'node1.example.com'].proxies,
+             slices[u'node2.example.com'].proxies))
+
+    def test_volume_moves(self):
+        """
+        The slices of both the node an application with a volume is currently
+        running on and the node it is moving to contain a ``VolumeMove``.
+        Other nodes' slices do not.
+        """
+        desired = Deployment(nodes=frozenset([
+            Node(hostname=u'node2.example.com',
+                 applications=frozenset([self.mysql])),
+            Node(hostname=u'node3.example.com',
+                 applications=frozenset([self.site]))]))
+        current = Deployment(nodes=frozenset([
+            Node(hostname=u'node1.example.com',
+                 applications=frozenset([self.mysql, self.site]))]))
+        slices = deployment_slices(desired, current)
+        move = VolumeMove(volume=self.volume, source=u'node1.example.com',
+                          destination=u'node2.example.com')
+        self.assertEqual(
+            (frozenset([move]), frozenset([move]), frozenset()),
+            (slices[u'node1.example.com'].volume_moves,
+             slices[u'node2.example.com'].volume_moves,
+             slices[u'node3.example.com'].volume_moves))
+
+    def test_volume_not_moving(self):
+        """
+        No ``VolumeMove`` is included for an application with a volume which
+        stays on the same node.
+        """
+        desired = Deployment(nodes=frozenset([
+            Node(hostname=u'node1.example.com',
+                 applications=frozenset([self.mysql]))]))
+        slices = deployment_slices(desired, desired)
+        self.assertEqual(
+            frozenset(), slices[u'node1.example.com'].volume_moves)
+
+    def test_extra_hostnames(self):
+        """
+        Slices are created for any additional hostnames, with proxies to all
+        applications.
+        """
+        desired = Deployment(nodes=frozenset([
+            Node(hostname=u'node1.example.com',
+                 applications=frozenset([self.mysql]))]))
+        slices = deployment_slices(desired, EMPTY, [u'node2.example.com'])
+        self.assertEqual(
+            NodeSlice(hostname=u'node2.example.com',
+                      proxies=frozenset([
+                          Proxy(ip=u'node1.example.com', port=3306)])),
+            slices[u'node2.example.com'])
+
+
+class DeploymentSliceTests(SynchronousTestCase):
+    """
+    Tests for ``deployment_slice``.
+    """
+    def setUp(self):
+        self.volume = AttachedVolume(name=u'mysql-hybridcluster',
+                                     mountpoint=FilePath(b"/var/lib/mysql"))
+        self.mysql = Application(
+            name=u'mysql-hybridcluster',
+            image=DockerImage(repository=u'clusterhq/mysql'),
+            ports=frozenset([Port(internal_port=3306, external_port=3306)]),
+            volume=self.volume)
+        self.site = Application(
+            name=u'site-hybridcluster.com',
+            image=DockerImage(repository=u'clusterhq/site'),
+            ports=frozenset([Port(internal_port=80, external_port=8080)]))
+        self.other_site = Application(
+            name=u'site-example.com',
+            image=DockerImage(repository=u'clusterhq/site'),
+            ports=frozenset([Port(internal_port=80, external_port=8080)]))
+
+    def test_same_as_deployment_slices(self):
+        """
+        ``deployment_slice`` gives each node the slice ``deployment_slices``
+        gives it.
+        """
+        current = Deployment(nodes=frozenset([
+            Node(hostname=u'node1.example.com',
+                 applications=frozenset([self.mysql, self.site]))]))
+        desired = Deployment(nodes=frozenset([
+            Node(hostname=u'node1.example.com',
+                 applications=frozenset([self.site])),
+            Node(hostname=u'node2.example.com',
+                 applications=frozenset([self.mysql, self.other_site])),
+            Node(hostname=u'node3.example.com',
+                 applications=frozenset())]))
+        hostnames = [u'node1.example.com', u'node2.example.com',
+                     u'node3.example.com', u'node4.example.com']
+        slices = deployment_slices(desired, current, hostnames)
+        self.assertEqual(
+            [slices[hostname] for hostname in hostnames],
+            [deployment_slice(desired, current, hostname)
+             for hostname in hostnames])
+
+    def test_volume_not_moving(self):
+        """
+        No ``VolumeMove`` is included for an application with a volume which
+        stays on the same node.
+        """
+        desired = Deployment(nodes=frozenset([
+            Node(hostname=u'node1.example.com',
+                 applications=frozenset([self.mysql]))]))
+        self.assertEqual(
+            frozenset(),
+            deployment_slice(
+                desired, desired, u'node1.example.com').volume_moves)
+
+
+class DeployerCalculateSliceChangesTests(SynchronousTestCase):
+    """
+    Tests for ``Deployer.calculate_slice_changes``.
+    """
+    def test_changes(self):
+        """
+        ``Deployer.calculate_slice_changes`` returns a ``Deferred`` which
+        fires with a ``StateChanges`` starting the slice's applications which
+        are not running, stopping those which are not in the slice and
+        including the slice's proxies.
+        """
+        unit = Unit(name=u'site-example.com', activation_state=u'active')
+        fake_gear = FakeGearClient(units={unit.name: unit})
+        api = Deployer(create_volume_service(self), gear_client=fake_gear,
+                       network=make_memory_network())
+        application = Application(
+            name=u'mysql-hybridcluster',
+            image=DockerImage(repository=u'clusterhq/mysql'))
+        proxy = Proxy(ip=u'node2.example.com', port=8080)
+        d = api.calculate_slice_changes(NodeSlice(
+            hostname=u'node1.example.com',
+            applications=frozenset([application]),
+            proxies=frozenset([proxy])))
+        expected = StateChanges(
+            applications_to_start={application},
+            applications_to_stop={Application(name=u'site-example.com')},
+            proxies={proxy})
+        self.assertEqual(expected, self.successResultOf(d))
+
+
 class DeployerApplyChangesTests(SynchronousTestCase):
     """
     Tests for ``Deployer._apply_changes``.
@@ -647,6 +1090,41 @@ class DeployerApplyChangesTests(SynchronousTestCase):
             set(fake_network.enumerate_proxies())
         )
 
+    def test_unchanged_proxies_untouched(self):
+        """
+        Proxies which exist and are still required are neither deleted nor
+        recreated, even if the network reports their address as an
+        ``IPAddress``.
+        """
+        fake_network = make_memory_network()
+        fake_network.create_proxy_to(ip=IPAddress(u'192.0.2.101'), port=3306)
+        operations = []
+        original_delete = fake_network.delete_proxy
+        original_create = fake_network.create_proxy_to
+
+        def delete_proxy(proxy):
+            operations.append(('delete', proxy))
+            return original_delete(proxy)
+
+        def create_proxy_to(ip, port):
+            operations.append(('create', Proxy(ip=ip, port=port)))
+            return original_create(ip, port)
+        fake_network.delete_proxy = delete_proxy
+        fake_network.create_proxy_to = create_proxy_to
+
+        api = Deployer(
+            create_volume_service(self), gear_client=FakeGearClient(),
+            network=fake_network)
+        new_proxy = Proxy(ip=u'192.0.2.102', port=8080)
+        desired_changes = StateChanges(
+            applications_to_start=frozenset(),
+            applications_to_stop=frozenset(),
+            proxies=frozenset([Proxy(ip=u'192.0.2.101', port=3306),
+                               new_proxy])
+        )
+        self.successResultOf(api._apply_changes(desired_changes))
+        self.assertEqual([('create', new_proxy)], operations)
+
     def test_delete_proxy_errors_as_errbacks(self):
         """
         Exceptions raised in `delete_proxy` operations are reported as
@@ -695,6 +1173,36 @@ class DeployerApplyChangesTests(SynchronousTestCase):
             ZeroDivisionError
         )
 
+    def test_proxy_changes_in_one_transaction(self):
+        """
+        The proxy changes are all made in a single transaction, so if any of
+        them fails the proxies are left unchanged.
+        """
+        fake_network = make_memory_network()
+        existing = fake_network.create_proxy_to(ip=u'192.0.2.100', port=3306)
+        original_begin = fake_network.begin
+
+        def begin():
+            transaction = original_begin()
+            transaction.create_proxy_to(ip=u'192.0.2.200', port=1)
+            # Deleting a proxy which doesn't exist makes the commit fail:
+            transaction.delete_proxy(Proxy(ip=u'192.0.2.200', port=2))
+            return transaction
+        fake_network.begin = begin
+
+        api = Deployer(
+            create_volume_service(self), gear_client=FakeGearClient(),
+            network=fake_network)
+
+        desired_changes = StateChanges(
+            applications_to_start=frozenset(),
+            applications_to_stop=frozenset(),
+            proxies=frozenset([Proxy(ip=u'192.0.2.101', port=3306)])
+        )
+        d = api._apply_changes(desired_changes)
+        self.failureResultOf(d, FirstError)
+        self.assertEqual([existing], fake_network.enumerate_proxies())
+
     def test_restarts(self):
         """
         Applications listed in ``StateChanges.applications_to_restart`` are
@@ -724,6 +1232,343 @@ class DeployerApplyChangesTests(SynchronousTestCase):
                          set([Unit(name=u'mysql-hybridcluster',
                                    activation_state=u'active')]))
 
+    def test_restarts_with_units(self):
+        """
+        An application being restarted is removed from the units listed at
+        the start of the run once it is stopped, so that starting it again
+        doesn't fail with ``AlreadyExists``.
+        """
+        unit = Unit(name=u'mysql-hybridcluster', activation_state=u'failed')
+        fake_gear = FakeGearClient(units={unit.name: unit})
+        api = Deployer(
+            create_volume_service(self), gear_client=fake_gear,
+            network=make_memory_network())
+        application = Application(
+            name=u'mysql-hybridcluster',
+            image=DockerImage.from_string(u'clusterhq/flocker'),
+        )
+        units = {unit.name}
+        desired_changes = StateChanges(
+            applications_to_start=frozenset(),
+            applications_to_stop=frozenset(),
+            applications_to_restart=frozenset([application]))
+        self.successResultOf(api._apply_changes(desired_changes, units))
+        self.assertEqual(
+            (set(), u'active'),
+            (units, fake_gear._units[unit.name].activation_state))
+
+
+class ControlledGearClient(FakeGearClient):
+    """
+    A ``FakeGearClient`` whose ``add`` and ``remove`` operations only finish
+    when the test says so.
+
+    :ivar list operations: ``tuple``\ s of the name of the method, the unit
+        name and the ``Deferred`` which finishes the operation, for each
+        operation started so far.
+    """
+    def __init__(self, units=None):
+        FakeGearClient.__init__(self, units)
+        self.operations = []
+
+    def _controlled(self, method, unit_name, operation):
+        d = Deferred()
+        self.operations.append((method, unit_name, d))
+        d.addCallback(lambda _: operation())
+        return d
+
+    def add(self, unit_name, *args, **kwargs):
+        return self._controlled(
+            'add', unit_name,
+            lambda: FakeGearClient.add(self, unit_name, *args, **kwargs))
+
+    def remove(self, unit_name):
+        return self._controlled(
+            'remove', unit_name,
+            lambda: FakeGearClient.remove(self, unit_name))
+
+    def started(self):
+        """
+        :return: ``list`` of the method name and unit name of the operations
+            started so far.
+        """
+        return [(method, name) for method, name, d in self.operations]
+
+    def finish(self, unit_name):
+        """
+        Finish the operation on the given unit.
+        """
+        for method, name, d in self.operations:
+            if name == unit_name and not d.called:
+                d.callback(None)
+                return
+        raise KeyError(unit_name)
+
+
+class DeployerSchedulingTests(SynchronousTestCase):
+    """
+    Tests for the scheduling of application starts and stops by
+    ``Deployer._apply_changes``.
+    """
+    def setUp(self):
+        self.gear = ControlledGearClient(units={
+            name: Unit(name=name, activation_state=u'active')
+            for name in [u'old1', u'old2', u'old3']})
+        self.deployer = Deployer(
+            create_volume_service(self), gear_client=self.gear,
+            network=make_memory_network(), max_concurrent_operations=2)
+
+    def changes(self, start=(), stop=()):
+        """
+        :param start: ``Application``\ s to start.
+        :param stop: Names of the applications to stop.
+
+        :return: ``StateChanges`` starting and stopping those applications.
+        """
+        return StateChanges(
+            applications_to_start=frozenset(start),
+            applications_to_stop=frozenset(
+                Application(name=name) for name in stop))
+
+    def test_default_limit(self):
+        """
+        ``Deployer`` limits the operations to
+        ``DEFAULT_MAX_CONCURRENT_OPERATIONS`` by default.
+        """
+        self.assertEqual(
+            DEFAULT_MAX_CONCURRENT_OPERATIONS,
+            Deployer(create_volume_service(self))._operations.limit)
+
+    def test_limit(self):
+        """
+        No more than the maximum number of operations run at once; the others
+        start as running operations finish.
+        """
+        d = self.deployer._apply_changes(
+            self.changes(stop=[u'old1', u'old2', u'old3']))
+        started = len(self.gear.started())
+        first = self.gear.started()[0][1]
+        self.gear.finish(first)
+        self.assertEqual((2, 3), (started, len(self.gear.started())))
+        for method, name in self.gear.started():
+            if name != first:
+                self.gear.finish(name)
+        self.successResultOf(d)
+
+    def test_start_with_ports_after_stops(self):
+        """
+        Applications exposing ports are started only once the applications
+        being stopped are stopped, since those may be using the same ports.
+        """
+        application = Application(
+            name=u'new', image=DockerImage.from_string(u'busybox'),
+            ports=frozenset([Port(internal_port=80, external_port=8080)]))
+        d = self.deployer._apply_changes(
+            self.changes(start=[application], stop=[u'old1']))
+        before = self.gear.started()
+        self.gear.finish(u'old1')
+        self.gear.finish(u'new')
+        self.successResultOf(d)
+        self.assertEqual(
+            ([('remove', u'old1')],
+             [('remove', u'old1'), ('add', u'new')]),
+            (before, self.gear.started()))
+
+    def test_start_without_ports_concurrent(self):
+        """
+        Applications which expose no ports are started without waiting for
+        the stops.
+        """
+        application = Application(
+            name=u'new', image=DockerImage.from_string(u'busybox'))
+        self.deployer._apply_changes(
+            self.changes(start=[application], stop=[u'old1']))
+        self.assertEqual(
+            {('remove', u'old1'), ('add', u'new')}, set(self.gear.started()))
+
+    def test_logged(self):
+        """
+        Each start and stop is logged as an action, which includes its
+        timing.
+        """
+        def validate(case, logger):
+            assertHasAction(case, logger, STOP_APPLICATION, succeeded=True,
+                            startFields={u"application": u"old1"})
+            assertHasAction(case, logger, START_APPLICATION, succeeded=True,
+                            startFields={u"application": u"new"})
+
+        @validateLogging(validate)
+        def run(case, logger):
+            self.patch(self.deployer, "logger", logger)
+            application = Application(
+                name=u'new', image=DockerImage.from_string(u'busybox'))
+            self.deployer._apply_changes(
+                self.changes(start=[application], stop=[u'old1']))
+            self.gear.finish(u'old1')
+            self.gear.finish(u'new')
+        run(self)
+
+
+class PullingGearClient(FakeGearClient):
+    """
+    A ``FakeGearClient`` whose ``pull`` operations only finish when the test
+    says so.
+
+    :ivar list pulls: ``tuple``\ s of the image name and the ``Deferred``
+        which finishes the pull, for each pull started so far.
+    """
+    def __init__(self, units=None):
+        FakeGearClient.__init__(self, units)
+        self.pulls = []
+
+    def pull(self, image_name):
+        FakeGearClient.pull(self, image_name)
+        d = Deferred()
+        self.pulls.append((image_name, d))
+        return d
+
+
+class DeployerPullImageTests(SynchronousTestCase):
+    """
+    Tests for ``Deployer.pull_image`` and its use when starting applications.
+    """
+    def setUp(self):
+        self.gear = PullingGearClient()
+        self.deployer = Deployer(
+            create_volume_service(self), gear_client=self.gear,
+            network=make_memory_network())
+        self.application = Application(
+            name=u'mysql-hybridcluster',
+            image=DockerImage.from_string(u'clusterhq/mysql:5.6'))
+
+    def test_pull(self):
+        """
+        ``Deployer.pull_image`` pulls the application's image with the gear
+        client and fires once it is pulled.
+        """
+        d = self.deployer.pull_image(self.application)
+        self.assertNoResult(d)
+        self.gear.pulls[0][1].callback(None)
+        self.assertEqual(
+            (None, [u'clusterhq/mysql:5.6']),
+            (self.successResultOf(d), self.gear.pulled))
+
+    def test_pulled_once(self):
+        """
+        An image is only pulled once, however many times it is asked for.
+        """
+        first = self.deployer.pull_image(self.application)
+        self.gear.pulls[0][1].callback(None)
+        second = self.deployer.pull_image(self.application)
+        self.assertEqual(
+            (None, None, [u'clusterhq/mysql:5.6']),
+            (self.successResultOf(first), self.successResultOf(second),
+             self.gear.pulled))
+
+    def test_failure_ignored(self):
+        """
+        If pulling fails ``Deployer.pull_image`` fires with ``None`` anyway,
+        and the next call for the image pulls it again.
+        """
+        d = self.deployer.pull_image(self.application)
+        self.gear.pulls[0][1].errback(RuntimeError())
+        self.successResultOf(d)
+        self.deployer.pull_image(self.application)
+        self.assertEqual(2, len(self.gear.pulled))
+
+    @validateLogging(assertHasAction, PULL_IMAGE, True,
+                     {u"image": u"clusterhq/mysql:5.6"})
+    def test_logged(self, logger):
+        """
+        Pulling an image is logged as an action.
+        """
+        self.patch(self.deployer, "logger", logger)
+        self.deployer.pull_image(self.application)
+        self.gear.pulls[0][1].callback(None)
+
+    def test_start_waits_for_pull(self):
+        """
+        An application is only started by ``Deployer._apply_changes`` once
+        its image has been pulled.
+        """
+        self.deployer._apply_changes(StateChanges(
+            applications_to_start={self.application},
+            applications_to_stop=set()))
+        added_before = set(self.gear._units)
+        self.gear.pulls[0][1].callback(None)
+        self.assertEqual((set(), {u'mysql-hybridcluster'}),
+                         (added_before, set(self.gear._units)))
+
+    def test_restart_pulled_during_stop(self):
+        """
+        ``Deployer._apply_changes`` pulls the image of an application being
+        restarted while it is being stopped, rather than after.
+        """
+        gear = ControlledGearClient()
+        deployer = Deployer(create_volume_service(self), gear_client=gear,
+                            network=make_memory_network())
+        deployer._apply_changes(StateChanges(
+            applications_to_start=set(),
+            applications_to_restart={self.application},
+            applications_to_stop=set()))
+        self.assertEqual(
+            ([('remove', self.application.name)], [u'clusterhq/mysql:5.6']),
+            (gear.started(), gear.pulled))
+
+    def test_pulls_before_proxies(self):
+        """
+        ``Deployer._apply_changes`` starts pulling the images of the
+        applications being started before changing the proxies.
+        """
+        pulled = []
+        network = make_memory_network()
+        begin = network.begin
+        self.patch(network, "begin",
+                   lambda: pulled.append(list(self.gear.pulled)) or begin())
+        self.deployer.network = network
+        self.deployer._apply_changes(StateChanges(
+            applications_to_start={self.application},
+            applications_to_stop=set()))
+        self.assertEqual([[u'clusterhq/mysql:5.6']], pulled)
+
+    def test_arriving_pulled_early(self):
+        """
+        ``Deployer.change_slice_state`` starts pulling the image of an
+        application whose volume is moving to the node before working out
+        which changes to make.
+        """
+        application = Application(
+            name=u'mysql-hybridcluster',
+            image=DockerImage.from_string(u'clusterhq/mysql:5.6'),
+            volume=AttachedVolume(name=u'mysql-hybridcluster',
+                                  mountpoint=FilePath(b'/var/lib/mysql')))
+        self.deployer.calculate_slice_changes = lambda node_slice: Deferred()
+        self.deployer.change_slice_state(NodeSlice(
+            hostname=u'node2.example.com',
+            applications=frozenset([application]),
+            volume_moves=frozenset([VolumeMove(
+                volume=application.volume, source=u'node1.example.com',
+                destination=u'node2.example.com')])))
+        self.assertEqual([u'clusterhq/mysql:5.6'], self.gear.pulled)
+
+    def test_departing_not_pulled(self):
+        """
+        ``Deployer.change_slice_state`` doesn't pull images early for volumes
+        moving away from the node.
+        """
+        application = Application(
+            name=u'mysql-hybridcluster',
+            image=DockerImage.from_string(u'clusterhq/mysql:5.6'),
+            volume=AttachedVolume(name=u'mysql-hybridcluster',
+                                  mountpoint=FilePath(b'/var/lib/mysql')))
+        self.deployer.calculate_slice_changes = lambda node_slice: Deferred()
+        self.deployer.change_slice_state(NodeSlice(
+            hostname=u'node1.example.com',
+            volume_moves=frozenset([VolumeMove(
+                volume=application.volume, source=u'node1.example.com',
+                destination=u'node2.example.com')])))
+        self.assertEqual([], self.gear.pulled)
+
 
 class DeployerChangeNodeStateTests(SynchronousTestCase):
     """
@@ -785,6 +1630,33 @@ class DeployerChangeNodeStateTests(SynchronousTestCase):
             NodeState(running=[expected_application], not_running=[]),
             self.successResultOf(d))
 
+    def test_resources_changed(self):
+        """
+        Changing the resource limits of a running application applies the
+        new limits to it without restarting it.
+        """
+        unit = Unit(name=u'mysql-hybridcluster', activation_state=u'active',
+                    resources=ResourceLimits(cpu_shares=512))
+        fake_gear = FakeGearClient(units={unit.name: unit})
+        fake_gear.remove = lambda unit_name: 1/0
+        api = Deployer(create_volume_service(self), gear_client=fake_gear,
+                       network=make_memory_network())
+        resources = ResourceLimits(cpu_shares=256, memory_limit=1024 ** 3)
+        application = Application(
+            name=u'mysql-hybridcluster',
+            image=DockerImage(repository=u'clusterhq/mysql'),
+            resources=resources)
+        desired = Deployment(nodes=frozenset([
+            Node(hostname=u'node.example.com',
+                 applications=frozenset([application]))]))
+        d = api.change_node_state(desired_state=desired,
+                                  current_cluster_state=EMPTY,
+                                  hostname=u'node.example.com')
+        d.addCallback(lambda _: api.discover_node_configuration())
+        self.assertEqual(
+            [resources],
+            [app.resources for app in self.successResultOf(d).running])
+
     def test_first_failure_pass_through(self):
         """
         The first failure in the operations performed by
@@ -866,14 +1738,14 @@ class DeployerChangeNodeStateTests(SynchronousTestCase):
 
         real_start_application = api.start_application
 
-        def fake_start(application):
+        def fake_start(application, existing_units=None):
             """
             Return a failure for attempts to start application1
             """
             if application.name == application1.name:
                 return fail(Exception('First start failure.'))
             else:
-                return real_start_application(application)
+                return real_start_application(application, existing_units)
 
         self.patch(api, 'start_application', fake_start)
 
@@ -886,21 +1758,192 @@ class DeployerChangeNodeStateTests(SynchronousTestCase):
 
     def test_arguments(self):
         """
-        The passed in arguments passed on in turn to
-        ``calculate_necessary_state_changes``.
+        The changes are worked out from this node's slice of the passed in
+        configurations.
         """
-        desired = object()
-        state = object()
-        host = object()
+        host = u'node.example.com'
+        application = Application(
+            name=u'mysql-hybridcluster',
+            image=DockerImage(repository=u'clusterhq/mysql'))
+        desired = Deployment(nodes=frozenset([
+            Node(hostname=host, applications=frozenset([application]))]))
         api = Deployer(create_volume_service(self),
                        gear_client=FakeGearClient(),
                        network=make_memory_network())
         arguments = []
 
-        def calculate(desired_state, current_cluster_state, hostname):
-            arguments.extend([desired_state, current_cluster_state, hostname])
-            return succeed(StateChanges(applications_to_start=[],
-                                        applications_to_stop=[]))
-        api.calculate_necessary_state_changes = calculate
-        api.change_node_state(desired, state, host)
-        self.assertEqual(arguments, [desired, state, host])
+        def find_differences(node_slice, current_node_state):
+            arguments.append(node_slice)
+            return StateChanges(applications_to_start=[],
+                                applications_to_stop=[])
+        api._find_differences = find_differences
+        api.change_node_state(desired, EMPTY, host)
+        self.assertEqual(
+            arguments, [deployment_slice(desired, EMPTY, host)])
+
+    def test_units_listed_once(self):
+        """
+        Whether the applications being started already exist is checked
+        against the units listed at the start of the run, rather than by
+        asking gear again.
+        """
+        fake_gear = FakeGearClient()
+        fake_gear.exists = lambda unit_name: 1/0
+        api = Deployer(create_volume_service(self), gear_client=fake_gear,
+                       network=make_memory_network())
+        application = Application(
+            name=u'mysql-hybridcluster',
+            image=DockerImage(repository=u'clusterhq/mysql'))
+        desired = Deployment(nodes=frozenset([
+            Node(hostname=u'node.example.com',
+                 applications=frozenset([application]))]))
+        self.successResultOf(api.change_node_state(
+            desired, EMPTY, u'node.example.com'))
+        self.assertIn(application.name, fake_gear._units)
+
+    def test_units_listed_per_run(self):
+        """
+        Each run lists the units afresh, so a unit removed since an earlier
+        run is started again.
+        """
+        fake_gear = FakeGearClient()
+        api = Deployer(create_volume_service(self), gear_client=fake_gear,
+                       network=make_memory_network())
+        application = Application(
+            name=u'mysql-hybridcluster',
+            image=DockerImage(repository=u'clusterhq/mysql'))
+        desired = Deployment(nodes=frozenset([
+            Node(hostname=u'node.example.com',
+                 applications=frozenset([application]))]))
+        self.successResultOf(api.change_node_state(
+            desired, EMPTY, u'node.example.com'))
+        fake_gear.remove(application.name)
+        self.successResultOf(api.change_node_state(
+            desired, EMPTY, u'node.example.com'))
+        self.assertIn(application.name, fake_gear._units)
+
+
+class ActivatingGearClient(FakeGearClient):
+    """
+    A ``FakeGearClient`` whose units are activating until they are told to
+    become active.
+    """
+    def add(self, unit_name, *args, **kwargs):
+        d = FakeGearClient.add(self, unit_name, *args, **kwargs)
+        self._set_state(unit_name, u'activating')
+        return d
+
+    def activate(self, unit_name):
+        """
+        Make a unit active.
+
+        :param unicode unit_name: The name of the unit.
+        """
+        self._set_state(unit_name, u'active')
+
+    def _set_state(self, unit_name, activation_state):
+        unit = self._units[unit_name]
+        self._units[unit_name] = Unit(
+            name=unit.name, container_image=unit.container_image,
+            ports=unit.ports, links=unit.links, resources=unit.resources,
+            activation_state=activation_state)
+        self._changed(unit_name)
+
+
+class DeployerChangeSliceStateTests(SynchronousTestCase):
+    """
+    Tests for ``Deployer.change_slice_state``.
+    """
+    def test_applications_started(self):
+        """
+        ``Deployer.change_slice_state`` starts the applications in the slice
+        which are not running.
+        """
+        fake_gear = FakeGearClient(units={})
+        api = Deployer(create_volume_service(self), gear_client=fake_gear,
+                       network=make_memory_network())
+        application = Application(
+            name=u'mysql-hybridcluster',
+            image=DockerImage(repository=u'clusterhq/mysql'))
+        d = api.change_slice_state(NodeSlice(
+            hostname=u'node1.example.com',
+            applications=frozenset([application])))
+        self.successResultOf(d)
+        self.assertIn(application.name, fake_gear._units)
+
+    def test_arguments(self):
+        """
+        The changes are worked out from the passed in slice.
+        """
+        node_slice = NodeSlice(hostname=u'node1.example.com')
+        api = Deployer(create_volume_service(self),
+                       gear_client=FakeGearClient(),
+                       network=make_memory_network())
+        arguments = []
+
+        def find_differences(node_slice, current_node_state):
+            arguments.append(node_slice)
+            return StateChanges(applications_to_start=[],
+                                applications_to_stop=[])
+        api._find_differences = find_differences
+        api.change_slice_state(node_slice)
+        self.assertEqual(arguments, [node_slice])
+
+    def test_units_watched(self):
+        """
+        ``Deployer.change_slice_state`` follows the units through a watch
+        while it runs rather than listing them, and stops watching when it is
+        done.
+        """
+        fake_gear = FakeGearClient()
+        fake_gear.list = lambda: 1/0
+        api = Deployer(create_volume_service(self), gear_client=fake_gear,
+                       network=make_memory_network())
+        application = Application(
+            name=u'mysql-hybridcluster',
+            image=DockerImage(repository=u'clusterhq/mysql'))
+        self.successResultOf(api.change_slice_state(NodeSlice(
+            hostname=u'node1.example.com',
+            applications=frozenset([application]))))
+        self.assertEqual(([], None), (fake_gear._watchers, api._units))
+
+    def test_waits_until_active(self):
+        """
+        ``Deployer.change_slice_state`` only finishes once the units of the
+        started applications are active.
+        """
+        fake_gear = ActivatingGearClient()
+        api = Deployer(create_volume_service(self), gear_client=fake_gear,
+                       network=make_memory_network(), reactor=Clock())
+        application = Application(
+            name=u'mysql-hybridcluster',
+            image=DockerImage(repository=u'clusterhq/mysql'))
+        d = api.change_slice_state(NodeSlice(
+            hostname=u'node1.example.com',
+            applications=frozenset([application])))
+        self.assertNoResult(d)
+        fake_gear.activate(application.name)
+        self.successResultOf(d)
+
+    def test_start_timeout(self):
+        """
+        ``Deployer.change_slice_state`` fails with ``StartTimeout`` if the
+        unit of a started application doesn't become active within the start
+        timeout.
+        """
+        clock = Clock()
+        fake_gear = ActivatingGearClient()
+        api = Deployer(create_volume_service(self), gear_client=fake_gear,
+                       network=make_memory_network(), reactor=clock)
+        application = Application(
+            name=u'mysql-hybridcluster',
+            image=DockerImage(repository=u'clusterhq/mysql'))
+        d = api.change_slice_state(NodeSlice(
+            hostname=u'node1.example.com',
+            applications=frozenset([application])))
+        clock.advance(DEFAULT_START_TIMEOUT)
+        failure = self.failureResultOf(d, FirstError)
+        self.assertEqual(
+            (StartTimeout, [], []),
+            (failure.value.subFailure.type, fake_gear._watchers,
+             clock.getDelayedCalls()))
@@ -2,12 +2,28 @@
 
 """Tests for :module:`flocker.node.gear`."""
 
+import json
+
 from zope.interface.verify import verifyObject
 
+from eliot.testing import validateLogging
+
+from twisted.internet.defer import Deferred, fail, succeed
+from twisted.internet.task import Clock
+from twisted.python.failure import Failure
+from twisted.python.filepath import FilePath
+from twisted.web.client import ResponseDone
+from twisted.test.proto_helpers import MemoryReactor
 from twisted.trial.unittest import TestCase
 
 from ...testtools import random_name, make_with_init_tests
-from ..gear import IGearClient, FakeGearClient, AlreadyExists, PortMap, Unit
+from ...volume import DockerClient
+from .._model import ResourceLimits
+from .test_cgroup import make_cgroups
+from .. import gear
+from ..gear import (
+    IGearClient, GearClient, FakeGearClient, AlreadyExists, GearError,
+    PortMap, Unit)
 
 
 def make_igearclient_tests(fixture):
@@ -50,6 +66,29 @@ def make_igearclient_tests(fixture):
             d.addCallback(lambda exc: self.assertEqual(exc.args[0], name))
             return d
 
+        def test_set_resources_missing(self):
+            """
+            Limiting the resources of a unit which doesn't exist results in
+            an error.
+            """
+            client = fixture(self)
+            d = client.set_resources(
+                random_name(), ResourceLimits(cpu_shares=512))
+            return self.assertFailure(d, GearError)
+
+        def test_add_existing(self):
+            """
+            Adding a unit named in the given existing units results in an
+            error, without the unit being added.
+            """
+            client = fixture(self)
+            name = random_name()
+            d = client.add(name, u"busybox", existing={name})
+            d = self.assertFailure(d, AlreadyExists)
+            d.addCallback(lambda _: client.exists(name))
+            d.addCallback(self.assertFalse)
+            return d
+
         def test_remove_nonexistent_is_ok(self):
             """Removing a non-existent unit does not result in a error."""
             client = fixture(self)
@@ -132,6 +171,88 @@ def make_igearclient_tests(fixture):
             d.addCallback(got_list)
             return d
 
+        def watch_for(self, client, name, removed=False):
+            """
+            Watch the units of a client until a unit changes.
+
+            :param IGearClient client: The client to watch.
+            :param unicode name: The name of the unit.
+            :param bool removed: Whether to wait for the unit to be removed
+                rather than to be reported.
+
+            :return: A ``Deferred`` that fires with the reported ``Unit`` or
+                ``None``.
+            """
+            changed = Deferred()
+
+            def receive(unit_name, unit):
+                if (unit_name == name and (unit is None) == removed and
+                        not changed.called):
+                    changed.callback(unit)
+            watching = client.watch(receive)
+            watching.addCallback(
+                lambda watch: self.addCleanup(watch.stop))
+            return watching.addCallback(lambda _: changed)
+
+        def test_pull(self):
+            """
+            ``pull`` makes an image available, after which a unit using it
+            can be added.
+            """
+            client = fixture(self)
+            name = random_name()
+            d = client.pull(u"busybox")
+            d.addCallback(lambda _: client.add(name, u"busybox"))
+            d.addCallback(lambda _: self.addCleanup(client.remove, name))
+            return d
+
+        def test_watch_existing(self):
+            """
+            ``watch`` reports the units which exist already.
+            """
+            client = fixture(self)
+            name = random_name()
+            d = client.add(name, u"busybox")
+
+            def added(_):
+                self.addCleanup(client.remove, name)
+                return self.watch_for(client, name)
+            d.addCallback(added)
+            d.addCallback(lambda unit: self.assertEqual(name, unit.name))
+            return d
+
+        def test_watch_added(self):
+            """
+            ``watch`` reports units added after watching started.
+            """
+            client = fixture(self)
+            name = random_name()
+            changed = self.watch_for(client, name)
+
+            def add(_):
+                self.addCleanup(client.remove, name)
+                client.add(name, u"busybox")
+                return changed
+            d = succeed(None).addCallback(add)
+            d.addCallback(lambda unit: self.assertEqual(name, unit.name))
+            return d
+
+        def test_watch_removed(self):
+            """
+            ``watch`` reports units which are removed with ``None``.
+            """
+            client = fixture(self)
+            name = random_name()
+            d = client.add(name, u"busybox")
+
+            def added(_):
+                changed = self.watch_for(client, name, removed=True)
+                client.remove(name)
+                return changed
+            d.addCallback(added)
+            d.addCallback(self.assertIs, None)
+            return d
+
     return IGearClientTests
 
 
@@ -159,6 +280,426 @@ class FakeGearClientImplementationTests(TestCase):
                               container_image=u'flocker/flocker:v1.0.0')}
         self.assertEqual(units, FakeGearClient(units=units)._units)
 
+    def test_set_resources(self):
+        """
+        ``FakeGearClient.list`` reports the limits applied with
+        ``FakeGearClient.set_resources``.
+        """
+        client = FakeGearClient()
+        client.add(u'foo', u'busybox')
+        client.set_resources(u'foo', ResourceLimits(cpu_shares=512))
+        self.assertEqual(
+            [ResourceLimits(cpu_shares=512)],
+            [unit.resources for unit in self.successResultOf(client.list())])
+
+
+class GearClientPoolTests(TestCase):
+    """
+    Tests for the connections used by ``GearClient``.
+    """
+    def test_pool_configured(self):
+        """
+        ``GearClient`` keeps up to the given number of idle connections open
+        for the given time.
+        """
+        client = GearClient(u"127.0.0.1", reactor=MemoryReactor(),
+                            max_connections=7, idle_timeout=30)
+        pool = client._pool
+        self.assertEqual((True, 7, 30),
+                         (pool.persistent, pool.maxPersistentPerHost,
+                          pool.cachedConnectionTimeout))
+
+    def test_requests_share_pool(self):
+        """
+        All requests made by a ``GearClient`` use its connection pool.
+        """
+        pools = []
+
+        def request(method, url, **kwargs):
+            pools.append(kwargs["pool"])
+            return succeed(None)
+        self.patch(gear, "request", request)
+        client = GearClient(u"127.0.0.1", reactor=MemoryReactor())
+        client._request(b"GET", b"/containers")
+        client._container_request(b"PUT", u"unit", data={})
+        self.assertEqual([client._pool, client._pool], pools)
+
+    def test_close(self):
+        """
+        ``GearClient.close`` closes the idle connections of the pool.
+        """
+        client = GearClient(u"127.0.0.1", reactor=MemoryReactor())
+        closed = []
+        self.patch(client._pool, "closeCachedConnections",
+                   lambda: closed.append(True) or succeed(None))
+        client.close()
+        self.assertEqual([True], closed)
+
+    def test_close_docker(self):
+        """
+        ``GearClient.close`` closes the connections of its Docker client.
+        """
+        docker = DockerClient(MemoryReactor())
+        client = GearClient(u"127.0.0.1", reactor=MemoryReactor(),
+                            docker_client=docker)
+        closed = []
+        self.patch(docker, "close",
+                   lambda: closed.append(True) or succeed(None))
+        client.close()
+        self.assertEqual([True], closed)
+
+    def test_local_docker(self):
+        """
+        A ``GearClient`` for gear on this host talks to this host's Docker
+        daemon by default.
+        """
+        client = GearClient(u"127.0.0.1", reactor=MemoryReactor())
+        self.assertIsInstance(client._docker, DockerClient)
+
+    def test_remote_no_docker(self):
+        """
+        A ``GearClient`` for gear on another host has no Docker client by
+        default, rather than one talking to this host's Docker daemon.
+        """
+        client = GearClient(u"192.0.2.1", reactor=MemoryReactor())
+        self.assertIs(None, client._docker)
+
+    def test_remote_pull(self):
+        """
+        Without a Docker client ``GearClient.pull`` does nothing, leaving the
+        image for gear to pull when the unit is added.
+        """
+        client = GearClient(u"192.0.2.1", reactor=MemoryReactor())
+        self.assertIs(
+            None, self.successResultOf(client.pull(u"busybox:latest")))
+
+    def test_remote_close(self):
+        """
+        ``GearClient.close`` works without a Docker client.
+        """
+        client = GearClient(u"192.0.2.1", reactor=MemoryReactor())
+        self.patch(client._pool, "closeCachedConnections",
+                   lambda: succeed(None))
+        self.successResultOf(client.close())
+
+    def test_pull(self):
+        """
+        ``GearClient.pull`` makes sure the image is available using its Docker
+        client.
+        """
+        docker = DockerClient(MemoryReactor())
+        ensured = []
+        self.patch(docker, "ensure_image",
+                   lambda image: ensured.append(image) or succeed(None))
+        client = GearClient(u"127.0.0.1", reactor=MemoryReactor(),
+                            docker_client=docker)
+        client.pull(u"busybox:latest")
+        self.assertEqual([b"busybox:latest"], ensured)
+
+
+class FakeResponse(object):
+    """
+    Just enough of an ``IResponse`` for ``treq.content``.
+    """
+    def __init__(self, code, body=b""):
+        self.code = code
+        self.length = len(body)
+        self._body = body
+
+    def deliverBody(self, protocol):
+        protocol.dataReceived(self._body)
+        protocol.connectionLost(Failure(ResponseDone()))
+
+
+class GearClientResourceLimitsTests(TestCase):
+    """
+    Tests for the resource limits applied by ``GearClient.set_resources``
+    and reported by ``GearClient.list``.
+    """
+    def setUp(self):
+        self.requests = []
+        self.patch(gear, "request", self.request)
+        self.cgroup_root = FilePath(self.mktemp())
+        make_cgroups(self.cgroup_root, b"abc")
+        self.docker = DockerClient(MemoryReactor())
+        self.container = {u"Id": u"abc", u"State": {u"Running": True}}
+        self.patch(self.docker, "inspect_container",
+                   lambda name: succeed(self.container))
+        self.patch(self.docker, "list_containers",
+                   lambda: succeed({b"unit": b"abc"}))
+        self.client = GearClient(
+            u"127.0.0.1", reactor=Clock(), docker_client=self.docker,
+            cgroup_root=self.cgroup_root)
+
+    def request(self, method, url, data=None, **kwargs):
+        """
+        Respond to a request like a gear daemon listing the units ``unit``
+        and ``other`` but reporting any other unit it is asked about as
+        missing.
+        """
+        self.requests.append((method, url.split(b"/", 3)[3]))
+        if url.endswith(b"/containers?all=1"):
+            return succeed(FakeResponse(200, json.dumps({u"Containers": [
+                {u"Id": name, u"ActiveState": u"active",
+                 u"SubState": u"running"}
+                for name in [u"unit", u"other"]]})))
+        if url.endswith(b"/status"):
+            return succeed(FakeResponse(404))
+        return succeed(FakeResponse(204))
+
+    def cpu_shares(self):
+        """
+        :return: The ``bytes`` CPU shares of the container's control group.
+        """
+        return self.cgroup_root.descendant(
+            [b"cpu", b"docker", b"abc", b"cpu.shares"]).getContent()
+
+    def test_limits(self):
+        """
+        ``GearClient.set_resources`` applies the limits to the control groups
+        of the unit's container, rather than sending them to gear.
+        """
+        self.successResultOf(self.client.set_resources(
+            u"unit", ResourceLimits(cpu_shares=512)))
+        self.assertEqual((b"512", []), (self.cpu_shares(), self.requests))
+
+    def test_remove_limits(self):
+        """
+        ``GearClient.set_resources`` removes the limits of a unit given
+        ``None``.
+        """
+        self.client.set_resources(u"unit", ResourceLimits(cpu_shares=512))
+        self.successResultOf(self.client.set_resources(u"unit", None))
+        self.assertEqual(b"1024", self.cpu_shares())
+
+    def test_not_running(self):
+        """
+        ``GearClient.set_resources`` fails with ``GearError`` if the unit's
+        container isn't running.
+        """
+        self.container = None
+        self.failureResultOf(
+            self.client.set_resources(
+                u"unit", ResourceLimits(cpu_shares=512)),
+            GearError)
+
+    def test_add_no_wait(self):
+        """
+        ``GearClient.add`` doesn't wait for the unit's container.
+        """
+        self.container = None
+        self.successResultOf(self.client.add(u"unit", u"busybox"))
+
+    def test_remote_limits(self):
+        """
+        ``GearClient.set_resources`` fails with ``ValueError`` if gear is on
+        another host.
+        """
+        client = GearClient(u"192.0.2.1", reactor=Clock())
+        self.failureResultOf(
+            client.set_resources(u"unit", ResourceLimits(cpu_shares=512)),
+            ValueError)
+
+    def test_list(self):
+        """
+        ``GearClient.list`` reports the limits applied to the control groups
+        of the units' containers.
+        """
+        self.client.set_resources(u"unit", ResourceLimits(cpu_shares=512))
+        self.assertEqual(
+            {u"unit": ResourceLimits(cpu_shares=512), u"other": None},
+            dict((unit.name, unit.resources) for unit
+                 in self.successResultOf(self.client.list())))
+
+    @validateLogging(None)
+    def test_list_docker_unreachable(self, logger):
+        """
+        ``GearClient.list`` still lists the units if Docker can't be reached,
+        logging the failure and reporting their limits as unknown.
+        """
+        self.patch(self.client, "logger", logger)
+        self.patch(self.docker, "list_containers",
+                   lambda: fail(GearError()))
+        units = self.successResultOf(self.client.list())
+        self.assertEqual(
+            (1, {u"unit": None, u"other": None}),
+            (len(logger.flushTracebacks(GearError)),
+             dict((unit.name, unit.resources) for unit in units)))
+
+    def test_list_stopped(self):
+        """
+        ``GearClient.list`` reports the limits of a unit whose container
+        stopped after being listed as unknown.
+        """
+        self.patch(self.docker, "list_containers",
+                   lambda: succeed({b"unit": b"def"}))
+        self.assertEqual(
+            [None, None],
+            [unit.resources for unit
+             in self.successResultOf(self.client.list())])
+
+    def test_list_remote(self):
+        """
+        ``GearClient.list`` reports the limits of units on another host as
+        unknown.
+        """
+        client = GearClient(u"192.0.2.1", reactor=Clock())
+        self.assertEqual(
+            [None, None],
+            [unit.resources for unit
+             in self.successResultOf(client.list())])
+
+
+class GearClientExistsTests(TestCase):
+    """
+    Tests for how ``GearClient`` checks whether units exist.
+    """
+    def setUp(self):
+        self.requests = []
+        self.units = [u"one"]
+        self.patch(gear, "request", self.request)
+        self.client = GearClient(u"127.0.0.1", reactor=MemoryReactor())
+
+    def request(self, method, url, **kwargs):
+        """
+        Respond to a request like a gear daemon with ``self.units``.
+        """
+        self.requests.append((method, url.split(b"/", 3)[3]))
+        if url.endswith(b"/containers?all=1"):
+            return succeed(FakeResponse(200, json.dumps({u"Containers": [
+                {u"Id": name, u"ActiveState": u"active",
+                 u"SubState": u"running"} for name in self.units]})))
+        if url.endswith(b"/status"):
+            name = url.split(b"/")[-2].decode("ascii")
+            return succeed(FakeResponse(200 if name in self.units else 404))
+        return succeed(FakeResponse(204))
+
+    def test_exists_one_unit(self):
+        """
+        ``GearClient.exists`` asks about the one unit rather than listing
+        all of them.
+        """
+        results = []
+        for name in [u"one", u"two"]:
+            self.client.exists(name).addCallback(results.append)
+        self.assertEqual(
+            ([True, False],
+             [(b"GET", b"container/one/status"),
+              (b"GET", b"container/two/status")]),
+            (results, self.requests))
+
+    def test_exists_error(self):
+        """
+        ``GearClient.exists`` fails with ``GearError`` if gear responds with
+        an error other than the unit not being found.
+        """
+        self.patch(gear, "request",
+                   lambda method, url, **kwargs: succeed(FakeResponse(500)))
+        self.failureResultOf(self.client.exists(u"one"), GearError)
+
+    def test_exists_after_list(self):
+        """
+        ``GearClient.exists`` asks gear even after the units were listed, so
+        it never answers from an old listing.
+        """
+        self.client.list()
+        self.units = [u"two"]
+        del self.requests[:]
+        self.assertEqual(
+            ((False, True),
+             [(b"GET", b"container/one/status"),
+              (b"GET", b"container/two/status")]),
+            ((self.successResultOf(self.client.exists(u"one")),
+              self.successResultOf(self.client.exists(u"two"))),
+             self.requests))
+
+    def test_add_existing(self):
+        """
+        ``GearClient.add`` given the names of the existing units checks
+        against them rather than asking gear.
+        """
+        self.client.add(u"two", u"busybox", existing={u"one"})
+        self.assertEqual([(b"PUT", b"container/two")], self.requests)
+
+    def test_add_existing_already(self):
+        """
+        ``GearClient.add`` fails with ``AlreadyExists`` without any requests
+        if the unit is one of the existing units it is given.
+        """
+        self.failureResultOf(
+            self.client.add(u"one", u"busybox", existing={u"one"}),
+            AlreadyExists)
+        self.assertEqual([], self.requests)
+
+
+class PollingWatchTests(TestCase):
+    """
+    Tests for ``_PollingWatch``, which ``GearClient.watch`` uses.
+    """
+    def setUp(self):
+        self.client = FakeGearClient()
+        self.client.add(u"one", u"busybox")
+        self.clock = Clock()
+        self.changes = []
+        self.watch = gear._PollingWatch(
+            self.client, lambda name, unit: self.changes.append((name, unit)),
+            self.clock, 1)
+
+    def test_existing(self):
+        """
+        The existing units are reported by the time watching has started.
+        """
+        self.successResultOf(self.watch.start())
+        self.assertEqual(
+            [(u"one", Unit(name=u"one", activation_state=u"active"))],
+            self.changes)
+
+    def test_changes(self):
+        """
+        The units added and removed are reported at the next listing.
+        """
+        self.watch.start()
+        del self.changes[:]
+        self.client.add(u"two", u"busybox")
+        self.client.remove(u"one")
+        self.clock.advance(1)
+        self.assertEqual(
+            [(u"one", None),
+             (u"two", Unit(name=u"two", activation_state=u"active"))],
+            self.changes)
+
+    def test_unchanged(self):
+        """
+        Units which haven't changed aren't reported again.
+        """
+        self.watch.start()
+        del self.changes[:]
+        self.clock.advance(1)
+        self.assertEqual([], self.changes)
+
+    def test_stop(self):
+        """
+        After ``stop`` the units are no longer listed.
+        """
+        self.watch.start()
+        self.watch.stop()
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+    @validateLogging(None)
+    def test_errors_logged(self, logger):
+        """
+        A failed listing is logged and polling carries on.
+        """
+        self.patch(self.watch, "logger", logger)
+        self.watch.start()
+        self.patch(self.client, "list",
+                   lambda: fail(GearError(500, b"")))
+        self.clock.advance(1)
+        self.assertEqual(
+            (1, 1),
+            (len(logger.flushTracebacks(GearError)),
+             len(self.clock.getDelayedCalls())))
+
 
 class PortMapInitTests(
         make_with_init_tests(
@@ -241,12 +782,13 @@ class UnitTests(TestCase):
     def test_repr(self):
         """
         ``Unit.__repr__`` shows the name, activation_state, container_image,
-        ports and links.
+        ports, links and resources.
         """
         self.assertEqual(
             "<Unit(name=u'site-example.com', "
             "activation_state=u'active', sub_state=u'running', "
-            "container_image=u'flocker/flocker:v1.0.0', ports=[], links=[])>",
+            "container_image=u'flocker/flocker:v1.0.0', ports=[], links=[], "
+            "resources=None)>",
             repr(Unit(name=u'site-example.com',
                       activation_state=u'active', sub_state=u'running',
                       container_image=u'flocker/flocker:v1.0.0',
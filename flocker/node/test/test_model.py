@@ -6,7 +6,9 @@ Tests for ``flocker.node._model``.
 from twisted.trial.unittest import SynchronousTestCase
 
 from ...testtools import make_with_init_tests
-from .._model import Application, DockerImage, Node, Deployment, StateChanges
+from .._model import (
+    Application, DockerImage, Node, Deployment, StateChanges, AttachedVolume,
+    VolumeMove, NodeSlice, ResourceLimits)
 from ...route import Proxy
 
 
@@ -82,19 +84,32 @@ class ApplicationInitTests(make_with_init_tests(
     """
 
 
+class ResourceLimitsInitTests(make_with_init_tests(
+    record_type=ResourceLimits,
+    kwargs=dict(cpu_shares=512, memory_limit=1024 ** 3, cpuset=u'0-3',
+                blkio_weight=500),
+    expected_defaults=dict(cpu_shares=None, memory_limit=None, cpuset=None,
+                           blkio_weight=None)
+)):
+    """
+    Tests for ``ResourceLimits.__init__``.
+    """
+
+
 class ApplicationTests(SynchronousTestCase):
     """
     Other tests for ``Application``.
     """
     def test_repr(self):
         """
-        ``Application.__repr__`` includes the name and image and ports.
+        ``Application.__repr__`` includes the name, image, ports, volume and
+        resource limits.
         """
         application = Application(name=u'site-example.com', image=None,
                                   ports=None)
         self.assertEqual(
             "<Application(name=u'site-example.com', image=None, ports=None, "
-            "volume=None)>",
+            "volume=None, resources=None)>",
             repr(application)
         )
 
@@ -139,3 +154,36 @@ class StateChangesInitTests(make_with_init_tests(
     """
     Tests for ``StateChanges.__init__``.
     """
+
+
+class VolumeMoveInitTests(make_with_init_tests(
+        record_type=VolumeMove,
+        kwargs=dict(
+            volume=AttachedVolume(name=u'mysql-clusterhq', mountpoint=None),
+            source=u'node1.example.com',
+            destination=u'node2.example.com')
+)):
+    """
+    Tests for ``VolumeMove.__init__``.
+    """
+
+
+class NodeSliceInitTests(make_with_init_tests(
+        record_type=NodeSlice,
+        kwargs=dict(
+            hostname=u'node1.example.com',
+            applications=frozenset([
+                Application(name=u'mysql-clusterhq', image=object())]),
+            proxies=frozenset([Proxy(ip=u'node2.example.com', port=3306)]),
+            volume_moves=frozenset([VolumeMove(
+                volume=AttachedVolume(name=u'site-clusterhq.com',
+                                      mountpoint=None),
+                source=u'node1.example.com',
+                destination=u'node2.example.com')])
+        ),
+        expected_defaults=dict(applications=frozenset(), proxies=frozenset(),
+                               volume_moves=frozenset())
+)):
+    """
+    Tests for ``NodeSlice.__init__``.
+    """
@@ -6,18 +6,26 @@ Tests for :module:`flocker.node.script`.
 
 from StringIO import StringIO
 
+from twisted.internet.defer import succeed, fail
 from twisted.trial.unittest import SynchronousTestCase
+from twisted.python.filepath import FilePath
 from twisted.python.usage import UsageError
 
 from yaml import safe_dump, safe_load
-from ...testtools import FlockerScriptTestsMixin, StandardOptionsTestsMixin
+from ...testtools import (
+    FlockerScriptTestsMixin, StandardOptionsTestsMixin, FakeSysModule)
 from ..script import (
     ChangeStateOptions, ChangeStateScript,
-    ReportStateScript, ReportStateOptions)
+    ReportStateScript, ReportStateOptions, _installed_key_fingerprint,
+    _applied_hash, _record_applied, _state_generation)
 from ..gear import FakeGearClient, Unit
-from .._deploy import Deployer
-from .._model import Application, Deployment, DockerImage, Node, AttachedVolume
+from .._deploy import Deployer, NodeState
+from .._model import Application, DockerImage, NodeSlice, ResourceLimits
+from .._config import node_slice_to_configuration, configuration_hash
+from ...route import Proxy, make_memory_network
 from ...testtools import create_volume_service
+from ...common.test.test_ssh import PUBLIC_KEY
+from ...common import ssh_key_fingerprint, encode_documents
 
 
 class ChangeStateScriptTests(FlockerScriptTestsMixin, SynchronousTestCase):
@@ -49,39 +57,111 @@ class ChangeStateScriptMainTests(SynchronousTestCase):
         script = ChangeStateScript(lambda: service)
         self.assertIs(script._deployer._volume_service, service)
 
-    def test_main_calls_deployer_change_node_state(self):
+    def test_main_calls_deployer_change_slice_state(self):
         """
-        ``ChangeStateScript.main`` calls ``Deployer.change_node_state`` with
-        the ``Deployment`` and `hostname` supplied on the command line.
+        ``ChangeStateScript.main`` calls ``Deployer.change_slice_state`` with
+        the ``NodeSlice`` supplied on standard input.
         """
-        script = ChangeStateScript(lambda: None)
+        script = ChangeStateScript(lambda: None,
+                                   flocker_path=FilePath(self.mktemp()))
 
-        change_node_state_calls = []
+        change_slice_state_calls = []
 
-        def spy_change_node_state(desired_state, current_cluster_state,
-                                  hostname):
+        def spy_change_slice_state(node_slice):
             """
-            A stand in for ``Deployer.change_node_state`` which records calls
+            A stand in for ``Deployer.change_slice_state`` which records calls
             made to it.
             """
-            change_node_state_calls.append((desired_state,
-                                            current_cluster_state, hostname))
+            change_slice_state_calls.append(node_slice)
+            return succeed(None)
 
         self.patch(
-            script._deployer, 'change_node_state', spy_change_node_state)
-
-        expected_deployment = object()
-        expected_current = object()
-        expected_hostname = b'node1.example.com'
-        options = dict(deployment=expected_deployment,
-                       current=expected_current,
-                       hostname=expected_hostname)
+            script._deployer, 'change_slice_state', spy_change_slice_state)
+        self.patch(
+            script._deployer, 'discover_node_configuration',
+            lambda: succeed(NodeState(running=[], not_running=[])))
+        script._deployer.network = make_memory_network()
+
+        expected_slice = NodeSlice(hostname=u'node1.example.com')
+        options = dict(slice=expected_slice, hostname=b'node1.example.com',
+                       slice_hash=u'abc')
         script.main(reactor=object(), options=options)
 
+        self.assertEqual([expected_slice], change_slice_state_calls)
+
+    def test_main_records_applied(self):
+        """
+        ``ChangeStateScript.main`` records the hash of the slice once it has
+        been applied successfully and the node is found to be in its state.
+        """
+        flocker_path = FilePath(self.mktemp())
+        script = ChangeStateScript(lambda: None, flocker_path=flocker_path)
+        application = Application(name=u'site-example.com',
+                                  resources=ResourceLimits(cpu_shares=512))
+        self.patch(script._deployer, 'change_slice_state',
+                   lambda node_slice: succeed(None))
+        self.patch(script._deployer, 'discover_node_configuration',
+                   lambda: succeed(NodeState(running=[application],
+                                             not_running=[])))
+        script._deployer.network = make_memory_network()
+        node_slice = NodeSlice(hostname=u'node1.example.com',
+                               applications=frozenset([application]))
+        self.successResultOf(script.main(
+            reactor=object(),
+            options=dict(slice=node_slice, hostname=node_slice.hostname,
+                         slice_hash=u'abc')))
         self.assertEqual(
-            [(expected_deployment, expected_current, expected_hostname)],
-            change_node_state_calls
-        )
+            u'abc',
+            _applied_hash(flocker_path,
+                          NodeState(running=[application], not_running=[]),
+                          make_memory_network()))
+
+    def test_main_not_reached(self):
+        """
+        ``ChangeStateScript.main`` doesn't record the hash of the slice if the
+        node isn't found to be in its state once it has been applied, e.g.
+        because resource limits weren't applied.
+        """
+        flocker_path = FilePath(self.mktemp())
+        script = ChangeStateScript(lambda: None, flocker_path=flocker_path)
+        application = Application(name=u'site-example.com',
+                                  resources=ResourceLimits(cpu_shares=512))
+        self.patch(script._deployer, 'change_slice_state',
+                   lambda node_slice: succeed(None))
+        self.patch(script._deployer, 'discover_node_configuration',
+                   lambda: succeed(NodeState(
+                       running=[Application(name=application.name)],
+                       not_running=[])))
+        script._deployer.network = make_memory_network()
+        node_slice = NodeSlice(hostname=u'node1.example.com',
+                               applications=frozenset([application]))
+        self.successResultOf(script.main(
+            reactor=object(),
+            options=dict(slice=node_slice, hostname=node_slice.hostname,
+                         slice_hash=u'abc')))
+        self.assertFalse(
+            flocker_path.child(b"applied_slice.json").exists())
+
+    def test_main_failure_forgets_applied(self):
+        """
+        If the slice cannot be applied, no hash is recorded, not even the one
+        recorded by a previous run.
+        """
+        flocker_path = FilePath(self.mktemp())
+        node_slice = NodeSlice(hostname=u'node1.example.com')
+        _record_applied(flocker_path, u'abc', node_slice)
+        script = ChangeStateScript(lambda: None, flocker_path=flocker_path)
+        self.patch(script._deployer, 'change_slice_state',
+                   lambda node_slice: fail(RuntimeError()))
+        self.failureResultOf(script.main(
+            reactor=object(),
+            options=dict(slice=node_slice, hostname=node_slice.hostname,
+                         slice_hash=u'def')), RuntimeError)
+        self.assertIs(
+            None,
+            _applied_hash(flocker_path,
+                          NodeState(running=[], not_running=[]),
+                          make_memory_network()))
 
 
 class ChangeStateOptionsTests(StandardOptionsTestsMixin, SynchronousTestCase):
@@ -90,213 +170,123 @@ class ChangeStateOptionsTests(StandardOptionsTestsMixin, SynchronousTestCase):
     """
     options = ChangeStateOptions
 
-    def test_custom_configs(self):
+    def options_with_stdin(self, documents):
+        """
+        Create a ``ChangeStateOptions`` which reads the given documents from
+        standard input.
+
+        :param documents: A ``list`` of ``bytes``, the documents to encode
+            with ``encode_documents``.
+        """
+        return self.options(
+            sys_module=FakeSysModule(stdin=encode_documents(documents)))
+
+    def test_slice(self):
         """
-        The supplied application and deployment configuration strings are
-        parsed as a :class:`Deployment` on the options instance.
+        The supplied node slice configuration is parsed as a
+        :class:`NodeSlice` on the options instance.
         """
         application = Application(
             name=u'mysql-hybridcluster',
             image=DockerImage(repository=u'hybridlogic/mysql5.9',
                               tag=u'latest'))
+        node_slice = NodeSlice(
+            hostname=u'node1.example.com',
+            applications=frozenset([application]),
+            proxies=frozenset([Proxy(ip=u'node2.example.com', port=80)]))
+        options = self.options_with_stdin(
+            [safe_dump(node_slice_to_configuration(node_slice))])
+        options.parseOptions([])
 
-        node = Node(hostname='node1.example.com',
-                    applications=frozenset([application]))
-        options = self.options()
-        deployment_config = {"nodes": {node.hostname: [application.name]},
-                             "version": 1}
-
-        application_config = dict(
-            version=1,
-            applications={
-                application.name: {'image': 'hybridlogic/mysql5.9:latest'}
-            }
-        )
-
-        current_config = {'node2.example.com': {
-            'applications': {
-                'mysql-something': {
-                    'image': 'unknown',
-                    'volume': {'mountpoint': None},
-                }
-            },
-            'version': 1
-        }}
-
-        options.parseOptions(
-            [safe_dump(deployment_config),
-             safe_dump(application_config),
-             safe_dump(current_config),
-             b'node1.example.com'])
+        self.assertEqual(node_slice, options['slice'])
 
+    def test_slice_hash_key(self):
+        """
+        The ``configuration_hash`` of the supplied node slice configuration
+        is assigned to a `slice_hash` key.
+        """
+        configuration = safe_dump(node_slice_to_configuration(
+            NodeSlice(hostname=u'node1.example.com')))
+        options = self.options_with_stdin([configuration])
+        options.parseOptions([])
         self.assertEqual(
-            Deployment(nodes=frozenset([node])), options['deployment'])
+            configuration_hash(configuration), options['slice_hash'])
 
-    def test_current_configuration(self):
+    def test_hostname_key(self):
         """
-        The supplied current cluster configuration strings is parsed as a
-        :class:`Deployment` on the options instance.
+        The hostname of the supplied node slice is assigned to a `hostname`
+        key.
         """
-        options = self.options()
-        deployment_config = {"nodes": {},
-                             "version": 1}
-
-        application_config = dict(
-            version=1,
-            applications={},
-        )
-
-        current_config = {'node2.example.com': {
-            'applications': {
-                'mysql-something': {
-                    'image': 'unknown',
-                    'volume': {'mountpoint': None},
-                }
-            },
-            'version': 1
-        }}
-
-        expected_current_config = Deployment(nodes=frozenset([
-            Node(hostname='node2.example.com', applications=frozenset([
-                Application(
-                    name='mysql-something',
-                    image=DockerImage.from_string('unknown'),
-                    ports=frozenset(),
-                    volume=AttachedVolume(
-                        name='mysql-something',
-                        mountpoint=None,
-                    )
-                ),
-            ]))]))
-
-        options.parseOptions(
-            [safe_dump(deployment_config),
-             safe_dump(application_config),
-             safe_dump(current_config),
-             b'node1.example.com'])
-
-        self.assertEqual(expected_current_config, options['current'])
+        expected_hostname = u'foobar.example.com'
+        options = self.options_with_stdin(
+            [safe_dump(node_slice_to_configuration(
+                NodeSlice(hostname=expected_hostname)))])
+        options.parseOptions([])
+        self.assertEqual(expected_hostname, options['hostname'])
 
     def test_configuration_error(self):
         """
-        If the supplied configuration strings are valid `YAML` but are not
-        valid, a ``UsageError`` is raised with a string representation of the
-        error.
+        If the supplied configuration string is valid `YAML` but is not valid,
+        a ``UsageError`` is raised with a string representation of the error.
         """
-        options = self.options()
-        application = Application(
-            name=u'mysql-hybridcluster',
-            image=DockerImage(
-                repository=u'hybridlogic/mysql5.9', tag=u'latest'),
-        )
-
-        node = Node(hostname='node1.example.com',
-                    applications=frozenset([application]))
-        options = self.options()
-        deployment_config = {"nodes": {node.hostname: [application.name]},
-                             "version": 1}
-
+        options = self.options_with_stdin([safe_dump({u"version": 1})])
         exception = self.assertRaises(
-            UsageError,
-            options.parseOptions,
-            [safe_dump(deployment_config), safe_dump({}), safe_dump({}),
-             b'node1.example.com']
-        )
+            UsageError, options.parseOptions, [])
 
         self.assertEqual(
             str(exception),
             ("Configuration Error: "
-             "Application configuration has an error. Missing "
-             "'applications' key.")
+             "Node configuration has an error. Missing 'hostname' key.")
         )
 
-    def test_invalid_deployment_yaml(self):
+    def test_invalid_yaml(self):
         """
-        If the supplied deployment_config is not valid `YAML`, a ``UsageError``
-        is raised.
+        If the supplied configuration is not valid `YAML`, a ``UsageError`` is
+        raised.
         """
-        options = self.options()
-        deployment_bad_yaml = "{'foo':'bar', 'x':y, '':'"
-        e = self.assertRaises(
-            UsageError, options.parseOptions,
-            [deployment_bad_yaml, b'', b'{}', b'node1.example.com'])
+        options = self.options_with_stdin(["{'foo':'bar', 'x':y, '':'"])
+        e = self.assertRaises(UsageError, options.parseOptions, [])
 
         # See https://github.com/ClusterHQ/flocker/issues/282 for more complete
         # testing of this string.
         self.assertTrue(
-            str(e).startswith('Deployment config could not be parsed as YAML')
+            str(e).startswith('Node config could not be parsed as YAML')
         )
 
-    def test_invalid_application_yaml(self):
+    def test_invalid_stdin(self):
         """
-        If the supplied application_config is not valid `YAML`, a
-        ``UsageError`` is raised.
+        A ``UsageError`` is raised if standard input does not contain
+        documents encoded with ``encode_documents``.
         """
-        options = self.options()
-        application_bad_yaml = "{'foo':'bar', 'x':y, '':'"
-        e = self.assertRaises(
-            UsageError, options.parseOptions,
-            [b'', application_bad_yaml, b'{}', b'node1.example.com'])
-
-        # See https://github.com/ClusterHQ/flocker/issues/282 for more complete
-        # testing of this string.
+        options = self.options(sys_module=FakeSysModule(
+            stdin=b'{version: 1}'))
+        e = self.assertRaises(UsageError, options.parseOptions, [])
         self.assertTrue(
-            str(e).startswith('Application config could not be parsed as YAML')
+            str(e).startswith(
+                'Configuration could not be read from standard input')
         )
 
-    def test_invalid_current_yaml(self):
+    def test_wrong_number_of_documents(self):
         """
-        If the supplied current config is not valid `YAML`, a
-        ``UsageError`` is raised.
+        A ``UsageError`` is raised if standard input does not contain exactly
+        one document.
         """
-        options = self.options()
-        bad_yaml = "{'foo':'bar', 'x':y, '':'"
-        e = self.assertRaises(
-            UsageError, options.parseOptions,
-            [b'', b'', bad_yaml, b'node1.example.com'])
-
-        # See https://github.com/ClusterHQ/flocker/issues/282 for more complete
-        # testing of this string.
+        options = self.options_with_stdin([b'{version: 1}', b'{}'])
+        e = self.assertRaises(UsageError, options.parseOptions, [])
         self.assertTrue(
-            str(e).startswith('Current config could not be parsed as YAML')
+            str(e).startswith(
+                'Configuration could not be read from standard input')
         )
 
-    def test_hostname_key(self):
+    def test_arguments_rejected(self):
         """
-        The supplied hostname is assigned to a `hostname` key.
+        A ``UsageError`` is raised if any arguments are given.
         """
-        expected_hostname = u'foobar.example.com'
-        options = self.options()
-        options.parseOptions(
-            [b'{nodes: {}, version: 1}',
-             b'{applications: {}, version: 1}',
-             b'{}',
-             expected_hostname.encode('ascii')])
-        self.assertEqual(
-            (expected_hostname, unicode),
-            (options['hostname'], type(options['hostname']))
-        )
-
-    def test_nonascii_hostname(self):
-        """
-        A ``UsageError`` is raised if the supplied hostname is not ASCII
-        encoded.
-        """
-        hostname = u'\xa3'.encode('utf8')
-        options = self.options()
-        e = self.assertRaises(
-            UsageError,
-            options.parseOptions,
-            [b'{nodes: {}, version: 1}',
-             b'{applications: {}, version: 1}',
-             b'{}',
-             hostname]
-        )
-
-        self.assertEqual(
-            "Non-ASCII hostname: {hostname}".format(hostname=hostname),
-            str(e)
-        )
+        options = self.options_with_stdin(
+            [safe_dump(node_slice_to_configuration(
+                NodeSlice(hostname=u'node1.example.com')))])
+        self.assertRaises(
+            UsageError, options.parseOptions, [b'node1.example.com'])
 
 
 class ReportStateOptionsTests(StandardOptionsTestsMixin, SynchronousTestCase):
@@ -313,6 +303,22 @@ class ReportStateOptionsTests(StandardOptionsTestsMixin, SynchronousTestCase):
         options = self.options()
         options.parseOptions([])
 
+    def test_known_generation(self):
+        """
+        ``--known-generation`` is parsed as an integer.
+        """
+        options = self.options()
+        options.parseOptions([b'--known-generation', b'123'])
+        self.assertEqual(123, options['known-generation'])
+
+    def test_known_generation_default(self):
+        """
+        ``known-generation`` defaults to ``None``.
+        """
+        options = self.options()
+        options.parseOptions([])
+        self.assertIs(None, options['known-generation'])
+
     def test_wrong_number_options(self):
         """
         If any additional arguments are supplied, a ``UsageError`` is raised.
@@ -346,6 +352,15 @@ class ReportStateScriptMainTests(SynchronousTestCase):
         script = ReportStateScript(lambda: None)
         self.assertIsInstance(script._deployer, Deployer)
 
+    def test_network(self):
+        """
+        ``ReportStateScript`` configures its ``Deployer`` with the given
+        network, through which the applied slice is checked.
+        """
+        network = make_memory_network()
+        script = ReportStateScript(lambda: None, network=network)
+        self.assertIs(network, script._deployer.network)
+
     def test_yaml_callback(self):
         """
         ``ReportStateScript.main`` returns a deferred which writes out the
@@ -363,16 +378,270 @@ class ReportStateScriptMainTests(SynchronousTestCase):
                 'site-example.net': {'image': 'unknown', 'ports': []},
                 'site-example.com': {'image': 'unknown', 'ports': []}
             },
-            'version': 1
+            'version': 1,
+            'ssh_key': None,
+            'applied': None,
         }
 
         script = ReportStateScript(lambda: create_volume_service(self),
-                                   fake_gear)
+                                   fake_gear,
+                                   flocker_path=FilePath(self.mktemp()))
         content = StringIO()
 
         def content_capture(data):
             content.write(data)
             content.seek(0)
         self.patch(script, '_print_yaml', content_capture)
-        script.main(reactor=object(), options=[])
-        self.assertEqual(safe_load(content.read()), expected)
+        script.main(reactor=object(), options={})
+        result = safe_load(content.read())
+        generation = result.pop('generation')
+        self.assertEqual((result, int), (expected, type(generation)))
+
+    def run_report(self, script, known_generation=None):
+        """
+        Run ``ReportStateScript.main`` and capture its output.
+
+        :return: The parsed YAML output.
+        """
+        content = StringIO()
+        self.patch(script, '_print_yaml', content.write)
+        script.main(reactor=object(),
+                    options={'known-generation': known_generation})
+        return safe_load(content.getvalue())
+
+    def test_known_generation_unchanged(self):
+        """
+        If the state has not changed since the generation passed as
+        ``known-generation``, only the generation is reported.
+        """
+        script = ReportStateScript(lambda: create_volume_service(self),
+                                   FakeGearClient(),
+                                   flocker_path=FilePath(self.mktemp()))
+        generation = self.run_report(script)['generation']
+        self.assertEqual({'generation': generation, 'unchanged': True},
+                         self.run_report(script, generation))
+
+    def test_known_generation_changed(self):
+        """
+        If the state has changed since the generation passed as
+        ``known-generation``, the full state is reported with a later
+        generation.
+        """
+        fake_gear = FakeGearClient()
+        script = ReportStateScript(lambda: create_volume_service(self),
+                                   fake_gear,
+                                   flocker_path=FilePath(self.mktemp()))
+        generation = self.run_report(script)['generation']
+        unit = Unit(name=u'site-example.com', activation_state=u'active')
+        fake_gear._units[unit.name] = unit
+        report = self.run_report(script, generation)
+        self.assertEqual(
+            (generation + 1, [u'site-example.com']),
+            (report['generation'], list(report['applications'])))
+
+
+class InstalledKeyFingerprintTests(SynchronousTestCase):
+    """
+    Tests for ``_installed_key_fingerprint``.
+    """
+    def setUp(self):
+        self.flocker_path = FilePath(self.mktemp())
+        self.flocker_path.makedirs()
+        self.authorized_keys = FilePath(self.mktemp())
+
+    def test_installed(self):
+        """
+        If the Flocker public key exists and is authorized, its fingerprint is
+        returned.
+        """
+        self.flocker_path.child(b"id_rsa_flocker.pub").setContent(PUBLIC_KEY)
+        self.authorized_keys.setContent(
+            b"ssh-rsa AAAAB3Nz1234567890 other\n"
+            b"\n# flocker-deploy access\n" + PUBLIC_KEY + b"\n")
+        self.assertEqual(
+            ssh_key_fingerprint(PUBLIC_KEY).decode("ascii"),
+            _installed_key_fingerprint(
+                self.flocker_path, self.authorized_keys))
+
+    def test_not_authorized(self):
+        """
+        If the Flocker public key is not in the authorized keys file, ``None``
+        is returned.
+        """
+        self.flocker_path.child(b"id_rsa_flocker.pub").setContent(PUBLIC_KEY)
+        self.authorized_keys.setContent(b"ssh-rsa AAAAB3Nz1234567890 other\n")
+        self.assertIs(
+            None,
+            _installed_key_fingerprint(
+                self.flocker_path, self.authorized_keys))
+
+    def test_no_key(self):
+        """
+        If there is no Flocker public key, ``None`` is returned.
+        """
+        self.authorized_keys.setContent(PUBLIC_KEY + b"\n")
+        self.assertIs(
+            None,
+            _installed_key_fingerprint(
+                self.flocker_path, self.authorized_keys))
+
+    def test_no_authorized_keys(self):
+        """
+        If there is no authorized keys file, ``None`` is returned.
+        """
+        self.flocker_path.child(b"id_rsa_flocker.pub").setContent(PUBLIC_KEY)
+        self.assertIs(
+            None,
+            _installed_key_fingerprint(
+                self.flocker_path, self.authorized_keys))
+
+
+class AppliedHashTests(SynchronousTestCase):
+    """
+    Tests for ``_applied_hash``.
+    """
+    def setUp(self):
+        self.flocker_path = FilePath(self.mktemp())
+        self.application = Application(name=u'site-example.com')
+        self.proxy = Proxy(ip=u'192.0.2.1', port=80)
+        _record_applied(
+            self.flocker_path, u'abc',
+            NodeSlice(hostname=u'node1.example.com',
+                      applications=frozenset([self.application]),
+                      proxies=frozenset([self.proxy])))
+        self.network = make_memory_network()
+        self.network.create_proxy_to(self.proxy.ip, self.proxy.port)
+
+    def test_unchanged(self):
+        """
+        The recorded hash is returned if the recorded applications are
+        running and the proxies are in place.
+        """
+        state = NodeState(running=[self.application], not_running=[])
+        self.assertEqual(
+            u'abc', _applied_hash(self.flocker_path, state, self.network))
+
+    def test_no_record(self):
+        """
+        ``None`` is returned if no slice has been recorded.
+        """
+        state = NodeState(running=[self.application], not_running=[])
+        self.assertIs(
+            None, _applied_hash(FilePath(self.mktemp()), state, self.network))
+
+    def test_corrupt_record(self):
+        """
+        ``None`` is returned if the record cannot be parsed.
+        """
+        self.flocker_path.child(b"applied_slice.json").setContent(b"{")
+        state = NodeState(running=[self.application], not_running=[])
+        self.assertIs(
+            None, _applied_hash(self.flocker_path, state, self.network))
+
+    def test_different_applications(self):
+        """
+        ``None`` is returned if different applications are running.
+        """
+        state = NodeState(
+            running=[Application(name=u'site-example.net')], not_running=[])
+        self.assertIs(
+            None, _applied_hash(self.flocker_path, state, self.network))
+
+    def test_different_resources(self):
+        """
+        ``None`` is returned if an application's resource limits differ from
+        the recorded ones, e.g. because they were lost when its container was
+        recreated.
+        """
+        _record_applied(
+            self.flocker_path, u'abc',
+            NodeSlice(hostname=u'node1.example.com',
+                      applications=frozenset([Application(
+                          name=self.application.name,
+                          resources=ResourceLimits(cpu_shares=512))]),
+                      proxies=frozenset([self.proxy])))
+        state = NodeState(running=[self.application], not_running=[])
+        self.assertIs(
+            None, _applied_hash(self.flocker_path, state, self.network))
+
+    def test_same_resources(self):
+        """
+        The recorded hash is returned if the applications have the recorded
+        resource limits.
+        """
+        application = Application(
+            name=self.application.name,
+            resources=ResourceLimits(cpu_shares=512, cpuset=u'0-3'))
+        _record_applied(
+            self.flocker_path, u'abc',
+            NodeSlice(hostname=u'node1.example.com',
+                      applications=frozenset([application]),
+                      proxies=frozenset([self.proxy])))
+        state = NodeState(running=[application], not_running=[])
+        self.assertEqual(
+            u'abc', _applied_hash(self.flocker_path, state, self.network))
+
+    def test_not_running(self):
+        """
+        ``None`` is returned if any application is not running.
+        """
+        state = NodeState(running=[],
+                          not_running=[self.application])
+        self.assertIs(
+            None, _applied_hash(self.flocker_path, state, self.network))
+
+    def test_proxies_missing(self):
+        """
+        ``None`` is returned if the proxies have gone away.
+        """
+        state = NodeState(running=[self.application], not_running=[])
+        self.assertIs(
+            None,
+            _applied_hash(self.flocker_path, state, make_memory_network()))
+
+
+class StateGenerationTests(SynchronousTestCase):
+    """
+    Tests for ``_state_generation``.
+    """
+    def setUp(self):
+        self.flocker_path = FilePath(self.mktemp())
+        self.report = {u"version": 1, u"applications": {}}
+
+    def test_initial(self):
+        """
+        Without a record the generation is the current time in milliseconds.
+        """
+        self.assertEqual(
+            1234567,
+            _state_generation(self.flocker_path, self.report,
+                              now=lambda: 1234.567))
+
+    def test_unchanged(self):
+        """
+        The generation stays the same while the report is unchanged.
+        """
+        generation = _state_generation(self.flocker_path, self.report)
+        self.assertEqual(
+            generation, _state_generation(self.flocker_path, self.report))
+
+    def test_changed(self):
+        """
+        The generation is incremented when the report changes.
+        """
+        generation = _state_generation(self.flocker_path, self.report)
+        self.report[u"ssh_key"] = u"aa:bb"
+        self.assertEqual(
+            generation + 1,
+            _state_generation(self.flocker_path, self.report))
+
+    def test_corrupt_record(self):
+        """
+        A corrupt record is replaced, starting again from the current time.
+        """
+        self.flocker_path.makedirs()
+        self.flocker_path.child(b"state_generation.json").setContent(b"[")
+        self.assertEqual(
+            5000,
+            _state_generation(self.flocker_path, self.report,
+                              now=lambda: 5))
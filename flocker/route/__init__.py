@@ -16,10 +16,14 @@ this allows easy, transparent migration of containers between any of the
 cooperating nodes.
 """
 
-__all__ = ["INetwork", "make_host_network", "make_memory_network", "Proxy"]
+__all__ = ["INetwork", "INetworkTransaction", "make_host_network",
+           "make_memory_network", "make_nftables_network",
+           "make_userspace_network", "Proxy"]
 
 
-from ._interfaces import INetwork
+from ._interfaces import INetwork, INetworkTransaction
 from ._iptables import make_host_network
 from ._memory import make_memory_network
+from ._nftables import make_nftables_network
+from ._userspace import make_userspace_network
 from ._model import Proxy
@@ -0,0 +1,48 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+# -*- test-case-name: flocker.route.test.test_conntrack -*-
+
+"""
+Clean up the connection tracking state of deleted proxies.
+
+The kernel decides how to NAT a connection when it starts and remembers the
+decision in its connection tracking table.  Deleting a proxy only affects new
+connections; packets belonging to connections which were proxied before keep
+being sent to the old destination until their tracking entries expire.
+"""
+
+from os import devnull
+from subprocess import check_call, CalledProcessError
+
+from ._logging import FORGET_CONNECTIONS
+
+
+def forget_connections(logger, proxies, call=check_call):
+    """
+    Delete the connection tracking entries of connections through some
+    proxies, so that their packets are no longer sent to the proxies' old
+    destinations.
+
+    Failures are ignored: ``conntrack`` exits with an error when there are no
+    entries to delete, it may not be installed and connection tracking
+    entries expire eventually anyway.
+
+    :param eliot.Logger logger: The logger to log the deletions to.
+    :param proxies: An iterable of deleted ``Proxy`` instances.
+    :param call: A callable like ``subprocess.check_call`` to use to run
+        ``conntrack``.
+    """
+    with open(devnull, "wb") as discard:
+        for proxy in proxies:
+            with FORGET_CONNECTIONS(logger=logger, target_ip=proxy.ip,
+                                    target_port=proxy.port):
+                try:
+                    call([
+                        b"conntrack", b"--delete", b"--proto", b"tcp",
+                        # Connections to the proxied port...
+                        b"--orig-port-dst",
+                        unicode(proxy.port).encode("ascii"),
+                        # ...which were rewritten to go to the destination.
+                        b"--reply-src", unicode(proxy.ip).encode("ascii"),
+                    ], stdout=discard, stderr=discard)
+                except (OSError, CalledProcessError):
+                    pass
@@ -46,3 +46,42 @@ class INetwork(Interface):
         :return: A :py:class:`list` of objects describing all configured
             proxies.
         """
+
+    def begin():
+        """
+        Start a transaction which creates and deletes a number of proxies at
+        once.
+
+        :return: An ``INetworkTransaction`` provider.
+        """
+
+
+class INetworkTransaction(Interface):
+    """
+    A batch of changes to the proxies of an ``INetwork``.  Nothing is changed
+    until the transaction is committed.
+    """
+    def create_proxy_to(ip, port):
+        """
+        Create a new TCP proxy to ``ip`` on port ``port`` when the transaction
+        is committed.
+
+        :see: :py:meth:`INetwork.create_proxy_to` for parameter documentation.
+
+        :return: An object representing the proxy which will be created.
+        """
+
+    def delete_proxy(proxy):
+        """
+        Delete an existing TCP proxy when the transaction is committed.
+
+        :see: :py:meth:`INetwork.delete_proxy` for parameter documentation.
+        """
+
+    def commit():
+        """
+        Apply all of the changes made in this transaction.
+
+        Either all of the changes are applied or, if an exception is raised,
+        none of them are.
+        """
@@ -8,202 +8,548 @@ Manipulate network routing behavior on a node using ``iptables``.
 from __future__ import unicode_literals
 
 import shlex
-from subprocess import check_call, check_output
+from subprocess import check_output, Popen, PIPE, CalledProcessError
 
 from zope.interface import implementer
 from ipaddr import IPAddress
 from characteristic import attributes
 from eliot import Logger
 
-from twisted.python.filepath import FilePath
-
-from ._logging import CREATE_PROXY_TO, DELETE_PROXY, IPTABLES
-from ._interfaces import INetwork
+from ._logging import (
+    CREATE_PROXY_TO, DELETE_PROXY, DELETE_ALL_PROXIES, IPTABLES_RESTORE)
+from ._interfaces import INetwork, INetworkTransaction
 from ._model import Proxy
-
+from ._sysctl import RoutingPrerequisites
+from ._conntrack import forget_connections
+
+# The chains in the NAT table holding the rules for every proxy, each with
+# the built-in chain which jumps to it.  Keeping the rules out of the
+# built-in chains means they can be listed without reading the rest of the
+# NAT table, all removed with one flush, and that unrelated traffic only
+# passes through a single jump rule.
+FLOCKER_CHAINS = [
+    (b"FLOCKER-PREROUTING", b"PREROUTING"),
+    (b"FLOCKER-POSTROUTING", b"POSTROUTING"),
+    (b"FLOCKER-OUTPUT", b"OUTPUT"),
+]
+
+# Every proxy is covered by exactly one rule in this chain, a DNAT rule
+# giving its destination and its port (along with the ports of other proxies
+# to the same destination).
+PROXY_CHAIN = FLOCKER_CHAINS[0][0]
+
+# The most ports the ``multiport`` match accepts in a single rule.
+MULTIPORT_LIMIT = 15
+
+# Before the Flocker chains were used, the rules of each proxy were appended
+# to the built-in chains, with the DNAT rule in PREROUTING marked by this
+# comment.
 FLOCKER_COMMENT_MARKER = b"flocker create_proxy_to"
 
 
-@attributes(["comment", "destination_port", "to_destination"])
+@attributes(["comment", "destination_ports", "to_destination"])
 class RuleOptions(object):
     """
     :ivar bytes comment: The value of the ``comment`` *match* for this rule.
 
-    :ivar int destination_port: The value of the ``destination-port`` option
-        for the ``tcp`` *match* for this rule.
+    :ivar tuple destination_ports: The ``int`` ports given by the
+        ``destination-port`` option of the ``tcp`` *match* or by the
+        ``destination-ports`` option of the ``multiport`` *match* for this
+        rule.
 
     :ivar IPv4Address to_destination: The value of the ``to-destination``
         option for the ``DNAT`` *target* for this rule.
     """
 
 
-def iptables(logger, argv):
+def _format_rule(argv):
     """
-    Run ``iptables`` with the given arguments.
+    Format a rule for ``iptables-restore``.
+
+    :param list argv: The ``iptables`` arguments describing the rule (without
+        the ``--table`` option).
 
-    :param list argv: A standard ``argv``-style argument list.  The path to
-        iptables is prepended to this list for execution.
+    :return: ``bytes`` holding a single line of ``iptables-restore`` input.
     """
-    with IPTABLES(logger=logger, argv=argv):
-        check_call([b"iptables"] + argv)
+    return b" ".join(
+        b'"' + arg + b'"' if b" " in arg else arg for arg in argv)
 
 
-def create_proxy_to(logger, ip, port):
+def iptables_restore(logger, rules, chains=()):
     """
-    :see: ``HostNetwork.create_proxy_to``
-    """
-    action = CREATE_PROXY_TO(
-        logger=logger, target_ip=ip, target_port=port)
+    Atomically change rules in the NAT table using ``iptables-restore``.
 
-    with action:
-        encoded_ip = unicode(ip).encode("ascii")
-        encoded_port = unicode(port).encode("ascii")
+    The existing rules are kept (``--noflush``); the new ones are applied in
+    a single kernel operation, so either all of them are applied or, if any
+    of them is invalid, none are.
 
+    :param list rules: ``list`` of ``iptables``-style argument lists, each
+        appending, inserting or deleting a single rule or flushing a chain in
+        the NAT table.
+    :param chains: An iterable of the names of chains which don't exist yet
+        and are created before the rules are changed.
+    """
+    payload = b"".join(
+        [b"*nat\n"] + [b":" + chain + b" - [0:0]\n" for chain in chains] +
+        [_format_rule(rule) + b"\n" for rule in rules] + [b"COMMIT\n"])
+    argv = [b"iptables-restore", b"--noflush"]
+    with IPTABLES_RESTORE(logger=logger, input=payload.decode("ascii")):
+        process = Popen(argv, stdin=PIPE)
+        process.communicate(payload)
+        if process.returncode:
+            raise CalledProcessError(process.returncode, argv)
+
+
+def _jump_rules():
+    """
+    Describe the rules directing traffic into the Flocker chains.
+
+    :return: A ``list`` of ``tuple``\ s of the name of a built-in NAT chain
+        and the arguments describing a rule in that chain.
+    """
+    return [
         # The first goal is to configure "Destination NAT" (DNAT).  We're just
-        # going to rewrite the destination address of traffic arriving on the
-        # specified port so it looks like it is destined for the specified ip
-        # instead of destined for "us".  This gets the packets delivered to the
-        # right destination.
-        iptables(logger, [
-            # All NAT stuff happens in the netfilter NAT table.
-            b"--table", b"nat",
-
-            # Destination NAT has to happen "pre"-routing so that the normal
-            # routing rules on the machine will use the re-written destination
-            # address and get the packet to that new destination.  Accomplish
-            # this by appending the rule to the PREROUTING chain.
-            b"--append", b"PREROUTING",
-
-            # Only re-route traffic with a destination port matching the one we
-            # were told to manipulate.  It is also necessary to specify TCP (or
-            # UDP) here since that is the layer of the network stack that
-            # defines ports.
-            b"--protocol", b"tcp", b"--destination-port", encoded_port,
+        # going to rewrite the destination address of traffic arriving on a
+        # proxied port so it looks like it is destined for the proxy's
+        # destination instead of destined for "us".  This gets the packets
+        # delivered to the right destination.
+        #
+        # Destination NAT has to happen "pre"-routing so that the normal
+        # routing rules on the machine will use the re-written destination
+        # address and get the packet to that new destination.  Accomplish
+        # this by jumping from the PREROUTING chain.
+        (b"PREROUTING", [
+            # Proxies are TCP only.  It is also necessary to specify TCP (or
+            # UDP) before the rules in the Flocker chain can match on ports.
+            b"--protocol", b"tcp",
 
             # And only re-route traffic directed at this host.  Traffic
             # originating on this host directed at some random other host that
             # happens to be on the same port should be left alone.
             b"--match", b"addrtype", b"--dst-type", b"LOCAL",
 
-            # Tag it as a flocker-created rule so we can recognize it later.
-            b"--match", b"comment", b"--comment", FLOCKER_COMMENT_MARKER,
-
-            # If the filter matched, jump to the DNAT chain to handle doing the
-            # actual packet mangling.  DNAT is a built-in chain that already
-            # knows how to do this.  Pass an argument to the DNAT chain so it
-            # knows how to mangle the packet - rewrite the destination IP of
-            # the address to the target we were told to use.
-            b"--jump", b"DNAT", b"--to-destination", encoded_ip,
-        ])
-
-        # Bonus round!  Having performed DNAT (changing the destination) during
-        # prerouting we are now prepared to send the packet on somewhere else.
-        # On its way out of this system it is also necessary to further
-        # modify and then track that packet.  We want it to look like it
-        # comes from us (the downstream client will be *very* confused if
-        # the node we're passing the packet on to replies *directly* to them;
-        # and by confused I mean it will be totally broken, of course) so we
-        # also need to "masquerade" in the postrouting chain.  This changes
-        # the source address (ip and port) of the packet to the address of
-        # the external interface the packet is exiting upon. Doing SNAT here
-        # would be a little bit more efficient because the kernel could avoid
-        # looking up the external interface's address for every single packet.
-        # But it requires this code to know that address and it requires that
-        # if it ever changes the rule gets updated and it may require some
-        # steps to do port allocation (not sure what they are yet).  So we'll
-        # just masquerade for now.
-        iptables(logger, [
-            # All NAT stuff happens in the netfilter NAT table.
-            b"--table", b"nat",
-
-            # As described above, this transformation happens after routing
-            # decisions have been made and the packet is on its way out of the
-            # system.  Therefore, append the rule to the POSTROUTING chain.
-            b"--append", b"POSTROUTING",
-
-            # We'll stick to matching the same kinds of packets we matched in
-            # the earlier stage.  We might want to change the factoring of this
-            # code to avoid the duplication - particularly in case we want to
-            # change the specifics of the filter.
-            #
-            # This omits the LOCAL addrtype check, though, because at this
-            # point the packet is definitely leaving this host.
-            b"--protocol", b"tcp", b"--destination-port", encoded_port,
-
-            # Do the masquerading.
-            b"--jump", b"MASQUERADE",
-        ])
-
-        # Secret level!!  Traffic that originates *on* the host bypasses the
-        # PREROUTING chain.  Instead, it passes through the OUTPUT chain.  If
-        # we want connections from localhost to the forwarded port to be
-        # affected then we need a rule in the OUTPUT chain to do the same kind
-        # of DNAT that we did in the PREROUTING chain.
-        iptables(logger, [
-            # All NAT stuff happens in the netfilter NAT table.
-            b"--table", b"nat",
-
-            # As mentioned, this rule is for the OUTPUT chain.
-            b"--append", b"OUTPUT",
-
-            # Matching the exact same kinds of packets as the PREROUTING rule
-            # matches.
+            b"--jump", b"FLOCKER-PREROUTING",
+        ]),
+
+        # Having performed DNAT during prerouting, the packet is on its way
+        # out of the system and needs to look like it comes from us.  This
+        # happens after routing decisions have been made, so the jump is from
+        # the POSTROUTING chain.  This omits the LOCAL addrtype check because
+        # at this point the packet is definitely leaving this host.
+        (b"POSTROUTING", [
+            b"--protocol", b"tcp",
+            b"--jump", b"FLOCKER-POSTROUTING",
+        ]),
+
+        # Traffic that originates *on* the host bypasses the PREROUTING chain.
+        # Instead, it passes through the OUTPUT chain.  If we want connections
+        # from localhost to the forwarded port to be affected then we need to
+        # jump from the OUTPUT chain to the same kind of DNAT rules.
+        (b"OUTPUT", [
             b"--protocol", b"tcp",
-            b"--destination-port", encoded_port,
             b"--match", b"addrtype", b"--dst-type", b"LOCAL",
+            b"--jump", b"FLOCKER-OUTPUT",
+        ]),
+    ]
 
-            # Do the same DNAT as we did in the rule for the PREROUTING chain.
-            b"--jump", b"DNAT", b"--to-destination", encoded_ip,
-        ])
 
-        # The network stack only considers forwarding traffic when certain
-        # system configuration is in place.
-        #
-        # https://www.kernel.org/doc/Documentation/networking/ip-sysctl.txt
-        # will explain the meaning of these in (very slightly) more detail.
-        conf = FilePath(b"/proc/sys/net/ipv4/conf")
-        descendant = conf.descendant([b"default", b"forwarding"])
-        with descendant.open("wb") as forwarding:
-            forwarding.write(b"1")
-
-        # In order to have the OUTPUT chain DNAT rule affect routing decisions,
-        # we also need to tell the system to make routing decisions about
-        # traffic from or to localhost.
-        for path in conf.children():
-            with path.child(b"route_localnet").open("wb") as route_localnet:
-                route_localnet.write(b"1")
-
-        return Proxy(ip=ip, port=port)
-
-
-def delete_proxy(logger, proxy):
-    """
-    :see: ``HostNetwork.delete_proxy``
-    """
-    ip = unicode(proxy.ip).encode("ascii")
-    port = unicode(proxy.port).encode("ascii")
-
-    commands = [
-        [b"--table", b"nat",
-         b"--delete", b"PREROUTING",
-         b"--protocol", b"tcp", b"--destination-port", port,
-         b"--match", b"addrtype", b"--dst-type", b"LOCAL",
-         b"--match", b"comment", b"--comment", FLOCKER_COMMENT_MARKER,
-         b"--jump", b"DNAT", b"--to-destination", ip],
-        [b"--table", b"nat",
-         b"--delete", b"POSTROUTING",
-         b"--protocol", b"tcp", b"--destination-port", port,
-         b"--jump", b"MASQUERADE"],
-        [b"--table", b"nat",
-         b"--delete", b"OUTPUT",
-         b"--protocol", b"tcp", b"--destination-port", port,
-         b"--match", b"addrtype", b"--dst-type", b"LOCAL",
-         b"--jump", b"DNAT", b"--to-destination", ip],
+def _port_chunks(ports):
+    """
+    Split ports into groups small enough for a ``multiport`` match.
+
+    :param ports: An iterable of ``int`` port numbers.
+
+    :return: A ``list`` of ``list``\ s of at most ``MULTIPORT_LIMIT`` ports
+        each, in order.
+    """
+    ports = sorted(ports)
+    return [ports[i:i + MULTIPORT_LIMIT]
+            for i in range(0, len(ports), MULTIPORT_LIMIT)]
+
+
+def _match_ports(ports):
+    """
+    :param list ports: ``int`` port numbers.
+
+    :return: The ``iptables`` arguments matching TCP traffic to any of the
+        ports.
+    """
+    return [
+        b"--protocol", b"tcp", b"--match", b"multiport",
+        b"--destination-ports",
+        b",".join(unicode(port).encode("ascii") for port in ports),
+    ]
+
+
+def _chunk_rules(ip, ports):
+    """
+    Describe the rules making up the proxies to one destination on some
+    ports, which share a ``multiport`` match.
+
+    :param unicode ip: The destination to which to proxy.
+    :param ports: The ``int`` TCP port numbers on which to proxy, at most
+        ``MULTIPORT_LIMIT`` of them.
+
+    :return: A ``list`` of ``tuple``\ s of the name of a Flocker NAT chain
+        and the arguments describing a rule in that chain.
+    """
+    encoded_ip = ip.encode("ascii")
+    return [
+        # Rewrite the destination of TCP traffic directed at this host (the
+        # jump into the chain checks that much) on the proxied ports.  DNAT
+        # is a built-in target that already knows how to do this.  Pass it an
+        # argument so it knows how to mangle the packet - rewrite the
+        # destination IP of the address to the target we were told to use.
+        (b"FLOCKER-PREROUTING", _match_ports(ports) + [
+            b"--jump", b"DNAT", b"--to-destination", encoded_ip]),
+
+        # Do the same DNAT for traffic originating on this host.
+        (b"FLOCKER-OUTPUT", _match_ports(ports) + [
+            b"--jump", b"DNAT", b"--to-destination", encoded_ip]),
+
+        # We want proxied traffic to look like it comes from us (the
+        # downstream client will be *very* confused if the node we're passing
+        # the packet on to replies *directly* to them; and by confused I mean
+        # it will be totally broken, of course) so we also need to
+        # "masquerade".  This changes the source address (ip and port) of the
+        # packet to the address of the external interface the packet is
+        # exiting upon. Doing SNAT here would be a little bit more efficient
+        # because the kernel could avoid looking up the external interface's
+        # address for every single packet.  But it requires this code to know
+        # that address and it requires that if it ever changes the rule gets
+        # updated and it may require some steps to do port allocation (not
+        # sure what they are yet).  So we'll just masquerade for now.  This
+        # doesn't depend on the destination, but matching the same ports as
+        # the DNAT rules means changing some proxies only touches the rules
+        # of their own ports.
+        (b"FLOCKER-POSTROUTING",
+         _match_ports(ports) + [b"--jump", b"MASQUERADE"]),
+    ]
+
+
+def _chunks(proxies):
+    """
+    Group proxies into as few rules as possible.
+
+    :param proxies: An iterable of ``tuple``\ s of the ``unicode``
+        destination to which to proxy and the ``int`` TCP port number on
+        which to proxy.
+
+    :return: A ``list`` of ``tuple``\ s of a ``unicode`` destination and a
+        ``tuple`` of at most ``MULTIPORT_LIMIT`` ``int`` ports.
+    """
+    destinations = {}
+    for ip, port in proxies:
+        destinations.setdefault(ip, set()).add(port)
+    return [(ip, tuple(ports))
+            for ip in sorted(destinations)
+            for ports in _port_chunks(destinations[ip])]
+
+
+def _change_chunks(chunks, operations):
+    """
+    Work out which rules change when proxies are created and deleted.
+
+    Only the rules of the chunks of ports gaining or losing a proxy change.
+    New proxies are added to a chunk of their destination with room to
+    spare, preferring one which changes anyway, or else get a chunk of their
+    own.
+
+    :param list chunks: The existing chunks, as returned by :func:`_chunks`.
+    :param operations: ``tuple``\ s of ``"create"`` or ``"delete"`` and a
+        ``tuple`` of the ``unicode`` destination and ``int`` port of a proxy.
+
+    :raise KeyError: If a proxy being deleted doesn't exist.
+
+    :return: A ``tuple`` of the ``list`` of existing chunks whose rules must
+        be deleted, the ``list`` of chunks whose rules must be added, and the
+        ``set`` of all of the proxies afterwards.
+    """
+    ips = [ip for ip, ports in chunks]
+    ports = [set(chunk_ports) for ip, chunk_ports in chunks]
+    where = {(ip, port): index for index, (ip, chunk_ports)
+             in enumerate(chunks) for port in chunk_ports}
+    changed = set()
+    for operation, (ip, port) in operations:
+        key = (ip, port)
+        if operation == "delete":
+            if key not in where:
+                raise KeyError(key)
+            index = where.pop(key)
+            ports[index].discard(port)
+        elif key not in where:
+            room = [i for i in range(len(ips))
+                    if ips[i] == ip and len(ports[i]) < MULTIPORT_LIMIT]
+            room.sort(key=lambda i: i not in changed)
+            if room:
+                index = room[0]
+            else:
+                index = len(ips)
+                ips.append(ip)
+                ports.append(set())
+            ports[index].add(port)
+            where[key] = index
+        else:
+            continue
+        changed.add(index)
+
+    removed = [chunks[i] for i in sorted(changed) if i < len(chunks)]
+    added = [(ips[i], tuple(sorted(ports[i])))
+             for i in sorted(changed) if ports[i]]
+    return removed, added, set(where)
+
+
+def _list_rules(chain):
+    """
+    Read the rules in a single chain of the NAT table.
+
+    :param bytes chain: The name of the chain.
+
+    :return: A ``list`` of ``bytes``, one ``iptables``-style line for each
+        rule in the chain, or ``None`` if the chain does not exist.
+    """
+    try:
+        output = check_output(
+            [b"iptables", b"--table", b"nat", b"--list-rules", chain],
+            stderr=PIPE)
+    except CalledProcessError:
+        return None
+    return [
+        line for line in output.splitlines()
+        # Skip the line describing the chain itself.
+        if line.startswith(b"-A ")
     ]
 
-    with DELETE_PROXY(logger, target_ip=proxy.ip, target_port=proxy.port):
-        for argv in commands:
-            iptables(logger, argv)
+
+def _legacy_rules():
+    """
+    Find the rules of proxies created before the Flocker chains were used,
+    which are directly in the built-in chains.
+
+    :return: A ``tuple`` of a ``list`` of ``iptables`` argument lists deleting
+        those rules and a ``set`` of ``tuple``\ s of the ``unicode``
+        destination and ``int`` port of each of those proxies.
+    """
+    deletes = []
+    proxies = set()
+    expected = []
+    for line in _list_rules(b"PREROUTING") or []:
+        if FLOCKER_COMMENT_MARKER not in line:
+            continue
+        argv = shlex.split(line)
+        options = parse_iptables_options(argv)
+        if options.comment != FLOCKER_COMMENT_MARKER:
+            continue
+        deletes.append([b"--delete"] + argv[1:])
+        if options.to_destination is None:
+            continue
+        ip = unicode(options.to_destination)
+        for port in options.destination_ports:
+            proxies.add((ip, port))
+            # The other rules of the proxy weren't marked, but were created
+            # exactly like this:
+            encoded_port = unicode(port).encode("ascii")
+            expected.extend([
+                [b"-A", b"OUTPUT", b"-p", b"tcp", b"-m", b"tcp",
+                 b"--dport", encoded_port,
+                 b"-m", b"addrtype", b"--dst-type", b"LOCAL",
+                 b"-j", b"DNAT", b"--to-destination", ip.encode("ascii")],
+                [b"-A", b"POSTROUTING", b"-p", b"tcp", b"-m", b"tcp",
+                 b"--dport", encoded_port, b"-j", b"MASQUERADE"],
+            ])
+    if expected:
+        for chain in [b"OUTPUT", b"POSTROUTING"]:
+            for line in _list_rules(chain) or []:
+                argv = line.split()
+                if argv in expected:
+                    expected.remove(argv)
+                    deletes.append([b"--delete"] + argv[1:])
+    return deletes, proxies
+
+
+@attributes(["chunks", "legacy_deletes", "legacy_proxies"])
+class ProxyRules(object):
+    """
+    A snapshot of the rules making up the proxies.
+
+    :ivar chunks: ``None`` if the Flocker chains don't exist yet, otherwise
+        the ``list`` of ``tuple``\ s of the ``unicode`` destination and the
+        ``tuple`` of ``int`` ports of each DNAT rule in ``PROXY_CHAIN``, in
+        order.
+    :ivar list legacy_deletes: ``iptables`` argument lists deleting the rules
+        of proxies left in the built-in chains by earlier versions.
+    :ivar frozenset legacy_proxies: ``tuple``\ s of the ``unicode``
+        destination and ``int`` port of those proxies.
+    """
+    def proxies(self):
+        """
+        :return: A ``list`` of ``Proxy`` instances, one for each proxy.
+        """
+        if self.chunks is None:
+            return [Proxy(ip=IPAddress(ip), port=port)
+                    for ip, port in sorted(self.legacy_proxies)]
+        return [Proxy(ip=IPAddress(ip), port=port)
+                for ip, ports in self.chunks for port in ports]
+
+
+def read_proxy_rules():
+    """
+    Read the rules making up the proxies from the system.
+
+    Only ``PROXY_CHAIN`` is read, unless the Flocker chains don't exist yet.
+
+    :return: A :class:`ProxyRules`.
+    """
+    lines = _list_rules(PROXY_CHAIN)
+    if lines is None:
+        deletes, legacy = _legacy_rules()
+        return ProxyRules(chunks=None, legacy_deletes=deletes,
+                          legacy_proxies=frozenset(legacy))
+    return ProxyRules(
+        chunks=[(unicode(rule.to_destination), rule.destination_ports)
+                for rule in _parse_flocker_rules(lines)],
+        legacy_deletes=[], legacy_proxies=frozenset())
+
+
+@implementer(INetworkTransaction)
+class IPTablesTransaction(object):
+    """
+    An ``INetworkTransaction`` which applies all of its changes with a single
+    ``iptables-restore`` run.
+
+    Only the rules of the chunks of ports whose proxies change are deleted
+    and added again.  If those rules aren't as expected, because they were
+    written by an earlier version or changed by something else, deleting
+    them fails and nothing is changed; the Flocker chains are then rewritten
+    from scratch instead.
+
+    :ivar list _operations: The changes to make on commit, as ``tuple``\ s of
+        ``"create"`` or ``"delete"`` and a ``Proxy``.
+    :ivar bool _creates: Whether any proxies are created on commit.
+    :ivar list _deleted: The proxies deleted on commit.
+    """
+    def __init__(self, logger, routing, changed=lambda: None,
+                 forget_connections=forget_connections,
+                 snapshot=read_proxy_rules):
+        """
+        :param eliot.Logger logger: The logger to log the changes to.
+        :param RoutingPrerequisites routing: The system configuration to
+            ensure is in place when proxies are created.
+        :param changed: A no-argument callable which is called when the
+            transaction is committed, whether or not that succeeds.
+        :param forget_connections: A callable like ``forget_connections``,
+            called with the deleted proxies once they have been deleted.
+        :param snapshot: A no-argument callable returning the
+            :class:`ProxyRules` the changes are made to.
+        """
+        self.logger = logger
+        self._routing = routing
+        self._changed = changed
+        self._forget_connections = forget_connections
+        self._snapshot = snapshot
+        self._operations = []
+        self._creates = False
+        self._deleted = []
+
+    def create_proxy_to(self, ip, port):
+        """
+        :see: ``HostNetwork.create_proxy_to``
+        """
+        proxy = Proxy(ip=ip, port=port)
+        self._operations.append(("create", proxy))
+        self._creates = True
+        return proxy
+
+    def delete_proxy(self, proxy):
+        """
+        :see: ``HostNetwork.delete_proxy``
+        """
+        self._operations.append(("delete", proxy))
+        self._deleted.append(proxy)
+
+    def commit(self):
+        """
+        Apply all of the changes with one ``iptables-restore --noflush``.
+        """
+        try:
+            self._commit()
+        finally:
+            self._changed()
+
+    def _commit(self):
+        """
+        :raise KeyError: If a proxy being deleted doesn't exist.  Nothing is
+            changed in that case.
+        """
+        if not self._operations:
+            return
+        snapshot = self._snapshot()
+        operations = [(operation, (unicode(proxy.ip), proxy.port))
+                      for operation, proxy in self._operations]
+        if snapshot.chunks is None:
+            # Rules left in the built-in chains by earlier versions would
+            # take precedence over the Flocker chains, so they are moved into
+            # them:
+            operations = [
+                ("create", proxy) for proxy in sorted(snapshot.legacy_proxies)
+            ] + operations
+        removed, added, proxies = _change_chunks(
+            snapshot.chunks or [], operations)
+
+        if snapshot.chunks is None:
+            # This is the first change, so create the Flocker chains (all of
+            # them are created together) and jump to them:
+            chains = [chain for chain, builtin in FLOCKER_CHAINS]
+            rules = snapshot.legacy_deletes + [
+                [b"--append", builtin] + rule
+                for builtin, rule in _jump_rules()]
+        else:
+            chains = []
+            rules = [
+                [b"--delete", chain] + rule
+                for ip, ports in removed
+                for chain, rule in _chunk_rules(ip, ports)]
+        rules.extend(
+            [b"--append", chain] + rule
+            for ip, ports in added
+            for chain, rule in _chunk_rules(ip, ports))
+
+        if rules:
+            try:
+                iptables_restore(self.logger, rules, chains)
+            except CalledProcessError:
+                if not removed:
+                    raise
+                iptables_restore(self.logger, [
+                    [b"--flush", chain] for chain, builtin in FLOCKER_CHAINS
+                ] + [[b"--append", chain] + rule
+                     for ip, ports in _chunks(proxies)
+                     for chain, rule in _chunk_rules(ip, ports)])
+        if self._deleted:
+            self._forget_connections(self.logger, self._deleted)
+        if self._creates:
+            self._routing.ensure()
+
+
+def delete_all_proxies(logger, forget_connections=forget_connections):
+    """
+    :param forget_connections: A callable like ``forget_connections``,
+        called with the proxies once they have been deleted.
+
+    :see: ``HostNetwork.delete_all_proxies``
+    """
+    with DELETE_ALL_PROXIES(logger=logger):
+        snapshot = read_proxy_rules()
+        proxies = snapshot.proxies()
+        if snapshot.chunks is None:
+            if snapshot.legacy_deletes:
+                iptables_restore(logger, snapshot.legacy_deletes)
+        else:
+            iptables_restore(
+                logger,
+                [[b"--flush", chain] for chain, builtin in FLOCKER_CHAINS])
+        if proxies:
+            forget_connections(logger, proxies)
 
 
 def enumerate_proxies():
@@ -211,47 +557,42 @@ def enumerate_proxies():
     Inspect the system's iptables configuration to determine what proxies
     currently exist.
 
+    Until the Flocker chains exist, the proxies left in the built-in chains
+    by earlier versions are enumerated instead, so that they can be deleted.
+
     :see: :py:meth:`INetwork.enumerate_proxies` for parameter documentation.
     """
-    proxies = []
-    for rule in get_flocker_rules():
-        proxies.append(
-            Proxy(ip=rule.to_destination, port=rule.destination_port))
-
-    return proxies
+    return read_proxy_rules().proxies()
 
 
 def get_flocker_rules():
     """
-    Look up all of the iptables rules created/managed by flocker.
+    Look up the DNAT rule of each proxy created/managed by flocker.
 
-    :return: An iterator of :py:class:`Options` instances, one for each rule
-        found.
-    """
-    # Life is horrible.
-    # https://stackoverflow.com/questions/109553/how-can-i-programmatically-manage-iptables-rules-on-the-fly
-    # At least we know all the rules we need to inspect are in the NAT table.
-    output = check_output([b"iptables-save", b"--table", b"nat"])
+    Only the ``FLOCKER-PREROUTING`` chain is read, rather than the whole NAT
+    table.
 
-    # Find the beginning of the NAT table
-    header = b"*nat\n"
-    begin = output.find(header) + len(header)
+    :return: An iterator of :py:class:`RuleOptions` instances, one for each
+        rule found.
+    """
+    return _parse_flocker_rules(_list_rules(PROXY_CHAIN) or [])
 
-    # Find the end of the NAT table
-    footer = b"COMMIT\n"
-    end = output.find(footer, begin)
 
-    # Slice it out.
-    nat = output[begin:end]
+def _parse_flocker_rules(lines):
+    """
+    :param list lines: The rules in the ``FLOCKER-PREROUTING`` chain, as
+        returned by ``_list_rules``.
 
-    for line in nat.splitlines():
-        if line.startswith(b":"):
-            # Skip these lines describing a chain or the table overall.
+    :return: An iterator of :py:class:`RuleOptions` instances, one for each
+        DNAT rule.
+    """
+    for line in lines:
+        # Only DNAT rules describe proxies; don't bother splitting up
+        # anything else.
+        if b"--to-destination" not in line:
             continue
-
-        options = parse_iptables_options(shlex.split(line))
-
-        if options.comment == FLOCKER_COMMENT_MARKER:
+        options = parse_iptables_options(line.split())
+        if options.to_destination is not None:
             yield options
 
 
@@ -267,55 +608,113 @@ def parse_iptables_options(argv):
     """
     # "Parsing" things like this:
     #
-    # -A PREROUTING -p tcp -m tcp --dport 4567 -m addrtype --dst-type LOCAL
-    #     -m comment --comment flocker -j DNAT --to-destination 10.1.2.3
-    #
-    # -A OUTPUT -p tcp -m tcp --dport 4567 -m addrtype --dst-type LOCAL -j DNAT
+    # -A FLOCKER-PREROUTING -p tcp -m multiport --dports 4567,4568 -j DNAT
     #     --to-destination 10.1.2.3
     #
-    # -A POSTROUTING -p tcp -m tcp --dport 4567 -j MASQUERADE
-    #
     # To avoid having to know about every single possible current and future
     # iptables option, don't try to parse the whole line.  Just look for things
-    # we expect and recognize.
+    # we expect and recognize, in a single pass over the arguments.
     comment = None
-    destination_port = None
+    destination_ports = None
     to_destination = None
 
-    try:
-        destination_port_index = argv.index(b"--dport")
-        destination_port = int(argv[destination_port_index + 1])
-
-        to_destination_index = argv.index(b"--to-destination")
-        to_destination = IPAddress(argv[to_destination_index + 1])
+    arguments = iter(argv)
+    for argument in arguments:
+        if argument in (b"--dport", b"--dports"):
+            destination_ports = next(arguments, None)
+        elif argument == b"--to-destination":
+            to_destination = next(arguments, None)
+        elif argument == b"--comment":
+            comment = next(arguments, None)
 
-        # Find the comment last so that the other two attributes always have a
-        # value if the comment has a value.
-        comment_index = argv.index(b"--comment")
-        comment = argv[comment_index + 1]
-    except (IndexError, ValueError):
-        pass
+    try:
+        destination_ports = _parse_ports(destination_ports)
+        to_destination = IPAddress(to_destination)
+    except (AttributeError, TypeError, ValueError):
+        # Either both of these have a value or neither does.
+        destination_ports = to_destination = None
 
     return RuleOptions(
         comment=comment,
-        destination_port=destination_port,
+        destination_ports=destination_ports,
         to_destination=to_destination)
 
 
+def _parse_ports(ports):
+    """
+    :param bytes ports: A port (as given to ``--dport``) or a comma-separated
+        list of ports and ``first:last`` port ranges (as given to
+        ``--dports``).
+
+    :raise ValueError: If ``ports`` can't be parsed.
+
+    :return: A ``tuple`` of the ``int`` ports.
+    """
+    result = []
+    for part in ports.split(b","):
+        first, _, last = part.partition(b":")
+        result.extend(range(int(first), int(last or first) + 1))
+    return tuple(result)
+
+
 @implementer(INetwork)
 class HostNetwork(object):
     """
     An ``INetwork`` implementation based on ``iptables``.
+
+    The proxies are only read from the system the first time they are
+    enumerated.  Afterwards the same snapshot is used until this instance
+    changes the proxies itself.  Changes made by anything else are not noticed
+    until then.
+
+    :ivar _rules: The :class:`ProxyRules` last read from the system, or
+        ``None`` if they must be read again.
+    :ivar RoutingPrerequisites _routing: The system configuration ensured to
+        be in place whenever proxies are created.
     """
     logger = Logger()
 
+    def __init__(self, routing=None, forget_connections=forget_connections):
+        """
+        :param RoutingPrerequisites routing: The system configuration to
+            ensure is in place when proxies are created.  By default the
+            interfaces of this host are configured.
+        :param forget_connections: A callable like ``forget_connections``,
+            called with proxies once they have been deleted.
+        """
+        if routing is None:
+            routing = RoutingPrerequisites()
+        self._routing = routing
+        self._forget_connections = forget_connections
+        self._rules = None
+
+    def _snapshot(self):
+        """
+        :return: The :class:`ProxyRules` of the system, read from it if there
+            is no snapshot.
+        """
+        if self._rules is None:
+            self._rules = read_proxy_rules()
+        return self._rules
+
+    def _changed(self):
+        """
+        Discard the snapshot of the proxies.
+        """
+        self._rules = None
+
     def create_proxy_to(self, ip, port):
         """
         Configure iptables to proxy TCP traffic on the given port.
 
         :see: :meth:`INetwork.create_proxy_to` for parameter documentation.
         """
-        return create_proxy_to(self.logger, ip, port)
+        with CREATE_PROXY_TO(
+                logger=self.logger, target_ip=ip, target_port=port):
+            transaction = self.begin()
+            proxy = transaction.create_proxy_to(ip, port)
+            transaction.commit()
+            return proxy
 
     def delete_proxy(self, proxy):
         """
@@ -323,9 +722,39 @@ class HostNetwork(object):
 
         :see: :meth:`INetwork.delete_proxy` for parameter documentation.
         """
-        return delete_proxy(self.logger, proxy)
+        with DELETE_PROXY(logger=self.logger, target_ip=proxy.ip,
+                          target_port=proxy.port):
+            transaction = self.begin()
+            transaction.delete_proxy(proxy)
+            transaction.commit()
+
+    def enumerate_proxies(self):
+        """
+        Determine what proxies currently exist.
 
-    enumerate_proxies = staticmethod(enumerate_proxies)
+        :see: :meth:`INetwork.enumerate_proxies`
+        """
+        return self._snapshot().proxies()
+
+    def delete_all_proxies(self):
+        """
+        Remove every proxy by flushing the Flocker chains.
+        """
+        try:
+            return delete_all_proxies(self.logger, self._forget_connections)
+        finally:
+            self._changed()
+
+    def begin(self):
+        """
+        Start a transaction which applies all of its changes with a single
+        ``iptables-restore`` run.
+
+        :see: :meth:`INetwork.begin`
+        """
+        return IPTablesTransaction(
+            self.logger, self._routing, self._changed,
+            self._forget_connections, self._snapshot)
 
 
 def make_host_network():
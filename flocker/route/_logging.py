@@ -34,16 +34,25 @@ TARGET_PORT = Field.forTypes(
     u"The port number which is the target of a proxy.")
 
 
-ARGV = Field.forTypes(
-    u"argv", [list],
-    u"The argument list of a child process being executed.")
+INPUT = Field.forTypes(
+    u"input", [unicode],
+    u"The standard input of a child process being executed.")
 
 
-IPTABLES = ActionType(
-    _system(u"iptables"),
-    [ARGV],
+IPTABLES_RESTORE = ActionType(
+    _system(u"iptables_restore"),
+    [INPUT],
     [],
-    u"An iptables command which Flocker is executing against the system.")
+    u"An iptables-restore run which Flocker is using to change several "
+    u"rules at once.")
+
+
+NFT = ActionType(
+    _system(u"nft"),
+    [INPUT],
+    [],
+    u"An nft batch which Flocker is using to change its nftables "
+    u"configuration.")
 
 
 CREATE_PROXY_TO = ActionType(
@@ -58,3 +67,18 @@ DELETE_PROXY = ActionType(
     [TARGET_IP, TARGET_PORT],
     [],
     u"Flocker is deleting an existing proxy.")
+
+
+DELETE_ALL_PROXIES = ActionType(
+    _system(u"delete_all_proxies"),
+    [],
+    [],
+    u"All of the proxies created by Flocker are being deleted.")
+
+
+FORGET_CONNECTIONS = ActionType(
+    _system(u"forget_connections"),
+    [TARGET_IP, TARGET_PORT],
+    [],
+    u"Flocker is deleting the connection tracking entries of connections "
+    u"through a deleted proxy.")
@@ -7,7 +7,7 @@ Objects related to an in-memory implementation of ``INetwork``.
 from zope.interface import implementer
 from eliot import Logger
 
-from ._interfaces import INetwork
+from ._interfaces import INetwork, INetworkTransaction
 from ._model import Proxy
 
 
@@ -35,6 +35,48 @@ class MemoryNetwork(object):
     def enumerate_proxies(self):
         return list(self._proxies)
 
+    def begin(self):
+        return MemoryTransaction(self)
+
+
+@implementer(INetworkTransaction)
+class MemoryTransaction(object):
+    """
+    An ``INetworkTransaction`` for a ``MemoryNetwork``.
+
+    :ivar list _operations: The changes to make on commit, as ``tuple``\ s of
+        ``"create"`` or ``"delete"`` and a ``Proxy``.
+    """
+    def __init__(self, network):
+        """
+        :param MemoryNetwork network: The network to change.
+        """
+        self._network = network
+        self._operations = []
+
+    def create_proxy_to(self, ip, port):
+        proxy = Proxy(ip=ip, port=port)
+        self._operations.append(("create", proxy))
+        return proxy
+
+    def delete_proxy(self, proxy):
+        self._operations.append(("delete", proxy))
+
+    def commit(self):
+        # Check that every change can be made before changing anything:
+        proxies = set(self._network._proxies)
+        for operation, proxy in self._operations:
+            if operation == "delete":
+                proxies.remove(proxy)
+            else:
+                proxies.add(proxy)
+
+        for operation, proxy in self._operations:
+            if operation == "delete":
+                self._network.delete_proxy(proxy)
+            else:
+                self._network.create_proxy_to(proxy.ip, proxy.port)
+
 
 def make_memory_network():
     """
@@ -0,0 +1,260 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+# -*- test-case-name: flocker.route.test.test_nftables -*-
+
+"""
+Manipulate network routing behavior on a node using ``nftables``.
+
+Rather than adding rules for every proxy, a fixed set of rules looks up the
+destination of each new connection in an nftables map keyed by port.  The
+cost of that lookup does not depend on the number of proxies.
+"""
+
+from subprocess import Popen, PIPE, CalledProcessError
+
+from zope.interface import implementer
+from ipaddr import IPAddress
+from eliot import Logger
+
+from ._logging import CREATE_PROXY_TO, DELETE_PROXY, NFT
+from ._interfaces import INetwork, INetworkTransaction
+from ._sysctl import RoutingPrerequisites
+from ._conntrack import forget_connections
+from ._model import Proxy
+
+# The nftables table holding all of Flocker's configuration.
+TABLE = b"ip flocker"
+
+# The statements which create the table, its map of proxied ports to
+# destinations and the rules using the map.  Tables, maps, sets and chains
+# can be added again without error; the chains are flushed before their
+# rules are added so the rules are never duplicated.  Map and set elements
+# are left alone by this.
+_SETUP = [
+    b"add table " + TABLE,
+    b"add map " + TABLE + b" proxies { type inet_service : ipv4_addr; }",
+    b"add set " + TABLE + b" ports { type inet_service; }",
+
+    # Rewrite the destination of TCP traffic directed at this host on a
+    # proxied port, both for traffic arriving from elsewhere and for traffic
+    # originating on this host (which bypasses the prerouting hook).
+    b"add chain " + TABLE +
+    b" prerouting { type nat hook prerouting priority -100; }",
+    b"flush chain " + TABLE + b" prerouting",
+    b"add rule " + TABLE +
+    b" prerouting fib daddr type local dnat to tcp dport map @proxies",
+    b"add chain " + TABLE + b" output { type nat hook output priority -100; }",
+    b"flush chain " + TABLE + b" output",
+    b"add rule " + TABLE +
+    b" output fib daddr type local dnat to tcp dport map @proxies",
+
+    # Make proxied traffic look like it comes from this host, so that
+    # replies come back through it.
+    b"add chain " + TABLE +
+    b" postrouting { type nat hook postrouting priority 100; }",
+    b"flush chain " + TABLE + b" postrouting",
+    b"add rule " + TABLE + b" postrouting tcp dport @ports masquerade",
+]
+
+
+def run_nft(argv, input=None):
+    """
+    Run ``nft``.
+
+    :param list argv: The arguments to pass to ``nft``.
+    :param bytes input: Data to write to its standard input, if any.
+
+    :raise CalledProcessError: If ``nft`` exits with a non-zero status.
+
+    :return: The ``bytes`` ``nft`` wrote to its standard output.
+    """
+    process = Popen([b"nft"] + argv, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+    output, error = process.communicate(input)
+    if process.returncode:
+        raise CalledProcessError(process.returncode, [b"nft"] + argv, error)
+    return output
+
+
+def _element(proxy):
+    """
+    :param Proxy proxy: A proxy.
+
+    :return: ``tuple`` of the ``bytes`` elements representing the proxy in the
+        ``proxies`` map and in the ``ports`` set.
+    """
+    port = unicode(proxy.port).encode("ascii")
+    return (port + b" : " + unicode(proxy.ip).encode("ascii"), port)
+
+
+def parse_map_elements(output):
+    """
+    Parse the elements of the ``proxies`` map out of ``nft list map`` output.
+
+    :param bytes output: The output of ``nft -nn list map``.
+
+    :return: A ``list`` of ``Proxy`` instances, one for each element.
+    """
+    # The output looks like this, with the elements possibly wrapped over
+    # several lines:
+    #
+    # table ip flocker {
+    #     map proxies {
+    #         type inet_service : ipv4_addr
+    #         elements = { 1234 : 10.1.2.3, 4567 : 10.1.2.4 }
+    #     }
+    # }
+    marker = b"elements = {"
+    begin = output.find(marker)
+    if begin == -1:
+        return []
+    begin += len(marker)
+    end = output.find(b"}", begin)
+    proxies = []
+    for element in output[begin:end].split(b","):
+        if not element.strip():
+            continue
+        port, ip = element.split(b":")
+        proxies.append(Proxy(ip=IPAddress(ip.strip()), port=int(port)))
+    return proxies
+
+
+@implementer(INetworkTransaction)
+class NFTablesTransaction(object):
+    """
+    An ``INetworkTransaction`` which applies all of its changes with a single
+    ``nft -f`` batch.
+
+    :ivar list _statements: The ``nft`` statements changing the map elements
+        on commit.
+    :ivar bool _creates: Whether any proxies are created on commit.
+    :ivar list _deleted: The proxies deleted on commit.
+    """
+    def __init__(self, network):
+        """
+        :param NFTablesNetwork network: The network to change.
+        """
+        self._network = network
+        self._statements = []
+        self._creates = False
+        self._deleted = []
+
+    def create_proxy_to(self, ip, port):
+        """
+        :see: ``NFTablesNetwork.create_proxy_to``
+        """
+        proxy = Proxy(ip=ip, port=port)
+        mapping, port = _element(proxy)
+        self._statements.extend([
+            b"add element " + TABLE + b" proxies { " + mapping + b" }",
+            b"add element " + TABLE + b" ports { " + port + b" }",
+        ])
+        self._creates = True
+        return proxy
+
+    def delete_proxy(self, proxy):
+        """
+        :see: ``NFTablesNetwork.delete_proxy``
+        """
+        mapping, port = _element(proxy)
+        self._statements.extend([
+            b"delete element " + TABLE + b" proxies { " + mapping + b" }",
+            b"delete element " + TABLE + b" ports { " + port + b" }",
+        ])
+        self._deleted.append(proxy)
+
+    def commit(self):
+        """
+        Apply all of the changes with one ``nft -f`` batch, which the kernel
+        applies atomically.
+        """
+        if not self._statements:
+            return
+        batch = b"".join(
+            statement + b"\n" for statement in _SETUP + self._statements)
+        with NFT(logger=self._network.logger, input=batch.decode("ascii")):
+            self._network._nft([b"-f", b"-"], batch)
+        if self._deleted:
+            self._network._forget_connections(
+                self._network.logger, self._deleted)
+        if self._creates:
+            self._network._routing.ensure()
+
+
+@implementer(INetwork)
+class NFTablesNetwork(object):
+    """
+    An ``INetwork`` implementation based on an ``nftables`` map from ports to
+    destinations.
+    """
+    logger = Logger()
+
+    def __init__(self, nft=run_nft, routing=None,
+                 forget_connections=forget_connections):
+        """
+        :param nft: A callable like ``run_nft`` to use to run ``nft``.
+        :param RoutingPrerequisites routing: The system configuration to
+            ensure is in place when proxies are created.  By default the
+            interfaces of this host are configured.
+        :param forget_connections: A callable like ``forget_connections``,
+            called with proxies once they have been deleted.
+        """
+        if routing is None:
+            routing = RoutingPrerequisites()
+        self._nft = nft
+        self._routing = routing
+        self._forget_connections = forget_connections
+
+    def create_proxy_to(self, ip, port):
+        """
+        Add a proxy on the given port to the ``nftables`` map.
+
+        :see: :meth:`INetwork.create_proxy_to` for parameter documentation.
+        """
+        with CREATE_PROXY_TO(
+                logger=self.logger, target_ip=ip, target_port=port):
+            transaction = self.begin()
+            proxy = transaction.create_proxy_to(ip, port)
+            transaction.commit()
+            return proxy
+
+    def delete_proxy(self, proxy):
+        """
+        Remove the given proxy from the ``nftables`` map.
+
+        :see: :meth:`INetwork.delete_proxy` for parameter documentation.
+        """
+        with DELETE_PROXY(logger=self.logger, target_ip=proxy.ip,
+                          target_port=proxy.port):
+            transaction = self.begin()
+            transaction.delete_proxy(proxy)
+            transaction.commit()
+
+    def enumerate_proxies(self):
+        """
+        List the elements of the ``nftables`` map.
+
+        :see: :meth:`INetwork.enumerate_proxies`
+        """
+        try:
+            output = self._nft(
+                [b"-nn", b"list", b"map"] + TABLE.split() + [b"proxies"])
+        except CalledProcessError:
+            # The table has not been created yet.
+            return []
+        return parse_map_elements(output)
+
+    def begin(self):
+        """
+        Start a transaction which applies all of its changes with a single
+        ``nft -f`` batch.
+
+        :see: :meth:`INetwork.begin`
+        """
+        return NFTablesTransaction(self)
+
+
+def make_nftables_network():
+    """
+    Create a new ``INetwork`` provider which will interact with the underlying
+    system's ``nftables`` configuration.
+    """
+    return NFTablesNetwork()
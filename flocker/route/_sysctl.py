@@ -0,0 +1,54 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+# -*- test-case-name: flocker.route.test.test_sysctl -*-
+
+"""
+System configuration needed for proxied traffic to be forwarded.
+"""
+
+from twisted.python.filepath import FilePath
+
+
+class RoutingPrerequisites(object):
+    """
+    Configure the system so that the network stack forwards proxied traffic.
+
+    Only interfaces which haven't been configured by this instance before are
+    changed, so ensuring the configuration is in place is cheap once it has
+    been done, even with many interfaces.
+
+    :ivar set _configured: The names of the entries in the configuration
+        directory which have already been configured.
+    """
+    def __init__(self, conf=FilePath(b"/proc/sys/net/ipv4/conf")):
+        """
+        :param FilePath conf: The directory holding the per-interface IPv4
+            configuration.
+        """
+        self._conf = conf
+        self._configured = set()
+
+    def ensure(self):
+        """
+        Configure any interfaces which haven't been configured yet.
+        """
+        # The network stack only considers forwarding traffic when certain
+        # system configuration is in place.
+        #
+        # https://www.kernel.org/doc/Documentation/networking/ip-sysctl.txt
+        # will explain the meaning of these in (very slightly) more detail.
+        #
+        # In order to have the OUTPUT chain DNAT rule affect routing
+        # decisions, we also need to tell the system to make routing decisions
+        # about traffic from or to localhost.  Interfaces created later get
+        # the value of the "default" entry, but existing ones need changing
+        # too.
+        for path in self._conf.children():
+            name = path.basename()
+            if name in self._configured:
+                continue
+            if name == b"default":
+                with path.child(b"forwarding").open("wb") as forwarding:
+                    forwarding.write(b"1")
+            with path.child(b"route_localnet").open("wb") as route_localnet:
+                route_localnet.write(b"1")
+            self._configured.add(name)
@@ -0,0 +1,397 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+# -*- test-case-name: flocker.route.test.test_userspace -*-
+
+"""
+Proxy traffic with TCP forwarders running in this process.
+
+Unlike the kernel based implementations, this needs no special privileges and
+can count the connections and bytes passing through each proxy.  Data is
+moved between the two sides of a proxied connection by Twisted transports,
+with each side throttling the other so that a fast sender can't fill the
+proxy's memory.  ``splice(2)`` would avoid copying the data through this
+process, but it isn't exposed by Python 2 or Twisted's transports, so it is
+not used.
+
+Deleting a proxy stops it from accepting new connections but lets the
+connections it already forwards finish, for up to ``DRAIN_TIMEOUT`` seconds.
+"""
+
+from zope.interface import implementer
+from eliot import Logger
+
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.protocol import Factory
+from twisted.protocols.portforward import (
+    ProxyClient, ProxyClientFactory, ProxyFactory, ProxyServer)
+
+from ._logging import CREATE_PROXY_TO, DELETE_PROXY
+from ._interfaces import INetwork, INetworkTransaction
+from ._model import Proxy
+
+# How many seconds the connections through a deleted proxy are given to
+# finish before they are closed.
+DRAIN_TIMEOUT = 60
+
+
+class ProxyStatistics(object):
+    """
+    Counters of the traffic through a proxy.
+
+    :ivar int connections: The number of connections the proxy has accepted.
+    :ivar int active: The number of those connections which are still open.
+    :ivar int bytes_in: The number of bytes forwarded from clients to the
+        proxy's destination.
+    :ivar int bytes_out: The number of bytes forwarded from the proxy's
+        destination back to clients.
+    """
+    def __init__(self):
+        self.connections = 0
+        self.active = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def __repr__(self):
+        return (
+            "<ProxyStatistics(connections=%d, active=%d, bytes_in=%d, "
+            "bytes_out=%d)>" % (self.connections, self.active, self.bytes_in,
+                                self.bytes_out))
+
+
+class _CountingProxyClient(ProxyClient):
+    """
+    The side of a proxied connection talking to the proxy's destination.
+    """
+    def dataReceived(self, data):
+        self.peer.factory.statistics.bytes_out += len(data)
+        ProxyClient.dataReceived(self, data)
+
+
+class _CountingProxyClientFactory(ProxyClientFactory):
+    protocol = _CountingProxyClient
+    noisy = False
+
+
+class _CountingProxyServer(ProxyServer):
+    """
+    The side of a proxied connection talking to the client.
+    """
+    clientProtocolFactory = _CountingProxyClientFactory
+    noisy = False
+
+    def connectionMade(self):
+        self.reactor = self.factory.reactor
+        self.factory.connection_made(self)
+        ProxyServer.connectionMade(self)
+
+    def dataReceived(self, data):
+        self.factory.statistics.bytes_in += len(data)
+        ProxyServer.dataReceived(self, data)
+
+    def connectionLost(self, reason):
+        ProxyServer.connectionLost(self, reason)
+        self.factory.connection_lost(self)
+
+
+class _ProxyFactory(ProxyFactory):
+    """
+    Forward connections to the destination of one proxy, keeping track of
+    them.
+
+    :ivar ProxyStatistics statistics: The traffic through the proxy.
+    :ivar set connections: The ``_CountingProxyServer`` instances for the
+        open connections.
+    """
+    protocol = _CountingProxyServer
+    noisy = False
+
+    def __init__(self, proxy, reactor):
+        """
+        :param Proxy proxy: The proxy to forward connections for.
+        :param reactor: The reactor to use to connect to the destination and
+            to time draining.
+        """
+        ProxyFactory.__init__(
+            self, unicode(proxy.ip).encode("ascii"), proxy.port)
+        self.reactor = reactor
+        self.statistics = ProxyStatistics()
+        self.connections = set()
+        self._waiting = []
+
+    def connection_made(self, server):
+        self.connections.add(server)
+        self.statistics.connections += 1
+        self.statistics.active += 1
+
+    def connection_lost(self, server):
+        self.connections.discard(server)
+        self.statistics.active -= 1
+        if not self.connections:
+            waiting, self._waiting = self._waiting, []
+            for d in waiting:
+                d.callback(None)
+
+    def drained(self):
+        """
+        :return: A ``Deferred`` which fires when all of the connections are
+            closed.
+        """
+        if not self.connections:
+            return succeed(None)
+        d = Deferred()
+        self._waiting.append(d)
+        return d
+
+    def drain(self, timeout):
+        """
+        Close the remaining connections after a while.
+
+        :param timeout: The number of seconds to give the connections to
+            finish.
+
+        :return: A ``Deferred`` which fires when all of the connections are
+            closed.
+        """
+        d = self.drained()
+        if self.connections:
+            call = self.reactor.callLater(timeout, self._abort)
+            d.addBoth(lambda result: call.active() and call.cancel())
+        return d
+
+    def _abort(self):
+        for server in list(self.connections):
+            server.transport.abortConnection()
+
+
+class _Listener(Factory):
+    """
+    The factory of a listening port, handing connections to the proxy
+    currently using the port.
+
+    :ivar _ProxyFactory target: The factory of that proxy.
+    """
+    noisy = False
+
+    def __init__(self):
+        self.target = None
+
+    def buildProtocol(self, addr):
+        return self.target.buildProtocol(addr)
+
+
+@implementer(INetworkTransaction)
+class UserspaceTransaction(object):
+    """
+    An ``INetworkTransaction`` for a ``UserspaceNetwork``.
+
+    :ivar list _operations: The changes to make on commit, as ``tuple``\ s of
+        ``"create"`` or ``"delete"`` and a ``Proxy``.
+    """
+    def __init__(self, network):
+        """
+        :param UserspaceNetwork network: The network to change.
+        """
+        self._network = network
+        self._operations = []
+
+    def create_proxy_to(self, ip, port):
+        """
+        :see: ``UserspaceNetwork.create_proxy_to``
+        """
+        proxy = Proxy(ip=ip, port=port)
+        self._operations.append(("create", proxy))
+        return proxy
+
+    def delete_proxy(self, proxy):
+        """
+        :see: ``UserspaceNetwork.delete_proxy``
+        """
+        self._operations.append(("delete", proxy))
+
+    def commit(self):
+        """
+        Apply the changes.
+
+        :raise KeyError: If a proxy being deleted doesn't exist.
+        :raise ValueError: If there would be several proxies on one port.
+        :raise CannotListenError: If a new port can't be listened on.
+
+        Nothing is changed if an exception is raised.
+        """
+        network = self._network
+        proxies = set(network._proxies)
+        for operation, proxy in self._operations:
+            if operation == "delete":
+                proxies.remove(proxy)
+            else:
+                proxies.add(proxy)
+        ports = set(proxy.port for proxy in proxies)
+        if len(ports) != len(proxies):
+            raise ValueError("Only one proxy can use each port.")
+
+        added = proxies - set(network._proxies)
+        removed = set(network._proxies) - proxies
+        listened = []
+        try:
+            for proxy in added:
+                if proxy.port not in network._ports:
+                    listened.append((proxy.port, network._listen(proxy.port)))
+        except:
+            for port, (listening, listener) in listened:
+                listening.stopListening()
+            raise
+        network._ports.update(listened)
+
+        for proxy in removed:
+            network._remove(proxy, proxy.port not in ports)
+        for proxy in added:
+            network._add(proxy)
+
+
+@implementer(INetwork)
+class UserspaceNetwork(object):
+    """
+    An ``INetwork`` implementation which listens on each proxied port and
+    forwards the connections it accepts to the proxy's destination.
+
+    :ivar dict _proxies: Map each ``Proxy`` to the ``_ProxyFactory``
+        forwarding its connections.
+    :ivar dict _draining: Map deleted ``Proxy`` instances to the
+        ``_ProxyFactory`` of the connections they still forward.
+    :ivar dict _ports: Map each ``int`` port being listened on to a ``tuple``
+        of the ``IListeningPort`` and its ``_Listener``.
+    """
+    logger = Logger()
+
+    def __init__(self, reactor=None, interface=b"",
+                 drain_timeout=DRAIN_TIMEOUT):
+        """
+        :param reactor: The reactor to listen and connect with.  By default
+            the global reactor.
+        :param bytes interface: The address to listen on.  By default all of
+            this host's addresses.
+        :param drain_timeout: The number of seconds the connections through a
+            deleted proxy are given to finish.
+        """
+        if reactor is None:
+            from twisted.internet import reactor
+        self._reactor = reactor
+        self._interface = interface
+        self._drain_timeout = drain_timeout
+        self._proxies = {}
+        self._draining = {}
+        self._ports = {}
+
+    def _listen(self, port):
+        """
+        Start listening on a port.
+
+        :param int port: The port to listen on.
+
+        :return: A ``tuple`` of the ``IListeningPort`` and its ``_Listener``.
+        """
+        listener = _Listener()
+        listening = self._reactor.listenTCP(
+            port, listener, interface=self._interface)
+        return listening, listener
+
+    def _add(self, proxy):
+        """
+        Start forwarding the connections to a port being listened on.
+
+        :param Proxy proxy: The proxy to forward connections for.
+        """
+        factory = _ProxyFactory(proxy, self._reactor)
+        self._proxies[proxy] = factory
+        listening, listener = self._ports[proxy.port]
+        listener.target = factory
+
+    def _remove(self, proxy, stop_listening):
+        """
+        Stop forwarding new connections for a proxy and start draining its
+        existing connections.
+
+        :param Proxy proxy: The proxy to remove.
+        :param bool stop_listening: Whether to stop listening on the proxy's
+            port too, rather than leaving it for another proxy.
+        """
+        factory = self._proxies.pop(proxy)
+        if stop_listening:
+            listening, listener = self._ports.pop(proxy.port)
+            listening.stopListening()
+        self._draining[proxy] = factory
+        drained = factory.drain(self._drain_timeout)
+
+        def forget(result):
+            if self._draining.get(proxy) is factory:
+                del self._draining[proxy]
+        drained.addCallback(forget)
+
+    def create_proxy_to(self, ip, port):
+        """
+        Listen on the given port and forward connections to it.
+
+        :see: :meth:`INetwork.create_proxy_to` for parameter documentation.
+        """
+        with CREATE_PROXY_TO(
+                logger=self.logger, target_ip=ip, target_port=port):
+            transaction = self.begin()
+            proxy = transaction.create_proxy_to(ip, port)
+            transaction.commit()
+            return proxy
+
+    def delete_proxy(self, proxy):
+        """
+        Stop accepting connections for the given proxy.  The connections
+        it already forwards are left to finish.
+
+        :see: :meth:`INetwork.delete_proxy` for parameter documentation.
+        """
+        with DELETE_PROXY(logger=self.logger, target_ip=proxy.ip,
+                          target_port=proxy.port):
+            transaction = self.begin()
+            transaction.delete_proxy(proxy)
+            transaction.commit()
+
+    def enumerate_proxies(self):
+        """
+        :see: :meth:`INetwork.enumerate_proxies`
+        """
+        return list(self._proxies)
+
+    def begin(self):
+        """
+        :see: :meth:`INetwork.begin`
+        """
+        return UserspaceTransaction(self)
+
+    def statistics(self, proxy):
+        """
+        :param Proxy proxy: A proxy which exists or is still draining.
+
+        :raise KeyError: If the proxy doesn't exist and has no connections
+            left.
+
+        :return: The ``ProxyStatistics`` of the proxy.
+        """
+        factory = self._proxies.get(proxy) or self._draining[proxy]
+        return factory.statistics
+
+    def drained(self, proxy):
+        """
+        :param Proxy proxy: A deleted proxy.
+
+        :return: A ``Deferred`` which fires when the connections through the
+            proxy are all closed.
+        """
+        factory = self._draining.get(proxy)
+        if factory is None:
+            return succeed(None)
+        return factory.drained()
+
+
+def make_userspace_network():
+    """
+    Create a new ``INetwork`` provider which forwards connections to the
+    proxied ports itself.
+    """
+    return UserspaceNetwork()
@@ -0,0 +1,348 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+# -*- test-case-name: flocker.route.test.test_benchmark -*-
+
+"""
+Measure the cost of proxying traffic with the ``INetwork`` implementations.
+
+For each number of proxies to measure, that many proxies are installed and
+then connections are made through the last of them.  The other proxies have
+destinations of their own, so that implementations with a rule per
+destination have to look past all of them.  The results are written as JSON,
+so that backends and changes to them can be compared.
+
+Run it as root, as ``python -m flocker.route.benchmark``.  The proxies are
+created in a new network namespace, as the functional tests do, so the
+host's own configuration is left alone.
+"""
+
+from __future__ import division
+
+import json
+import sys
+from math import ceil
+from socket import create_connection, socket, SHUT_RDWR, SHUT_WR
+from threading import Thread
+from time import time
+
+from zope.interface import implementer
+
+from ipaddr import IPAddress
+
+from twisted.internet.threads import blockingCallFromThread, deferToThread
+from twisted.python.usage import Options, UsageError
+
+from ..common.script import (
+    flocker_standard_options, ICommandLineScript, FlockerScriptRunner)
+from ._iptables import HostNetwork
+from ._nftables import NFTablesNetwork
+from ._userspace import UserspaceNetwork
+
+# Create the network to measure, given the address proxies are connected to.
+BACKENDS = {
+    b"iptables": lambda proxy_ip: HostNetwork(),
+    b"nftables": lambda proxy_ip: NFTablesNetwork(),
+    b"userspace": lambda proxy_ip: UserspaceNetwork(
+        interface=proxy_ip.exploded),
+}
+
+# The size of the reads and writes of the bulk transfer.
+CHUNK_SIZE = 64 * 1024
+
+
+def percentile(values, fraction):
+    """
+    :param list values: Some numbers.
+    :param float fraction: Which percentile to find, between 0 and 1.
+
+    :return: The smallest of ``values`` which is at least as large as
+        ``fraction`` of them.
+    """
+    values = sorted(values)
+    return values[max(int(ceil(fraction * len(values))) - 1, 0)]
+
+
+class _Server(Thread):
+    """
+    The destination of the measured proxy.
+
+    For each connection it echoes the first byte and then reads until the
+    client stops sending.
+    """
+    daemon = True
+
+    def __init__(self, ip):
+        """
+        :param IPAddress ip: The address to listen on.
+        """
+        Thread.__init__(self)
+        self.port = socket()
+        self.port.bind((ip.exploded, 0))
+        self.port.listen(128)
+
+    def run(self):
+        while True:
+            try:
+                connection, address = self.port.accept()
+            except Exception:
+                # The port was closed.
+                return
+            try:
+                connection.sendall(connection.recv(1))
+                while connection.recv(CHUNK_SIZE):
+                    pass
+            finally:
+                connection.close()
+
+    def stop(self):
+        # Shutting the port down makes the blocked accept fail:
+        self.port.shutdown(SHUT_RDWR)
+        self.port.close()
+        self.join()
+
+
+def _handshake(address):
+    """
+    Connect to an address and wait for the server to echo a byte back.
+
+    :param tuple address: The address to connect to.
+
+    :return: The connected socket.
+    """
+    client = create_connection(address)
+    client.sendall(b"x")
+    if client.recv(1) != b"x":
+        raise IOError("No echo from %s:%d" % address)
+    return client
+
+
+def measure_connections(address, count):
+    """
+    Make connections one after another.
+
+    The latency of a connection includes the first byte going to the
+    destination and back, so that it is comparable between implementations
+    which proxy in the kernel and those which accept the connection
+    themselves.
+
+    :param tuple address: The address to connect to.
+    :param int count: The number of connections to make.
+
+    :return: A ``tuple`` of the connections made per second and the 99th
+        percentile of their latencies in seconds.
+    """
+    latencies = []
+    start = time()
+    for i in range(count):
+        before = time()
+        client = _handshake(address)
+        latencies.append(time() - before)
+        client.close()
+    elapsed = time() - start
+    return count / elapsed, percentile(latencies, 0.99)
+
+
+def measure_throughput(address, size):
+    """
+    Send data over a single connection.
+
+    :param tuple address: The address to connect to.
+    :param int size: The number of bytes to send.
+
+    :return: The number of bytes sent per second, until the server had read
+        them all.
+    """
+    chunk = b"\0" * CHUNK_SIZE
+    client = _handshake(address)
+    try:
+        start = time()
+        for i in range(0, size, CHUNK_SIZE):
+            client.sendall(chunk[:size - i])
+        client.shutdown(SHUT_WR)
+        # The server closes the connection once it has read everything:
+        client.recv(1)
+        elapsed = time() - start
+    finally:
+        client.close()
+    return size / elapsed
+
+
+def _filler_ip(index):
+    """
+    :param int index: The index of a proxy not carrying any traffic.
+
+    :return: A destination for that proxy, different from those of the
+        others.
+    """
+    return IPAddress(u"10.200.0.0") + index
+
+
+def run_benchmark(network, proxy_ip, server_ip, counts, connections,
+                  bulk_bytes, first_port=10000, call=None):
+    """
+    Measure proxying through a network with increasing numbers of proxies.
+
+    :param INetwork network: The network to measure.  It should have no
+        proxies.
+    :param IPAddress proxy_ip: An address of this host to connect to the
+        proxies on.
+    :param IPAddress server_ip: Another address of this host for the
+        destination of the measured proxy.
+    :param list counts: The ``int`` numbers of proxies to measure with.
+    :param int connections: The number of connections to make each time.
+    :param int bulk_bytes: The number of bytes to send each time.
+    :param int first_port: The first port of the proxies not carrying any
+        traffic.
+    :param call: A callable taking a function and arguments and calling it
+        in the thread the network must be used from.  By default it is called
+        directly.
+
+    :return: A ``list`` of ``dict``\ s of results, one for each count.
+    """
+    if call is None:
+        call = lambda f, *args: f(*args)
+
+    server = _Server(server_ip)
+    server.start()
+    try:
+        port = server.port.getsockname()[1]
+        filler_ports = (p for p in range(first_port, 65536) if p != port)
+        results = []
+        for count in counts:
+            proxies = [(_filler_ip(i), next(filler_ports))
+                       for i in range(count - 1)]
+            proxies.append((server_ip, port))
+
+            start = time()
+            call(_change_proxies, network, proxies, [])
+            install = time() - start
+
+            rate, latency = measure_connections(
+                (proxy_ip.exploded, port), connections)
+            throughput = measure_throughput(
+                (proxy_ip.exploded, port), bulk_bytes)
+            results.append({
+                u"proxies": count,
+                u"install_seconds": install,
+                u"connections_per_second": rate,
+                u"p99_connect_latency_seconds": latency,
+                u"throughput_bytes_per_second": throughput,
+            })
+
+            call(_change_proxies, network, [],
+                 call(network.enumerate_proxies))
+    finally:
+        server.stop()
+    return results
+
+
+def _change_proxies(network, create, delete):
+    """
+    Create and delete some proxies in one transaction.
+
+    :param INetwork network: The network to change.
+    :param list create: ``tuple``\ s of the destination and port of the
+        proxies to create.
+    :param list delete: The ``Proxy`` instances to delete.
+    """
+    transaction = network.begin()
+    for proxy in delete:
+        transaction.delete_proxy(proxy)
+    for ip, port in create:
+        transaction.create_proxy_to(ip, port)
+    transaction.commit()
+
+
+def _counts(value):
+    """
+    Parse a comma-separated list of numbers of proxies.
+    """
+    try:
+        counts = [int(count) for count in value.split(b",")]
+    except ValueError:
+        raise UsageError("--proxies must be comma-separated numbers.")
+    if min(counts) < 1:
+        raise UsageError("--proxies must be at least 1.")
+    return counts
+
+
+@flocker_standard_options
+class BenchmarkOptions(Options):
+    """
+    Command line options for the route benchmark.
+    """
+    longdesc = """Measure the connection rate, connection latency and
+    throughput of proxies as their number grows, and write the results as
+    JSON.
+
+    """
+    synopsis = "Usage: python -m flocker.route.benchmark [OPTIONS]"
+
+    optParameters = [
+        ["backend", None, b"iptables",
+         "The INetwork implementation to measure: one of " +
+         ", ".join(sorted(BACKENDS)) + "."],
+        ["proxies", None, b"1,10,100,1000",
+         "The comma-separated numbers of proxies to measure with.", _counts],
+        ["connections", None, 1000,
+         "The number of connections to make for each number of proxies.",
+         int],
+        ["bulk-bytes", None, 64 * 1024 * 1024,
+         "The number of bytes to send for each number of proxies.", int],
+        ["output", None, None,
+         "The file to write the results to, rather than standard output."],
+    ]
+
+    def postOptions(self):
+        if self["backend"] not in BACKENDS:
+            raise UsageError("Unknown backend: %s" % (self["backend"],))
+
+
+@implementer(ICommandLineScript)
+class BenchmarkScript(object):
+    """
+    Run the benchmark in a new network namespace.
+    """
+    def main(self, reactor, options):
+        # Imported here since it needs test dependencies:
+        from .functional.iptables import create_network_namespace
+
+        # The namespace is created before the thread pool starts, so the
+        # measuring thread shares it.
+        namespace = create_network_namespace()
+        server_ip, proxy_ip = namespace.ADDRESSES
+        network = BACKENDS[options["backend"]](proxy_ip)
+
+        d = deferToThread(
+            run_benchmark, network, proxy_ip, server_ip,
+            options["proxies"], options["connections"],
+            options["bulk-bytes"],
+            call=lambda f, *args: blockingCallFromThread(reactor, f, *args))
+
+        def report(results):
+            output = json.dumps({
+                u"backend": options["backend"].decode("ascii"),
+                u"connections": options["connections"],
+                u"bulk_bytes": options["bulk-bytes"],
+                u"results": results,
+            }, indent=4, sort_keys=True) + b"\n"
+            if options["output"] is None:
+                sys.stdout.write(output)
+            else:
+                with open(options["output"], "wb") as f:
+                    f.write(output)
+        d.addCallback(report)
+
+        def restore(result):
+            namespace.restore()
+            return result
+        d.addBoth(restore)
+        return d
+
+
+def flocker_route_benchmark_main():
+    return FlockerScriptRunner(
+        script=BenchmarkScript(), options=BenchmarkOptions()).main()
+
+
+if __name__ == "__main__":
+    flocker_route_benchmark_main()
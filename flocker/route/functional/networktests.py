@@ -8,7 +8,7 @@ from zope.interface.verify import verifyObject
 from ipaddr import IPAddress
 from twisted.trial.unittest import SynchronousTestCase
 
-from .. import INetwork
+from .. import INetwork, INetworkTransaction
 
 
 def make_proxying_tests(make_network):
@@ -94,4 +94,66 @@ def make_proxying_tests(make_network):
             self.network.delete_proxy(proxy_one)
             self.assertEqual([proxy_two], self.network.enumerate_proxies())
 
+        def test_transaction_interface(self):
+            """
+            :py:meth:`INetwork.begin` returns an object which implements
+            ``INetworkTransaction``.
+            """
+            self.assertTrue(
+                verifyObject(INetworkTransaction, self.network.begin()))
+
+        def test_transaction_proxy_object(self):
+            """
+            The :py:meth:`INetworkTransaction.create_proxy_to` implementation
+            returns an object with attributes describing the proxy.
+            """
+            server_ip = IPAddress("10.2.3.4")
+            port = 54321
+            proxy = self.network.begin().create_proxy_to(server_ip, port)
+            self.assertEqual((proxy.ip, proxy.port), (server_ip, port))
+
+        def test_uncommitted_transaction(self):
+            """
+            Nothing is changed until the transaction is committed.
+            """
+            proxy = self.network.create_proxy_to(IPAddress("10.0.0.1"), 1)
+            transaction = self.network.begin()
+            transaction.create_proxy_to(IPAddress("10.0.0.2"), 2)
+            transaction.delete_proxy(proxy)
+            self.assertEqual([proxy], self.network.enumerate_proxies())
+
+        def test_committed_transaction(self):
+            """
+            After :py:meth:`INetworkTransaction.commit` is called, all the
+            proxies created in the transaction are enumerated and none of
+            those deleted in it.
+            """
+            proxy_one = self.network.create_proxy_to(IPAddress("10.0.0.1"), 1)
+            proxy_two = self.network.create_proxy_to(IPAddress("10.0.0.2"), 2)
+            transaction = self.network.begin()
+            proxy_three = transaction.create_proxy_to(
+                IPAddress("10.0.0.3"), 3)
+            proxy_four = transaction.create_proxy_to(IPAddress("10.0.0.4"), 4)
+            transaction.delete_proxy(proxy_one)
+            transaction.commit()
+            self.assertEqual(
+                sorted([proxy_two, proxy_three, proxy_four]),
+                sorted(self.network.enumerate_proxies()))
+
+        def test_failed_transaction(self):
+            """
+            If :py:meth:`INetworkTransaction.commit` fails because a proxy
+            being deleted does not exist, none of the changes in the
+            transaction are applied.
+            """
+            proxy = self.network.create_proxy_to(IPAddress("10.0.0.1"), 1)
+            self.network.delete_proxy(proxy)
+            existing = self.network.create_proxy_to(IPAddress("10.0.0.2"), 2)
+            transaction = self.network.begin()
+            transaction.create_proxy_to(IPAddress("10.0.0.3"), 3)
+            transaction.delete_proxy(existing)
+            transaction.delete_proxy(proxy)
+            self.assertRaises(Exception, transaction.commit)
+            self.assertEqual([existing], self.network.enumerate_proxies())
+
     return ProxyingTests
@@ -19,7 +19,8 @@ from eliot.testing import LoggedAction, validateLogging, assertHasAction
 from twisted.trial.unittest import TestCase
 
 from .. import make_host_network
-from .._logging import CREATE_PROXY_TO, DELETE_PROXY, IPTABLES
+from .._logging import (
+    CREATE_PROXY_TO, DELETE_PROXY, DELETE_ALL_PROXIES, IPTABLES_RESTORE)
 from .networktests import make_proxying_tests
 
 try:
@@ -47,8 +48,8 @@ def create_user_rule():
     """
     check_call([
         b"iptables",
-        # Stick it in the PREROUTING chain based on our knowledge that the
-        # implementation inspects this chain to enumerate proxies.
+        # Stick it in the PREROUTING chain, which jumps to the chain the
+        # implementation inspects to enumerate proxies.
         b"--table", b"nat", b"--append", b"PREROUTING",
 
         b"--protocol", b"tcp", b"--dport", b"12345",
@@ -72,7 +73,8 @@ def is_environment_configured():
 
 def some_iptables_logged(parent_action_type):
     """
-    Create a validator which assert that some ``IPTABLES`` actions got logged.
+    Create a validator which assert that some ``IPTABLES_RESTORE`` actions got
+    logged.
 
     They should be logged as children of a ``parent_action_type`` action (but
     this function will not verify that).  No other assertions are made about
@@ -86,7 +88,7 @@ def some_iptables_logged(parent_action_type):
         # Remember what the docstring said?  Ideally this would inspect the
         # children of the action returned by assertHasAction but the interfaces
         # don't seem to line up.
-        iptables = LoggedAction.ofType(logger.messages, IPTABLES)
+        iptables = LoggedAction.ofType(logger.messages, IPTABLES_RESTORE)
         case.assertNotEqual(iptables, [])
     return validate
 
@@ -357,8 +359,11 @@ class DeleteTests(TestCase):
         """
         After a route created using :py:func:`flocker.route.create_proxy_to` is
         deleted using :py:meth:`delete_proxy` the iptables rules which were
-        added by the former are removed.
+        added by the former are removed.  The Flocker chains, created along
+        with the first proxy, are left in place.
         """
+        self.network.delete_proxy(
+            self.network.create_proxy_to(IPAddress("10.1.2.4"), 23456))
         original_rules = get_iptables_rules()
 
         proxy = self.network.create_proxy_to(IPAddress("10.1.2.3"), 12345)
@@ -396,3 +401,87 @@ class DeleteTests(TestCase):
         self.assertEqual(
             expected,
             actual)
+
+    @validateLogging(some_iptables_logged(DELETE_ALL_PROXIES))
+    def test_delete_all_proxies(self, logger):
+        """
+        ``HostNetwork.delete_all_proxies`` removes all of the proxies and
+        leaves no rules behind in the Flocker chains.
+        """
+        self.network.delete_proxy(
+            self.network.create_proxy_to(IPAddress("10.1.2.4"), 23456))
+        expected = get_iptables_rules()
+
+        self.network.create_proxy_to(IPAddress("10.1.2.3"), 12345)
+        self.network.create_proxy_to(IPAddress("10.1.2.4"), 23456)
+        self.patch(self.network, "logger", logger)
+        self.network.delete_all_proxies()
+
+        self.assertEqual(
+            (expected, []),
+            (get_iptables_rules(), self.network.enumerate_proxies()))
+
+    def test_delete_all_without_proxies(self):
+        """
+        ``HostNetwork.delete_all_proxies`` does nothing if no proxy has ever
+        been created.
+        """
+        expected = get_iptables_rules()
+        self.network.delete_all_proxies()
+        self.assertEqual(expected, get_iptables_rules())
+
+
+class ChainTests(TestCase):
+    """
+    Tests for the chains holding the Flocker-managed rules.
+    """
+    @_dependency_skip
+    @_environment_skip
+    def setUp(self):
+        self.addCleanup(create_network_namespace().restore)
+        self.network = make_host_network()
+
+    def test_one_jump(self):
+        """
+        Each built-in chain has a single rule jumping to the corresponding
+        Flocker chain however many proxies there are, and the proxies' rules
+        are all in the Flocker chains.
+        """
+        self.network.create_proxy_to(IPAddress("10.1.2.3"), 12345)
+        self.network.create_proxy_to(IPAddress("10.1.2.4"), 23456)
+        rules = get_iptables_rules()
+        builtin = [rule.split()[1] for rule in rules
+                   if not rule.startswith(b"-A FLOCKER-")
+                   and rule.startswith(b"-A ")]
+        self.assertEqual(
+            sorted([b"PREROUTING", b"POSTROUTING", b"OUTPUT"]),
+            sorted(builtin))
+
+    def test_legacy_rules_migrated(self):
+        """
+        The rules an earlier version added to the built-in chains for a proxy
+        are replaced by rules in the Flocker chains by the first change.
+        """
+        for chain, options in [
+                (b"PREROUTING", [
+                    b"--match", b"addrtype", b"--dst-type", b"LOCAL",
+                    b"--match", b"comment",
+                    b"--comment", b"flocker create_proxy_to",
+                    b"--jump", b"DNAT", b"--to-destination", b"10.1.2.5"]),
+                (b"POSTROUTING", [b"--jump", b"MASQUERADE"]),
+                (b"OUTPUT", [
+                    b"--match", b"addrtype", b"--dst-type", b"LOCAL",
+                    b"--jump", b"DNAT", b"--to-destination", b"10.1.2.5"])]:
+            check_call([b"iptables", b"--table", b"nat", b"--append", chain,
+                        b"--protocol", b"tcp",
+                        b"--destination-port", b"8080"] + options)
+        self.network.create_proxy_to(IPAddress("10.1.2.3"), 12345)
+        builtin = [rule for rule in get_iptables_rules()
+                   if not rule.startswith(b"-A FLOCKER-")
+                   and rule.startswith(b"-A ")]
+        self.assertEqual(
+            ([b"FLOCKER-OUTPUT", b"FLOCKER-POSTROUTING",
+              b"FLOCKER-PREROUTING"],
+             [IPAddress("10.1.2.3"), IPAddress("10.1.2.5")]),
+            (sorted(rule.split()[-1] for rule in builtin),
+             sorted(proxy.ip for proxy in self.network.enumerate_proxies())))
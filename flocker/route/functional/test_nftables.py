@@ -0,0 +1,108 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Tests for :py:mod:`flocker.route._nftables`.
+"""
+
+from socket import socket
+from unittest import skipUnless
+
+from twisted.python.procutils import which
+from twisted.trial.unittest import TestCase
+
+from .. import make_nftables_network
+from .networktests import make_proxying_tests
+from .test_iptables_create import (
+    NOMENCLATURE_INSTALLED, is_environment_configured, connect_nonblocking)
+
+if NOMENCLATURE_INSTALLED:
+    from .iptables import create_network_namespace
+
+
+_environment_skip = skipUnless(
+    is_environment_configured() and which(b"nft"),
+    "Cannot test nftables proxies without suitable test environment.")
+
+_dependency_skip = skipUnless(
+    NOMENCLATURE_INSTALLED,
+    "Cannot test nftables proxies without nomenclature installed.")
+
+
+class NFTablesProxyTests(make_proxying_tests(make_nftables_network)):
+    """
+    Apply the generic ``INetwork`` test suite to the implementation which
+    manipulates the actual system ``nftables`` configuration.
+    """
+    @_dependency_skip
+    @_environment_skip
+    def setUp(self):
+        """
+        Arrange for the tests to not corrupt the system network configuration.
+        """
+        self.namespace = create_network_namespace()
+        self.addCleanup(self.namespace.restore)
+        super(NFTablesProxyTests, self).setUp()
+
+
+class NFTablesCreateTests(TestCase):
+    """
+    Tests for the proxying behaviour of ``nftables`` proxies.
+    """
+    @_dependency_skip
+    @_environment_skip
+    def setUp(self):
+        """
+        Select some addresses between which to proxy and set up a server to act
+        as the target of the proxying.
+        """
+        self.namespace = create_network_namespace()
+        self.addCleanup(self.namespace.restore)
+
+        self.network = make_nftables_network()
+
+        self.server_ip = self.namespace.ADDRESSES[0]
+        self.proxy_ip = self.namespace.ADDRESSES[1]
+
+        self.server = socket()
+        self.server.bind((self.server_ip.exploded, 0))
+        self.server.listen(1)
+        self.server.settimeout(1)
+        self.port = self.server.getsockname()[1]
+
+    def test_connection(self):
+        """
+        A connection attempt is forwarded to the specified destination address.
+        """
+        self.network.create_proxy_to(self.server_ip, self.port)
+
+        client = connect_nonblocking(self.proxy_ip, self.port)
+        accepted, client_address = self.server.accept()
+        self.assertEqual(client.getsockname(), client_address)
+
+    def test_deleted_proxy(self):
+        """
+        Once a proxy is deleted, connection attempts are no longer forwarded.
+        """
+        proxy = self.network.create_proxy_to(self.server_ip, self.port)
+        self.network.delete_proxy(proxy)
+
+        client = socket()
+        client.settimeout(1)
+        self.assertNotEqual(
+            0, client.connect_ex((self.proxy_ip.exploded, self.port)))
+
+    def test_many_proxies(self):
+        """
+        Connections are forwarded to the right destination when many proxies
+        exist.
+        """
+        transaction = self.network.begin()
+        for port in range(20000, 21000):
+            if port != self.port:
+                transaction.create_proxy_to(self.proxy_ip, port)
+        transaction.create_proxy_to(self.server_ip, self.port)
+        transaction.commit()
+
+        client = connect_nonblocking(self.proxy_ip, self.port)
+        accepted, client_address = self.server.accept()
+        self.assertEqual(client.getsockname(), client_address)
@@ -0,0 +1,100 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.route.benchmark``.
+"""
+
+from socket import socket
+
+from ipaddr import IPAddress
+
+from twisted.internet import reactor
+from twisted.internet.threads import blockingCallFromThread, deferToThread
+from twisted.python.usage import UsageError
+from twisted.trial.unittest import SynchronousTestCase, TestCase
+
+from .._userspace import UserspaceNetwork
+from ..benchmark import BenchmarkOptions, percentile, run_benchmark
+
+
+class PercentileTests(SynchronousTestCase):
+    """
+    Tests for ``percentile``.
+    """
+    def test_percentile(self):
+        """
+        ``percentile`` returns the smallest value at least as large as the
+        given fraction of the values.
+        """
+        values = range(100, 0, -1)
+        self.assertEqual((99, 50, 100),
+                         (percentile(values, 0.99), percentile(values, 0.5),
+                          percentile(values, 1)))
+
+    def test_single(self):
+        """
+        Every percentile of a single value is that value.
+        """
+        self.assertEqual(3, percentile([3], 0.99))
+
+
+class BenchmarkOptionsTests(SynchronousTestCase):
+    """
+    Tests for ``BenchmarkOptions``.
+    """
+    def test_proxies(self):
+        """
+        ``--proxies`` is parsed into a ``list`` of numbers of proxies.
+        """
+        options = BenchmarkOptions()
+        options.parseOptions([b"--proxies", b"1,5,20"])
+        self.assertEqual([1, 5, 20], options["proxies"])
+
+    def test_bad_proxies(self):
+        """
+        ``--proxies`` must be positive numbers.
+        """
+        self.assertRaises(
+            UsageError,
+            BenchmarkOptions().parseOptions, [b"--proxies", b"1,0"])
+
+    def test_unknown_backend(self):
+        """
+        ``--backend`` must name one of the implementations.
+        """
+        self.assertRaises(
+            UsageError,
+            BenchmarkOptions().parseOptions, [b"--backend", b"carrier-pigeon"])
+
+
+class RunBenchmarkTests(TestCase):
+    """
+    Tests for ``run_benchmark``, using the userspace implementation so that no
+    privileges are needed.
+    """
+    def test_results(self):
+        """
+        ``run_benchmark`` measures each number of proxies and deletes the
+        proxies it created.
+        """
+        port = socket()
+        port.bind((b"127.0.0.1", 0))
+        first_port = port.getsockname()[1]
+        port.close()
+
+        network = UserspaceNetwork(interface=b"127.0.0.1")
+        d = deferToThread(
+            run_benchmark, network, IPAddress("127.0.0.1"),
+            IPAddress("127.0.0.2"), [1, 2], 5, 1024 * 1024,
+            first_port=first_port,
+            call=lambda f, *args: blockingCallFromThread(reactor, f, *args))
+
+        def measured(results):
+            self.assertEqual(
+                ([1, 2], [], set()),
+                ([result[u"proxies"] for result in results],
+                 network.enumerate_proxies(),
+                 {key for result in results for key, value in result.items()
+                  if not value > 0}))
+        d.addCallback(measured)
+        return d
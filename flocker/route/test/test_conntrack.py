@@ -0,0 +1,63 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.route._conntrack``.
+"""
+
+from subprocess import CalledProcessError
+
+from ipaddr import IPAddress
+from eliot.testing import validateLogging, assertHasAction
+
+from twisted.trial.unittest import SynchronousTestCase
+
+from .. import Proxy
+from .._conntrack import forget_connections
+from .._logging import FORGET_CONNECTIONS
+
+
+class ForgetConnectionsTests(SynchronousTestCase):
+    """
+    Tests for ``forget_connections``.
+    """
+    def setUp(self):
+        self.commands = []
+
+    def call(self, argv, stdout, stderr):
+        self.commands.append(argv)
+
+    @validateLogging(assertHasAction, FORGET_CONNECTIONS, True)
+    def test_delete(self, logger):
+        """
+        ``forget_connections`` deletes the connection tracking entries of
+        connections to each proxy's port which were sent to its destination.
+        """
+        forget_connections(
+            logger,
+            [Proxy(ip=IPAddress("10.0.0.1"), port=1),
+             Proxy(ip=IPAddress("10.0.0.2"), port=2)],
+            call=self.call)
+        self.assertEqual(
+            [[b"conntrack", b"--delete", b"--proto", b"tcp",
+              b"--orig-port-dst", b"1", b"--reply-src", b"10.0.0.1"],
+             [b"conntrack", b"--delete", b"--proto", b"tcp",
+              b"--orig-port-dst", b"2", b"--reply-src", b"10.0.0.2"]],
+            self.commands)
+
+    @validateLogging(None)
+    def test_failures_ignored(self, logger):
+        """
+        ``forget_connections`` carries on if ``conntrack`` fails or isn't
+        installed.
+        """
+        def call(argv, stdout, stderr):
+            self.commands.append(argv)
+            if len(self.commands) == 1:
+                raise OSError()
+            raise CalledProcessError(1, argv)
+        forget_connections(
+            logger,
+            [Proxy(ip=IPAddress("10.0.0.1"), port=1),
+             Proxy(ip=IPAddress("10.0.0.2"), port=2)],
+            call=call)
+        self.assertEqual(2, len(self.commands))
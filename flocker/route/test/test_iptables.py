@@ -0,0 +1,847 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.route._iptables`` which don't need to change the
+system's ``iptables`` configuration.
+"""
+
+from subprocess import CalledProcessError
+
+from zope.interface.verify import verifyObject
+from ipaddr import IPAddress
+from eliot.testing import validateLogging, assertHasAction
+
+from twisted.trial.unittest import SynchronousTestCase
+
+from .. import INetworkTransaction, Proxy
+from .._logging import IPTABLES_RESTORE, DELETE_ALL_PROXIES
+from .. import _iptables
+from .._iptables import (
+    IPTablesTransaction, HostNetwork, iptables_restore, _format_rule,
+    _list_rules, FLOCKER_CHAINS, MULTIPORT_LIMIT, PROXY_CHAIN, RuleOptions,
+    parse_iptables_options)
+from .test_nftables import RecordingRouting
+
+
+class FakePopen(object):
+    """
+    A fake ``subprocess.Popen`` which records the standard input written to
+    it.
+
+    :ivar list processes: All of the ``FakePopen`` instances created so far,
+        shared by instances of the class.
+    """
+    returncode = 0
+    processes = None
+
+    def __init__(self, argv, stdin):
+        self.argv = argv
+        self.stdin = stdin
+        self.input = None
+        self.processes.append(self)
+
+    def communicate(self, data):
+        self.input = data
+        return None, None
+
+
+def fake_popen(case, returncode=0):
+    """
+    Replace ``Popen`` in ``flocker.route._iptables`` for the duration of a
+    test.
+
+    :param SynchronousTestCase case: The test to patch for.
+    :param int returncode: The exit code of the fake processes.
+
+    :return: The ``list`` to which the ``FakePopen`` instances are added.
+    """
+    processes = []
+
+    class Popen(FakePopen):
+        pass
+    Popen.processes = processes
+    Popen.returncode = returncode
+    case.patch(_iptables, "Popen", Popen)
+    return processes
+
+
+class FormatRuleTests(SynchronousTestCase):
+    """
+    Tests for ``_format_rule``.
+    """
+    def test_arguments(self):
+        """
+        The arguments are joined with spaces.
+        """
+        self.assertEqual(
+            b"--append OUTPUT --jump MASQUERADE",
+            _format_rule([b"--append", b"OUTPUT", b"--jump", b"MASQUERADE"]))
+
+    def test_quoting(self):
+        """
+        Arguments containing spaces are quoted.
+        """
+        self.assertEqual(
+            b'--comment "flocker create_proxy_to"',
+            _format_rule([b"--comment", b"flocker create_proxy_to"]))
+
+
+class IPTablesRestoreTests(SynchronousTestCase):
+    """
+    Tests for ``iptables_restore``.
+    """
+    @validateLogging(None)
+    def test_input(self, logger):
+        """
+        ``iptables_restore`` runs ``iptables-restore --noflush`` once with all
+        the rules for the NAT table on its standard input.
+        """
+        processes = fake_popen(self)
+        iptables_restore(logger, [[b"--append", b"OUTPUT"],
+                                  [b"--delete", b"PREROUTING"]])
+        self.assertEqual(
+            [([b"iptables-restore", b"--noflush"],
+              b"*nat\n--append OUTPUT\n--delete PREROUTING\nCOMMIT\n")],
+            [(process.argv, process.input) for process in processes])
+
+    def test_logged(self):
+        """
+        ``iptables_restore`` logs an ``IPTABLES_RESTORE`` action including its
+        input.
+        """
+        fake_popen(self)
+
+        def validate(case, logger):
+            assertHasAction(
+                case, logger, IPTABLES_RESTORE, succeeded=True,
+                startFields={u"input": u"*nat\n--append OUTPUT\nCOMMIT\n"})
+
+        @validateLogging(validate)
+        def run(case, logger):
+            iptables_restore(logger, [[b"--append", b"OUTPUT"]])
+        run(self)
+
+    @validateLogging(None)
+    def test_chains(self, logger):
+        """
+        ``iptables_restore`` declares the given chains before changing the
+        rules.
+        """
+        processes = fake_popen(self)
+        iptables_restore(logger, [[b"--append", b"FLOCKER-OUTPUT"]],
+                         [b"FLOCKER-OUTPUT"])
+        self.assertEqual(
+            b"*nat\n:FLOCKER-OUTPUT - [0:0]\n--append FLOCKER-OUTPUT\n"
+            b"COMMIT\n",
+            processes[0].input)
+
+    @validateLogging(None)
+    def test_failure(self, logger):
+        """
+        ``iptables_restore`` raises ``CalledProcessError`` if
+        ``iptables-restore`` exits with a non-zero status.
+        """
+        fake_popen(self, returncode=1)
+        self.assertRaises(
+            CalledProcessError,
+            iptables_restore, logger, [[b"--append", b"OUTPUT"]])
+
+
+class IPTablesTransactionTests(SynchronousTestCase):
+    """
+    Tests for ``IPTablesTransaction``.
+    """
+    def setUp(self):
+        self.restored = []
+        self.routing = RecordingRouting()
+        self.forgotten = []
+        self.forget = lambda logger, proxies: self.forgotten.extend(proxies)
+        self.patch(_iptables, "iptables_restore",
+                   lambda logger, rules, chains=():
+                   self.restored.append((rules, list(chains))))
+        # The Flocker chains exist, though empty:
+        self.patch(_iptables, "_list_rules", lambda chain: [])
+
+    def test_interface(self):
+        """
+        ``HostNetwork.begin`` returns an ``INetworkTransaction`` provider.
+        """
+        self.assertTrue(
+            verifyObject(INetworkTransaction, HostNetwork().begin()))
+
+    def test_empty(self):
+        """
+        Committing an empty transaction doesn't run ``iptables-restore``.
+        """
+        IPTablesTransaction(
+            None, self.routing, forget_connections=self.forget).commit()
+        self.assertEqual(([], 0), (self.restored, self.routing.ensured))
+
+    def existing(self, *proxies):
+        """
+        Make it look like some proxies exist already.
+
+        :param proxies: ``tuple``\ s of the ``bytes`` destination and the
+            ``bytes`` comma-separated ports of each rule of the existing
+            proxies.
+        """
+        lines = [
+            b"-A FLOCKER-PREROUTING -p tcp -m multiport --dports %s -j DNAT "
+            b"--to-destination %s" % (ports, ip)
+            for ip, ports in proxies]
+        self.patch(_iptables, "_list_rules", lambda chain: lines)
+
+    def test_single_restore(self):
+        """
+        All the proxies created and deleted in a transaction are changed with
+        a single ``iptables-restore`` run, which deletes the rules of the
+        deleted proxies and adds those of the created proxies.
+        """
+        self.existing((b"10.0.0.3", b"3"))
+        transaction = IPTablesTransaction(
+            None, self.routing, forget_connections=self.forget)
+        transaction.create_proxy_to(IPAddress("10.0.0.1"), 1)
+        transaction.create_proxy_to(IPAddress("10.0.0.2"), 2)
+        transaction.delete_proxy(Proxy(ip=IPAddress("10.0.0.3"), port=3))
+        transaction.commit()
+
+        def chunk(action, ip, port):
+            return [
+                [action, b"FLOCKER-PREROUTING", b"--protocol", b"tcp",
+                 b"--match", b"multiport", b"--destination-ports", port,
+                 b"--jump", b"DNAT", b"--to-destination", ip],
+                [action, b"FLOCKER-OUTPUT", b"--protocol", b"tcp",
+                 b"--match", b"multiport", b"--destination-ports", port,
+                 b"--jump", b"DNAT", b"--to-destination", ip],
+                [action, b"FLOCKER-POSTROUTING", b"--protocol", b"tcp",
+                 b"--match", b"multiport", b"--destination-ports", port,
+                 b"--jump", b"MASQUERADE"],
+            ]
+        self.assertEqual(
+            [chunk(b"--delete", b"10.0.0.3", b"3") +
+             chunk(b"--append", b"10.0.0.1", b"1") +
+             chunk(b"--append", b"10.0.0.2", b"2")],
+            [rules for rules, chains in self.restored])
+
+    def test_only_changed_chunks(self):
+        """
+        Only the rules of the chunk of ports gaining a proxy are rewritten;
+        the rules of other destinations are left alone.
+        """
+        self.existing((b"10.0.0.1", b"1,2"), (b"10.0.0.2", b"5"))
+        transaction = IPTablesTransaction(
+            None, self.routing, forget_connections=self.forget)
+        transaction.create_proxy_to(IPAddress("10.0.0.2"), 6)
+        transaction.commit()
+        [(rules, chains)] = self.restored
+        self.assertEqual(
+            [(b"--delete", b"5", b"10.0.0.2")] * 3 +
+            [(b"--append", b"5,6", b"10.0.0.2")] * 3,
+            [(rule[0], rule[rule.index(b"--destination-ports") + 1],
+              rule[-1] if rule[-2] == b"--to-destination" else b"10.0.0.2")
+             for rule in rules])
+
+    def test_delete_last_of_chunk(self):
+        """
+        Deleting the last proxy of a chunk deletes its rules without adding
+        any.
+        """
+        self.existing((b"10.0.0.1", b"1,2"), (b"10.0.0.2", b"5"))
+        transaction = IPTablesTransaction(
+            None, self.routing, forget_connections=self.forget)
+        transaction.delete_proxy(Proxy(ip=IPAddress("10.0.0.2"), port=5))
+        transaction.commit()
+        [(rules, chains)] = self.restored
+        self.assertEqual([b"--delete"] * 3, [rule[0] for rule in rules])
+
+    def test_existing_proxy_unchanged(self):
+        """
+        Creating a proxy which already exists doesn't run
+        ``iptables-restore``.
+        """
+        self.existing((b"10.0.0.1", b"1"))
+        transaction = IPTablesTransaction(
+            None, self.routing, forget_connections=self.forget)
+        transaction.create_proxy_to(IPAddress("10.0.0.1"), 1)
+        transaction.commit()
+        self.assertEqual([], self.restored)
+
+    def test_unexpected_rules_rewritten(self):
+        """
+        If the rules of a changed chunk can't be deleted, for example because
+        an earlier version wrote them differently, the Flocker chains are
+        rewritten from scratch.
+        """
+        def restore(logger, rules, chains=()):
+            self.restored.append(rules)
+            if rules[0][0] == b"--delete":
+                raise CalledProcessError(1, [b"iptables-restore"])
+        self.patch(_iptables, "iptables_restore", restore)
+        self.existing((b"10.0.0.1", b"1"), (b"10.0.0.2", b"5"))
+        transaction = IPTablesTransaction(
+            None, self.routing, forget_connections=self.forget)
+        transaction.create_proxy_to(IPAddress("10.0.0.1"), 2)
+        transaction.commit()
+        self.assertEqual(
+            [[b"--flush", chain] for chain, builtin in FLOCKER_CHAINS] +
+            [[b"--append", PROXY_CHAIN, b"1,2", b"10.0.0.1"],
+             [b"--append", PROXY_CHAIN, b"5", b"10.0.0.2"]],
+            [rule if rule[0] == b"--flush" else
+             rule[:2] + [rule[rule.index(b"--destination-ports") + 1],
+                         rule[-1]]
+             for rule in self.restored[-1]
+             if rule[0] == b"--flush" or rule[1] == PROXY_CHAIN])
+
+    def test_snapshot(self):
+        """
+        The rules are changed from the snapshot the transaction is given,
+        rather than read from the system again.
+        """
+        self.patch(_iptables, "_list_rules", None)
+        snapshot = _iptables.ProxyRules(
+            chunks=[(u"10.0.0.1", (1,))], legacy_deletes=[],
+            legacy_proxies=frozenset())
+        transaction = IPTablesTransaction(
+            None, self.routing, forget_connections=self.forget,
+            snapshot=lambda: snapshot)
+        transaction.create_proxy_to(IPAddress("10.0.0.1"), 2)
+        transaction.commit()
+        [(rules, chains)] = self.restored
+        self.assertEqual(
+            [b"1"] * 3 + [b"1,2"] * 3,
+            [rule[rule.index(b"--destination-ports") + 1] for rule in rules])
+
+    def test_flocker_chains(self):
+        """
+        The rules of the proxies are all in the Flocker chains.
+        """
+        transaction = IPTablesTransaction(
+            None, self.routing, forget_connections=self.forget)
+        transaction.create_proxy_to(IPAddress("10.0.0.1"), 1)
+        transaction.commit()
+        [(rules, chains)] = self.restored
+        self.assertEqual(
+            ({chain for chain, builtin in FLOCKER_CHAINS}, []),
+            ({rule[1] for rule in rules}, chains))
+
+    def test_create_chains(self):
+        """
+        If the Flocker chains don't exist yet they are created, along with the
+        rules jumping to them from the built-in chains, in the same
+        ``iptables-restore`` run as the first change.
+        """
+        self.patch(_iptables, "_list_rules", lambda chain: None)
+        transaction = IPTablesTransaction(
+            None, self.routing, forget_connections=self.forget)
+        transaction.create_proxy_to(IPAddress("10.0.0.1"), 1)
+        transaction.commit()
+        [(rules, chains)] = self.restored
+        self.assertEqual(
+            ([chain for chain, builtin in FLOCKER_CHAINS],
+             [[b"--append", builtin, b"--jump", chain]
+              for chain, builtin in FLOCKER_CHAINS]),
+            (chains, [rule[:2] + rule[-2:] for rule in rules[:3]]))
+
+    def test_existing_proxies_kept(self):
+        """
+        The proxies which already exist are kept when the Flocker chains are
+        rewritten.
+        """
+        self.existing((b"10.0.0.1", b"1"))
+        transaction = IPTablesTransaction(
+            None, self.routing, forget_connections=self.forget)
+        transaction.create_proxy_to(IPAddress("10.0.0.1"), 2)
+        transaction.commit()
+        [(rules, chains)] = self.restored
+        self.assertEqual(
+            [b"1,2"] * 3,
+            [rule[rule.index(b"--destination-ports") + 1]
+             for rule in rules if rule[0] == b"--append"])
+
+    def test_compacted(self):
+        """
+        Proxies to the same destination share a rule in each Flocker chain,
+        whatever the order they were created in.
+        """
+        transaction = IPTablesTransaction(
+            None, self.routing, forget_connections=self.forget)
+        for port in [3, 1, 2]:
+            transaction.create_proxy_to(IPAddress("10.0.0.1"), port)
+        transaction.commit()
+        [(rules, chains)] = self.restored
+        self.assertEqual(
+            [(b"FLOCKER-PREROUTING", b"1,2,3"), (b"FLOCKER-OUTPUT", b"1,2,3"),
+             (b"FLOCKER-POSTROUTING", b"1,2,3")],
+            [(rule[1], rule[rule.index(b"--destination-ports") + 1])
+             for rule in rules if rule[0] == b"--append"])
+
+    def test_multiport_limit(self):
+        """
+        No rule matches more than ``MULTIPORT_LIMIT`` ports; more proxies to a
+        destination are split across several rules.
+        """
+        transaction = IPTablesTransaction(
+            None, self.routing, forget_connections=self.forget)
+        for port in range(1, MULTIPORT_LIMIT + 2):
+            transaction.create_proxy_to(IPAddress("10.0.0.1"), port)
+        transaction.commit()
+        [(rules, chains)] = self.restored
+        output = [
+            rule[rule.index(b"--destination-ports") + 1]
+            for rule in rules if rule[:2] == [b"--append", b"FLOCKER-OUTPUT"]]
+        self.assertEqual(
+            [b",".join(b"%d" % (port,)
+                       for port in range(1, MULTIPORT_LIMIT + 1)),
+             b"%d" % (MULTIPORT_LIMIT + 1,)],
+            output)
+
+    def test_delete_missing(self):
+        """
+        Committing a transaction which deletes a proxy that doesn't exist
+        raises ``KeyError`` and changes nothing.
+        """
+        transaction = IPTablesTransaction(
+            None, self.routing, forget_connections=self.forget)
+        transaction.create_proxy_to(IPAddress("10.0.0.1"), 1)
+        transaction.delete_proxy(Proxy(ip=IPAddress("10.0.0.3"), port=3))
+        self.assertRaises(KeyError, transaction.commit)
+        self.assertEqual([], self.restored)
+
+    def test_routing_enabled_once(self):
+        """
+        The system is configured to forward traffic only once however many
+        proxies are created.
+        """
+        transaction = IPTablesTransaction(
+            None, self.routing, forget_connections=self.forget)
+        transaction.create_proxy_to(IPAddress("10.0.0.1"), 1)
+        transaction.create_proxy_to(IPAddress("10.0.0.2"), 2)
+        transaction.commit()
+        self.assertEqual(1, self.routing.ensured)
+
+    def test_delete_only(self):
+        """
+        The system's forwarding configuration is left alone if proxies are
+        only deleted.
+        """
+        self.existing((b"10.0.0.3", b"3"))
+        transaction = IPTablesTransaction(
+            None, self.routing, forget_connections=self.forget)
+        transaction.delete_proxy(Proxy(ip=IPAddress("10.0.0.3"), port=3))
+        transaction.commit()
+        self.assertEqual(0, self.routing.ensured)
+
+    def test_forget_connections(self):
+        """
+        The connections through the deleted proxies are forgotten once the
+        proxies have been deleted.
+        """
+        self.existing((b"10.0.0.3", b"3"))
+        proxy = Proxy(ip=IPAddress("10.0.0.3"), port=3)
+        transaction = IPTablesTransaction(
+            None, self.routing, forget_connections=self.forget)
+        transaction.create_proxy_to(IPAddress("10.0.0.1"), 1)
+        transaction.delete_proxy(proxy)
+        transaction.commit()
+        self.assertEqual([proxy], self.forgotten)
+
+    def test_failed_commit_remembers_connections(self):
+        """
+        If the proxies can't be deleted the connections through them are not
+        forgotten.
+        """
+        def fail(logger, rules, chains=()):
+            raise CalledProcessError(1, [b"iptables-restore"])
+        self.patch(_iptables, "iptables_restore", fail)
+        self.existing((b"10.0.0.3", b"3"))
+        transaction = IPTablesTransaction(
+            None, self.routing, forget_connections=self.forget)
+        transaction.delete_proxy(Proxy(ip=IPAddress("10.0.0.3"), port=3))
+        self.assertRaises(CalledProcessError, transaction.commit)
+        self.assertEqual([], self.forgotten)
+
+    def test_create_and_delete(self):
+        """
+        A proxy created and deleted in the same transaction doesn't exist
+        after it is committed, so no rules are changed.
+        """
+        transaction = IPTablesTransaction(
+            None, self.routing, forget_connections=self.forget)
+        transaction.create_proxy_to(IPAddress("10.0.0.1"), 1)
+        transaction.delete_proxy(Proxy(ip=IPAddress("10.0.0.1"), port=1))
+        transaction.commit()
+        self.assertEqual([], self.restored)
+
+
+# The rules an earlier version created for a proxy to 10.0.0.5 on port 80,
+# along with rules of other software, as listed by ``_list_rules``.
+LEGACY_RULES = {
+    b"PREROUTING": [
+        b"-A PREROUTING -p tcp -m tcp --dport 22 -j ACCEPT",
+        b"-A PREROUTING -p tcp -m tcp --dport 80 -m addrtype --dst-type LOCAL "
+        b"-m comment --comment \"flocker create_proxy_to\" -j DNAT "
+        b"--to-destination 10.0.0.5"],
+    b"OUTPUT": [
+        b"-A OUTPUT -p tcp -m tcp --dport 80 -m addrtype --dst-type LOCAL "
+        b"-j DNAT --to-destination 10.0.0.5",
+        b"-A OUTPUT -p tcp -m tcp --dport 81 -m addrtype --dst-type LOCAL "
+        b"-j DNAT --to-destination 10.0.0.5"],
+    b"POSTROUTING": [
+        b"-A POSTROUTING -p tcp -m tcp --dport 80 -j MASQUERADE",
+        b"-A POSTROUTING -o eth0 -j MASQUERADE"],
+}
+
+# The rules deleting the rules of that proxy.
+LEGACY_DELETES = [
+    [b"--delete", b"PREROUTING", b"-p", b"tcp", b"-m", b"tcp",
+     b"--dport", b"80", b"-m", b"addrtype", b"--dst-type", b"LOCAL",
+     b"-m", b"comment", b"--comment", b"flocker create_proxy_to",
+     b"-j", b"DNAT", b"--to-destination", b"10.0.0.5"],
+    [b"--delete", b"OUTPUT", b"-p", b"tcp", b"-m", b"tcp",
+     b"--dport", b"80", b"-m", b"addrtype", b"--dst-type", b"LOCAL",
+     b"-j", b"DNAT", b"--to-destination", b"10.0.0.5"],
+    [b"--delete", b"POSTROUTING", b"-p", b"tcp", b"-m", b"tcp",
+     b"--dport", b"80", b"-j", b"MASQUERADE"],
+]
+
+
+class LegacyRulesTests(SynchronousTestCase):
+    """
+    Tests for the handling of the rules earlier versions created in the
+    built-in chains, before the Flocker chains existed.
+    """
+    def setUp(self):
+        self.restored = []
+        self.forgotten = []
+        self.patch(_iptables, "iptables_restore",
+                   lambda logger, rules, chains=():
+                   self.restored.append(rules))
+        # Only the built-in chains exist:
+        self.patch(_iptables, "_list_rules", LEGACY_RULES.get)
+        self.network = HostNetwork(
+            routing=RecordingRouting(),
+            forget_connections=lambda logger, proxies:
+            self.forgotten.extend(proxies))
+
+    def test_enumerated(self):
+        """
+        The proxies created by earlier versions are enumerated until the
+        Flocker chains exist.
+        """
+        self.assertEqual([Proxy(ip=IPAddress("10.0.0.5"), port=80)],
+                         self.network.enumerate_proxies())
+
+    def test_migrated(self):
+        """
+        The first transaction deletes the rules of the proxies created by
+        earlier versions, leaving other rules alone, and recreates the
+        proxies in the Flocker chains.
+        """
+        self.network.create_proxy_to(IPAddress("10.0.0.1"), 1)
+        [rules] = self.restored
+        self.assertEqual(
+            (LEGACY_DELETES,
+             [b"80", b"1"]),
+            (rules[:3],
+             [rule[rule.index(b"--destination-ports") + 1]
+              for rule in rules if rule[:2] == [b"--append", PROXY_CHAIN]]))
+
+    def test_migrated_deleted(self):
+        """
+        A proxy created by an earlier version can be deleted in the first
+        transaction.
+        """
+        self.network.delete_proxy(Proxy(ip=IPAddress("10.0.0.5"), port=80))
+        [rules] = self.restored
+        self.assertEqual(
+            (LEGACY_DELETES, []),
+            (rules[:3], [rule for rule in rules
+                         if rule[:2] == [b"--append", PROXY_CHAIN]]))
+
+    def test_delete_all(self):
+        """
+        ``HostNetwork.delete_all_proxies`` deletes the rules of the proxies
+        created by earlier versions and forgets their connections.
+        """
+        self.network.delete_all_proxies()
+        self.assertEqual(
+            ([LEGACY_DELETES], [Proxy(ip=IPAddress("10.0.0.5"), port=80)]),
+            (self.restored, self.forgotten))
+
+
+class ListRulesTests(SynchronousTestCase):
+    """
+    Tests for ``_list_rules``.
+    """
+    def test_rules(self):
+        """
+        ``_list_rules`` lists the rules of the given chain only.
+        """
+        commands = []
+
+        def check_output(argv, stderr):
+            commands.append(argv)
+            return (
+                b"-N FLOCKER-PREROUTING\n"
+                b"-A FLOCKER-PREROUTING -p tcp -m tcp --dport 1 "
+                b"-m comment --comment \"a b\" -j DNAT "
+                b"--to-destination 10.0.0.1\n")
+        self.patch(_iptables, "check_output", check_output)
+        self.assertEqual(
+            ([b"-A FLOCKER-PREROUTING -p tcp -m tcp --dport 1 "
+              b"-m comment --comment \"a b\" -j DNAT "
+              b"--to-destination 10.0.0.1"],
+             [[b"iptables", b"--table", b"nat", b"--list-rules",
+               b"FLOCKER-PREROUTING"]]),
+            (_list_rules(b"FLOCKER-PREROUTING"), commands))
+
+    def test_missing_chain(self):
+        """
+        ``_list_rules`` returns ``None`` if the chain does not exist.
+        """
+        def check_output(argv, stderr):
+            raise CalledProcessError(1, argv)
+        self.patch(_iptables, "check_output", check_output)
+        self.assertIs(None, _list_rules(b"FLOCKER-PREROUTING"))
+
+
+class EnumerateProxiesTests(SynchronousTestCase):
+    """
+    Tests for ``HostNetwork.enumerate_proxies``.
+    """
+    def test_proxies(self):
+        """
+        A proxy is enumerated for each DNAT rule in the
+        ``FLOCKER-PREROUTING`` chain.
+        """
+        rules = {
+            b"FLOCKER-PREROUTING": [
+                b"-A FLOCKER-PREROUTING -p tcp -m tcp --dport 1 -j DNAT "
+                b"--to-destination 10.0.0.1",
+                b"-A FLOCKER-PREROUTING -p tcp -j RETURN"]}
+        self.patch(_iptables, "_list_rules", rules.get)
+        self.assertEqual(
+            [Proxy(ip=IPAddress("10.0.0.1"), port=1)],
+            HostNetwork().enumerate_proxies())
+
+    def test_multiport_expanded(self):
+        """
+        A proxy is enumerated for each port matched by a ``multiport`` DNAT
+        rule.
+        """
+        rules = {
+            b"FLOCKER-PREROUTING": [
+                b"-A FLOCKER-PREROUTING -p tcp -m multiport --dports 1,3 "
+                b"-j DNAT --to-destination 10.0.0.1"]}
+        self.patch(_iptables, "_list_rules", rules.get)
+        self.assertEqual(
+            [Proxy(ip=IPAddress("10.0.0.1"), port=1),
+             Proxy(ip=IPAddress("10.0.0.1"), port=3)],
+            HostNetwork().enumerate_proxies())
+
+    def test_snapshot(self):
+        """
+        The proxies are only read from the system once, as long as the
+        ``HostNetwork`` doesn't change them.
+        """
+        reads = []
+
+        def list_rules(chain):
+            reads.append(chain)
+            return []
+        self.patch(_iptables, "_list_rules", list_rules)
+        network = HostNetwork()
+        network.enumerate_proxies()
+        network.enumerate_proxies()
+        self.assertEqual([b"FLOCKER-PREROUTING"], reads)
+
+    def test_snapshot_copied(self):
+        """
+        Changing the ``list`` returned by ``HostNetwork.enumerate_proxies``
+        doesn't change the snapshot.
+        """
+        self.patch(_iptables, "_list_rules", lambda chain: [])
+        network = HostNetwork()
+        network.enumerate_proxies().append(None)
+        self.assertEqual([], network.enumerate_proxies())
+
+    def assert_invalidated(self, change):
+        """
+        Assert that a change made by the ``HostNetwork`` makes it read the
+        proxies from the system again.
+
+        :param change: A callable taking the ``HostNetwork`` and changing its
+            proxies.
+        """
+        reads = []
+
+        def list_rules(chain):
+            reads.append(chain)
+            return [b"-A FLOCKER-PREROUTING -p tcp -m tcp --dport 1 -j DNAT "
+                    b"--to-destination 10.0.0.1"]
+        self.patch(_iptables, "_list_rules", list_rules)
+        self.patch(_iptables, "iptables_restore",
+                   lambda logger, rules, chains=(): None)
+        network = HostNetwork(
+            routing=RecordingRouting(),
+            forget_connections=lambda logger, proxies: None)
+        network.enumerate_proxies()
+        del reads[:]
+        change(network)
+        del reads[:]
+        network.enumerate_proxies()
+        self.assertEqual([b"FLOCKER-PREROUTING"], reads)
+
+    def test_create_invalidates(self):
+        """
+        Creating a proxy discards the snapshot.
+        """
+        self.assert_invalidated(
+            lambda network: network.create_proxy_to(IPAddress("10.0.0.1"), 1))
+
+    def test_delete_invalidates(self):
+        """
+        Deleting a proxy discards the snapshot.
+        """
+        self.assert_invalidated(
+            lambda network: network.delete_proxy(
+                Proxy(ip=IPAddress("10.0.0.1"), port=1)))
+
+    def test_delete_all_invalidates(self):
+        """
+        Deleting all proxies discards the snapshot.
+        """
+        self.assert_invalidated(
+            lambda network: network.delete_all_proxies())
+
+    def test_commit_invalidates(self):
+        """
+        Committing a transaction discards the snapshot.
+        """
+        def change(network):
+            transaction = network.begin()
+            transaction.create_proxy_to(IPAddress("10.0.0.1"), 1)
+            transaction.commit()
+        self.assert_invalidated(change)
+
+    def test_failed_commit_invalidates(self):
+        """
+        Committing a transaction discards the snapshot even if the commit
+        fails.
+        """
+        def fail(logger, rules, chains=()):
+            raise CalledProcessError(1, [b"iptables-restore"])
+
+        def change(network):
+            self.patch(_iptables, "iptables_restore", fail)
+            transaction = network.begin()
+            transaction.create_proxy_to(IPAddress("10.0.0.1"), 2)
+            self.assertRaises(CalledProcessError, transaction.commit)
+        self.assert_invalidated(change)
+
+    def test_no_chains(self):
+        """
+        No proxies are enumerated if the Flocker chains don't exist.
+        """
+        self.patch(_iptables, "_list_rules", lambda chain: None)
+        self.assertEqual([], HostNetwork().enumerate_proxies())
+
+
+class ParseIPTablesOptionsTests(SynchronousTestCase):
+    """
+    Tests for ``parse_iptables_options``.
+    """
+    def test_dnat(self):
+        """
+        The destination port, the DNAT destination and the comment are taken
+        from the rule.
+        """
+        self.assertEqual(
+            RuleOptions(comment=b"x", destination_ports=(1,),
+                        to_destination=IPAddress("10.0.0.1")),
+            parse_iptables_options(
+                b"-A FLOCKER-PREROUTING -p tcp -m tcp --dport 1 -m comment "
+                b"--comment x -j DNAT --to-destination 10.0.0.1".split()))
+
+    def test_not_dnat(self):
+        """
+        A rule without a DNAT destination has no destination port either.
+        """
+        self.assertEqual(
+            RuleOptions(comment=None, destination_ports=None,
+                        to_destination=None),
+            parse_iptables_options(
+                b"-A FLOCKER-POSTROUTING -p tcp -m tcp --dport 1 "
+                b"-j MASQUERADE".split()))
+
+    def test_truncated(self):
+        """
+        A rule ending in an option without its value is parsed without that
+        value.
+        """
+        self.assertEqual(
+            RuleOptions(comment=None, destination_ports=None,
+                        to_destination=None),
+            parse_iptables_options([b"--dport", b"1", b"--to-destination"]))
+
+    def test_multiport(self):
+        """
+        All of the ports and port ranges of a ``multiport`` match are taken
+        from the rule.
+        """
+        self.assertEqual(
+            RuleOptions(comment=None, destination_ports=(1, 3, 4, 5),
+                        to_destination=IPAddress("10.0.0.1")),
+            parse_iptables_options(
+                b"-A FLOCKER-PREROUTING -p tcp -m multiport --dports 1,3:5 "
+                b"-j DNAT --to-destination 10.0.0.1".split()))
+
+
+class DeleteAllProxiesTests(SynchronousTestCase):
+    """
+    Tests for ``HostNetwork.delete_all_proxies``.
+    """
+    def setUp(self):
+        self.restored = []
+        self.forgotten = []
+        self.patch(_iptables, "iptables_restore",
+                   lambda logger, rules: self.restored.append(rules))
+        self.network = HostNetwork(
+            forget_connections=lambda logger, proxies:
+            self.forgotten.extend(proxies))
+
+    @validateLogging(assertHasAction, DELETE_ALL_PROXIES, True)
+    def test_flush(self, logger):
+        """
+        ``HostNetwork.delete_all_proxies`` flushes each of the Flocker chains
+        in a single ``iptables-restore`` run.
+        """
+        self.patch(_iptables, "_list_rules", lambda chain: [])
+        self.patch(self.network, "logger", logger)
+        self.network.delete_all_proxies()
+        self.assertEqual(
+            [[[b"--flush", chain] for chain, builtin in FLOCKER_CHAINS]],
+            self.restored)
+
+    def test_forget_connections(self):
+        """
+        ``HostNetwork.delete_all_proxies`` forgets the connections through
+        all of the deleted proxies.
+        """
+        rules = {
+            b"FLOCKER-PREROUTING": [
+                b"-A FLOCKER-PREROUTING -p tcp -m tcp --dport 1 -j DNAT "
+                b"--to-destination 10.0.0.1"]}
+        self.patch(_iptables, "_list_rules", rules.get)
+        self.network.delete_all_proxies()
+        self.assertEqual(
+            [Proxy(ip=IPAddress("10.0.0.1"), port=1)], self.forgotten)
+
+    def test_no_chains(self):
+        """
+        ``HostNetwork.delete_all_proxies`` does nothing if the Flocker chains
+        don't exist.
+        """
+        self.patch(_iptables, "_list_rules", lambda chain: None)
+        self.network.delete_all_proxies()
+        self.assertEqual(([], []), (self.restored, self.forgotten))
@@ -0,0 +1,234 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.route._nftables`` which don't need to change the
+system's ``nftables`` configuration.
+"""
+
+from subprocess import CalledProcessError
+
+from ipaddr import IPAddress
+from eliot.testing import validateLogging, assertHasAction
+
+from twisted.trial.unittest import SynchronousTestCase
+
+from .. import Proxy
+from .._logging import NFT
+from .._nftables import NFTablesNetwork, parse_map_elements, _SETUP
+from ..functional.networktests import make_proxying_tests
+
+
+class FakeNFT(object):
+    """
+    An in-memory stand-in for ``run_nft`` which understands the statements
+    used by ``NFTablesNetwork``.
+
+    :ivar bool table: Whether the ``flocker`` table has been created.
+    :ivar dict proxies: The ``proxies`` map, from ``bytes`` port to ``bytes``
+        address.
+    :ivar set ports: The ``ports`` set, of ``bytes`` ports.
+    :ivar list batches: The batches which were run.
+    """
+    def __init__(self):
+        self.table = False
+        self.proxies = {}
+        self.ports = set()
+        self.batches = []
+
+    def __call__(self, argv, input=None):
+        if argv == [b"-f", b"-"]:
+            self._run_batch(input)
+            return b""
+        if argv == [b"-nn", b"list", b"map", b"ip", b"flocker", b"proxies"]:
+            if not self.table:
+                raise CalledProcessError(1, argv)
+            return (
+                b"table ip flocker {\n"
+                b"\tmap proxies {\n"
+                b"\t\ttype inet_service : ipv4_addr\n"
+                b"\t\telements = { " +
+                b",\n\t\t\t     ".join(
+                    port + b" : " + ip
+                    for port, ip in sorted(self.proxies.items())) +
+                b" }\n"
+                b"\t}\n"
+                b"}\n")
+        raise CalledProcessError(1, argv)
+
+    def _run_batch(self, batch):
+        """
+        Apply a batch, or nothing of it if any statement fails.
+        """
+        self.batches.append(batch)
+        table = self.table
+        proxies = self.proxies.copy()
+        ports = self.ports.copy()
+        for statement in batch.splitlines():
+            words = statement.split()
+            if words[:2] == [b"add", b"table"]:
+                table = True
+            elif words[1:2] == [b"element"]:
+                if not table:
+                    raise CalledProcessError(1, [b"nft"])
+                elements = statement[statement.index(b"{") + 1:-1]
+                port = elements.split(b":")[0].strip()
+                if words[0] == b"add" and words[4] == b"proxies":
+                    proxies[port] = elements.split(b":")[1].strip()
+                elif words[0] == b"add":
+                    ports.add(port)
+                elif port not in (proxies if words[4] == b"proxies"
+                                  else ports):
+                    raise CalledProcessError(1, [b"nft"])
+                elif words[4] == b"proxies":
+                    del proxies[port]
+                else:
+                    ports.remove(port)
+        self.table, self.proxies, self.ports = table, proxies, ports
+
+
+class RecordingRouting(object):
+    """
+    A stand-in for ``RoutingPrerequisites`` which records how often it is
+    ensured.
+
+    :ivar int ensured: The number of ``ensure`` calls.
+    """
+    ensured = 0
+
+    def ensure(self):
+        self.ensured += 1
+
+
+def make_fake_nftables_network():
+    """
+    :return: A ``NFTablesNetwork`` which changes a ``FakeNFT``.
+    """
+    return NFTablesNetwork(
+        nft=FakeNFT(), routing=RecordingRouting(),
+        forget_connections=lambda logger, proxies: None)
+
+
+class FakeNFTablesProxyTests(make_proxying_tests(make_fake_nftables_network)):
+    """
+    Apply the generic ``INetwork`` test suite to the ``nftables``
+    implementation, running a fake ``nft``.
+    """
+
+
+class NFTablesNetworkTests(SynchronousTestCase):
+    """
+    Tests for ``NFTablesNetwork``.
+    """
+    def setUp(self):
+        self.nft = FakeNFT()
+        self.routing = RecordingRouting()
+        self.forgotten = []
+        self.network = NFTablesNetwork(
+            nft=self.nft, routing=self.routing,
+            forget_connections=lambda logger, proxies:
+            self.forgotten.extend(proxies))
+
+    def test_single_batch(self):
+        """
+        All the changes in a transaction are made in a single batch, which
+        also sets up the table.
+        """
+        transaction = self.network.begin()
+        transaction.create_proxy_to(IPAddress("10.0.0.1"), 1)
+        transaction.create_proxy_to(IPAddress("10.0.0.2"), 2)
+        transaction.commit()
+        [batch] = self.nft.batches
+        self.assertEqual(
+            _SETUP + [
+                b"add element ip flocker proxies { 1 : 10.0.0.1 }",
+                b"add element ip flocker ports { 1 }",
+                b"add element ip flocker proxies { 2 : 10.0.0.2 }",
+                b"add element ip flocker ports { 2 }",
+            ],
+            batch.splitlines())
+
+    def test_no_rule_per_proxy(self):
+        """
+        The rules do not depend on the proxies; the proxies are elements of
+        the map and set the rules look up.
+        """
+        self.network.create_proxy_to(IPAddress("10.0.0.1"), 1)
+        self.network.create_proxy_to(IPAddress("10.0.0.2"), 2)
+        rules = [
+            [line for line in batch.splitlines()
+             if not line.startswith(b"add element ")]
+            for batch in self.nft.batches]
+        self.assertEqual([_SETUP, _SETUP], rules)
+
+    def test_empty_transaction(self):
+        """
+        Committing an empty transaction doesn't run ``nft``.
+        """
+        self.network.begin().commit()
+        self.assertEqual(([], 0), (self.nft.batches, self.routing.ensured))
+
+    def test_routing_configured(self):
+        """
+        The system is configured to forward traffic once when proxies are
+        created.
+        """
+        transaction = self.network.begin()
+        transaction.create_proxy_to(IPAddress("10.0.0.1"), 1)
+        transaction.create_proxy_to(IPAddress("10.0.0.2"), 2)
+        transaction.commit()
+        self.assertEqual(1, self.routing.ensured)
+
+    def test_forget_connections(self):
+        """
+        The connections through deleted proxies are forgotten once the
+        proxies have been deleted.
+        """
+        proxy = self.network.create_proxy_to(IPAddress("10.0.0.1"), 1)
+        self.network.delete_proxy(proxy)
+        self.assertEqual([proxy], self.forgotten)
+
+    def test_logged(self):
+        """
+        The batch is logged in an ``NFT`` action.
+        """
+        def validate(case, logger):
+            assertHasAction(case, logger, NFT, succeeded=True)
+
+        @validateLogging(validate)
+        def run(case, logger):
+            self.patch(self.network, "logger", logger)
+            self.network.create_proxy_to(IPAddress("10.0.0.1"), 1)
+        run(self)
+
+
+class ParseMapElementsTests(SynchronousTestCase):
+    """
+    Tests for ``parse_map_elements``.
+    """
+    def test_no_elements(self):
+        """
+        A map without elements has no ``elements`` line, and no proxies.
+        """
+        self.assertEqual([], parse_map_elements(
+            b"table ip flocker {\n"
+            b"\tmap proxies {\n"
+            b"\t\ttype inet_service : ipv4_addr\n"
+            b"\t}\n"
+            b"}\n"))
+
+    def test_elements(self):
+        """
+        Each element, even when wrapped over several lines, is a proxy.
+        """
+        self.assertEqual(
+            [Proxy(ip=IPAddress("10.0.0.1"), port=1),
+             Proxy(ip=IPAddress("10.0.0.2"), port=2),
+             Proxy(ip=IPAddress("10.0.0.3"), port=3)],
+            parse_map_elements(
+                b"table ip flocker {\n"
+                b"\tmap proxies {\n"
+                b"\t\ttype inet_service : ipv4_addr\n"
+                b"\t\telements = { 1 : 10.0.0.1, 2 : 10.0.0.2,\n"
+                b"\t\t\t     3 : 10.0.0.3 }\n"
+                b"\t}\n"
+                b"}\n"))
@@ -0,0 +1,86 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.route._sysctl``.
+"""
+
+from twisted.python.filepath import FilePath
+from twisted.trial.unittest import SynchronousTestCase
+
+from .._sysctl import RoutingPrerequisites
+
+
+class RoutingPrerequisitesTests(SynchronousTestCase):
+    """
+    Tests for ``RoutingPrerequisites``.
+    """
+    def setUp(self):
+        self.conf = FilePath(self.mktemp())
+        self.conf.makedirs()
+        for name in [b"all", b"default", b"lo", b"eth0"]:
+            self.add_interface(name)
+        self.routing = RoutingPrerequisites(self.conf)
+
+    def add_interface(self, name):
+        """
+        Add the configuration of an interface, as the kernel would.
+
+        :param bytes name: The name of the interface.
+        """
+        path = self.conf.child(name)
+        path.makedirs()
+        path.child(b"forwarding").setContent(b"0")
+        path.child(b"route_localnet").setContent(b"0")
+
+    def settings(self, setting):
+        """
+        :param bytes setting: The name of a setting.
+
+        :return: A ``dict`` mapping interface names to the value of the
+            setting for that interface.
+        """
+        return {path.basename(): path.child(setting).getContent()
+                for path in self.conf.children()}
+
+    def test_route_localnet(self):
+        """
+        ``RoutingPrerequisites.ensure`` enables ``route_localnet`` for all
+        interfaces.
+        """
+        self.routing.ensure()
+        self.assertEqual(
+            {b"all": b"1", b"default": b"1", b"lo": b"1", b"eth0": b"1"},
+            self.settings(b"route_localnet"))
+
+    def test_forwarding(self):
+        """
+        ``RoutingPrerequisites.ensure`` enables forwarding by default.
+        """
+        self.routing.ensure()
+        self.assertEqual(
+            {b"all": b"0", b"default": b"1", b"lo": b"0", b"eth0": b"0"},
+            self.settings(b"forwarding"))
+
+    def test_configured_once(self):
+        """
+        Interfaces which have been configured already are not configured
+        again.
+        """
+        self.routing.ensure()
+        self.conf.child(b"eth0").child(b"route_localnet").setContent(b"0")
+        self.routing.ensure()
+        self.assertEqual(
+            b"0",
+            self.conf.child(b"eth0").child(b"route_localnet").getContent())
+
+    def test_new_interfaces(self):
+        """
+        Interfaces which appear after the configuration was first ensured are
+        configured the next time it is ensured.
+        """
+        self.routing.ensure()
+        self.add_interface(b"veth0")
+        self.routing.ensure()
+        self.assertEqual(
+            b"1",
+            self.conf.child(b"veth0").child(b"route_localnet").getContent())
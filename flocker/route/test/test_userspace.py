@@ -0,0 +1,299 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.route._userspace``.
+"""
+
+from ipaddr import IPAddress
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.error import CannotListenError, ConnectionRefusedError
+from twisted.internet.protocol import ClientCreator, Factory, Protocol
+from twisted.internet.task import Clock
+from twisted.test.proto_helpers import MemoryReactor
+from twisted.trial.unittest import SynchronousTestCase, TestCase
+
+from .. import Proxy
+from .._userspace import UserspaceNetwork
+from ..functional.networktests import make_proxying_tests
+
+
+class FakeListeningPort(object):
+    """
+    A listening port which records whether it was stopped.
+
+    :ivar bool stopped: Whether ``stopListening`` was called.
+    """
+    stopped = False
+
+    def stopListening(self):
+        self.stopped = True
+        return succeed(None)
+
+
+class FakeReactor(MemoryReactor, Clock):
+    """
+    A reactor which records the ports listened on and refuses to listen on
+    some of them.
+
+    :ivar set unavailable: The ports which can't be listened on.
+    :ivar list listening: The ``FakeListeningPort`` instances created so far.
+    """
+    def __init__(self):
+        MemoryReactor.__init__(self)
+        Clock.__init__(self)
+        self.unavailable = set()
+        self.listening = []
+
+    def listenTCP(self, port, factory, backlog=50, interface=''):
+        if port in self.unavailable:
+            raise CannotListenError(interface, port, None)
+        MemoryReactor.listenTCP(self, port, factory, backlog, interface)
+        listening = FakeListeningPort()
+        self.listening.append(listening)
+        return listening
+
+
+def make_fake_userspace_network():
+    """
+    :return: A ``UserspaceNetwork`` using a ``FakeReactor``.
+    """
+    return UserspaceNetwork(reactor=FakeReactor())
+
+
+class FakeUserspaceProxyTests(
+        make_proxying_tests(make_fake_userspace_network)):
+    """
+    Apply the generic ``INetwork`` test suite to the userspace
+    implementation, using a fake reactor.
+    """
+
+
+class UserspaceNetworkTests(SynchronousTestCase):
+    """
+    Tests for ``UserspaceNetwork`` which don't need to accept connections.
+    """
+    def setUp(self):
+        self.reactor = FakeReactor()
+        self.network = UserspaceNetwork(
+            reactor=self.reactor, interface=b"192.168.0.1")
+
+    def test_listen(self):
+        """
+        Creating a proxy listens on its port on the configured interface.
+        """
+        self.network.create_proxy_to(IPAddress("10.0.0.1"), 1)
+        self.assertEqual(
+            [(1, b"192.168.0.1")],
+            [(port, interface)
+             for port, factory, backlog, interface in self.reactor.tcpServers])
+
+    def test_stop_listening(self):
+        """
+        Deleting a proxy stops listening on its port.
+        """
+        proxy = self.network.create_proxy_to(IPAddress("10.0.0.1"), 1)
+        self.network.delete_proxy(proxy)
+        self.assertEqual(
+            [True], [port.stopped for port in self.reactor.listening])
+
+    def test_move(self):
+        """
+        If a transaction replaces a proxy with one to another destination on
+        the same port, the port stays open.
+        """
+        proxy = self.network.create_proxy_to(IPAddress("10.0.0.1"), 1)
+        transaction = self.network.begin()
+        transaction.delete_proxy(proxy)
+        transaction.create_proxy_to(IPAddress("10.0.0.2"), 1)
+        transaction.commit()
+        self.assertEqual(
+            [False], [port.stopped for port in self.reactor.listening])
+
+    def test_listen_failure(self):
+        """
+        If one of the ports of a transaction can't be listened on, the
+        transaction fails and the other ports it opened are closed again.
+        """
+        self.reactor.unavailable.add(2)
+        transaction = self.network.begin()
+        transaction.create_proxy_to(IPAddress("10.0.0.1"), 1)
+        transaction.create_proxy_to(IPAddress("10.0.0.2"), 2)
+        self.assertRaises(CannotListenError, transaction.commit)
+        self.assertEqual(
+            ([], [True]),
+            (self.network.enumerate_proxies(),
+             [port.stopped for port in self.reactor.listening]))
+
+    def test_one_proxy_per_port(self):
+        """
+        Creating a second proxy on a port raises ``ValueError``.
+        """
+        self.network.create_proxy_to(IPAddress("10.0.0.1"), 1)
+        self.assertRaises(
+            ValueError,
+            self.network.create_proxy_to, IPAddress("10.0.0.2"), 1)
+
+    def test_unknown_statistics(self):
+        """
+        ``UserspaceNetwork.statistics`` raises ``KeyError`` for a proxy which
+        doesn't exist.
+        """
+        self.assertRaises(
+            KeyError,
+            self.network.statistics, Proxy(ip=IPAddress("10.0.0.1"), port=1))
+
+
+class Echo(Protocol):
+    def dataReceived(self, data):
+        self.transport.write(data)
+
+
+class Client(Protocol):
+    """
+    A client which can wait for some of the data it receives.
+
+    :ivar bytes received: The data received so far.
+    :ivar Deferred lost: Fires when the connection is lost.
+    """
+    def __init__(self):
+        self.received = b""
+        self.lost = Deferred()
+        self._waiting = None
+
+    def receive(self, length):
+        """
+        :return: A ``Deferred`` firing when ``length`` bytes in all have been
+            received.
+        """
+        self._waiting = (length, Deferred())
+        self._check()
+        return self._waiting[1]
+
+    def _check(self):
+        if self._waiting is None:
+            return
+        length, d = self._waiting
+        if len(self.received) >= length:
+            self._waiting = None
+            d.callback(self.received)
+
+    def dataReceived(self, data):
+        self.received += data
+        self._check()
+
+    def connectionLost(self, reason):
+        self.lost.callback(None)
+
+
+class ForwardingTests(TestCase):
+    """
+    Tests for the connections forwarded by ``UserspaceNetwork``.
+
+    The destination listens on ``127.0.0.2`` and the proxy on ``127.0.0.1``,
+    so that they can use the same port without special privileges.
+    """
+    def setUp(self):
+        server = reactor.listenTCP(
+            0, Factory.forProtocol(Echo), interface=b"127.0.0.2")
+        self.addCleanup(server.stopListening)
+        self.port = server.getHost().port
+        self.network = UserspaceNetwork(
+            interface=b"127.0.0.1", drain_timeout=0.1)
+        self.proxy = self.network.create_proxy_to(
+            IPAddress("127.0.0.2"), self.port)
+        self.addCleanup(self.delete)
+
+    def delete(self):
+        """
+        Delete the proxy if the test didn't, and wait for its connections to
+        close.
+        """
+        if self.proxy in self.network.enumerate_proxies():
+            self.network.delete_proxy(self.proxy)
+        return self.network.drained(self.proxy)
+
+    def connect(self):
+        """
+        Connect to the proxy.
+
+        :return: A ``Deferred`` firing with a connected ``Client``.
+        """
+        d = ClientCreator(reactor, Client).connectTCP(b"127.0.0.1", self.port)
+
+        def connected(client):
+            self.addCleanup(lambda: client.lost)
+            self.addCleanup(client.transport.loseConnection)
+            return client
+        return d.addCallback(connected)
+
+    def test_forwarded(self):
+        """
+        Data is forwarded to the destination of the proxy and back.
+        """
+        d = self.connect()
+
+        def connected(client):
+            client.transport.write(b"hello")
+            return client.receive(5)
+        d.addCallback(connected)
+        d.addCallback(self.assertEqual, b"hello")
+        return d
+
+    def test_statistics(self):
+        """
+        The connections and the bytes forwarded in each direction are counted.
+        """
+        d = self.connect()
+
+        def connected(client):
+            client.transport.write(b"hello")
+            return client.receive(5)
+        d.addCallback(connected)
+        d.addCallback(lambda _: self.network.statistics(self.proxy))
+        d.addCallback(
+            lambda statistics: self.assertEqual(
+                (1, 1, 5, 5),
+                (statistics.connections, statistics.active,
+                 statistics.bytes_in, statistics.bytes_out)))
+        return d
+
+    def test_draining(self):
+        """
+        After a proxy is deleted its existing connections are still forwarded
+        but new connections are refused.
+        """
+        d = self.connect()
+
+        def connected(client):
+            self.client = client
+            client.transport.write(b"hello")
+            return client.receive(5)
+
+        def delete(_):
+            self.network.delete_proxy(self.proxy)
+            self.client.transport.write(b"again")
+            return self.client.receive(10)
+
+        def forwarded(received):
+            self.assertEqual(b"helloagain", received)
+            return self.assertFailure(self.connect(), ConnectionRefusedError)
+        d.addCallback(connected)
+        d.addCallback(delete)
+        d.addCallback(forwarded)
+        return d
+
+    def test_drain_timeout(self):
+        """
+        The connections through a deleted proxy are closed if they don't
+        finish within the drain timeout.
+        """
+        d = self.connect()
+
+        def connected(client):
+            self.network.delete_proxy(self.proxy)
+            return client.lost
+        d.addCallback(connected)
+        d.addCallback(lambda _: self.network.drained(self.proxy))
+        return d
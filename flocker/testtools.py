@@ -203,18 +203,21 @@ class FakeSysModule(object):
     line scripts.
 
     :ivar list argv: See ``__init__``
+    :ivar stdin: A :py:class:`io.BytesIO` object representing standard input.
     :ivar stdout: A :py:class:`io.BytesIO` object representing standard output.
     :ivar stderr: A :py:class:`io.BytesIO` object representing standard error.
     """
-    def __init__(self, argv=None):
+    def __init__(self, argv=None, stdin=b""):
         """Initialise the fake sys module.
 
         :param list argv: The arguments list which should be exposed as
             ``sys.argv``.
+        :param bytes stdin: The data which can be read from ``sys.stdin``.
         """
         if argv is None:
             argv = []
         self.argv = argv
+        self.stdin = io.BytesIO(stdin)
         # io.BytesIO is not quite the same as sys.stdout/stderr
         # particularly with respect to unicode handling.  So,
         # hopefully the implementation doesn't try to write any
@@ -1,3 +1,10 @@
 # Copyright Hybrid Logic Ltd.  See LICENSE file for details.
 
 """The Flocker volume manager."""
+
+from ._docker import DockerClient, DockerError
+
+__all__ = [
+    'DockerClient',
+    'DockerError',
+]
@@ -0,0 +1,295 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+# -*- test-case-name: flocker.volume.test.test_docker -*-
+
+"""
+A client for the Docker Engine API, talking to the Docker daemon over its UNIX
+socket rather than running the ``docker`` command-line tool.
+
+Requests are sent through a persistent connection pool, so a series of calls
+reuses the same connection rather than connecting and starting a process for
+each one.
+"""
+
+import json
+from urllib import quote, urlencode
+
+from treq import content
+from treq.client import HTTPClient
+
+from twisted.internet.defer import fail, succeed
+from twisted.internet.endpoints import UNIXClientEndpoint
+from twisted.web.client import HTTPConnectionPool, ProxyAgent
+from twisted.web.http_headers import Headers
+
+DOCKER_SOCKET = b"/var/run/docker.sock"
+
+# The URL requests are sent to.  Docker ignores the host, since the requests
+# arrive over its UNIX socket.
+_BASE_URL = b"http://docker"
+
+
+def _json_stream(data):
+    """
+    :param bytes data: A series of JSON objects, as Docker reports progress
+        with, possibly separated by whitespace.
+
+    :return: A ``list`` of the decoded objects.
+    """
+    decoder = json.JSONDecoder()
+    data = data.decode("utf-8")
+    objects = []
+    index = 0
+    while True:
+        while index < len(data) and data[index].isspace():
+            index += 1
+        if index == len(data):
+            return objects
+        obj, index = decoder.raw_decode(data, index)
+        objects.append(obj)
+
+
+class DockerError(Exception):
+    """Unexpected error received from the Docker daemon."""
+
+
+class DockerClient(object):
+    """
+    Create, start, inspect and remove Docker containers using the Docker
+    Engine API.
+
+    :ivar set _images: The names of the images known to be available
+        locally.
+    """
+    def __init__(self, reactor=None, socket_path=DOCKER_SOCKET):
+        """
+        :param reactor: The reactor to connect with.  By default the global
+            reactor.
+        :param bytes socket_path: The path of the Docker daemon's UNIX
+            socket.
+        """
+        if reactor is None:
+            from twisted.internet import reactor
+        self._pool = HTTPConnectionPool(reactor, persistent=True)
+        # ``ProxyAgent`` sends every request to the one endpoint it is given,
+        # which is the only way to use a UNIX socket with this version of
+        # Twisted.
+        self._client = HTTPClient(ProxyAgent(
+            UNIXClientEndpoint(reactor, socket_path), reactor,
+            pool=self._pool))
+        self._images = set()
+
+    def close(self):
+        """
+        Close the connections kept open for reuse.
+
+        :return: ``Deferred`` firing when the connections are closed.
+        """
+        return self._pool.closeCachedConnections()
+
+    def _request(self, method, path, query=None, data=None):
+        """
+        Send a request to the Docker daemon.
+
+        :param bytes method: The HTTP method to send, e.g. ``b"GET"``.
+        :param bytes path: The path of the request, e.g.
+            ``b"/containers/json"``.
+        :param dict query: The query arguments of the request, if any.
+        :param data: A JSON-encodable object to send as the body of the
+            request, or ``None`` to send none.
+
+        :return: ``Deferred`` firing with a ``tuple`` of the response code and
+            the ``bytes`` of the response body.
+        """
+        url = _BASE_URL + path
+        if query:
+            url += b"?" + urlencode(sorted(query.items()))
+        headers = None
+        if data is not None:
+            data = json.dumps(data)
+            headers = Headers({b"Content-Type": [b"application/json"]})
+        d = self._client.request(method, url, data=data, headers=headers)
+        # Read the whole body, so that the connection can be reused:
+        d.addCallback(
+            lambda response: content(response).addCallback(
+                lambda body: (response.code, body)))
+        return d
+
+    def _container_path(self, name, action=b""):
+        """
+        :param bytes name: The name of a container.
+        :param bytes action: The path within the container's resource.
+
+        :return: The ``bytes`` path of the container's resource.
+        """
+        return b"/containers/" + quote(name, safe=b"") + action
+
+    def create_container(self, name, image, command, volumes=()):
+        """
+        Create, but don't start, a container.
+
+        If the image isn't available locally it is pulled first.
+
+        :param bytes name: The name of the container.
+        :param bytes image: The name of the image to create it from.
+        :param list command: The ``bytes`` arguments of the command the
+            container will run.
+        :param volumes: The ``bytes`` paths within the container of the
+            volumes it has.
+
+        :return: ``Deferred`` firing with the ``unicode`` ID of the new
+            container, or errbacking with ``DockerError``.
+        """
+        def create():
+            return self._request(
+                b"POST", b"/containers/create", {b"name": name},
+                {u"Image": image, u"Cmd": command,
+                 u"Volumes": dict((path, {}) for path in volumes)})
+
+        def created((code, body), pulled=False):
+            if code == 404 and not pulled:
+                d = self.pull_image(image)
+                d.addCallback(lambda _: create())
+                d.addCallback(created, pulled=True)
+                return d
+            if code != 201:
+                return fail(DockerError(code, body))
+            return json.loads(body)[u"Id"]
+        d = create()
+        d.addCallback(created)
+        return d
+
+    def start_container(self, name, binds=()):
+        """
+        Start a container.
+
+        :param bytes name: The name of the container.
+        :param binds: ``tuple``\ s of the ``bytes`` path of a directory of
+            this host and the ``bytes`` path within the container to mount it
+            at, read-write.
+
+        :return: ``Deferred`` firing with ``None`` once the container has
+            started, or errbacking with ``DockerError``.
+        """
+        d = self._request(
+            b"POST", self._container_path(name, b"/start"),
+            data={u"Binds": [b"%s:%s:rw" % bind for bind in binds]})
+
+        def started((code, body)):
+            # 304 means it was already running:
+            if code not in (204, 304):
+                return fail(DockerError(code, body))
+        d.addCallback(started)
+        return d
+
+    def inspect_container(self, name):
+        """
+        :param bytes name: The name of a container.
+
+        :return: ``Deferred`` firing with the ``dict`` Docker describes the
+            container with, or ``None`` if there is no such container.
+        """
+        d = self._request(b"GET", self._container_path(name, b"/json"))
+
+        def inspected((code, body)):
+            if code == 404:
+                return None
+            if code != 200:
+                return fail(DockerError(code, body))
+            return json.loads(body)
+        d.addCallback(inspected)
+        return d
+
+    def list_containers(self):
+        """
+        :return: ``Deferred`` firing with a ``dict`` mapping the ``bytes``
+            name of each running container to its ``bytes`` ID.
+        """
+        d = self._request(b"GET", b"/containers/json")
+
+        def listed((code, body)):
+            if code != 200:
+                return fail(DockerError(code, body))
+            containers = {}
+            for container in json.loads(body):
+                for name in container[u"Names"]:
+                    # Containers are also listed under the names they are
+                    # linked to from other containers, e.g. "/web/db":
+                    name = name.encode("ascii").lstrip(b"/")
+                    if b"/" not in name:
+                        containers[name] = container[u"Id"].encode("ascii")
+            return containers
+        d.addCallback(listed)
+        return d
+
+    def remove_container(self, name):
+        """
+        Remove a container.
+
+        If there is no such container this silently does nothing.
+
+        :param bytes name: The name of the container.
+
+        :return: ``Deferred`` firing with ``None`` when the container has
+            been removed, or errbacking with ``DockerError``.
+        """
+        d = self._request(b"DELETE", self._container_path(name))
+
+        def removed((code, body)):
+            if code not in (204, 404):
+                return fail(DockerError(code, body))
+        d.addCallback(removed)
+        return d
+
+    def ensure_image(self, image):
+        """
+        Make sure an image is available locally, pulling it if it isn't.
+
+        Once an image is known to be available it isn't checked again.
+
+        :param bytes image: The name of the image, optionally with a tag.
+
+        :return: ``Deferred`` firing with ``None`` once the image is
+            available, or errbacking with ``DockerError``.
+        """
+        if image in self._images:
+            return succeed(None)
+        d = self._request(
+            b"GET", b"/images/" + quote(image, safe=b"") + b"/json")
+
+        def inspected((code, body)):
+            if code == 404:
+                return self.pull_image(image)
+            if code != 200:
+                return fail(DockerError(code, body))
+            self._images.add(image)
+        d.addCallback(inspected)
+        return d
+
+    def pull_image(self, image):
+        """
+        Pull an image from the registry.
+
+        The image is then known to be available, so ``ensure_image`` doesn't
+        check for it again.
+
+        :param bytes image: The name of the image, optionally with a tag.
+
+        :return: ``Deferred`` firing with ``None`` once the image has been
+            pulled, or errbacking with ``DockerError``.
+        """
+        repository, _, tag = image.partition(b":")
+        d = self._request(
+            b"POST", b"/images/create",
+            {b"fromImage": repository, b"tag": tag or b"latest"})
+
+        def pulled((code, body)):
+            if code != 200:
+                return fail(DockerError(code, body))
+            # Failures after the pull has started are reported in the
+            # stream of progress messages:
+            for message in _json_stream(body):
+                if u"error" in message:
+                    return fail(DockerError(code, message[u"error"]))
+            self._images.add(image)
+        d.addCallback(pulled)
+        return d
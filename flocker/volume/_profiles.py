@@ -0,0 +1,37 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+# -*- test-case-name: flocker.volume.test.test_profiles -*-
+
+"""
+Profiles of the dataset properties volumes can be tuned with.
+
+These are shared by the parsing of application configuration and by the
+storage pools, so they don't depend on any particular storage backend.
+"""
+
+# The dataset properties volumes can be created with.  Others, such as the
+# mountpoint, are managed by the storage pool.
+TUNABLE_PROPERTIES = frozenset([
+    u"recordsize", u"compression", u"logbias", u"primarycache",
+    u"secondarycache", u"atime", u"sync", u"copies",
+])
+
+# Dataset properties suiting common workloads, by name.  Datasets default to
+# 128K records, which suits large sequential reads and writes but amplifies
+# the IO of databases writing pages of a few kilobytes.
+PROFILES = {
+    # PostgreSQL writes 8K pages:
+    u"postgresql": {
+        u"recordsize": u"8K", u"compression": u"lz4",
+        u"logbias": u"throughput"},
+    # InnoDB writes 16K pages and caches them itself:
+    u"mysql": {
+        u"recordsize": u"16K", u"compression": u"lz4",
+        u"logbias": u"throughput", u"primarycache": u"metadata"},
+    # Logs such as Kafka's are written and read once, sequentially:
+    u"sequential": {
+        u"recordsize": u"128K", u"compression": u"lz4",
+        u"logbias": u"throughput", u"primarycache": u"metadata"},
+    # Many small files which are mostly read, such as web assets:
+    u"small-files": {
+        u"recordsize": u"16K", u"compression": u"lz4", u"atime": u"off"},
+}
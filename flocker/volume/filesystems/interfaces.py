@@ -6,6 +6,8 @@ from __future__ import absolute_import
 
 from zope.interface import Interface
 
+from characteristic import attributes
+
 
 class FilesystemAlreadyExists(Exception):
     """
@@ -14,6 +16,19 @@ class FilesystemAlreadyExists(Exception):
     """
 
 
+@attributes(["free_space", "io_load"])
+class PoolStatistics(object):
+    """
+    How full and how busy a storage pool is, for choosing where to place new
+    filesystems.
+
+    :ivar int free_space: The number of bytes available for new data.
+    :ivar float io_load: The average number of read and write operations per
+        second, over however long the pool measures it, e.g. since it was
+        imported.
+    """
+
+
 class IFilesystemSnapshots(Interface):
     """Support creating and listing snapshots of a specific filesystem."""
 
@@ -90,7 +105,7 @@ class IFilesystem(Interface):
 class IStoragePool(Interface):
     """Pool of on-disk storage where filesystems are stored."""
 
-    def create(volume):
+    def create(volume, properties=None, storage_class=None):
         """Create a new filesystem for the given volume.
 
         By default new filesystems will be automounted. In future
@@ -102,6 +117,15 @@ class IStoragePool(Interface):
         :param volume: The volume whose filesystem should be created.
         :type volume: :class:`flocker.volume.service.Volume`
 
+        :param properties: ``None``, or a ``dict`` mapping the ``unicode``
+            names of properties to tune the filesystem with, as listed in
+            ``zfs.TUNABLE_PROPERTIES``, to their ``unicode`` values.  Pools
+            whose filesystems can't be tuned ignore them.
+
+        :param storage_class: ``None``, or the ``unicode`` class of storage,
+            e.g. ``u"ssd"``, to create the filesystem on.  Pools which aren't
+            divided into classes of storage ignore it.
+
         :return: Deferred that fires on filesystem creation with a
             :class:`IFilesystem` provider, or errbacks if creation failed.
         """
@@ -130,6 +154,12 @@ class IStoragePool(Interface):
             exists.
         """
 
+    def statistics():
+        """Measure how full and how busy the pool is.
+
+        :return: ``Deferred`` that fires with a :class:`PoolStatistics`.
+        """
+
     def enumerate():
         """Get a listing of all filesystems in this pool.
 
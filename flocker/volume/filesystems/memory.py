@@ -4,6 +4,7 @@
 
 from __future__ import absolute_import
 
+import os
 from contextlib import contextmanager
 from tarfile import TarFile
 from io import BytesIO
@@ -16,7 +17,7 @@ from twisted.internet.defer import succeed, fail
 
 from .interfaces import (
     IFilesystemSnapshots, IStoragePool, IFilesystem,
-    FilesystemAlreadyExists)
+    FilesystemAlreadyExists, PoolStatistics)
 
 
 @implementer(IFilesystemSnapshots)
@@ -91,7 +92,7 @@ class FilesystemStoragePool(object):
         if not self._root.exists():
             self._root.createDirectory()
 
-    def create(self, volume):
+    def create(self, volume, properties=None, storage_class=None):
         filesystem = self.get(volume)
         filesystem.get_path().makedirs()
         return succeed(filesystem)
@@ -115,6 +116,15 @@ class FilesystemStoragePool(object):
             path=self._root.child(b"%s.%s" % (
                 volume.uuid.encode("ascii"), volume.name.encode("ascii"))))
 
+    def statistics(self):
+        """
+        The free space is that of the filesystem the root directory is on.
+        Directories don't report their IO, so the load is always 0.
+        """
+        result = os.statvfs(self._root.path)
+        return succeed(PoolStatistics(
+            free_space=result.f_bavail * result.f_frsize, io_load=0.0))
+
     def enumerate(self):
         if self._root.isdir():
             return succeed({
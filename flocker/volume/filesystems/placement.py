@@ -0,0 +1,249 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+# -*- test-case-name: flocker.volume.test.test_filesystems_placement -*-
+
+"""
+A storage pool spreading filesystems over several other pools, such as a fast
+and a slow ZFS pool on the same node.
+"""
+
+from __future__ import absolute_import, division
+
+from characteristic import attributes
+
+from zope.interface import implementer
+
+from eliot import Logger, writeFailure
+
+from twisted.internet.defer import (
+    fail, gatherResults, maybeDeferred, succeed)
+
+from .interfaces import (
+    IStoragePool, FilesystemAlreadyExists, PoolStatistics)
+
+
+# The IO load at which a pool counts as having half as much free space as it
+# really does, in read and write operations per second.
+IO_LOAD_SCALE = 1000.0
+
+
+@attributes(["pool", "storage_class"])
+class ClassifiedPool(object):
+    """
+    One of the pools of a :class:`PlacementPool`.
+
+    :ivar pool: An ``IStoragePool`` provider.
+    :ivar unicode storage_class: The class of storage the pool provides, e.g.
+        ``u"ssd"``, which new volumes can ask to be placed on.
+    """
+
+
+def placement_score(statistics):
+    """
+    :param PoolStatistics statistics: The statistics of a pool.
+
+    :return: How suitable the pool is for a new filesystem; higher is better.
+        This is its free space, weighted down by its IO load.
+    """
+    return statistics.free_space / (1 + statistics.io_load / IO_LOAD_SCALE)
+
+
+@implementer(IStoragePool)
+class PlacementPool(object):
+    """
+    A storage pool which places each new filesystem on one of several other
+    pools.
+
+    New filesystems are placed on the pool of the requested storage class
+    with the best :func:`placement_score`.  Existing filesystems are found on
+    whichever pool they are on, so that the other operations work across all
+    of the pools.
+    """
+    logger = Logger()
+
+    def __init__(self, pools):
+        """
+        :param list pools: The :class:`ClassifiedPool`\ s to place filesystems
+            on.  Filesystems which aren't on any of them yet, such as those
+            of volumes being received from another node, are put on the
+            first.  Each pool must mount its filesystems in a different
+            place.
+        """
+        self._pools = pools
+        # The filesystems on each pool, as of the last listing and the
+        # changes made since, or None until the pools are first listed:
+        self._listings = None
+
+    def _find(self, volume):
+        """
+        :param Volume volume: A volume.
+
+        :return: The index of the pool the volume's filesystem is on as of
+            the last listing, or ``None`` if it isn't on any of them or the
+            pools haven't been listed.
+        """
+        if self._listings is None:
+            return None
+        for index, classified in enumerate(self._pools):
+            if classified.pool.get(volume) in self._listings[index]:
+                return index
+        return None
+
+    def _listed(self):
+        """
+        Make sure the pools have been listed.
+
+        The pools are only listed the first time; after that the listings
+        are kept up to date with the filesystems created and renamed through
+        this pool, and refreshed whenever ``enumerate`` is called.
+
+        :return: ``Deferred`` firing once the listings are known.
+        """
+        if self._listings is not None:
+            return succeed(None)
+        return self.enumerate()
+
+    def _holding(self, volume):
+        """
+        Find out which of the pools has a volume's filesystem.
+
+        :param Volume volume: A volume.
+
+        :return: ``Deferred`` firing with the index of the pool the volume's
+            filesystem is on, or ``None`` if it isn't on any of them.
+        """
+        d = self._listed()
+        d.addCallback(lambda _: self._find(volume))
+        return d
+
+    def _created(self, index, filesystem):
+        """
+        Record a new filesystem on a pool.
+
+        :param int index: The index of the pool.
+        :param filesystem: The ``IFilesystem`` provider created.
+
+        :return: ``filesystem``.
+        """
+        self._listings[index].add(filesystem)
+        return filesystem
+
+    def create(self, volume, properties=None, storage_class=None):
+        """
+        :param storage_class: ``None`` to place the filesystem on any of the
+            pools, or the ``unicode`` class of the pools to choose from.
+
+        :see: :meth:`IStoragePool.create` for the other parameters and the
+            result.  It errbacks with ``ValueError`` if there is no pool of
+            the requested class.
+        """
+        d = self._holding(volume)
+
+        def found(holding):
+            if holding is not None:
+                # Let the pool report the filesystem already exists:
+                return self._pools[holding].pool.create(volume, properties)
+            return self._place(volume, properties, storage_class)
+        d.addCallback(found)
+        return d
+
+    def _place(self, volume, properties, storage_class):
+        """
+        Create a new filesystem on the best pool of the requested class.
+
+        :see: :meth:`create`
+        """
+        candidates = [index for index, classified in enumerate(self._pools)
+                      if storage_class in (None, classified.storage_class)]
+        if not candidates:
+            return fail(ValueError(
+                "No storage pool of class %s" % (storage_class,)))
+
+        def create_on(index):
+            d = self._pools[index].pool.create(volume, properties)
+            d.addCallback(lambda filesystem: self._created(index, filesystem))
+            return d
+        if len(candidates) == 1:
+            return create_on(candidates[0])
+
+        def measure(index):
+            d = maybeDeferred(self._pools[index].pool.statistics)
+            # The statistics only guide the placement, so a pool which can't
+            # report them is passed over rather than failing the creation:
+            d.addErrback(
+                writeFailure, self.logger, u"flocker:volume:placement")
+            return d
+        d = gatherResults([measure(index) for index in candidates])
+
+        def measured(statistics):
+            reported = [(index, result)
+                        for index, result in zip(candidates, statistics)
+                        if result is not None]
+            if not reported:
+                return create_on(candidates[0])
+            # max picks the first of equally good pools:
+            best, _ = max(reported,
+                          key=lambda reported: placement_score(reported[1]))
+            return create_on(best)
+        d.addCallback(measured)
+        return d
+
+    def get(self, volume):
+        """
+        :see: :meth:`IStoragePool.get`
+
+        This has to answer without asking the pools, so it relies on the
+        filesystems the pools had when they were last listed.  A filesystem
+        which hasn't been listed yet, e.g. in a process which hasn't listed
+        the pools, is found by its mountpoint, which is unique to each pool.
+        """
+        index = self._find(volume)
+        if index is not None:
+            return self._pools[index].pool.get(volume)
+        for classified in self._pools:
+            filesystem = classified.pool.get(volume)
+            if filesystem.get_path().exists():
+                return filesystem
+        return self._pools[0].pool.get(volume)
+
+    def change_owner(self, volume, new_volume):
+        d = self._listed()
+
+        def listed(_):
+            if self._find(new_volume) is not None:
+                return fail(FilesystemAlreadyExists())
+            holding = self._find(volume)
+            if holding is None:
+                holding = 0
+            pool = self._pools[holding].pool
+            changing = pool.change_owner(volume, new_volume)
+
+            def changed(filesystem):
+                self._listings[holding].discard(pool.get(volume))
+                return self._created(holding, filesystem)
+            changing.addCallback(changed)
+            return changing
+        d.addCallback(listed)
+        return d
+
+    def statistics(self):
+        d = gatherResults(
+            [classified.pool.statistics() for classified in self._pools],
+            consumeErrors=True)
+
+        def measured(statistics):
+            return PoolStatistics(
+                free_space=sum(s.free_space for s in statistics),
+                io_load=sum(s.io_load for s in statistics))
+        d.addCallback(measured)
+        return d
+
+    def enumerate(self):
+        d = gatherResults(
+            [classified.pool.enumerate() for classified in self._pools],
+            consumeErrors=True)
+
+        def listed(listings):
+            self._listings = [set(filesystems) for filesystems in listings]
+            return set().union(*self._listings)
+        d.addCallback(listed)
+        return d
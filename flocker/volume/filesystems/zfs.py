@@ -16,13 +16,14 @@ from zope.interface import implementer
 from twisted.python.filepath import FilePath
 from twisted.internet.endpoints import ProcessEndpoint, connectProtocol
 from twisted.internet.protocol import Protocol
-from twisted.internet.defer import Deferred
+from twisted.internet.defer import Deferred, fail
 from twisted.internet.error import ConnectionDone, ProcessTerminated
 
 from .interfaces import (
     IFilesystemSnapshots, IStoragePool, IFilesystem,
-    FilesystemAlreadyExists)
+    FilesystemAlreadyExists, PoolStatistics)
 from ..snapshots import SnapshotName
+from .._profiles import TUNABLE_PROPERTIES
 
 
 def random_name():
@@ -65,6 +66,18 @@ class _AccumulatingProtocol(Protocol):
         del self._result
 
 
+def _command(reactor, executable, arguments):
+    """Run a ZFS command-line tool with the given arguments.
+
+    :see: :func:`zfs_command` for the parameters and result.
+    """
+    endpoint = ProcessEndpoint(reactor, executable, [executable] + arguments,
+                               os.environ)
+    d = connectProtocol(endpoint, _AccumulatingProtocol())
+    d.addCallback(lambda protocol: protocol._result)
+    return d
+
+
 def zfs_command(reactor, arguments):
     """Run the ``zfs`` command-line tool with the given arguments.
 
@@ -77,11 +90,15 @@ def zfs_command(reactor, arguments):
         exit code 0), or errbacking with :class:`CommandFailed` or
         :class:`BadArguments` depending on the exit code (1 or 2).
     """
-    endpoint = ProcessEndpoint(reactor, b"zfs", [b"zfs"] + arguments,
-                               os.environ)
-    d = connectProtocol(endpoint, _AccumulatingProtocol())
-    d.addCallback(lambda protocol: protocol._result)
-    return d
+    return _command(reactor, b"zfs", arguments)
+
+
+def zpool_command(reactor, arguments):
+    """Run the ``zpool`` command-line tool with the given arguments.
+
+    :see: :func:`zfs_command` for the parameters and result.
+    """
+    return _command(reactor, b"zpool", arguments)
 
 
 @implementer(IFilesystem)
@@ -229,12 +246,18 @@ class StoragePool(object):
         self._name = name
         self._mount_root = mount_root
 
-    def create(self, volume):
+    def create(self, volume, properties=None, storage_class=None):
         filesystem = self.get(volume)
         mount_path = filesystem.get_path().path
+        options = [b"-o", b"mountpoint=" + mount_path]
+        for name, value in sorted((properties or {}).items()):
+            if name not in TUNABLE_PROPERTIES:
+                return fail(ValueError(
+                    "Unsupported dataset property: %s" % (name,)))
+            option = b"%s=%s" % (name.encode("ascii"), value.encode("ascii"))
+            options += [b"-o", option]
         d = zfs_command(self._reactor,
-                        [b"create",  b"-o", b"mountpoint=" + mount_path,
-                         filesystem.name])
+                        [b"create"] + options + [filesystem.name])
         d.addCallback(lambda _: filesystem)
         return d
 
@@ -275,6 +298,34 @@ class StoragePool(object):
         mount_path = self._mount_root.child(dataset)
         return Filesystem(self._name, dataset, mount_path)
 
+    def statistics(self):
+        """
+        The load is the average ``zpool iostat`` keeps since the pool was
+        imported, which it reports straight away, rather than a sample over
+        an interval which would have to be waited for.
+        """
+        # The datasets may be kept within a dataset of a larger pool:
+        zpool = self._name.split(b"/", 1)[0]
+        d = zfs_command(self._reactor,
+                        [b"list", b"-H", b"-p", b"-o", b"available",
+                         self._name])
+
+        def measure_load(output):
+            free_space = int(output.strip())
+            load = zpool_command(self._reactor,
+                                 [b"iostat", b"-H", b"-p", zpool])
+
+            def parse(output):
+                # name, allocated, free, read operations, write operations,
+                # read bandwidth, write bandwidth:
+                fields = output.strip().split()
+                return PoolStatistics(
+                    free_space=free_space,
+                    io_load=float(fields[3]) + float(fields[4]))
+            return load.addCallback(parse)
+        d.addCallback(measure_load)
+        return d
+
     def enumerate(self):
         listing = _list_filesystems(self._reactor, self._name)
 
@@ -15,6 +15,7 @@ from twisted.trial.unittest import TestCase
 
 from ...testtools import random_name
 from ..service import Volume, VolumeService
+from .._docker import DockerClient
 from ..filesystems.memory import FilesystemStoragePool
 
 
@@ -30,7 +31,8 @@ class VolumeTests(TestCase):
     @_if_root
     @_if_docker
     def setUp(self):
-        pass
+        self.docker = DockerClient()
+        self.addCleanup(self.docker.close)
 
     def add_container_cleanup(self, name):
         """Delete container with the given name when the test is over.
@@ -43,7 +45,7 @@ class VolumeTests(TestCase):
         """``Volume.expose_to_docker`` creates a Docker container."""
         pool = FilesystemStoragePool(FilePath(self.mktemp()))
         volume = Volume(uuid=u"myuuid", name=random_name(), _pool=pool)
-        d = volume.expose_to_docker(FilePath(b"/my/path"))
+        d = volume.expose_to_docker(self.docker, FilePath(b"/my/path"))
 
         def exposed(_):
             self.add_container_cleanup(volume._container_name)
@@ -80,7 +82,8 @@ class VolumeTests(TestCase):
         def got_volume(volume):
             a_file = volume.get_filesystem().get_path().child(b"somefile.txt")
             a_file.setContent(b"I EXIST!")
-            result = volume.expose_to_docker(FilePath(b"/my/path"))
+            result = volume.expose_to_docker(
+                self.docker, FilePath(b"/my/path"))
             result.addCallback(lambda _: volume)
             return result
         d.addCallback(got_volume)
@@ -106,9 +109,10 @@ class VolumeTests(TestCase):
         def got_volume(volume):
             a_file = volume.get_filesystem().get_path().child(b"somefile.txt")
             a_file.setContent(b"I EXIST!")
-            result = volume.expose_to_docker(FilePath(b"/my/path"))
+            result = volume.expose_to_docker(
+                self.docker, FilePath(b"/my/path"))
             result.addCallback(lambda _: volume.expose_to_docker(
-                FilePath(b"/another/")))
+                self.docker, FilePath(b"/another/")))
             result.addCallback(lambda _: volume)
             return result
         d.addCallback(got_volume)
@@ -134,8 +138,10 @@ class VolumeTests(TestCase):
         d = service.create(random_name())
 
         def got_volume(volume):
-            exposed = volume.expose_to_docker(FilePath(b"/my/path"))
-            exposed.addCallback(lambda _: volume.remove_from_docker())
+            exposed = volume.expose_to_docker(
+                self.docker, FilePath(b"/my/path"))
+            exposed.addCallback(
+                lambda _: volume.remove_from_docker(self.docker))
             exposed.addCallback(lambda _: volume)
             return exposed
         d.addCallback(got_volume)
@@ -160,6 +166,6 @@ class VolumeTests(TestCase):
 
         d = service.create(random_name())
 
-        d.addCallback(lambda volume: volume.remove_from_docker())
+        d.addCallback(lambda volume: volume.remove_from_docker(self.docker))
         d.addCallback(self.assertEqual, None)
         return d
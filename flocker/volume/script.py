@@ -4,7 +4,7 @@
 
 import sys
 
-from twisted.python.usage import Options
+from twisted.python.usage import Options, UsageError
 from twisted.python.filepath import FilePath
 from twisted.internet.defer import succeed, maybeDeferred
 
@@ -14,6 +14,7 @@ from .service import (
     VolumeService, CreateConfigurationError, DEFAULT_CONFIG_PATH,
     )
 from .filesystems.zfs import StoragePool
+from .filesystems.placement import ClassifiedPool, PlacementPool
 from ..common.script import (
     flocker_standard_options, FlockerScriptRunner, ICommandLineScript)
 
@@ -112,6 +113,8 @@ class VolumeOptions(Options):
          "The ZFS pool to use for volumes."],
         ["mountpoint", None, b"/flocker",
          "The path where ZFS filesystems will be mounted."],
+        ["pool-class", None, b"default",
+         "The class of storage the ZFS pool provides, e.g. ssd."],
     ]
 
     subCommands = [
@@ -121,8 +124,32 @@ class VolumeOptions(Options):
          "Acquire a remotely owned volume."],
     ]
 
+    def __init__(self):
+        Options.__init__(self)
+        self["additional-pools"] = []
+
+    def opt_additional_pool(self, value):
+        """
+        Another ZFS pool to place volumes on, as <pool>:<class>:<mountpoint>.
+        May be given more than once.
+        """
+        try:
+            name, storage_class, mountpoint = value.split(b":")
+        except ValueError:
+            raise UsageError(
+                "--additional-pool must be <pool>:<class>:<mountpoint>.")
+        self["additional-pools"].append(
+            (name, storage_class.decode("ascii"), FilePath(mountpoint)))
+
     def postOptions(self):
         self["config"] = FilePath(self["config"])
+        # Pools sharing a mountpoint would mount their filesystems over each
+        # other's:
+        mountpoints = [FilePath(self["mountpoint"])] + [
+            mountpoint for name, storage_class, mountpoint
+            in self["additional-pools"]]
+        if len(set(mountpoints)) != len(mountpoints):
+            raise UsageError("Each pool must have its own mountpoint.")
 
 
 @implementer(ICommandLineScript)
@@ -154,6 +181,16 @@ class VolumeScript(object):
         """
         pool = StoragePool(reactor, options["pool"],
                            FilePath(options["mountpoint"]))
+        if options["additional-pools"]:
+            pool = PlacementPool(
+                [ClassifiedPool(
+                    pool=pool,
+                    storage_class=options["pool-class"].decode("ascii"))] +
+                [ClassifiedPool(
+                    pool=StoragePool(reactor, name, mountpoint),
+                    storage_class=storage_class)
+                 for name, storage_class, mountpoint
+                 in options["additional-pools"]])
         service = self._service_factory(
             config_path=options["config"], pool=pool, reactor=reactor)
         try:
@@ -5,7 +5,6 @@
 
 from __future__ import absolute_import
 
-import os
 import json
 import stat
 from uuid import UUID, uuid4
@@ -14,21 +13,20 @@ from characteristic import attributes
 
 from twisted.python.filepath import FilePath
 from twisted.application.service import Service
-from twisted.internet.endpoints import ProcessEndpoint, connectProtocol
-from twisted.internet import reactor
-from twisted.internet.defer import fail
+from twisted.internet.defer import fail, gatherResults
 from twisted.internet.task import LoopingCall
 
-# We might want to make these utilities shared, rather than in zfs
-# module... but in this case the usage is temporary and should go away as
-# part of https://github.com/ClusterHQ/flocker/issues/64
-from .filesystems.zfs import _AccumulatingProtocol, CommandFailed
+from ._docker import DockerClient
+from ._profiles import PROFILES
 
 
 DEFAULT_CONFIG_PATH = FilePath(b"/etc/flocker/volume.json")
 
 WAIT_FOR_VOLUME_INTERVAL = 0.1
 
+# The image of the containers exposing volumes to Docker.
+DATA_IMAGE = b"busybox"
+
 
 class CreateConfigurationError(Exception):
     """Create the configuration file failed."""
@@ -41,16 +39,22 @@ class VolumeService(Service):
         volume manager. Only available once the service has started.
     """
 
-    def __init__(self, config_path, pool, reactor):
+    def __init__(self, config_path, pool, reactor, docker_client=None):
         """
         :param FilePath config_path: Path to the volume manager config file.
         :param pool: A `flocker.volume.filesystems.interface.IStoragePool`
             provider.
         :param reactor: A ``twisted.internet.interface.IReactorTime`` provider.
+        :param DockerClient docker_client: The client to expose volumes to
+            Docker with.  By default one talking to the Docker daemon of this
+            host.
         """
         self._config_path = config_path
         self._pool = pool
         self._reactor = reactor
+        if docker_client is None:
+            docker_client = DockerClient()
+        self._docker = docker_client
 
     def startService(self):
         parent = self._config_path.parent()
@@ -66,15 +70,31 @@ class VolumeService(Service):
         config = json.loads(self._config_path.getContent())
         self.uuid = config[u"uuid"]
 
-    def create(self, name):
+    def create(self, name, profile=None, properties=None, storage_class=None):
         """Create a new volume.
 
         :param unicode name: The name of the volume.
-
-        :return: A ``Deferred`` that fires with a :class:`Volume`.
+        :param profile: ``None``, or the ``unicode`` name of one of the
+            ``PROFILES`` of dataset properties to tune the volume's
+            filesystem for a kind of workload.
+        :param properties: ``None``, or a ``dict`` of dataset properties to
+            tune the volume's filesystem with, overriding those of the
+            profile.
+        :param storage_class: ``None``, or the ``unicode`` class of storage
+            to place the volume on.  Pools which aren't divided into classes
+            of storage, i.e. anything but a ``PlacementPool``, ignore it.
+
+        :return: A ``Deferred`` that fires with a :class:`Volume`, or
+            errbacks with ``KeyError`` if the profile is unknown.
         """
+        tuning = {}
+        if profile is not None:
+            if profile not in PROFILES:
+                return fail(KeyError(profile))
+            tuning.update(PROFILES[profile])
+        tuning.update(properties or {})
         volume = Volume(uuid=self.uuid, name=name, _pool=self._pool)
-        d = self._pool.create(volume)
+        d = self._pool.create(volume, tuning, storage_class=storage_class)
 
         def created(filesystem):
             filesystem.get_path().chmod(
@@ -143,6 +163,25 @@ class VolumeService(Service):
         enumerating.addCallback(enumerated)
         return enumerating
 
+    def expose_to_docker(self, mounts):
+        """
+        Expose many volumes to Docker at once.
+
+        The image of the containers exposing the volumes is made available
+        first, so it is only looked for once.
+
+        :param mounts: ``tuple``\ s of a :class:`Volume` and the
+            ``FilePath`` to mount it at within its container.
+
+        :return: ``Deferred`` firing when all of the volumes are exposed.
+        """
+        d = self._docker.ensure_image(DATA_IMAGE)
+        d.addCallback(lambda _: gatherResults(
+            [volume.expose_to_docker(self._docker, mount_path)
+             for volume, mount_path in mounts], consumeErrors=True))
+        d.addCallback(lambda _: None)
+        return d
+
     def push(self, volume, destination, config_path=DEFAULT_CONFIG_PATH):
         """
         Push the latest data in the volume to a remote destination.
@@ -240,28 +279,6 @@ class VolumeService(Service):
         return volume.change_owner(remote_uuid)
 
 
-# Communication with Docker should be done via its API, not with this
-# approach, but that depends on unreleased Twisted 14.1:
-# https://github.com/ClusterHQ/flocker/issues/64
-def _docker_command(reactor, arguments):
-    """Run the ``docker`` command-line tool with the given arguments.
-
-    :param reactor: A ``IReactorProcess`` provider.
-
-    :param arguments: A ``list`` of ``bytes``, command-line arguments to
-    ``docker``.
-
-    :return: A :class:`Deferred` firing with the bytes of the result (on
-        exit code 0), or errbacking with :class:`CommandFailed` or
-        :class:`BadArguments` depending on the exit code (1 or 2).
-    """
-    endpoint = ProcessEndpoint(reactor, b"docker", [b"docker"] + arguments,
-                               os.environ)
-    d = connectProtocol(endpoint, _AccumulatingProtocol())
-    d.addCallback(lambda protocol: protocol._result)
-    return d
-
-
 @attributes(["uuid", "name", "_pool"])
 class Volume(object):
     """A data volume's identifier.
@@ -306,14 +323,16 @@ class Volume(object):
         """
         return b"%s-data" % (self.name.encode("ascii"),)
 
-    def expose_to_docker(self, mount_path):
+    def expose_to_docker(self, docker, mount_path):
         """
         Create a container that will expose the volume to Docker at the given
         mount path.
 
         Can be called multiple times. Mount paths from previous calls will
-        be overridden.
+        be overridden.  If the volume's container already mounts the volume
+        at the given path it is left alone.
 
+        :param DockerClient docker: The client to talk to Docker with.
         :param FilePath mount_path: The path at which to mount the volume
             within the container.
 
@@ -321,26 +340,37 @@ class Volume(object):
         """
         local_path = self.get_filesystem().get_path().path
         mount_path = mount_path.path
-        d = self.remove_from_docker()
-        d.addCallback(
-            lambda _:
-                _docker_command(reactor,
-                                [b"run", b"--name", self._container_name,
-                                 b"--volume=%s:%s:rw" % (local_path,
-                                                         mount_path),
-                                 b"busybox", b"/bin/true"]))
+
+        def inspected(info):
+            if info is not None and (
+                    info.get(u"Volumes") == {mount_path: local_path} and
+                    info.get(u"VolumesRW") == {mount_path: True}):
+                return
+            d = self.remove_from_docker(docker)
+            d.addCallback(lambda _: docker.ensure_image(DATA_IMAGE))
+            d.addCallback(
+                lambda _: docker.create_container(
+                    self._container_name, DATA_IMAGE, [b"/bin/true"],
+                    volumes=[mount_path]))
+            # Docker only binds the directory into the container when it is
+            # started:
+            d.addCallback(
+                lambda _: docker.start_container(
+                    self._container_name, binds=[(local_path, mount_path)]))
+            return d
+        d = docker.inspect_container(self._container_name)
+        d.addCallback(inspected)
         return d
 
-    def remove_from_docker(self):
+    def remove_from_docker(self, docker):
         """
         Remove the Docker container created for the volume.
 
         If no container exists this will silently do nothing.
 
+        :param DockerClient docker: The client to talk to Docker with.
+
         :return: ``Deferred`` firing with ``None`` when the operation is
            done.
         """
-        d = _docker_command(reactor, [b"rm", self._container_name])
-        d.addErrback(lambda failure: failure.trap(CommandFailed))
-        d.addCallback(lambda _: None)
-        return d
+        return docker.remove_container(self._container_name)
@@ -23,7 +23,7 @@ from ...testtools import assertNoFDsLeaked
 
 from ..filesystems.interfaces import (
     IFilesystemSnapshots, IStoragePool, IFilesystem,
-    FilesystemAlreadyExists,
+    FilesystemAlreadyExists, PoolStatistics,
     )
 from ..snapshots import SnapshotName
 from ..service import Volume
@@ -441,6 +441,22 @@ def make_istoragepool_tests(fixture):
             d.addCallback(got_volumes)
             return d
 
+        def test_statistics(self):
+            """
+            ``statistics()`` returns a ``Deferred`` that fires with the
+            ``PoolStatistics`` of the pool.
+            """
+            pool = fixture(self)
+            d = pool.statistics()
+
+            def measured(statistics):
+                self.assertEqual(
+                    (PoolStatistics, True, True),
+                    (type(statistics), statistics.free_space > 0,
+                     statistics.io_load >= 0))
+            d.addCallback(measured)
+            return d
+
         def test_enumerate_no_filesystems(self):
             """Lacking any filesystems, ``enumerate()`` returns an empty
             result."""
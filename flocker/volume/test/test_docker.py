@@ -0,0 +1,339 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.volume._docker``.
+"""
+
+import json
+from urlparse import urlparse, parse_qs
+
+from twisted.internet import reactor
+from twisted.trial.unittest import TestCase
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+
+from .._docker import DockerClient, DockerError, _json_stream
+
+
+class FakeDockerResource(Resource):
+    """
+    A small part of the Docker Engine API, keeping containers in memory.
+
+    :ivar dict containers: Map the ``bytes`` name of each container to the
+        ``dict`` it was created with, with ``"Binds"`` added once it is
+        started.  A container's ID is the hex encoding of its name.
+    :ivar set images: The ``bytes`` names of the images available locally.
+    :ivar list requests: ``tuple``\ s of the method and path of each request
+        received.
+    """
+    isLeaf = True
+
+    def __init__(self):
+        Resource.__init__(self)
+        self.containers = {}
+        self.images = set()
+        self.requests = []
+
+    def render(self, request):
+        # Requests are sent with an absolute URL:
+        url = urlparse(request.uri)
+        query = parse_qs(url.query)
+        self.requests.append((request.method, url.path))
+        body = request.content.read()
+        segments = url.path.split(b"/")[1:]
+        request.setResponseCode(204)
+
+        if segments == [b"containers", b"create"]:
+            config = json.loads(body)
+            name = query[b"name"][0]
+            if config[u"Image"] not in self.images:
+                request.setResponseCode(404)
+                return b"No such image"
+            if name in self.containers:
+                request.setResponseCode(409)
+                return b"Conflict"
+            self.containers[name] = config
+            request.setResponseCode(201)
+            return json.dumps({u"Id": name.encode("hex")})
+        elif segments == [b"images", b"create"]:
+            image = query[b"fromImage"][0]
+            request.setResponseCode(200)
+            if image == b"missing":
+                return b'{"status": "Pulling"}\r\n{"error": "Not found"}'
+            self.images.add(image)
+            return b'{"status": "Pulling"}{"status": "Done"}'
+        elif segments == [b"containers", b"json"]:
+            request.setResponseCode(200)
+            return json.dumps([
+                {u"Id": name.encode("hex"),
+                 u"Names": [u"/" + name.decode("ascii")]}
+                for name, config in self.containers.items()
+                if u"Binds" in config])
+        elif segments[0] == b"images":
+            if segments[1] not in self.images:
+                request.setResponseCode(404)
+                return b"No such image"
+            request.setResponseCode(200)
+            return json.dumps({u"id": segments[1].encode("hex")})
+
+        name = segments[1]
+        if name not in self.containers:
+            request.setResponseCode(404)
+            return b"No such container"
+        if request.method == b"DELETE":
+            del self.containers[name]
+        elif segments[2:] == [b"start"]:
+            self.containers[name][u"Binds"] = json.loads(body)[u"Binds"]
+        elif segments[2:] == [b"json"]:
+            # Docker describes the directories bound into a container by
+            # their path within it:
+            binds = [bind.rsplit(u":", 2)
+                     for bind in self.containers[name].get(u"Binds", [])]
+            request.setResponseCode(200)
+            return json.dumps({
+                u"Id": name.encode("hex"),
+                u"Name": u"/" + name.decode("ascii"),
+                u"State": {
+                    u"Running": u"Binds" in self.containers[name]},
+                u"Volumes": dict((path, local) for local, path, mode in binds),
+                u"VolumesRW": dict(
+                    (path, mode == u"rw") for local, path, mode in binds)})
+        return b""
+
+
+class FakeDocker(object):
+    """
+    A fake Docker daemon listening on a UNIX socket.
+
+    :ivar FakeDockerResource resource: The state of the fake daemon.
+    :ivar int connections: The number of connections it has accepted.
+    """
+    def __init__(self, test_case):
+        """
+        :param TestCase test_case: The test the daemon is used by, which
+            stops it when finished.
+        """
+        self.resource = FakeDockerResource()
+        self.connections = 0
+        site = Site(self.resource)
+        build = site.buildProtocol
+
+        def buildProtocol(addr):
+            self.connections += 1
+            return build(addr)
+        site.buildProtocol = buildProtocol
+        self.socket_path = test_case.mktemp()
+        port = reactor.listenUNIX(self.socket_path, site)
+        test_case.addCleanup(port.stopListening)
+
+    def client(self, test_case):
+        """
+        :param TestCase test_case: The test the client is used by, which
+            closes its connections when finished.
+
+        :return: A ``DockerClient`` connecting to this daemon.
+        """
+        client = DockerClient(socket_path=self.socket_path)
+        test_case.addCleanup(client.close)
+        return client
+
+
+class DockerClientTests(TestCase):
+    """
+    Tests for ``DockerClient``.
+    """
+    def setUp(self):
+        self.docker = FakeDocker(self)
+        self.docker.resource.images.add(b"busybox")
+        self.client = self.docker.client(self)
+
+    def test_create(self):
+        """
+        ``DockerClient.create_container`` creates a container with the given
+        image, command and volumes.
+        """
+        d = self.client.create_container(
+            b"data", b"busybox", [b"/bin/true"], volumes=[b"/my/path"])
+        d.addCallback(lambda _: self.assertEqual(
+            {b"data": {u"Image": u"busybox", u"Cmd": [u"/bin/true"],
+                       u"Volumes": {u"/my/path": {}}}},
+            self.docker.resource.containers))
+        return d
+
+    def test_create_result(self):
+        """
+        ``DockerClient.create_container`` returns a ``Deferred`` firing with
+        the ID of the new container.
+        """
+        d = self.client.create_container(b"data", b"busybox", [b"/bin/true"])
+        d.addCallback(self.assertEqual, u"data".encode("hex"))
+        return d
+
+    def test_create_pulls(self):
+        """
+        If the image isn't available ``DockerClient.create_container`` pulls
+        it and then creates the container.
+        """
+        d = self.client.create_container(b"data", b"other", [b"/bin/true"])
+        d.addCallback(lambda _: self.assertEqual(
+            [(b"POST", b"/containers/create"), (b"POST", b"/images/create"),
+             (b"POST", b"/containers/create")],
+            self.docker.resource.requests))
+        return d
+
+    def test_create_pull_fails(self):
+        """
+        If the image can't be pulled, the ``Deferred`` returned by
+        ``DockerClient.create_container`` errbacks with ``DockerError``.
+        """
+        d = self.client.create_container(b"data", b"missing", [b"/bin/true"])
+        return self.assertFailure(d, DockerError)
+
+    def test_create_conflict(self):
+        """
+        If a container with the name exists, the ``Deferred`` returned by
+        ``DockerClient.create_container`` errbacks with ``DockerError``.
+        """
+        d = self.client.create_container(b"data", b"busybox", [b"/bin/true"])
+        d.addCallback(lambda _: self.client.create_container(
+            b"data", b"busybox", [b"/bin/true"]))
+        return self.assertFailure(d, DockerError)
+
+    def test_start(self):
+        """
+        ``DockerClient.start_container`` starts the container with the given
+        directories bound into it.
+        """
+        d = self.client.create_container(b"data", b"busybox", [b"/bin/true"])
+        d.addCallback(lambda _: self.client.start_container(
+            b"data", binds=[(b"/local", b"/my/path")]))
+        d.addCallback(lambda _: self.assertEqual(
+            [u"/local:/my/path:rw"],
+            self.docker.resource.containers[b"data"][u"Binds"]))
+        return d
+
+    def test_start_missing(self):
+        """
+        Starting a container which doesn't exist errbacks with
+        ``DockerError``.
+        """
+        return self.assertFailure(
+            self.client.start_container(b"data"), DockerError)
+
+    def test_inspect(self):
+        """
+        ``DockerClient.inspect_container`` returns a ``Deferred`` firing with
+        Docker's description of the container.
+        """
+        d = self.client.create_container(b"data", b"busybox", [b"/bin/true"])
+        d.addCallback(lambda _: self.client.inspect_container(b"data"))
+        d.addCallback(lambda info: self.assertEqual(u"/data", info[u"Name"]))
+        return d
+
+    def test_inspect_missing(self):
+        """
+        ``DockerClient.inspect_container`` returns a ``Deferred`` firing with
+        ``None`` if there is no such container.
+        """
+        d = self.client.inspect_container(b"data")
+        d.addCallback(self.assertIs, None)
+        return d
+
+    def test_list(self):
+        """
+        ``DockerClient.list_containers`` returns the IDs of the running
+        containers by name.
+        """
+        d = self.client.create_container(b"data", b"busybox", [b"/bin/true"])
+        d.addCallback(lambda _: self.client.create_container(
+            b"other", b"busybox", [b"/bin/true"]))
+        d.addCallback(lambda _: self.client.start_container(b"data"))
+        d.addCallback(lambda _: self.client.list_containers())
+        d.addCallback(self.assertEqual, {b"data": b"data".encode("hex")})
+        return d
+
+    def test_remove(self):
+        """
+        ``DockerClient.remove_container`` removes the container.
+        """
+        d = self.client.create_container(b"data", b"busybox", [b"/bin/true"])
+        d.addCallback(lambda _: self.client.remove_container(b"data"))
+        d.addCallback(
+            lambda _: self.assertEqual({}, self.docker.resource.containers))
+        return d
+
+    def test_remove_missing(self):
+        """
+        Removing a container which doesn't exist does nothing.
+        """
+        d = self.client.remove_container(b"data")
+        d.addCallback(self.assertIs, None)
+        return d
+
+    def test_ensure_image(self):
+        """
+        ``DockerClient.ensure_image`` pulls an image which isn't available.
+        """
+        d = self.client.ensure_image(b"other")
+        d.addCallback(lambda _: self.assertIn(
+            b"other", self.docker.resource.images))
+        return d
+
+    def test_ensure_image_once(self):
+        """
+        ``DockerClient.ensure_image`` only checks for an image the first time
+        it is called for it.
+        """
+        d = self.client.ensure_image(b"busybox")
+        d.addCallback(lambda _: self.client.ensure_image(b"busybox"))
+        d.addCallback(lambda _: self.assertEqual(
+            [(b"GET", b"/images/busybox/json")],
+            self.docker.resource.requests))
+        return d
+
+    def test_pulled_image_not_checked(self):
+        """
+        ``DockerClient.ensure_image`` doesn't check for an image which the
+        client has already pulled, e.g. when creating a container.
+        """
+        d = self.client.create_container(b"data", b"other", [b"/bin/true"])
+
+        def created(_):
+            del self.docker.resource.requests[:]
+            return self.client.ensure_image(b"other")
+        d.addCallback(created)
+        d.addCallback(lambda _: self.assertEqual(
+            [], self.docker.resource.requests))
+        return d
+
+    def test_ensure_image_fails(self):
+        """
+        If the image can't be pulled, the ``Deferred`` returned by
+        ``DockerClient.ensure_image`` errbacks with ``DockerError``.
+        """
+        return self.assertFailure(
+            self.client.ensure_image(b"missing"), DockerError)
+
+    def test_connection_reused(self):
+        """
+        A series of requests is sent over a single connection.
+        """
+        d = self.client.create_container(b"data", b"busybox", [b"/bin/true"])
+        d.addCallback(lambda _: self.client.inspect_container(b"data"))
+        d.addCallback(lambda _: self.client.remove_container(b"data"))
+        d.addCallback(lambda _: self.assertEqual(1, self.docker.connections))
+        return d
+
+
+class JSONStreamTests(TestCase):
+    """
+    Tests for ``_json_stream``.
+    """
+    def test_objects(self):
+        """
+        ``_json_stream`` decodes a series of JSON objects, whether or not they
+        are separated by whitespace.
+        """
+        self.assertEqual(
+            [{u"a": 1}, {u"b": 2}, {u"c": 3}],
+            _json_stream(b'{"a": 1}{"b": 2}\r\n{"c": 3}\r\n'))
@@ -0,0 +1,283 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Tests for :module:`flocker.volume.filesystems.placement`.
+"""
+
+from __future__ import absolute_import
+
+from eliot.testing import validateLogging
+
+from twisted.internet.defer import fail, succeed
+from twisted.trial.unittest import SynchronousTestCase
+from twisted.python.filepath import FilePath
+
+from .filesystemtests import make_istoragepool_tests
+from ..filesystems.interfaces import FilesystemAlreadyExists, PoolStatistics
+from ..filesystems.memory import FilesystemStoragePool
+from ..filesystems.zfs import CommandFailed
+from ..filesystems.placement import (
+    ClassifiedPool, PlacementPool, placement_score, IO_LOAD_SCALE,
+    )
+from ..service import Volume
+
+
+def make_placement_pool(test_case):
+    """
+    :param TestCase test_case: The test the pool is used by.
+
+    :return: A ``PlacementPool`` of two ``FilesystemStoragePool``\ s.
+    """
+    return PlacementPool([
+        ClassifiedPool(pool=FilesystemStoragePool(
+            FilePath(test_case.mktemp())), storage_class=u"ssd"),
+        ClassifiedPool(pool=FilesystemStoragePool(
+            FilePath(test_case.mktemp())), storage_class=u"hdd"),
+    ])
+
+
+class IStoragePoolTests(make_istoragepool_tests(make_placement_pool)):
+    """``IStoragePoolTests`` for a pool placing filesystems on two others."""
+
+
+def measured_pool(test_case, free_space, io_load=0.0):
+    """
+    :param TestCase test_case: The test the pool is used by.
+    :param int free_space: The free space the pool reports.
+    :param float io_load: The IO load the pool reports.
+
+    :return: A ``FilesystemStoragePool`` reporting the given statistics.
+    """
+    pool = FilesystemStoragePool(FilePath(test_case.mktemp()))
+    pool.statistics = lambda: succeed(
+        PoolStatistics(free_space=free_space, io_load=io_load))
+    return pool
+
+
+class PlacementScoreTests(SynchronousTestCase):
+    """
+    Tests for ``placement_score``.
+    """
+    def test_idle(self):
+        """
+        The score of an idle pool is its free space.
+        """
+        self.assertEqual(
+            1000, placement_score(PoolStatistics(free_space=1000, io_load=0)))
+
+    def test_loaded(self):
+        """
+        A pool with an IO load of ``IO_LOAD_SCALE`` scores half its free
+        space.
+        """
+        self.assertEqual(
+            500, placement_score(
+                PoolStatistics(free_space=1000, io_load=IO_LOAD_SCALE)))
+
+
+class PlacementPoolTests(SynchronousTestCase):
+    """
+    Tests for ``PlacementPool``.
+    """
+    def setUp(self):
+        self.ssd = measured_pool(self, free_space=100)
+        self.hdd = measured_pool(self, free_space=1000)
+        self.pool = PlacementPool([
+            ClassifiedPool(pool=self.ssd, storage_class=u"ssd"),
+            ClassifiedPool(pool=self.hdd, storage_class=u"hdd"),
+        ])
+        self.volume = Volume(uuid=u"my-uuid", name=u"myvolume",
+                             _pool=self.pool)
+
+    def test_create_most_free_space(self):
+        """
+        Without a storage class, ``PlacementPool.create`` creates the
+        filesystem on the idle pool with the most free space.
+        """
+        self.successResultOf(self.pool.create(self.volume))
+        self.assertEqual(
+            (False, True),
+            (self.ssd.get(self.volume).get_path().exists(),
+             self.hdd.get(self.volume).get_path().exists()))
+
+    def test_create_least_loaded(self):
+        """
+        ``PlacementPool.create`` avoids a pool whose IO load outweighs its
+        extra free space.
+        """
+        self.hdd.statistics = lambda: succeed(
+            PoolStatistics(free_space=1000, io_load=IO_LOAD_SCALE * 10))
+        self.successResultOf(self.pool.create(self.volume))
+        self.assertTrue(self.ssd.get(self.volume).get_path().exists())
+
+    @validateLogging(None)
+    def test_create_statistics_failed(self, logger):
+        """
+        ``PlacementPool.create`` logs the failure of a pool to report its
+        statistics and places the filesystem on one of the pools which did.
+        """
+        self.patch(self.pool, "logger", logger)
+        self.hdd.statistics = lambda: fail(CommandFailed())
+        self.successResultOf(self.pool.create(self.volume))
+        self.assertEqual(
+            (1, True, False),
+            (len(logger.flushTracebacks(CommandFailed)),
+             self.ssd.get(self.volume).get_path().exists(),
+             self.hdd.get(self.volume).get_path().exists()))
+
+    @validateLogging(None)
+    def test_create_no_statistics(self, logger):
+        """
+        If none of the pools report their statistics, ``PlacementPool.create``
+        places the filesystem on the first of them.
+        """
+        self.patch(self.pool, "logger", logger)
+        self.ssd.statistics = lambda: fail(CommandFailed())
+        self.hdd.statistics = lambda: fail(CommandFailed())
+        self.successResultOf(self.pool.create(self.volume))
+        logger.flushTracebacks(CommandFailed)
+        self.assertTrue(self.ssd.get(self.volume).get_path().exists())
+
+    def test_create_storage_class(self):
+        """
+        ``PlacementPool.create`` only creates the filesystem on a pool of the
+        requested storage class.
+        """
+        self.successResultOf(
+            self.pool.create(self.volume, storage_class=u"ssd"))
+        self.assertEqual(
+            (True, False),
+            (self.ssd.get(self.volume).get_path().exists(),
+             self.hdd.get(self.volume).get_path().exists()))
+
+    def test_create_unknown_storage_class(self):
+        """
+        ``PlacementPool.create`` fails with ``ValueError`` if there is no pool
+        of the requested storage class.
+        """
+        self.failureResultOf(
+            self.pool.create(self.volume, storage_class=u"tape"), ValueError)
+
+    def test_create_existing(self):
+        """
+        ``PlacementPool.create`` doesn't create a second filesystem for a
+        volume which already has one on another pool.
+        """
+        self.successResultOf(
+            self.pool.create(self.volume, storage_class=u"ssd"))
+        self.failureResultOf(self.pool.create(self.volume), OSError)
+        self.assertFalse(self.hdd.get(self.volume).get_path().exists())
+
+    def test_get(self):
+        """
+        ``PlacementPool.get`` returns the filesystem from the pool it was
+        created on.
+        """
+        filesystem = self.successResultOf(
+            self.pool.create(self.volume, storage_class=u"hdd"))
+        self.assertEqual(filesystem, self.pool.get(self.volume))
+
+    def test_get_new(self):
+        """
+        ``PlacementPool.get`` returns a filesystem from the first pool for a
+        volume which doesn't exist yet, e.g. one about to be received.
+        """
+        self.assertEqual(self.ssd.get(self.volume),
+                         self.pool.get(self.volume))
+
+    def test_get_unmounted(self):
+        """
+        ``PlacementPool.get`` returns the filesystem from the pool which
+        listed it, even if it isn't mounted.
+        """
+        self.hdd.enumerate = lambda: succeed({self.hdd.get(self.volume)})
+        self.successResultOf(self.pool.enumerate())
+        self.assertEqual(self.hdd.get(self.volume),
+                         self.pool.get(self.volume))
+
+    def test_create_existing_unmounted(self):
+        """
+        ``PlacementPool.create`` asks the pools whether they have the volume's
+        filesystem, so it leaves an unmounted filesystem to the pool it is
+        on to report.
+        """
+        self.hdd.enumerate = lambda: succeed({self.hdd.get(self.volume)})
+        self.ssd.create = lambda volume, properties=None: 1/0
+        self.successResultOf(self.pool.create(self.volume))
+        self.assertTrue(self.hdd.get(self.volume).get_path().exists())
+
+    def test_listed_once(self):
+        """
+        ``PlacementPool.create`` only lists the pools the first time, and
+        keeps track of the filesystems it creates after that.
+        """
+        volume2 = Volume(uuid=u"my-uuid", name=u"myvolume2", _pool=self.pool)
+        self.successResultOf(self.pool.create(self.volume))
+        self.ssd.enumerate = lambda: 1/0
+        self.hdd.enumerate = lambda: 1/0
+        self.successResultOf(self.pool.create(volume2, storage_class=u"ssd"))
+        self.failureResultOf(
+            self.pool.create(self.volume, storage_class=u"ssd"), OSError)
+        self.assertFalse(self.ssd.get(self.volume).get_path().exists())
+
+    def test_enumerate(self):
+        """
+        ``PlacementPool.enumerate`` lists the filesystems of all of the pools.
+        """
+        volume2 = Volume(uuid=u"my-uuid", name=u"myvolume2", _pool=self.pool)
+        self.pool.create(self.volume, storage_class=u"ssd")
+        self.pool.create(volume2, storage_class=u"hdd")
+        self.assertEqual(
+            {self.ssd.get(self.volume), self.hdd.get(volume2)},
+            self.successResultOf(self.pool.enumerate()))
+
+    def test_change_owner(self):
+        """
+        ``PlacementPool.change_owner`` keeps the filesystem on the pool it is
+        on.
+        """
+        new_volume = Volume(uuid=u"other-uuid", name=u"myvolume",
+                            _pool=self.pool)
+        self.pool.create(self.volume, storage_class=u"hdd")
+        filesystem = self.successResultOf(
+            self.pool.change_owner(self.volume, new_volume))
+        self.assertEqual(self.hdd.get(new_volume), filesystem)
+
+    def test_change_owner_exists_elsewhere(self):
+        """
+        ``PlacementPool.change_owner`` fails with ``FilesystemAlreadyExists``
+        if the new volume's filesystem exists on another pool.
+        """
+        new_volume = Volume(uuid=u"other-uuid", name=u"myvolume",
+                            _pool=self.pool)
+        self.pool.create(self.volume, storage_class=u"hdd")
+        self.pool.create(new_volume, storage_class=u"ssd")
+        self.failureResultOf(
+            self.pool.change_owner(self.volume, new_volume),
+            FilesystemAlreadyExists)
+
+    def test_change_owner_exists_unmounted(self):
+        """
+        ``PlacementPool.change_owner`` fails with ``FilesystemAlreadyExists``
+        if a pool lists the new volume's filesystem, even if it isn't
+        mounted.
+        """
+        new_volume = Volume(uuid=u"other-uuid", name=u"myvolume",
+                            _pool=self.pool)
+        self.ssd.enumerate = lambda: succeed({self.ssd.get(new_volume)})
+        self.pool.create(self.volume, storage_class=u"hdd")
+        self.failureResultOf(
+            self.pool.change_owner(self.volume, new_volume),
+            FilesystemAlreadyExists)
+
+    def test_statistics(self):
+        """
+        ``PlacementPool.statistics`` adds up the statistics of all of the
+        pools.
+        """
+        self.ssd.statistics = lambda: succeed(
+            PoolStatistics(free_space=100, io_load=5.0))
+        self.hdd.statistics = lambda: succeed(
+            PoolStatistics(free_space=1000, io_load=10.0))
+        self.assertEqual(PoolStatistics(free_space=1100, io_load=15.0),
+                         self.successResultOf(self.pool.statistics()))
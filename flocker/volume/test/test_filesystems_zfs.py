@@ -14,13 +14,17 @@ from pytz import UTC
 from twisted.trial.unittest import SynchronousTestCase
 from twisted.internet.error import ProcessDone, ProcessTerminated
 from twisted.python.failure import Failure
+from twisted.python.filepath import FilePath
 
 from ...testtools import FakeProcessReactor
 
 from ..snapshots import SnapshotName
 from ..filesystems.zfs import (
     zfs_command, CommandFailed, BadArguments, Filesystem, ZFSSnapshots,
+    StoragePool,
     )
+from ..filesystems.interfaces import PoolStatistics
+from ..service import Volume
 
 
 class FilesystemTests(SynchronousTestCase):
@@ -212,3 +216,94 @@ class ZFSSnapshotsTests(SynchronousTestCase):
         reactor.processes[0].processProtocol.processEnded(
             Failure(ProcessDone(0)))
         self.assertEqual(self.successResultOf(d), [name])
+
+
+class StoragePoolCreateTests(SynchronousTestCase):
+    """
+    Unit tests for ``StoragePool.create``.
+    """
+    def setUp(self):
+        self.reactor = FakeProcessReactor()
+        self.pool = StoragePool(self.reactor, b"pool", FilePath(b"/flocker"))
+        self.volume = Volume(uuid=u"my-uuid", name=u"myvolume",
+                             _pool=self.pool)
+
+    def test_create(self):
+        """
+        ``StoragePool.create`` creates a dataset mounted under the pool's
+        mount root.
+        """
+        self.pool.create(self.volume)
+        self.assertEqual(
+            [b"zfs", b"create", b"-o", b"mountpoint=/flocker/my-uuid.myvolume",
+             b"pool/my-uuid.myvolume"],
+            self.reactor.processes[0].args)
+
+    def test_properties(self):
+        """
+        ``StoragePool.create`` creates the dataset with the given properties,
+        in order of their names.
+        """
+        self.pool.create(
+            self.volume, {u"recordsize": u"8K", u"compression": u"lz4"})
+        self.assertEqual(
+            [b"zfs", b"create", b"-o", b"mountpoint=/flocker/my-uuid.myvolume",
+             b"-o", b"compression=lz4", b"-o", b"recordsize=8K",
+             b"pool/my-uuid.myvolume"],
+            self.reactor.processes[0].args)
+
+    def test_unsupported_property(self):
+        """
+        ``StoragePool.create`` fails with ``ValueError`` without creating a
+        dataset if it is given a property which can't be tuned.
+        """
+        d = self.pool.create(self.volume, {u"mountpoint": u"/elsewhere"})
+        self.failureResultOf(d, ValueError)
+        self.assertEqual([], self.reactor.processes)
+
+
+class StoragePoolStatisticsTests(SynchronousTestCase):
+    """
+    Unit tests for ``StoragePool.statistics``.
+    """
+    def setUp(self):
+        self.reactor = FakeProcessReactor()
+        self.pool = StoragePool(
+            self.reactor, b"tank/flocker", FilePath(b"/flocker"))
+
+    def finish(self, index, output):
+        """
+        Make a process spawned by the pool write some output and exit.
+
+        :param int index: The index of the process.
+        :param bytes output: The output of the process.
+        """
+        process_protocol = self.reactor.processes[index].processProtocol
+        process_protocol.childDataReceived(1, output)
+        process_protocol.processEnded(Failure(ProcessDone(0)))
+
+    def test_commands(self):
+        """
+        ``StoragePool.statistics`` asks ``zfs`` for the space available to
+        the pool's dataset and ``zpool`` for the average load of its pool,
+        without waiting for a sample over an interval.
+        """
+        self.pool.statistics()
+        self.finish(0, b"1048576\n")
+        self.assertEqual(
+            ([b"zfs", b"list", b"-H", b"-p", b"-o", b"available",
+              b"tank/flocker"],
+             [b"zpool", b"iostat", b"-H", b"-p", b"tank"]),
+            (self.reactor.processes[0].args, self.reactor.processes[1].args))
+
+    def test_result(self):
+        """
+        ``StoragePool.statistics`` returns a ``Deferred`` firing with the
+        available space and the read and write operations per second reported
+        by ``zpool iostat``.
+        """
+        d = self.pool.statistics()
+        self.finish(0, b"1048576\n")
+        self.finish(1, b"tank\t100\t200\t20\t10\t80\t40\n")
+        self.assertEqual(PoolStatistics(free_space=1048576, io_load=30.0),
+                         self.successResultOf(d))
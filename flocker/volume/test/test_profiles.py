@@ -0,0 +1,22 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Tests for :module:`flocker.volume._profiles`.
+"""
+
+from twisted.trial.unittest import SynchronousTestCase
+
+from .._profiles import PROFILES, TUNABLE_PROPERTIES
+
+
+class ProfilesTests(SynchronousTestCase):
+    """
+    Tests for ``PROFILES``.
+    """
+    def test_profiles_tunable(self):
+        """
+        The predefined profiles only set properties which can be tuned.
+        """
+        self.assertEqual(
+            set(), set(name for profile in PROFILES.values()
+                       for name in profile) - TUNABLE_PROPERTIES)
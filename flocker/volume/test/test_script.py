@@ -6,10 +6,13 @@ import sys
 
 from twisted.trial.unittest import SynchronousTestCase
 from twisted.python.filepath import FilePath
+from twisted.python.usage import UsageError
 
 from ...testtools import (
     FlockerScriptTestsMixin, StandardOptionsTestsMixin, FakeSysModule)
 from ..script import VolumeOptions, VolumeScript
+from ..filesystems.placement import ClassifiedPool
+from ..filesystems.zfs import StoragePool
 from ..service import VolumeService, CreateConfigurationError
 
 
@@ -109,3 +112,87 @@ class VolumeOptionsTests(StandardOptionsTestsMixin, SynchronousTestCase):
         options.parseOptions([b"--config", b"/path/somefile.json"])
         self.assertEqual(options["config"],
                          FilePath(b"/path/somefile.json"))
+
+    def test_additional_pools(self):
+        """
+        ``--additional-pool`` can be given more than once, each time with the
+        name, storage class and mount root of a pool.
+        """
+        options = self.options()
+        options.parseOptions([b"--additional-pool", b"fast:ssd:/fast",
+                              b"--additional-pool", b"slow:hdd:/slow"])
+        self.assertEqual(
+            [(b"fast", u"ssd", FilePath(b"/fast")),
+             (b"slow", u"hdd", FilePath(b"/slow"))],
+            options["additional-pools"])
+
+    def test_bad_additional_pool(self):
+        """
+        ``--additional-pool`` must have a name, storage class and mount root.
+        """
+        self.assertRaises(UsageError, self.options().parseOptions,
+                          [b"--additional-pool", b"fast:ssd"])
+
+    def test_duplicate_mountpoint(self):
+        """
+        ``--additional-pool`` can't have the same mountpoint as another
+        additional pool.
+        """
+        self.assertRaises(UsageError, self.options().parseOptions,
+                          [b"--additional-pool", b"fast:ssd:/pools",
+                           b"--additional-pool", b"slow:hdd:/pools"])
+
+    def test_main_pool_mountpoint(self):
+        """
+        ``--additional-pool`` can't have the same mountpoint as the
+        ``--pool``.
+        """
+        self.assertRaises(UsageError, self.options().parseOptions,
+                          [b"--mountpoint", b"/pools",
+                           b"--additional-pool", b"fast:ssd:/pools/"])
+
+
+class VolumeScriptCreateVolumeServiceTests(SynchronousTestCase):
+    """
+    Tests for ``VolumeScript.create_volume_service``.
+    """
+    def create_pool(self, arguments):
+        """
+        :param list arguments: Command line arguments to ``flocker-volume``.
+
+        :return: The pool of the service created for those arguments.
+        """
+        class Service(object):
+            def __init__(self, config_path, pool, reactor):
+                self.pool = pool
+
+            def startService(self):
+                pass
+
+        options = VolumeOptions()
+        options.parseOptions(arguments)
+        script = VolumeScript()
+        script._service_factory = Service
+        return script.create_volume_service(object(), options).pool
+
+    def test_single_pool(self):
+        """
+        Without additional pools the service uses the ``--pool`` alone.
+        """
+        self.assertIsInstance(self.create_pool([]), StoragePool)
+
+    def test_additional_pools(self):
+        """
+        With additional pools the service places volumes on them and on the
+        ``--pool``, which comes first.
+        """
+        pool = self.create_pool([b"--pool-class", b"ssd",
+                                 b"--additional-pool", b"slow:hdd:/slow"])
+        self.assertEqual(
+            [ClassifiedPool(
+                pool=StoragePool(None, b"flocker", FilePath(b"/flocker")),
+                storage_class=u"ssd"),
+             ClassifiedPool(
+                 pool=StoragePool(None, b"slow", FilePath(b"/slow")),
+                 storage_class=u"hdd")],
+            pool._pools)
@@ -12,6 +12,7 @@ from uuid import uuid4
 from zope.interface.verify import verifyObject
 
 from twisted.application.service import IService
+from twisted.internet.defer import gatherResults
 from twisted.internet.task import Clock
 from twisted.python.filepath import FilePath, Permissions
 from twisted.trial.unittest import TestCase
@@ -21,7 +22,10 @@ from ..service import (
     WAIT_FOR_VOLUME_INTERVAL
     )
 from ..filesystems.memory import FilesystemStoragePool
+from ..filesystems.placement import ClassifiedPool, PlacementPool
+from .._profiles import PROFILES
 from .._ipc import RemoteVolumeManager, LocalVolumeManager
+from .test_docker import FakeDocker
 from ...common import FakeNode
 from ...testtools import skip_on_broken_permissions
 
@@ -118,6 +122,62 @@ class VolumeServiceAPITests(TestCase):
         volume = self.successResultOf(service.create(u"myvolume"))
         self.assertTrue(pool.get(volume).get_path().isdir())
 
+    def test_create_tuning(self):
+        """
+        ``create()`` creates the volume's filesystem with the properties of
+        the given profile, overridden by the given properties.
+        """
+        pool = FilesystemStoragePool(FilePath(self.mktemp()))
+        created = []
+        create = pool.create
+        self.patch(pool, "create", lambda volume, properties, storage_class:
+                   created.append(properties) or create(volume))
+        service = VolumeService(FilePath(self.mktemp()), pool, reactor=Clock())
+        service.startService()
+        service.create(u"myvolume", profile=u"postgresql",
+                       properties={u"compression": u"off", u"atime": u"off"})
+        expected = dict(PROFILES[u"postgresql"])
+        expected.update({u"compression": u"off", u"atime": u"off"})
+        self.assertEqual([expected], created)
+
+    def test_create_unknown_profile(self):
+        """
+        ``create()`` returns a ``Deferred`` that fails with ``KeyError`` if
+        the profile is unknown.
+        """
+        pool = FilesystemStoragePool(FilePath(self.mktemp()))
+        service = VolumeService(FilePath(self.mktemp()), pool, reactor=Clock())
+        service.startService()
+        self.failureResultOf(
+            service.create(u"myvolume", profile=u"unknown"), KeyError)
+
+    def test_create_storage_class(self):
+        """
+        ``create()`` places the volume on a pool of the given storage class.
+        """
+        ssd = FilesystemStoragePool(FilePath(self.mktemp()))
+        hdd = FilesystemStoragePool(FilePath(self.mktemp()))
+        pool = PlacementPool([
+            ClassifiedPool(pool=ssd, storage_class=u"ssd"),
+            ClassifiedPool(pool=hdd, storage_class=u"hdd")])
+        service = VolumeService(FilePath(self.mktemp()), pool, reactor=Clock())
+        service.startService()
+        volume = self.successResultOf(
+            service.create(u"myvolume", storage_class=u"hdd"))
+        self.assertEqual(hdd.get(volume), volume.get_filesystem())
+
+    def test_create_storage_class_ignored(self):
+        """
+        ``create()`` ignores the storage class if the pool isn't divided into
+        classes of storage.
+        """
+        pool = FilesystemStoragePool(FilePath(self.mktemp()))
+        service = VolumeService(FilePath(self.mktemp()), pool, reactor=Clock())
+        service.startService()
+        volume = self.successResultOf(
+            service.create(u"myvolume", storage_class=u"hdd"))
+        self.assertTrue(pool.get(volume).get_path().exists())
+
     @skip_on_broken_permissions
     def test_create_mode(self):
         """The created filesystem is readable/writable/executable by anyone.
@@ -435,6 +495,138 @@ class VolumeTests(TestCase):
         self.assertEqual(volume._container_name, b"456-data")
 
 
+class VolumeDockerTests(TestCase):
+    """
+    Tests for ``Volume.expose_to_docker`` and ``Volume.remove_from_docker``,
+    using a fake Docker daemon.
+    """
+    def setUp(self):
+        self.docker = FakeDocker(self)
+        self.docker.resource.images.add(b"busybox")
+        self.client = self.docker.client(self)
+        pool = FilesystemStoragePool(FilePath(self.mktemp()))
+        self.volume = Volume(uuid=u"123", name=u"456", _pool=pool)
+
+    def test_expose(self):
+        """
+        ``Volume.expose_to_docker`` creates and starts a container with the
+        volume's filesystem bound at the given mount path.
+        """
+        d = self.volume.expose_to_docker(self.client, FilePath(b"/my/path"))
+        local_path = self.volume.get_filesystem().get_path().path
+        d.addCallback(lambda _: self.assertEqual(
+            {b"456-data": {u"Image": u"busybox", u"Cmd": [u"/bin/true"],
+                           u"Volumes": {u"/my/path": {}},
+                           u"Binds": [u"%s:/my/path:rw" % (local_path,)]}},
+            self.docker.resource.containers))
+        return d
+
+    def test_expose_twice(self):
+        """
+        Exposing a volume again replaces its container.
+        """
+        d = self.volume.expose_to_docker(self.client, FilePath(b"/my/path"))
+        d.addCallback(
+            lambda _: self.volume.expose_to_docker(
+                self.client, FilePath(b"/other")))
+        d.addCallback(lambda _: self.assertEqual(
+            {u"/other": {}},
+            self.docker.resource.containers[b"456-data"][u"Volumes"]))
+        return d
+
+    def test_expose_unchanged(self):
+        """
+        Exposing a volume again at the same mount path leaves its container
+        alone.
+        """
+        d = self.volume.expose_to_docker(self.client, FilePath(b"/my/path"))
+
+        def exposed(_):
+            del self.docker.resource.requests[:]
+            return self.volume.expose_to_docker(
+                self.client, FilePath(b"/my/path"))
+        d.addCallback(exposed)
+        d.addCallback(lambda _: self.assertEqual(
+            [(b"GET", b"/containers/456-data/json")],
+            self.docker.resource.requests))
+        return d
+
+    def test_expose_pulls_image(self):
+        """
+        ``Volume.expose_to_docker`` pulls the image of the container if it
+        isn't available.
+        """
+        self.docker.resource.images.clear()
+        d = self.volume.expose_to_docker(self.client, FilePath(b"/my/path"))
+        d.addCallback(lambda _: self.assertIn(
+            b"456-data", self.docker.resource.containers))
+        return d
+
+    def test_remove(self):
+        """
+        ``Volume.remove_from_docker`` removes the volume's container.
+        """
+        d = self.volume.expose_to_docker(self.client, FilePath(b"/my/path"))
+        d.addCallback(lambda _: self.volume.remove_from_docker(self.client))
+        d.addCallback(
+            lambda _: self.assertEqual({}, self.docker.resource.containers))
+        return d
+
+    def test_remove_unexposed(self):
+        """
+        ``Volume.remove_from_docker`` does nothing if the volume has no
+        container.
+        """
+        d = self.volume.remove_from_docker(self.client)
+        d.addCallback(self.assertIs, None)
+        return d
+
+
+class VolumeServiceExposeTests(TestCase):
+    """
+    Tests for ``VolumeService.expose_to_docker``.
+    """
+    def setUp(self):
+        self.docker = FakeDocker(self)
+        self.service = VolumeService(
+            FilePath(self.mktemp()),
+            FilesystemStoragePool(FilePath(self.mktemp())),
+            reactor=Clock(), docker_client=self.docker.client(self))
+        self.service.startService()
+
+    def test_expose_all(self):
+        """
+        ``VolumeService.expose_to_docker`` exposes each of the volumes at its
+        mount path.
+        """
+        d = gatherResults(
+            [self.service.create(u"one"), self.service.create(u"two")])
+        d.addCallback(lambda (one, two): self.service.expose_to_docker(
+            [(one, FilePath(b"/one")), (two, FilePath(b"/two"))]))
+        d.addCallback(lambda _: self.assertEqual(
+            {b"one-data": {u"/one": {}}, b"two-data": {u"/two": {}}},
+            dict((name, config[u"Volumes"]) for name, config
+                 in self.docker.resource.containers.items())))
+        return d
+
+    def test_image_checked_once(self):
+        """
+        ``VolumeService.expose_to_docker`` looks for the image of the
+        containers once, pulling it if needed, however many volumes there
+        are.
+        """
+        d = gatherResults(
+            [self.service.create(u"one"), self.service.create(u"two")])
+        d.addCallback(lambda (one, two): self.service.expose_to_docker(
+            [(one, FilePath(b"/one")), (two, FilePath(b"/two"))]))
+        d.addCallback(lambda _: self.assertEqual(
+            [(b"GET", b"/images/busybox/json"),
+             (b"POST", b"/images/create")],
+            [request for request in self.docker.resource.requests
+             if request[1].startswith(b"/images/")]))
+        return d
+
+
 class VolumeOwnerChangeTests(TestCase):
     """
     Tests for ``Volume.change_owner``.